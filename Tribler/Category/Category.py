@@ -89,15 +89,28 @@ class Category(object):
         comment = torrent_dict.get('comment')
         return self.calculateCategoryNonDict(files_list, display_name, tracker, comment)
 
+    def calculate_categories(self, torrents):
+        """
+        Calculate the category of many torrents at once.
+        :param torrents: iterable of (torrent_dict, display_name) tuples
+        :return: the list of categories, in the same order
+        """
+        return [self.calculateCategory(torrent_dict, display_name) for torrent_dict, display_name in torrents]
+
     def calculateCategoryNonDict(self, files_list, display_name, tracker, comment):
-        if self.xxx_filter.isXXXTorrent(files_list, display_name, tracker, comment):
+        # Every name is lowercased and split into words once, for the family filter and all categories
+        tokenized_files = [self.xxx_filter.tokenize(name) + (length,) for name, length in files_list]
+        if self.xxx_filter.isXXXTorrent(files_list, display_name, tracker, comment, tokenized_files):
             return 'xxx'
 
+        display_words = frozenset(self._getWords(display_name.lower()))
+        tokenized_files = [(name, frozenset(words), length) for name, words, length in tokenized_files]
+
         torrent_category = None
         # filename_list ready
         strongest_cat = 0.0
         for category in self.category_info:  # for each category
-            (decision, strength) = self.judge(category, files_list, display_name)
+            (decision, strength) = self._judge(category, tokenized_files, display_words)
             if decision and (strength > strongest_cat):
                 torrent_category = category['name']
                 strongest_cat = strength
@@ -110,18 +123,21 @@ class Category(object):
     # judge whether a torrent file belongs to a certain category
     # return bool
     def judge(self, category, files_list, display_name=''):
+        tokenized_files = [(name.lower(), frozenset(self._getWords(name.lower())), length)
+                           for name, length in files_list]
+        return self._judge(category, tokenized_files, frozenset(self._getWords(display_name.lower())))
+
+    def _judge(self, category, tokenized_files, display_words):
+        """
+        Same as judge, for file names that have been lowercased and split into (frozen) sets of words.
+        """
+        keywords = category['keywords']
 
         # judge file keywords
-        display_name = display_name.lower()
         factor = 1.0
-        fileKeywords = self._getWords(display_name)
-
-        for ikeywords in category['keywords'].keys():
-            try:
-                fileKeywords.index(ikeywords)
-                factor *= 1 - category['keywords'][ikeywords]
-            except ValueError:
-                pass
+        for ikeywords in keywords:
+            if ikeywords in display_words:
+                factor *= 1 - keywords[ikeywords]
         if (1 - factor) > 0.5:
             if 'strength' in category:
                 return (True, category['strength'])
@@ -129,35 +145,25 @@ class Category(object):
                 return (True, (1 - factor))
 
         # judge each file
+        suffixes = tuple(category['suffix'])
         matchSize = 0
         totalSize = 1e-19
-        for name, length in files_list:
+        for name, words, length in tokenized_files:
             totalSize += length
             # judge file size
             if length < category['minfilesize'] or 0 < category['maxfilesize'] < length:
                 continue
 
             # judge file suffix
-            OK = False
-            for isuffix in category['suffix']:
-                if name.lower().endswith(isuffix):
-                    OK = True
-                    break
-            if OK:
+            if name.endswith(suffixes):
                 matchSize += length
                 continue
 
             # judge file keywords
             factor = 1.0
-            fileKeywords = self._getWords(name.lower())
-
-            for ikeywords in category['keywords'].keys():
-                try:
-                    fileKeywords.index(ikeywords)
-                    # print ikeywords
-                    factor *= 1 - category['keywords'][ikeywords]
-                except ValueError:
-                    pass
+            for ikeywords in keywords:
+                if ikeywords in words:
+                    factor *= 1 - keywords[ikeywords]
             if factor < 0.5:
                 matchSize += length
 
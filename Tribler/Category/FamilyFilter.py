@@ -19,6 +19,15 @@ class XXXFilter(object):
         termfilename = os.path.join(install_dir, LIBRARYNAME, 'Category', 'filter_terms.filter')
         self.xxx_terms, self.xxx_searchterms = self.initTerms(termfilename)
 
+        # Every word that isXXXTerm considers dirty: the terms themselves and their -es, -s and -n forms. A -s form
+        # that also ends in -es (the term ends with an e) is left out, as isXXXTerm only strips the -es from those.
+        self.xxx_term_forms = frozenset(self.xxx_terms).union(
+            [term + 'es' for term in self.xxx_terms],
+            [term + 's' for term in self.xxx_terms if not term.endswith('e')],
+            [term + 'n' for term in self.xxx_terms])
+        # The first words of the two-word terms, only word pairs starting with one of these can be dirty
+        self.xxx_phrase_heads = frozenset(term.split(' ', 1)[0] for term in self.xxx_term_forms if ' ' in term)
+
     def initTerms(self, filename):
         terms = set()
         searchterms = set()
@@ -42,15 +51,27 @@ class XXXFilter(object):
     def _getWords(self, string):
         return [a.lower() for a in WORDS_REGEXP.findall(string)]
 
-    def isXXXTorrent(self, files_list, torrent_name, tracker, comment=None):
+    def tokenize(self, s):
+        """
+        Return the lowercase version of s and the words in it, as used by is_xxx_tokens.
+        """
+        s = s.lower()
+        return s, WORDS_REGEXP.findall(s)
+
+    def isXXXTorrent(self, files_list, torrent_name, tracker, comment=None, tokenized_files=None):
+        """
+        Return whether a torrent is XXX. Callers that already tokenized the file names with tokenize can pass them as
+        tokenized_files, as (lowercase name, words, ...) tuples in the same order as files_list.
+        """
         if tracker:
             tracker = tracker.lower().replace('http://', '').replace('announce', '')
         else:
             tracker = ''
-        terms = [a[0].lower() for a in files_list]
+        if tokenized_files is None:
+            tokenized_files = [self.tokenize(a[0]) for a in files_list]
         is_xxx = (self.isXXX(torrent_name, False) or
                   self.isXXX(tracker, False) or
-                  any(self.isXXX(term) for term in terms) or
+                  any(self.is_xxx_tokens(tokenized[0], tokenized[1]) for tokenized in tokenized_files) or
                   (comment and self.isXXX(comment, False))
                   )
         tracker = repr(tracker)
@@ -61,18 +82,30 @@ class XXXFilter(object):
         return is_xxx
 
     def isXXX(self, s, isFilename=True):
-        s = s.lower()
-        if self.isXXXTerm(s):  # We have also put some full titles in the filter file
+        s, words = self.tokenize(s)
+        return self.is_xxx_tokens(s, words, isFilename)
+
+    def is_xxx_tokens(self, s, words, isFilename=True):
+        """
+        Same as isXXX, for a string that has already been tokenized with tokenize.
+        """
+        if s in self.xxx_term_forms:  # We have also put some full titles in the filter file
+            self._logger.debug('XXXFilter: "%s" is dirty', s)
             return True
-        if not self.isAudio(s) and self.foundXXXTerm(s):
+        is_audio = self.isAudio(s)
+        if not is_audio and self.foundXXXTerm(s):
             return True
-        words = self._getWords(s)
-        words2 = [' '.join(words[i:i + 2]) for i in xrange(0, len(words) - 1)]
-        num_xxx = len([w for w in words + words2 if self.isXXXTerm(w, s)])
-        if isFilename and self.isAudio(s):
-            return num_xxx > 2  # almost never classify mp3 as porn
+
+        terms = [w for w in words if w in self.xxx_term_forms]
+        terms.extend(w for w in (' '.join(words[i:i + 2]) for i in xrange(0, len(words) - 1)
+                                 if words[i] in self.xxx_phrase_heads)
+                     if w in self.xxx_term_forms)
+        if terms:
+            self._logger.debug('XXXFilter: %s are dirty in %s', terms, s)
+        if isFilename and is_audio:
+            return len(terms) > 2  # almost never classify mp3 as porn
         else:
-            return num_xxx > 0
+            return len(terms) > 0
 
     def foundXXXTerm(self, s):
         for term in self.xxx_searchterms:
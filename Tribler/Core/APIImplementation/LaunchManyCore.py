@@ -11,8 +11,8 @@ from glob import iglob
 from threading import Event, enumerate as enumerate_threads
 from traceback import print_exc
 
-from twisted.internet import reactor
-from twisted.internet.defer import Deferred
+from twisted.internet import reactor, threads
+from twisted.internet.defer import Deferred, DeferredList
 from twisted.internet.defer import inlineCallbacks
 
 from Tribler.Core.APIImplementation.threadpoolmanager import ThreadPoolManager
@@ -25,10 +25,11 @@ from Tribler.Core.TorrentDef import TorrentDef, TorrentDefNoMetainfo
 from Tribler.Core.Utilities.configparser import CallbackConfigParser
 from Tribler.Core.Video.VideoPlayer import VideoPlayer
 from Tribler.Core.exceptions import DuplicateDownloadException
-from Tribler.Core.simpledefs import NTFY_DISPERSY, NTFY_STARTED, NTFY_TORRENTS, NTFY_UPDATE, NTFY_TRIBLER
+from Tribler.Core.simpledefs import (NTFY_DISPERSY, NTFY_STARTED, NTFY_TORRENTS, NTFY_UPDATE, NTFY_TRIBLER,
+                                     NTFY_CHECKPOINT_RESUME, NTFY_FINISHED)
 from Tribler.community.tunnel.tunnel_community import TunnelSettings
 from Tribler.dispersy.taskmanager import TaskManager
-from Tribler.dispersy.util import blockingCallFromThread, blocking_call_on_reactor_thread
+from Tribler.dispersy.util import blockingCallFromThread, blocking_call_on_reactor_thread, call_on_reactor_thread
 
 try:
     import prctl
@@ -40,6 +41,13 @@ if sys.platform == 'win32':
 else:
     SOCKET_BLOCK_ERRORCODE = errno.EWOULDBLOCK
 
+# The downloads in the checkpoint are resumed in batches. The pstates of a batch are parsed in parallel by the reactor
+# thread pool, and the next batch is started once most downloads of the batch have been added to libtorrent, or
+# RESUME_BATCH_MAX_WAIT seconds have passed.
+RESUME_BATCH_SIZE = 50
+RESUME_BATCH_CHECK_INTERVAL = 0.5
+RESUME_BATCH_MAX_WAIT = 10
+
 
 # Internal classes
 #
@@ -164,7 +172,9 @@ class TriblerLaunchMany(TaskManager):
 
                 # register TFTP service
                 from Tribler.Core.TFTP.handler import TftpHandler
-                self.tftp_handler = TftpHandler(self.session, endpoint, "fffffffd".decode('hex'), block_size=1024)
+                from Tribler.Core.TFTP.session import MAX_BLOCK_SIZE
+                self.tftp_handler = TftpHandler(self.session, endpoint, "fffffffd".decode('hex'),
+                                                block_size=MAX_BLOCK_SIZE)
                 self.tftp_handler.initialize()
 
             if self.session.get_enable_torrent_search() or self.session.get_enable_channel_search():
@@ -511,14 +521,71 @@ class TriblerLaunchMany(TaskManager):
         """ Called by any thread """
 
         def do_load_checkpoint(initialdlstatus, initialdlstatus_dict):
-            with self.sesslock:
-                for i, filename in enumerate(iglob(os.path.join(self.session.get_downloads_pstate_dir(), '*.state'))):
-                    self.resume_download(filename, initialdlstatus, initialdlstatus_dict, setupDelay=i * 0.1)
+            filenames = list(iglob(os.path.join(self.session.get_downloads_pstate_dir(), '*.state')))
+            self._logger.info("tlm: load_checkpoint: resuming %d downloads", len(filenames))
+            self._resume_checkpoint_batch(filenames, 0, initialdlstatus, initialdlstatus_dict)
 
         if self.initComplete:
             do_load_checkpoint(initialdlstatus, initialdlstatus_dict)
         else:
-            self.register_task("load_checkpoint", reactor.callLater(1, do_load_checkpoint))
+            self.register_task("load_checkpoint", reactor.callLater(1, do_load_checkpoint, initialdlstatus,
+                                                                    initialdlstatus_dict))
+
+    @call_on_reactor_thread
+    def _resume_checkpoint_batch(self, filenames, offset, initialdlstatus, initialdlstatus_dict):
+        """
+        Parses the pstates of the next batch of filenames in parallel and resumes their downloads.
+        """
+        batch = filenames[offset:offset + RESUME_BATCH_SIZE]
+        if not batch or not self.session:
+            self._logger.info("tlm: load_checkpoint: resumed %d downloads", len(filenames))
+            if self.session:
+                self.session.notifier.notify(NTFY_CHECKPOINT_RESUME, NTFY_FINISHED, None, len(filenames))
+            return
+
+        def on_pstates_loaded(results):
+            if not self.session:
+                return
+
+            downloads = []
+            with self.sesslock:
+                for filename, (_, pstate) in zip(batch, results):
+                    download = self.resume_download(filename, initialdlstatus, initialdlstatus_dict, pstate=pstate)
+                    if download:
+                        downloads.append(download)
+
+            resumed = offset + len(batch)
+            self.session.notifier.notify(NTFY_CHECKPOINT_RESUME, NTFY_UPDATE, None,
+                                         {u'resumed': resumed, u'total': len(filenames)})
+
+            def resume_next_batch():
+                self._resume_checkpoint_batch(filenames, resumed, initialdlstatus, initialdlstatus_dict)
+
+            self._wait_for_resumed_downloads(downloads, timemod.time() + RESUME_BATCH_MAX_WAIT, resume_next_batch)
+
+        DeferredList([threads.deferToThread(self.load_download_pstate_from_file_noexc, filename)
+                      for filename in batch]).addCallback(on_pstates_loaded)
+
+    def _wait_for_resumed_downloads(self, downloads, deadline, callback):
+        """
+        Calls callback once at most half of the downloads are still waiting to be added to libtorrent, or after
+        the deadline.
+        """
+        waiting = len([download for download in downloads if download.handle is None])
+        if waiting <= len(downloads) / 2 or timemod.time() >= deadline:
+            callback()
+        else:
+            self.register_task("resume checkpoint batch",
+                               reactor.callLater(RESUME_BATCH_CHECK_INTERVAL, self._wait_for_resumed_downloads,
+                                                 downloads, deadline, callback))
+
+    def load_download_pstate_from_file_noexc(self, filename):
+        """ Called by any thread """
+        try:
+            return self.load_download_pstate(filename)
+        except Exception:
+            # resume_download handles the invalid pstate
+            return None
 
     def load_download_pstate_noexc(self, infohash):
         """ Called by any thread, assume sesslock already held """
@@ -533,11 +600,17 @@ class TriblerLaunchMany(TaskManager):
         except Exception:
             self._logger.exception("Exception while loading pstate: %s", infohash)
 
-    def resume_download(self, filename, initialdlstatus=None, initialdlstatus_dict={}, setupDelay=0):
-        tdef = dscfg = pstate = None
+    def resume_download(self, filename, initialdlstatus=None, initialdlstatus_dict={}, setupDelay=0, pstate=None):
+        """
+        Resumes the download of the pstate in filename.
+        :param pstate: The pstate in filename, if it has already been loaded.
+        :return: The resumed download, or None.
+        """
+        tdef = dscfg = None
 
         try:
-            pstate = self.load_download_pstate(filename)
+            if pstate is None:
+                pstate = self.load_download_pstate(filename)
 
             # SWIFTPROC
             metainfo = pstate.get('state', 'metainfo')
@@ -571,19 +644,19 @@ class TriblerLaunchMany(TaskManager):
                         if os.path.isdir(dest_dir) or dest_dir == '':
                             dscfg.set_dest_dir(dest_dir)
 
-        self._logger.debug("tlm: load_checkpoint: pstate is %s %s",
-                           pstate.get('dlstate', 'status'), pstate.get('dlstate', 'progress'))
-        if pstate is None or pstate.get('state', 'engineresumedata') is None:
-            self._logger.debug("tlm: load_checkpoint: resumedata None")
-        else:
-            self._logger.debug("tlm: load_checkpoint: resumedata len %d", len(pstate.get('state', 'engineresumedata')))
+        # The resume data is only decoded when libtorrent needs it
+        if pstate is not None:
+            self._logger.debug("tlm: load_checkpoint: pstate is %s %s, resumedata length %s",
+                               pstate.get('dlstate', 'status', literal_eval=False),
+                               pstate.get('dlstate', 'progress', literal_eval=False),
+                               len(pstate.get('state', 'engineresumedata', literal_eval=False) or ''))
 
         if tdef and dscfg:
             if dscfg.get_dest_dir() != '':  # removed torrent ignoring
                 try:
                     if not self.download_exists(tdef.get_infohash()):
                         initialdlstatus = initialdlstatus_dict.get(tdef.get_infohash(), initialdlstatus)
-                        self.add(tdef, dscfg, pstate, initialdlstatus, setupDelay=setupDelay)
+                        return self.add(tdef, dscfg, pstate, initialdlstatus, setupDelay=setupDelay)
                     else:
                         self._logger.info("tlm: not resuming checkpoint because download has already been added")
 
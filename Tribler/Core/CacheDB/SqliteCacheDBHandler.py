@@ -9,16 +9,17 @@ import threading
 import json
 from copy import deepcopy
 from pprint import pformat
-from struct import unpack_from
 from time import time
 from traceback import print_exc
 from collections import OrderedDict, defaultdict
 from libtorrent import bencode
 from twisted.internet.task import LoopingCall
 
+from Tribler.Core.CacheDB.search_engine import TorrentSearchEngine
 from Tribler.Core.CacheDB.sqlitecachedb import bin2str, str2bin
+from Tribler.Core.CacheDB.suggestion_index import SuggestionIndex
 from Tribler.Core.TorrentDef import TorrentDef
-from Tribler.Core.Utilities.search_utils import split_into_keywords, filter_keywords
+from Tribler.Core.Utilities.search_utils import split_into_keywords
 from Tribler.Core.Utilities.unicode import dunno2unicode
 from Tribler.Core.simpledefs import (INFOHASH_LENGTH, NTFY_UPDATE, NTFY_INSERT, NTFY_DELETE, NTFY_CREATE,
                                      NTFY_MODIFIED, NTFY_TRACKERINFO, NTFY_MYPREFERENCES, NTFY_VOTECAST, NTFY_TORRENTS,
@@ -33,6 +34,8 @@ VOTECAST_FLUSH_DB_INTERVAL = 15
 
 DEFAULT_ID_CACHE_SIZE = 1024 * 5
 
+REMOTE_SEARCH_LIMIT = 25
+
 
 class LimitedOrderedDict(OrderedDict):
 
@@ -75,6 +78,12 @@ class BasicDBHandler(TaskManager):
     def getAll(self, value_name, where=None, group_by=None, having=None, order_by=None, limit=None, offset=None, conj=u"AND", **kw):
         return self._db.getAll(self.table_name, value_name, where=where, group_by=group_by, having=having, order_by=order_by, limit=limit, offset=offset, conj=conj, **kw)
 
+    def async_getOne(self, value_name, where=None, conj=u"AND", **kw):
+        return self._db.async_getOne(self.table_name, value_name, where=where, conj=conj, **kw)
+
+    def async_getAll(self, value_name, where=None, group_by=None, having=None, order_by=None, limit=None, offset=None, conj=u"AND", **kw):
+        return self._db.async_getAll(self.table_name, value_name, where=where, group_by=group_by, having=having, order_by=order_by, limit=limit, offset=offset, conj=conj, **kw)
+
 
 class PeerDBHandler(BasicDBHandler):
 
@@ -222,6 +231,9 @@ class TorrentDBHandler(BasicDBHandler):
 
         self.infohash_id = LimitedOrderedDict(DEFAULT_ID_CACHE_SIZE)
 
+        self.search_engine = TorrentSearchEngine(self._db)
+        self.suggestion_index = SuggestionIndex(self._db)
+
     def initialize(self, *args, **kwargs):
         super(TorrentDBHandler, self).initialize(*args, **kwargs)
         self.category = self.session.lm.cat
@@ -229,9 +241,11 @@ class TorrentDBHandler(BasicDBHandler):
         self.votecast_db = self.session.open_dbhandler(NTFY_VOTECAST)
         self.channelcast_db = self.session.open_dbhandler(NTFY_CHANNELCAST)
         self._rtorrent_handler = self.session.lm.rtorrent_handler
+        self.suggestion_index.initialize()
 
     def close(self):
         super(TorrentDBHandler, self).close()
+        self.suggestion_index.close()
         self.category = None
         self.mypref_db = None
         self.votecast_db = None
@@ -339,9 +353,9 @@ class TorrentDBHandler(BasicDBHandler):
                 if self._rtorrent_handler:
                     self._rtorrent_handler.notify_possible_torrent_infohash(infohash)
 
-                insert_files = [(torrent_id, unicode(path), length) for path, length in files]
-                sql_insert_files = "INSERT OR IGNORE INTO TorrentFiles (torrent_id, path, length) VALUES (?,?,?)"
-                self._db.executemany(sql_insert_files, insert_files)
+                sql_insert_files = u"INSERT OR IGNORE INTO TorrentFiles (torrent_id, path, length) VALUES (?,?,?)"
+                for path, length in files:
+                    self._db.queue_write(u"TorrentFiles", sql_insert_files, (torrent_id, unicode(path), length))
             except:
                 self._logger.error("Could not create a TorrentDef instance %r %r %r %r %r %r", infohash, timestamp, name, files, trackers, extra_info)
                 print_exc()
@@ -408,30 +422,36 @@ class TorrentDBHandler(BasicDBHandler):
 
         # see if there is already a torrent in the database with this infohash
         torrent_id = self.getTorrentID(infohash)
+        indexed_swarmname = None
         if torrent_id is None:  # not in database
             self._db.insert("Torrent", **database_dict)
             torrent_id = self.getTorrentID(infohash)
 
         else:  # infohash in db
+            indexed_swarmname = self._db.getOne('Torrent', 'name', torrent_id=torrent_id)
             del database_dict["infohash"]  # no need for infohash, its already stored
             where = "torrent_id = %d" % torrent_id
             self._db.update('Torrent', where=where, **database_dict)
 
         if not torrentdef.is_multifile_torrent():
             swarmname, _ = os.path.splitext(swarmname)
-        self._indexTorrent(torrent_id, swarmname, torrentdef.get_files_as_unicode())
+        self._indexTorrent(torrent_id, swarmname, torrentdef.get_files_as_unicode(), indexed_swarmname)
 
         self._addTorrentTracker(torrent_id, torrentdef, extra_info)
         return torrent_id
 
-    def _indexTorrent(self, torrent_id, swarmname, files):
+    def _indexTorrent(self, torrent_id, swarmname, files, indexed_swarmname=None):
         existed = self._db.getOne('CollectedTorrent', 'infohash', torrent_id=torrent_id)
         if existed:
             return
 
         # Niels: new method for indexing, replaces invertedindex
         # Making sure that swarmname does not include extension for single file torrents
-        swarm_keywords = " ".join(split_into_keywords(swarmname))
+        swarm_keywords = split_into_keywords(swarmname)
+        # a torrent that is indexed again, under the name it had in the Torrent table, only adds the keywords that were
+        # not in that name to the vocabulary
+        self.suggestion_index.add_keywords(swarm_keywords,
+                                           split_into_keywords(indexed_swarmname) if indexed_swarmname else ())
 
         filedict = {}
         fileextensions = set()
@@ -449,15 +469,12 @@ class TorrentDBHandler(BasicDBHandler):
             filenames.sort(cmp=popSort, reverse=True)
             filenames = filenames[:1000]
 
-        values = (torrent_id, swarm_keywords, " ".join(filenames), " ".join(fileextensions))
-        try:
-            # INSERT OR REPLACE not working for fts3 table
-            self._db.execute_write(u"DELETE FROM FullTextIndex WHERE rowid = ?", (torrent_id,))
-            self._db.execute_write(
-                u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) VALUES(?,?,?,?)", values)
-        except:
-            # this will fail if the fts3 module cannot be found
-            print_exc()
+        values = (torrent_id, " ".join(swarm_keywords), " ".join(filenames), " ".join(fileextensions))
+        # INSERT OR REPLACE not working for fts3 table, queue the DELETE and INSERT as one statement so that
+        # consecutive updates of many torrents are coalesced into a single batch
+        self._db.queue_write(u"FullTextIndex", u"DELETE FROM FullTextIndex WHERE rowid = ?;"
+                                               u" INSERT INTO FullTextIndex (rowid, swarmname, filenames,"
+                                               u" fileextensions) VALUES(?,?,?,?)", (torrent_id,) + values)
 
     # ------------------------------------------------------------
     # Adds the trackers of a given torrent into the database.
@@ -533,9 +550,9 @@ class TorrentDBHandler(BasicDBHandler):
                 continue
             to_be_inserted.append((infohash,))
 
-        if len(to_be_inserted) > 0:
-            sql = u"INSERT OR IGNORE INTO Torrent (infohash) VALUES (?)"
-            self._db.executemany(sql, to_be_inserted)
+        sql = u"INSERT OR IGNORE INTO Torrent (infohash) VALUES (?)"
+        for args in to_be_inserted:
+            self._db.queue_write(u"Torrent", sql, args)
 
     def on_search_response(self, torrents):
         status = u'unknown'
@@ -570,7 +587,7 @@ class TorrentDBHandler(BasicDBHandler):
             if tid:  # we know this torrent
                 if tid not in tid_collected and swarmname != tid_name.get(tid, ''):  # if not collected and name not equal then do fullupdate
                     update.append((swarmname, length, nrfiles, category, creation_date, infohash, status, tid))
-                    to_be_indexed.append((tid, swarmname))
+                    to_be_indexed.append((tid, swarmname, tid_name.get(tid)))
 
                 elif infohash and infohash not in infohash_tid:
                     update_infohash.append((infohash, tid))
@@ -594,13 +611,14 @@ class TorrentDBHandler(BasicDBHandler):
 
                 were_inserted = [(inserted[5],) for inserted in insert]
                 sql = u"SELECT torrent_id, name FROM Torrent WHERE infohash == ?"
-                to_be_indexed = to_be_indexed + list(self._db.executemany(sql, were_inserted))
+                to_be_indexed = to_be_indexed + [(torrent_id, swarmname, None) for torrent_id, swarmname
+                                                 in self._db.executemany(sql, were_inserted)]
             except:
                 print_exc()
                 self._logger.error(u"infohashes: %s", insert)
 
-        for torrent_id, swarmname in to_be_indexed:
-            self._indexTorrent(torrent_id, swarmname, [])
+        for torrent_id, swarmname, indexed_swarmname in to_be_indexed:
+            self._indexTorrent(torrent_id, swarmname, [], indexed_swarmname)
 
     def getTorrentCheckRetries(self, torrent_id):
         sql = u"SELECT tracker_check_retries FROM Torrent WHERE torrent_id = ?"
@@ -685,6 +703,21 @@ class TorrentDBHandler(BasicDBHandler):
         infohash_list = self._db.fetchall(sql, (tracker, current_time))
         return [(torrent_id, str2bin(infohash), last_tracker_check) for torrent_id, infohash, last_tracker_check in infohash_list]
 
+    def getTorrentsToCheck(self, current_time, last_check_before, limit):
+        """
+        Returns up to limit (torrent_id, infohash, tracker, next_tracker_check) tuples for all trackers, of the
+        torrents that are due to be checked and were last checked before last_check_before, the ones that are overdue
+        the longest first.
+        """
+        sql = u"SELECT T.torrent_id, T.infohash, TI.tracker, T.next_tracker_check" \
+              u" FROM Torrent T, TrackerInfo TI, TorrentTrackerMapping TTM" \
+              u" WHERE TI.tracker_id = TTM.tracker_id AND T.torrent_id = TTM.torrent_id" \
+              u" AND TI.tracker != 'no-DHT' AND T.next_tracker_check < ? AND T.last_tracker_check < ?" \
+              u" ORDER BY T.next_tracker_check LIMIT ?"
+        results = self._db.fetchall(sql, (current_time, last_check_before, limit))
+        return [(torrent_id, str2bin(infohash), tracker, next_tracker_check)
+                for torrent_id, infohash, tracker, next_tracker_check in results]
+
     def getTrackerListByTorrentID(self, torrent_id):
         sql = 'SELECT TR.tracker FROM TrackerInfo TR, TorrentTrackerMapping MP'\
             + ' WHERE MP.torrent_id = ?'\
@@ -862,42 +895,29 @@ class TorrentDBHandler(BasicDBHandler):
         self._logger.info("Erased %d torrents", deleted)
         return deleted
 
-    def searchNames(self, kws, local=True, keys=None, doSort=True):
+    def searchNames(self, kws, local=True, keys=None, doSort=True, limit=None, offset=0):
+        """
+        Searches the local database for torrents matching the keywords kws, see TorrentSearchEngine.search.
+        Results are ordered by rank, or by seeders first if doSort is set. A remote (not local) search returns at
+        most REMOTE_SEARCH_LIMIT results.
+        :return: A list of results, each a list of the requested keys followed by the channel id, a dictionary with
+        the matched keywords per full-text column and the details of the channel.
+        """
         assert 'infohash' in keys
         assert not doSort or ('num_seeders' in keys or 'T.num_seeders' in keys)
 
         infohash_index = keys.index('infohash')
-        num_seeders_index = keys.index('num_seeders') if 'num_seeders' in keys else -1
-
-        if num_seeders_index == -1:
-            doSort = False
-
-        values = ", ".join(keys)
-        mainsql = "SELECT " + values + ", C.channel_id, Matchinfo(FullTextIndex) FROM"
-        if local:
-            mainsql += " Torrent T"
-        else:
-            mainsql += " CollectedTorrent T"
-
-        mainsql += """, FullTextIndex
-                    LEFT OUTER JOIN _ChannelTorrents C ON T.torrent_id = C.torrent_id
-                    WHERE t.name IS NOT NULL AND t.torrent_id = FullTextIndex.rowid AND C.deleted_at IS NULL AND FullTextIndex MATCH ?
-                    """
 
         if not local:
-            mainsql += "AND T.secret is not 1 LIMIT 250"
-
-        query = " ".join(filter_keywords(kws))
-        not_negated = [kw for kw in filter_keywords(kws) if kw[0] != '-']
+            limit = min(limit or REMOTE_SEARCH_LIMIT, REMOTE_SEARCH_LIMIT)
 
-        results = self._db.fetchall(mainsql, (query,))
+        my_channel_id = self.channelcast_db._channel_id or 0
+        results = self.search_engine.search(kws, keys, local=local, sort_by_seeders=doSort,
+                                            my_channel_id=my_channel_id, limit=limit, offset=offset)
 
-        channels = set()
+        # only fetch the details of the channels on this page
         channel_dict = {}
-        for result in results:
-            if result[-2]:
-                channels.add(result[-2])
-
+        channels = set(result[-2] for result in results if result[-2])
         if len(channels) > 0:
             # results are tuples of (id, str(dispersy_cid), name, description,
             # nr_torrents, nr_favorites, nr_spam, my_vote, modified, id ==
@@ -906,160 +926,19 @@ class TorrentDBHandler(BasicDBHandler):
                 if channel[1] != '-1':
                     channel_dict[channel[0]] = channel
 
-        myChannelId = self.channelcast_db._channel_id or 0
-
-        result_dict = {}
-
-        # step 1, merge torrents keep one with best channel
         for result in results:
-            channel_id = result[-2]
-            channel = channel_dict.get(channel_id, None)
-
-            infohash = result[infohash_index]
-            if channel:
-                # ignoring spam channels
-                if channel[7] < 0:
-                    continue
-
-                # see if we have a better channel in torrents_dict
-                if infohash in result_dict:
-                    old_channel = channel_dict.get(result_dict[infohash][-2], False)
-                    if old_channel:
-
-                        # allways prefer my channel
-                        if old_channel[0] == myChannelId:
-                            continue
-
-                        # allways prefer channel with higher vote
-                        if channel[7] < old_channel[7]:
-                            continue
-
-                        votes = (channel[5] or 0) - (channel[6] or 0)
-                        oldvotes = (old_channel[5] or 0) - (old_channel[6] or 0)
-                        if votes < oldvotes:
-                            continue
-
-                result_dict[infohash] = result
-
-            elif infohash not in result_dict:
-                result_dict[infohash] = result
-
-
-        # step 2, fix all dict fields
-        dont_sort_list = []
-        results = [list(result) for result in result_dict.values()]
-        for index in xrange(len(results) - 1, -1, -1):
-            result = results[index]
-
             result[infohash_index] = str2bin(result[infohash_index])
 
-            matches = {'swarmname': set(), 'filenames': set(), 'fileextensions': set()}
-
-            # Matchinfo is documented at: http://www.sqlite.org/fts3.html#matchinfo
-            matchinfo = str(result[-1])
-            num_phrases, num_cols = unpack_from('II', matchinfo)
-            unpack_str = 'I' * (3 * num_cols * num_phrases)
-            matchinfo = unpack_from('II' + unpack_str, matchinfo)
-
-            swarmnames, filenames, fileextensions = [
-                [matchinfo[3 * (i + p * num_cols) + 2] for p in range(num_phrases)]
-                for i in range(num_cols)
-            ]
-
-            for i, keyword in enumerate(not_negated):
-                if swarmnames[i]:
-                    matches['swarmname'].add(keyword)
-                if filenames[i]:
-                    matches['filenames'].add(keyword)
-                if fileextensions[i]:
-                    matches['fileextensions'].add(keyword)
-            result[-1] = matches
-
             channel = channel_dict.get(result[-2], (result[-2], None, '', '', 0, 0, 0, 0, 0, False))
             result.extend(channel)
 
-            if doSort and result[num_seeders_index] <= 0:
-                dont_sort_list.append((index, result))
-
-        if doSort:
-            # Remove the items with 0 seeders from the results list so the sort is faster, append them to the
-            # results list afterwards.
-            for index, result in dont_sort_list:
-                results.pop(index)
-
-            def compare(a, b):
-                return cmp(a[num_seeders_index], b[num_seeders_index])
-            results.sort(compare, reverse=True)
-
-            for index, result in dont_sort_list:
-                results.append(result)
-
-        if not local:
-            results = results[:25]
-
         return results
 
     def getAutoCompleteTerms(self, keyword, max_terms, limit=100):
-        sql = "SELECT swarmname FROM FullTextIndex WHERE swarmname MATCH ? LIMIT ?"
-        result = self._db.fetchall(sql, (keyword + '*', limit))
-
-        all_terms = set()
-        for line, in result:
-            if len(all_terms) >= max_terms:
-                break
-            i1 = line.find(keyword)
-            i2 = line.find(' ', i1 + len(keyword))
-            all_terms.add(line[i1:i2] if i2 >= 0 else line[i1:])
-
-        if keyword in all_terms:
-            all_terms.remove(keyword)
-        if '' in all_terms:
-            all_terms.remove('')
-
-        return list(all_terms)
+        return self.suggestion_index.get_completions(keyword, max_terms, limit=limit)
 
     def getSearchSuggestion(self, keywords, limit=1):
-        match = [keyword.lower() for keyword in keywords if len(keyword) > 3]
-
-        def lev(a, b):
-            "Calculates the Levenshtein distance between a and b."
-            n, m = len(a), len(b)
-            if n > m:
-                # Make sure n <= m, to use O(min(n,m)) space
-                a, b = b, a
-                n, m = m, n
-
-            current = range(n + 1)
-            for i in range(1, m + 1):
-                previous, current = current, [i] + [0] * n
-                for j in range(1, n + 1):
-                    add, delete = previous[j] + 1, current[j - 1] + 1
-                    change = previous[j - 1]
-                    if a[j - 1] != b[i - 1]:
-                        change = change + 1
-                    current[j] = min(add, delete, change)
-
-            return current[n]
-
-        def levcollate(s1, s2):
-            l1 = sum(sorted([lev(a, b) for a in s1.split() for b in match])[:len(match)])
-            l2 = sum(sorted([lev(a, b) for a in s2.split() for b in match])[:len(match)])
-
-            # return -1 if s1<s2, +1 if s1>s2 else 0
-            if l1 < l2:
-                return -1
-            if l1 > l2:
-                return 1
-            return 0
-
-        cursor = self._db.get_cursor()
-        connection = cursor.getconnection()
-        connection.createcollation("leven", levcollate)
-
-        sql = "SELECT swarmname FROM FullTextIndex WHERE swarmname MATCH ? ORDER By swarmname collate leven ASC LIMIT ?"
-        results = self._db.fetchall(sql, (' OR '.join(['*%s*' % m for m in match]), limit))
-        connection.createcollation("leven", None)
-        return [result[0] for result in results]
+        return self.suggestion_index.get_suggestions(keywords, limit=limit)
 
 
 class MyPreferenceDBHandler(BasicDBHandler):
@@ -1443,9 +1322,9 @@ ORDER BY CMD.time_stamp DESC LIMIT ?;
             updated_channel_torrent_dict[channel_id].append({u'info_hash': infohash,
                                                              u'channel_torrent_id': channel_torrent_id})
 
-        sql_update_channel = "UPDATE _Channels SET modified = strftime('%s','now'), nr_torrents = nr_torrents+? WHERE id = ?"
-        update_channels = [(new_torrents, channel_id) for channel_id, new_torrents in updated_channels.iteritems()]
-        self._db.executemany(sql_update_channel, update_channels)
+        sql_update_channel = u"UPDATE _Channels SET modified = strftime('%s','now'), nr_torrents = nr_torrents+? WHERE id = ?"
+        for channel_id, new_torrents in updated_channels.iteritems():
+            self._db.queue_write(u"_Channels", sql_update_channel, (new_torrents, channel_id))
 
         for channel_id in updated_channels.keys():
             self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, channel_id)
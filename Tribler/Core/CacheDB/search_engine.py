@@ -0,0 +1,128 @@
+"""
+Ranked full-text search over the FullTextIndex.
+
+Ranking, de-duplication of torrents that are in several channels and paging are all done in SQL, so only the
+requested page of results is ever loaded into Python.
+"""
+import logging
+from math import log
+from struct import unpack_from
+
+from Tribler.Core.Utilities.search_utils import filter_keywords
+
+
+# BM25 term frequency saturation
+BM25_K1 = 1.2
+# Lower bound of the inverse document frequency, so that very common terms still add a little relevance
+MIN_IDF = 0.01
+# Weights of the swarmname, filenames and fileextensions columns of the FullTextIndex
+COLUMN_WEIGHTS = (1.0, 0.4, 0.2)
+FULL_TEXT_COLUMNS = ('swarmname', 'filenames', 'fileextensions')
+
+# Weights of the popularity of a torrent (its seeders) and of its channel (favorite votes minus spam votes)
+SEEDERS_WEIGHT = 0.5
+VOTES_WEIGHT = 0.25
+
+
+def unpack_matchinfo(matchinfo):
+    """
+    Unpacks the default ("pcx") FTS3 matchinfo blob, documented at http://www.sqlite.org/fts3.html#matchinfo.
+    :return: A tuple (num_phrases, num_cols, values), with three values for every phrase/column combination:
+    the hits in this row, the hits in all rows and the number of rows with at least one hit.
+    """
+    num_phrases, num_cols = unpack_from('II', matchinfo)
+    values = unpack_from('I' * (3 * num_cols * num_phrases), matchinfo, 8)
+    return num_phrases, num_cols, values
+
+
+def search_rank(matchinfo, num_documents, num_seeders, votes):
+    """
+    Scores a full-text match by combining BM25-style relevance with the number of seeders and channel votes.
+
+    The FTS3 FullTextIndex does not keep document lengths, so the BM25 length normalization is left out.
+    This function is registered as the search_rank SQL function.
+    """
+    num_phrases, num_cols, values = unpack_matchinfo(matchinfo)
+
+    relevance = 0.0
+    for phrase in xrange(num_phrases):
+        for col in xrange(min(num_cols, len(COLUMN_WEIGHTS))):
+            offset = 3 * (col + phrase * num_cols)
+            hits = values[offset]
+            if hits:
+                documents_with_hits = values[offset + 2]
+                idf = max(log((num_documents - documents_with_hits + 0.5) / (documents_with_hits + 0.5)), MIN_IDF)
+                relevance += COLUMN_WEIGHTS[col] * idf * hits * (BM25_K1 + 1) / (hits + BM25_K1)
+
+    return relevance + SEEDERS_WEIGHT * log(1 + max(num_seeders or 0, 0)) + VOTES_WEIGHT * log(1 + max(votes or 0, 0))
+
+
+class TorrentSearchEngine(object):
+    """
+    Searches the FullTextIndex and returns a single page of torrents, ordered by search_rank.
+    """
+
+    def __init__(self, db):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._db = db
+
+    def search(self, keywords, keys, local=True, sort_by_seeders=False, my_channel_id=0, limit=None, offset=0):
+        """
+        Searches for torrents matching keywords. Torrents that are in several channels are returned once, together
+        with the preferred channel: our own channel, then the channel we voted highest on, then the channel with the
+        most votes. Torrents that are only in channels we marked as spam are left out.
+        :param keys: The torrent columns to return.
+        :param local: Whether to search all torrents, or only collected torrents that are not secret.
+        :param sort_by_seeders: Whether to sort by seeders before sorting by rank.
+        :return: A list of results, each a list of the requested columns followed by the channel id and a dictionary
+        with the matched keywords per full-text column.
+        """
+        self._db.register_function(u"search_rank", search_rank, 4)
+
+        query = u" ".join(filter_keywords(keywords))
+        not_negated = [keyword for keyword in filter_keywords(keywords) if keyword[0] != '-']
+
+        num_documents = self._db.fetchone(u"SELECT max(torrent_id) FROM Torrent") or 1
+
+        # The LIMIT -1 keeps SQLite from flattening the subquery, as matchinfo can only be used in the full-text query
+        sql = u"SELECT " + u", ".join(keys) + u", C.channel_id, M.match_info," \
+              u" search_rank(M.match_info, ?, T.num_seeders, ifnull(CH.nr_favorite, 0) - ifnull(CH.nr_spam, 0))" \
+              u" AS relevance," \
+              u" max(ifnull(C.channel_id == ?, 0) * 1000000000000 + ifnull(CV.vote, 0) * 1000000000" \
+              u" + ifnull(CH.nr_favorite, 0) - ifnull(CH.nr_spam, 0))" \
+              u" FROM (SELECT rowid AS torrent_id, Matchinfo(FullTextIndex) AS match_info FROM FullTextIndex" \
+              u" WHERE FullTextIndex MATCH ? LIMIT -1) M" \
+              u" JOIN %s T ON T.torrent_id = M.torrent_id" \
+              u" LEFT OUTER JOIN _ChannelTorrents C ON T.torrent_id = C.torrent_id AND C.deleted_at IS NULL" \
+              u" LEFT OUTER JOIN _Channels CH ON CH.id = C.channel_id" \
+              u" LEFT OUTER JOIN ChannelVotes CV ON CV.channel_id = C.channel_id AND CV.voter_id ISNULL" \
+              u" WHERE T.name IS NOT NULL AND ifnull(CV.vote, 0) >= 0" % (u"Torrent" if local else u"CollectedTorrent")
+        if not local:
+            sql += u" AND T.secret IS NOT 1"
+        sql += u" GROUP BY T.torrent_id ORDER BY "
+        if sort_by_seeders:
+            sql += u"T.num_seeders DESC, "
+        sql += u"relevance DESC LIMIT ? OFFSET ?"
+
+        results = self._db.fetchall(sql, (num_documents, my_channel_id, query,
+                                          limit if limit is not None else -1, offset))
+
+        page = []
+        for result in results:
+            result = list(result[:-2])
+            result[-1] = self._get_matches(result[-1], not_negated)
+            page.append(result)
+        return page
+
+    def _get_matches(self, matchinfo, keywords):
+        """
+        Returns which of the (not negated) keywords matched, per full-text column.
+        """
+        num_phrases, num_cols, values = unpack_matchinfo(matchinfo)
+
+        matches = dict((column, set()) for column in FULL_TEXT_COLUMNS)
+        for phrase, keyword in enumerate(keywords[:num_phrases]):
+            for col, column in enumerate(FULL_TEXT_COLUMNS[:num_cols]):
+                if values[3 * (col + phrase * num_cols)]:
+                    matches[column].add(keyword)
+        return matches
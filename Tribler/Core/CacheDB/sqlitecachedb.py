@@ -2,12 +2,18 @@
 # see LICENSE.txt for license information
 import logging
 import os
+import re
 from base64 import encodestring, decodestring
-from threading import currentThread, RLock
+from time import time
+from threading import currentThread, RLock, local
 
 import apsw
 from apsw import CantOpenError, SQLError
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.threads import deferToThreadPool
 from twisted.python.threadable import isInIOThread
+from twisted.python.threadpool import ThreadPool
 
 from Tribler.dispersy.taskmanager import TaskManager
 from Tribler.dispersy.util import blocking_call_on_reactor_thread, call_on_reactor_thread
@@ -25,6 +31,30 @@ DB_FILE_RELATIVE_PATH = os.path.join(DB_DIR_NAME, DB_FILE_NAME)
 
 
 DEFAULT_BUSY_TIMEOUT = 10000
+DEFAULT_READ_POOL_SIZE = 4
+
+# The write-behind queue is flushed when it holds this many rows, or after this many seconds.
+WRITE_QUEUE_MAX_SIZE = 1000
+WRITE_QUEUE_FLUSH_INTERVAL = 1.0
+
+# Flushed writes are group-committed when this many rows are uncommitted, or after this many seconds.
+GROUP_COMMIT_SIZE = 10000
+GROUP_COMMIT_INTERVAL = 5.0
+
+# The views of the database schema and the table they select from, so a query on a view flushes the queued writes
+# on its table.
+VIEW_TABLES = {u"CollectedTorrent": u"Torrent",
+               u"Channels": u"_Channels",
+               u"ChannelTorrents": u"_ChannelTorrents",
+               u"Playlists": u"_Playlists",
+               u"PlaylistTorrents": u"_PlaylistTorrents",
+               u"Comments": u"_Comments",
+               u"Moderations": u"_Moderations",
+               u"ChannelMetaData": u"_ChannelMetaData",
+               u"ChannelVotes": u"_ChannelVotes",
+               u"TorrentMarkings": u"_TorrentMarkings"}
+_VIEW_TABLES_LOWER = dict((view.lower(), table.lower()) for view, table in VIEW_TABLES.iteritems())
+_IDENTIFIER_RE = re.compile(r"\w+", re.UNICODE)
 
 TRHEADING_DEBUG = False
 
@@ -46,7 +76,8 @@ def str2bin(str_data):
 
 class SQLiteCacheDB(TaskManager):
 
-    def __init__(self, db_path, db_script_path=None, busytimeout=DEFAULT_BUSY_TIMEOUT):
+    def __init__(self, db_path, db_script_path=None, busytimeout=DEFAULT_BUSY_TIMEOUT,
+                 read_pool_size=DEFAULT_READ_POOL_SIZE):
         super(SQLiteCacheDB, self).__init__()
 
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -55,6 +86,8 @@ class SQLiteCacheDB(TaskManager):
         self._cursor_table = {}
 
         self._connection = None
+        # Serializes the statements and commits on the connection, as the reactor and the writer thread both use it
+        self._connection_lock = RLock()
         self.sqlite_db_path = db_path
         self.db_script_path = db_script_path
         self._busytimeout = busytimeout  # busytimeout is in milliseconds
@@ -64,6 +97,36 @@ class SQLiteCacheDB(TaskManager):
         self._should_commit = False
         self._show_execute = False
 
+        # The database executor: a single writer thread sharing the connection (see _connection_lock) and a pool of
+        # threads that each own a read-only connection. Both pools are started on first use.
+        self._executor_lock = RLock()
+        self._read_pool_size = read_pool_size
+        self._read_pool = None
+        self._write_pool = None
+        self._read_local = local()
+        self._read_connections = []
+
+        # SQL functions that are registered on the write connection and on every read connection.
+        self._functions = {}
+
+        # The write-behind queue: a list of (table_name, sql, [args, ...]) batches, only accessed on the reactor.
+        self._write_queue = []
+        self._write_queue_sql_index = {}
+        self._write_queue_table_index = {}
+        self._write_queue_depth = 0
+
+        self._uncommitted_writes = 0
+        self._last_commit_time = time()
+
+        self._write_queue_statistics = {u"max_queue_depth": 0,
+                                        u"flushes": 0,
+                                        u"flushed_rows": 0,
+                                        u"flushed_batches": 0,
+                                        u"flush_errors": 0,
+                                        u"commits": 0,
+                                        u"last_commit_latency": 0.0,
+                                        u"total_commit_latency": 0.0}
+
     @property
     def version(self):
         """The version of this database."""
@@ -89,10 +152,12 @@ class SQLiteCacheDB(TaskManager):
     @blocking_call_on_reactor_thread
     def close(self):
         """
-        Cancels all pending tasks and closes all cursors. Then, it closes the connection.
+        Cancels all pending tasks, stops the database executor and closes all cursors. Then, it closes the connection.
         """
+        self.flush_write_queue()
         self.cancel_all_pending_tasks()
-        with self._cursor_lock:
+        self._stop_executor()
+        with self._connection_lock, self._cursor_lock:
             for cursor in self._cursor_table.itervalues():
                 cursor.close()
             self._cursor_table = {}
@@ -219,15 +284,30 @@ class SQLiteCacheDB(TaskManager):
 
     @call_on_reactor_thread
     def commit_now(self, vacuum=False, exiting=False):
+        # the writer thread cannot run a statement between the COMMIT and the next BEGIN
+        with self._connection_lock:
+            self._commit_now(vacuum, exiting)
+
+    def _commit_now(self, vacuum, exiting):
+        self.flush_write_queue(allow_commit=False)
+
         if self._should_commit and isInIOThread():
             try:
                 self._logger.info(u"Start committing...")
+                start_time = time()
                 self.execute(u"COMMIT;")
             except:
                 self._logger.exception(u"COMMIT FAILED")
                 raise
             self._should_commit = False
 
+            commit_latency = time() - start_time
+            self._uncommitted_writes = 0
+            self._last_commit_time = time()
+            self._write_queue_statistics[u"commits"] += 1
+            self._write_queue_statistics[u"last_commit_latency"] = commit_latency
+            self._write_queue_statistics[u"total_commit_latency"] += commit_latency
+
             if vacuum:
                 self._logger.info(u"Start vacuuming...")
                 self.execute(u"VACUUM;")
@@ -260,6 +340,11 @@ class SQLiteCacheDB(TaskManager):
 
     @blocking_call_on_reactor_thread
     def execute(self, sql, args=None):
+        if self._write_queue and self._touches_write_queue(sql):
+            self.flush_write_queue()
+        return self._execute(sql, args)
+
+    def _execute(self, sql, args=None):
         cur = self.get_cursor()
 
         if self._show_execute:
@@ -267,10 +352,11 @@ class SQLiteCacheDB(TaskManager):
             self._logger.info(u"===%s===\n%s\n-----\n%s\n======\n", thread_name, sql, args)
 
         try:
-            if args is None:
-                return cur.execute(sql)
-            else:
-                return cur.execute(sql, args)
+            with self._connection_lock:
+                if args is None:
+                    return cur.execute(sql)
+                else:
+                    return cur.execute(sql, args)
 
         except Exception as msg:
             if str(msg).startswith(u"BusyError"):
@@ -285,6 +371,11 @@ class SQLiteCacheDB(TaskManager):
 
     @blocking_call_on_reactor_thread
     def executemany(self, sql, args=None):
+        if self._write_queue and self._touches_write_queue(sql):
+            self.flush_write_queue()
+        return self._executemany(sql, args)
+
+    def _executemany(self, sql, args=None):
         self._should_commit = True
 
         cur = self.get_cursor()
@@ -293,10 +384,11 @@ class SQLiteCacheDB(TaskManager):
             self._logger.info(u"===%s===\n%s\n-----\n%s\n======\n", thread_name, sql, args)
 
         try:
-            if args is None:
-                result = cur.executemany(sql)
-            else:
-                result = cur.executemany(sql, args)
+            with self._connection_lock:
+                if args is None:
+                    result = cur.executemany(sql)
+                else:
+                    result = cur.executemany(sql, args)
 
             return result
 
@@ -382,19 +474,7 @@ class SQLiteCacheDB(TaskManager):
         find = self.execute_read(sql, args)
         if not find:
             return
-        else:
-            find = list(find)
-            if len(find) > 0:
-                if len(find) > 1:
-                    self._logger.debug(
-                        u"FetchONE resulted in many more rows than one, consider putting a LIMIT 1 in the sql statement %s, %s", sql, len(find))
-                find = find[0]
-            else:
-                return
-        if len(find) > 1:
-            return find
-        else:
-            return find[0]
+        return self._first_row(list(find), sql)
 
     @blocking_call_on_reactor_thread
     def fetchall(self, sql, args=None):
@@ -405,47 +485,240 @@ class SQLiteCacheDB(TaskManager):
         else:
             return []  # should it return None?
 
-    def getOne(self, table_name, value_name, where=None, conj=u"AND", **kw):
-        """ value_name could be a string, a tuple of strings, or '*'
+    def _first_row(self, rows, sql):
         """
-        if isinstance(value_name, tuple):
-            value_names = u",".join(value_name)
-        elif isinstance(value_name, list):
-            value_names = u",".join(value_name)
+        Reduces the result rows of a query to what fetchone returns: None if there are no rows, the single value
+        if the first row has only one column and the first row itself otherwise.
+        """
+        if len(rows) == 0:
+            return
+        if len(rows) > 1:
+            self._logger.debug(
+                u"FetchONE resulted in many more rows than one, consider putting a LIMIT 1 in the sql statement %s, %s", sql, len(rows))
+        find = rows[0]
+        if len(find) > 1:
+            return find
         else:
-            value_names = value_name
+            return find[0]
 
-        if isinstance(table_name, tuple):
-            table_names = u",".join(table_name)
-        elif isinstance(table_name, list):
-            table_names = u",".join(table_name)
-        else:
-            table_names = table_name
+    def register_function(self, name, function, num_args=-1):
+        """
+        Makes a Python function available as a scalar SQL function, both on the write connection and on the read
+        connections of the database executor. Registering the same function again is a no-op.
+        """
+        with self._executor_lock:
+            if self._functions.get(name) == (function, num_args):
+                return
+            self._functions[name] = (function, num_args)
 
-        sql = u'SELECT %s FROM %s' % (value_names, table_names)
+            with self._connection_lock:
+                self._connection.createscalarfunction(name, function, num_args)
+            for connection in self._read_connections:
+                connection.createscalarfunction(name, function, num_args)
 
-        if where or kw:
-            sql += u' WHERE '
-        if where:
-            sql += where
-            if kw:
-                sql += u' %s ' % conj
-        if kw:
-            arg = []
-            for k, v in kw.iteritems():
-                if isinstance(v, tuple):
-                    operator = v[0]
-                    arg.append(v[1])
+    # -------- Write-behind Queue --------
+    @call_on_reactor_thread
+    def queue_write(self, table_name, sql, args):
+        """
+        Queues a write statement on table_name instead of executing it right away. Queued rows for the same statement
+        are coalesced into a single executemany when the queue is flushed, after which they are group-committed.
+
+        Statements on the same table keep their order, statements on different tables may be reordered. Any statement
+        executed through execute or executemany that mentions a table with queued writes flushes the queue first.
+        As errors can only be logged when the queue is flushed, prefer statements that cannot fail
+        (i.e. INSERT OR IGNORE, UPDATE).
+        """
+        index = self._write_queue_sql_index.get(sql)
+        if index is None or self._write_queue_table_index[table_name] != index:
+            index = len(self._write_queue)
+            self._write_queue.append((table_name, sql, []))
+            self._write_queue_sql_index[sql] = index
+            self._write_queue_table_index[table_name] = index
+
+        self._write_queue[index][2].append(args)
+        self._write_queue_depth += 1
+        if self._write_queue_depth > self._write_queue_statistics[u"max_queue_depth"]:
+            self._write_queue_statistics[u"max_queue_depth"] = self._write_queue_depth
+
+        if self._write_queue_depth >= WRITE_QUEUE_MAX_SIZE:
+            self.flush_write_queue()
+        elif not self.is_pending_task_active(u"flush write queue"):
+            self.register_task(u"flush write queue", reactor.callLater(WRITE_QUEUE_FLUSH_INTERVAL,
+                                                                        self.flush_write_queue))
+
+    def _touches_write_queue(self, sql):
+        # SQL identifiers are case insensitive, views are replaced by the table they select from
+        tables = set(_VIEW_TABLES_LOWER.get(identifier, identifier)
+                     for identifier in _IDENTIFIER_RE.findall(sql.lower()))
+        return any(table_name.lower() in tables for table_name in self._write_queue_table_index)
+
+    @blocking_call_on_reactor_thread
+    def flush_write_queue(self, allow_commit=True):
+        """
+        Executes all queued writes, one executemany per batch. Afterwards, the open transaction is committed if
+        enough rows are uncommitted or if the last commit was long enough ago.
+        """
+        if self.is_pending_task_active(u"flush write queue"):
+            self.cancel_pending_task(u"flush write queue")
+
+        if not self._write_queue:
+            return
+
+        write_queue = self._write_queue
+        self._write_queue = []
+        self._write_queue_sql_index = {}
+        self._write_queue_table_index = {}
+        self._write_queue_depth = 0
+
+        for _, sql, args_list in write_queue:
+            try:
+                if len(args_list) == 1:
+                    self._execute(sql, args_list[0])
                 else:
-                    operator = "="
-                    arg.append(v)
-                sql += u' %s %s ? ' % (k, operator)
-                sql += conj
-            sql = sql[:-len(conj)]
-        else:
-            arg = None
+                    self._executemany(sql, args_list)
+            except Exception:
+                self._logger.exception(u"Failed to flush %d queued rows for %s", len(args_list), sql)
+                self._write_queue_statistics[u"flush_errors"] += 1
+
+            self._uncommitted_writes += len(args_list)
+            self._write_queue_statistics[u"flushed_rows"] += len(args_list)
+        self._should_commit = True
+
+        self._write_queue_statistics[u"flushes"] += 1
+        self._write_queue_statistics[u"flushed_batches"] += len(write_queue)
+
+        # Only commit if there is an open transaction, otherwise the writes have already been committed.
+        if allow_commit and not self._connection.getautocommit() and \
+                (self._uncommitted_writes >= GROUP_COMMIT_SIZE
+                 or time() - self._last_commit_time >= GROUP_COMMIT_INTERVAL):
+            self.commit_now()
+
+    def get_write_queue_statistics(self):
+        """
+        Returns a dictionary with the current depth of the write-behind queue and counters about flushes and commits.
+        """
+        statistics = dict(self._write_queue_statistics)
+        statistics[u"queue_depth"] = self._write_queue_depth
+        statistics[u"uncommitted_rows"] = self._uncommitted_writes
+        return statistics
+
+    # -------- Asynchronous Operations --------
+    def _get_write_pool(self):
+        with self._executor_lock:
+            if self._write_pool is None:
+                self._write_pool = ThreadPool(1, 1, name="SQLiteCacheDB-writer")
+                self._write_pool.start()
+            return self._write_pool
+
+    def _get_read_pool(self):
+        """
+        Returns the pool of reader threads, or None if reads cannot be served by separate connections (as is the
+        case for in-memory databases).
+        """
+        if self.sqlite_db_path == u":memory:" or self._read_pool_size <= 0:
+            return None
+
+        with self._executor_lock:
+            if self._read_pool is None:
+                self._read_pool = ThreadPool(1, self._read_pool_size, name="SQLiteCacheDB-reader")
+                self._read_pool.start()
+            return self._read_pool
+
+    def _stop_executor(self):
+        with self._executor_lock:
+            for pool in (self._write_pool, self._read_pool):
+                if pool is not None:
+                    pool.stop()
+            self._write_pool = None
+            self._read_pool = None
+
+            for connection in self._read_connections:
+                connection.close()
+            self._read_connections = []
+
+    def _get_read_cursor(self):
+        """
+        Returns a cursor on the read-only connection owned by the calling reader thread.
+        """
+        connection = getattr(self._read_local, "connection", None)
+        if connection is None:
+            connection = apsw.Connection(self.sqlite_db_path, flags=apsw.SQLITE_OPEN_READONLY)
+            connection.setbusytimeout(self._busytimeout)
+            self._read_local.connection = connection
+            with self._executor_lock:
+                for name, (function, num_args) in self._functions.iteritems():
+                    connection.createscalarfunction(name, function, num_args)
+                self._read_connections.append(connection)
+        return connection.cursor()
+
+    def _read_rows(self, sql, args):
+        cur = self._get_read_cursor()
 
-        # print >> sys.stderr, 'SQL: %s %s' % (sql, arg)
+        if self._show_execute:
+            thread_name = currentThread().getName()
+            self._logger.info(u"===%s===\n%s\n-----\n%s\n======\n", thread_name, sql, args)
+
+        try:
+            if args is None:
+                return list(cur.execute(sql))
+            else:
+                return list(cur.execute(sql, args))
+
+        except Exception:
+            thread_name = currentThread().getName()
+            self._logger.exception(u"cachedb: ===%s===\nSQL Type: %s\n-----\n%s\n-----\n%s\n======\n",
+                                   thread_name, type(sql), sql, args)
+            raise
+
+        finally:
+            cur.close()
+
+    def async_fetchall(self, sql, args=None):
+        """
+        Runs a read query in one of the reader threads.
+
+        The reader threads use their own read-only connections, so with WAL they run in parallel with each other
+        and with the writer. Note that they only see data that has been committed (see commit_now).
+        :return: A Deferred that fires with a list of all result rows.
+        """
+        read_pool = self._get_read_pool()
+        if read_pool is None:
+            return maybeDeferred(self.fetchall, sql, args)
+        return deferToThreadPool(reactor, read_pool, self._read_rows, sql, args)
+
+    def async_fetchone(self, sql, args=None):
+        """
+        Like async_fetchall, but the Deferred fires with the same result fetchone would return.
+        """
+        return self.async_fetchall(sql, args).addCallback(self._first_row, sql)
+
+    def _write(self, sql, args):
+        self._should_commit = True
+        self._execute(sql, args)
+
+    def async_execute_write(self, sql, args=None):
+        """
+        Runs a write statement in the writer thread, within the transaction that is closed by commit_now.
+        The writer thread shares the connection with the reactor, so its statements wait for the statement or commit
+        that the reactor is running, and the other way around.
+        :return: A Deferred that fires with None once the statement has been executed.
+        """
+        return deferToThreadPool(reactor, self._get_write_pool(), self._write, sql, args)
+
+    def async_executemany(self, sql, args=None):
+        """
+        Runs a write statement for every set of arguments in the writer thread.
+        :return: A Deferred that fires with None once all statements have been executed.
+        """
+        return deferToThreadPool(reactor, self._get_write_pool(), self._write_many, sql, args)
+
+    def _write_many(self, sql, args):
+        self._executemany(sql, args)
+
+    def getOne(self, table_name, value_name, where=None, conj=u"AND", **kw):
+        """ value_name could be a string, a tuple of strings, or '*'
+        """
+        sql, arg = self._select_sql(table_name, value_name, where, conj, kw)
         return self.fetchone(sql, arg)
 
     def getAll(self, table_name, value_name, where=None, group_by=None, having=None, order_by=None, limit=None,
@@ -454,6 +727,32 @@ class SQLiteCacheDB(TaskManager):
             order by is represented as order_by
             group by is represented as group_by
         """
+        sql, arg = self._select_sql(table_name, value_name, where, conj, kw, group_by=group_by, having=having,
+                                    order_by=order_by, limit=limit, offset=offset)
+        try:
+            return self.fetchall(sql, arg) or []
+        except Exception as msg:
+            self._logger.exception(u"Wrong getAll sql statement: %s", sql)
+            raise Exception(msg)
+
+    def async_getOne(self, table_name, value_name, where=None, conj=u"AND", **kw):
+        """ Like getOne, but runs in a reader thread and returns a Deferred.
+        """
+        sql, arg = self._select_sql(table_name, value_name, where, conj, kw)
+        return self.async_fetchone(sql, arg)
+
+    def async_getAll(self, table_name, value_name, where=None, group_by=None, having=None, order_by=None, limit=None,
+                     offset=None, conj=u"AND", **kw):
+        """ Like getAll, but runs in a reader thread and returns a Deferred.
+        """
+        sql, arg = self._select_sql(table_name, value_name, where, conj, kw, group_by=group_by, having=having,
+                                    order_by=order_by, limit=limit, offset=offset)
+        return self.async_fetchall(sql, arg)
+
+    def _select_sql(self, table_name, value_name, where, conj, kw, group_by=None, having=None, order_by=None,
+                    limit=None, offset=None):
+        """ Builds the SELECT statement and its arguments for getOne and getAll.
+        """
         if isinstance(value_name, tuple):
             value_names = u",".join(value_name)
         elif isinstance(value_name, list):
@@ -504,8 +803,4 @@ class SQLiteCacheDB(TaskManager):
         if offset is not None:
             sql += u' OFFSET %d' % offset
 
-        try:
-            return self.fetchall(sql, arg) or []
-        except Exception as msg:
-            self._logger.exception(u"Wrong getAll sql statement: %s", sql)
-            raise Exception(msg)
+        return sql, arg
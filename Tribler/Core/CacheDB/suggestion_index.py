@@ -0,0 +1,267 @@
+"""
+Vocabulary of swarm name keywords, used for search suggestions ("did you mean") and search completions.
+
+The vocabulary is stored in the SearchTerms table, together with how often each keyword occurs. For spelling
+suggestions, the most frequent keywords are kept in memory in a BK-tree, which finds all keywords within a small edit
+distance of a misspelled keyword without comparing it to the whole vocabulary.
+"""
+import logging
+
+from twisted.internet.task import LoopingCall
+
+from Tribler.Core.Utilities.search_utils import split_into_keywords
+from Tribler.dispersy.taskmanager import TaskManager
+from Tribler.dispersy.util import call_on_reactor_thread
+
+
+# The number of torrents that are added to a new vocabulary per interval
+POPULATE_BATCH_SIZE = 1000
+POPULATE_INTERVAL = 1.0
+
+# The number of swarm names that are ranked when making a search suggestion
+SUGGESTION_CANDIDATES = 50
+
+# The maximum number of keywords in the BK-tree, the most frequent keywords are added first
+BK_TREE_MAX_TERMS = 50000
+# The number of keywords that are added to the BK-tree per interval while it is being built. The tree is built on the
+# reactor thread, a batch takes up to 10 ms once the tree is large.
+BK_TREE_BATCH_SIZE = 20
+BK_TREE_BUILD_INTERVAL = 0.05
+
+
+def levenshtein(a, b):
+    """
+    Calculates the Levenshtein distance between a and b.
+    """
+    n, m = len(a), len(b)
+    if n > m:
+        # Make sure n <= m, to use O(min(n,m)) space
+        a, b = b, a
+        n, m = m, n
+
+    current = range(n + 1)
+    for i in range(1, m + 1):
+        previous, current = current, [i] + [0] * n
+        for j in range(1, n + 1):
+            add, delete = previous[j] + 1, current[j - 1] + 1
+            change = previous[j - 1]
+            if a[j - 1] != b[i - 1]:
+                change = change + 1
+            current[j] = min(add, delete, change)
+
+    return current[n]
+
+
+def max_suggestion_distance(term):
+    """
+    Returns the largest edit distance at which a keyword is still considered a misspelling of term.
+    """
+    return 1 if len(term) <= 4 else 2
+
+
+class BKTree(object):
+    """
+    Burkhard-Keller tree of terms under the Levenshtein distance.
+
+    Every node is a (term, children) tuple, where children maps a distance d to the subtree of terms that are at
+    distance d from the term of the node. Because of the triangle inequality, a search with tolerance t only has to
+    descend into the children at distances d - t up to d + t.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, term):
+        """
+        Adds term to the tree.
+        :return: False if the term was already in the tree, True otherwise.
+        """
+        if self._root is None:
+            self._root = (term, {})
+            self._size += 1
+            return True
+
+        node_term, children = self._root
+        while True:
+            distance = levenshtein(term, node_term)
+            if distance == 0:
+                return False
+
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (term, {})
+                self._size += 1
+                return True
+            node_term, children = child
+
+    def search(self, term, max_distance):
+        """
+        Returns a list of (distance, term) tuples of all terms within max_distance of term.
+        """
+        if self._root is None:
+            return []
+
+        results = []
+        nodes = [self._root]
+        while nodes:
+            node_term, children = nodes.pop()
+            distance = levenshtein(term, node_term)
+            if distance <= max_distance:
+                results.append((distance, node_term))
+
+            # the tree can grow while it is searched from another thread
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return results
+
+
+class SuggestionIndex(TaskManager):
+    """
+    Persistent vocabulary of swarm name keywords, incrementally updated whenever a torrent is indexed.
+
+    When the database is upgraded to version 29, the keywords of the torrents that are already in the database are
+    added to it in the background, from the highest torrent id down. The torrent id to continue from is kept in MyInfo.
+    """
+
+    def __init__(self, db):
+        super(SuggestionIndex, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._db = db
+
+        self._bk_tree = None
+        self._bk_tree_terms = None
+
+    def initialize(self):
+        populate_from = self._db.fetchone(u"SELECT value FROM MyInfo WHERE entry == 'search_terms_torrent_id'")
+        if populate_from is not None and int(populate_from) > 0:
+            self.register_task(u"populate search terms",
+                               LoopingCall(self._populate_step)).start(POPULATE_INTERVAL, now=False)
+
+    def close(self):
+        self.cancel_all_pending_tasks()
+        self._bk_tree = None
+        self._bk_tree_terms = None
+
+    def _populate_step(self):
+        """
+        Adds the keywords of the next batch of existing torrents to the vocabulary.
+        """
+        populate_from = int(self._db.fetchone(u"SELECT value FROM MyInfo WHERE entry == 'search_terms_torrent_id'"))
+        torrents = self._db.fetchall(u"SELECT torrent_id, name FROM Torrent WHERE torrent_id <= ? AND name IS NOT NULL"
+                                     u" ORDER BY torrent_id DESC LIMIT ?", (populate_from, POPULATE_BATCH_SIZE))
+
+        for _, name in torrents:
+            self.add_keywords(split_into_keywords(name))
+
+        populate_from = torrents[-1][0] - 1 if len(torrents) == POPULATE_BATCH_SIZE else 0
+        self._db.queue_write(u"MyInfo", u"UPDATE MyInfo SET value = ? WHERE entry == 'search_terms_torrent_id'",
+                             (populate_from,))
+
+        if populate_from == 0:
+            self._logger.info(u"Finished populating the SearchTerms table")
+            self.cancel_pending_task(u"populate search terms")
+
+    def add_keywords(self, keywords, previous_keywords=()):
+        """
+        Adds the keywords of a swarm name to the vocabulary. Every keyword is counted once per swarm name.
+        :param previous_keywords: The keywords of the swarm name when the torrent was indexed before, which have
+        been counted already.
+        """
+        for keyword in set(keywords).difference(previous_keywords):
+            self._db.queue_write(u"SearchTerms", u"INSERT OR IGNORE INTO SearchTerms (term) VALUES (?);"
+                                                 u" UPDATE SearchTerms SET frequency = frequency + 1 WHERE term = ?",
+                                 (keyword, keyword))
+            if self._bk_tree is not None and len(self._bk_tree) < BK_TREE_MAX_TERMS:
+                self._bk_tree.add(keyword)
+
+    def _get_bk_tree(self):
+        """
+        Returns the BK-tree of the vocabulary. The first call starts building it in the background, until then
+        spelling suggestions only come from the part of the vocabulary that has been added already.
+        """
+        if self._bk_tree is None:
+            self._bk_tree = BKTree()
+            self._start_building_bk_tree()
+        return self._bk_tree
+
+    @call_on_reactor_thread
+    def _start_building_bk_tree(self):
+        terms = self._db.fetchall(u"SELECT term FROM SearchTerms ORDER BY frequency DESC LIMIT ?", (BK_TREE_MAX_TERMS,))
+        # the terms are popped from the end, so the most frequent terms are added first
+        self._bk_tree_terms = [term for term, in reversed(terms)]
+        self.register_task(u"build bk-tree",
+                           LoopingCall(self._build_bk_tree_step)).start(BK_TREE_BUILD_INTERVAL, now=True)
+
+    def _build_bk_tree_step(self):
+        """
+        Adds the next batch of keywords to the BK-tree.
+        """
+        for _ in xrange(min(BK_TREE_BATCH_SIZE, len(self._bk_tree_terms))):
+            if len(self._bk_tree) >= BK_TREE_MAX_TERMS:
+                break
+            self._bk_tree.add(self._bk_tree_terms.pop())
+
+        if not self._bk_tree_terms or len(self._bk_tree) >= BK_TREE_MAX_TERMS:
+            self._logger.info(u"Finished building the BK-tree of %d keywords", len(self._bk_tree))
+            self._bk_tree_terms = None
+            self.cancel_pending_task(u"build bk-tree")
+
+    def get_correction(self, keyword):
+        """
+        Returns the most frequent keyword in the vocabulary that is closest to keyword, or keyword itself if there is
+        no keyword in the vocabulary that looks like it.
+        """
+        candidates = self._get_bk_tree().search(keyword, max_suggestion_distance(keyword))
+        if not candidates:
+            return keyword
+
+        min_distance = min(distance for distance, _ in candidates)
+        closest = [term for distance, term in candidates if distance == min_distance]
+        if len(closest) == 1:
+            return closest[0]
+
+        parameters = u",".join(u"?" * len(closest))
+        return self._db.fetchone(u"SELECT term FROM SearchTerms WHERE term IN (%s) ORDER BY frequency DESC LIMIT 1"
+                                 % parameters, closest)
+
+    def get_completions(self, prefix, max_terms, limit=100):
+        """
+        Returns up to max_terms keywords that start with (but are not equal to) prefix, the most frequent ones first.
+        At most limit keywords are considered.
+        """
+        if not prefix:
+            return []
+
+        # every keyword starting with prefix sorts before the prefix with its last character incremented
+        upper_bound = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        sql = u"SELECT term FROM (SELECT term, frequency FROM SearchTerms WHERE term > ? AND term < ? LIMIT ?)" \
+              u" ORDER BY frequency DESC LIMIT ?"
+        return [term for term, in self._db.fetchall(sql, (prefix, upper_bound, limit, max_terms))]
+
+    def get_suggestions(self, keywords, limit=1):
+        """
+        Returns up to limit swarm names that best match the keywords, after correcting their spelling.
+        """
+        match = [keyword.lower() for keyword in keywords if len(keyword) > 3]
+        corrected = []
+        for keyword in match:
+            correction = self.get_correction(keyword)
+            if correction not in corrected:
+                corrected.append(correction)
+        if not corrected:
+            return []
+
+        sql = u"SELECT swarmname FROM FullTextIndex WHERE swarmname MATCH ? LIMIT ?"
+        swarmnames = [swarmname for swarmname, in self._db.fetchall(sql, (u" OR ".join(corrected),
+                                                                           SUGGESTION_CANDIDATES))]
+
+        def distance(swarmname):
+            return sum(sorted([levenshtein(a, b) for a in swarmname.split() for b in match])[:len(match)])
+
+        swarmnames.sort(key=distance)
+        return swarmnames[:limit]
@@ -2,8 +2,8 @@
 import logging
 import os
 import sys
-import time
 from binascii import hexlify
+from threading import Condition
 from traceback import print_exc
 
 import libtorrent as lt
@@ -29,37 +29,75 @@ if sys.platform == "win32":
     except ImportError:
         pass
 
+# the number of pieces after the playback position that get a deadline, and the deadline of the first of them in ms.
+# Every next piece gets a deadline that is VOD_PIECE_DEADLINE later.
+VOD_READAHEAD_PIECES = 8
+VOD_PIECE_DEADLINE = 500
+
+# the maximum time a VODFile read waits for a piece before checking whether it should stop waiting
+VOD_READ_TIMEOUT = 1.0
+
+# the alerts that are handled by an on_<alert type> method of LibtorrentDownloadImpl
+ALERT_HANDLERS = frozenset(['tracker_reply_alert', 'tracker_error_alert', 'tracker_warning_alert',
+                            'metadata_received_alert', 'file_renamed_alert', 'performance_alert',
+                            'torrent_checked_alert', 'torrent_finished_alert', 'save_resume_data_alert',
+                            'piece_finished_alert'])
+
 
 class VODFile(object):
 
-    def __init__(self, f, d):
+    def __init__(self, f, d, fileindex=None, shared=False):
+        """
+        :param fileindex: The index of the file in the torrent, by default the VOD file of the download.
+        :param shared: Whether other readers may stream from the download at the same time, in which case seeking does
+        not lower the priority of the pieces before the new position.
+        """
         self._logger = logging.getLogger(self.__class__.__name__)
 
         self._file = f
         self._download = d
+        self.fileindex = fileindex if fileindex is not None else self._download.get_vod_fileindex()
+        self.shared = shared
 
         pieces = self._download.tdef.get_pieces()
         self.pieces = [pieces[x:x + 20]for x in xrange(0, len(pieces), 20)]
         self.piecesize = self._download.tdef.get_piece_length()
 
-        self.startpiece = get_info_from_handle(self._download.handle).map_file(
-            self._download.get_vod_fileindex(), 0, 0)
-        self.endpiece = get_info_from_handle(self._download.handle).map_file(
-            self._download.get_vod_fileindex(), self._download.get_vod_filesize(), 0)
+        torrent_info = get_info_from_handle(self._download.handle)
+        self.filesize = torrent_info.file_at(self.fileindex).size
+        self.startpiece = torrent_info.map_file(self.fileindex, 0, 0)
+        self.endpiece = torrent_info.map_file(self.fileindex, self.filesize, 0)
+
+        self.fileoffset = self.startpiece.piece * self.piecesize + self.startpiece.start
+        self.readahead_piece = None
 
     def read(self, *args):
         oldpos = self._file.tell()
 
         self._logger.debug('VODFile: get bytes %s - %s', oldpos, oldpos + args[0])
 
-        while not self._file.closed and self._download.get_byte_progress([(self._download.get_vod_fileindex(), oldpos, oldpos + args[0])]) < 1 and self._download.vod_seekpos is not None:
-            time.sleep(1)
+        self.readahead_piece = self._download.set_vod_readahead(self.fileindex, oldpos, self.readahead_piece)
+
+        # wait until the piece at oldpos has been downloaded, we are woken up by the piece_finished alerts. The
+        # pieces are checked without holding the condition, as the alerts are processed while holding the dllock.
+        size = args[0]
+        condition = self._download.vod_piece_condition
+        while not self._file.closed and self._download.vod_seekpos is not None:
+            with condition:
+                pieces_finished = self._download.vod_pieces_finished
+            readable = self.get_readable_bytes(oldpos, size)
+            if readable:
+                size = readable
+                break
+            with condition:
+                if pieces_finished == self._download.vod_pieces_finished:
+                    condition.wait(VOD_READ_TIMEOUT)
 
         if self._file.closed:
             self._logger.debug('VODFile: got no bytes, file is closed')
             return ''
 
-        result = self._file.read(*args)
+        result = self._file.read(size)
 
         newpos = self._file.tell()
         if self._download.vod_seekpos == oldpos:
@@ -69,6 +107,22 @@ class VODFile(object):
 
         return result
 
+    def get_readable_bytes(self, pos, size):
+        """
+        Returns how many of the size bytes at pos can be read, which is up to the first piece that we do not have.
+        Reading past the end of the file is always possible.
+        """
+        end = pos + size
+        if pos >= self.filesize:
+            return size
+
+        readable_end = pos
+        piece = (self.fileoffset + pos) // self.piecesize
+        while readable_end < end and self._download.has_piece(piece):
+            readable_end = (piece + 1) * self.piecesize - self.fileoffset
+            piece += 1
+        return min(readable_end, end) - pos
+
     def seek(self, *args):
         self._file.seek(*args)
         newpos = self._file.tell()
@@ -77,8 +131,10 @@ class VODFile(object):
 
         if self._download.vod_seekpos is None or abs(newpos - self._download.vod_seekpos) < 1024 * 1024:
             self._download.vod_seekpos = newpos
-        self._download.set_byte_priority([(self._download.get_vod_fileindex(), 0, newpos)], 0)
-        self._download.set_byte_priority([(self._download.get_vod_fileindex(), newpos, -1)], 1)
+        if not self.shared:
+            self._download.set_byte_priority([(self.fileindex, 0, newpos)], 0)
+        self._download.set_byte_priority([(self.fileindex, newpos, -1)], 1)
+        self.readahead_piece = self._download.set_vod_readahead(self.fileindex, newpos, self.readahead_piece)
 
         self._logger.debug('VODFile: seek, get pieces %s', self._download.handle.piece_priorities())
         self._logger.debug('VODFile: seek, got pieces %s', [
@@ -136,6 +192,11 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         self.prebuffsize = 5 * 1024 * 1024
         self.endbuffsize = 0
         self.vod_seekpos = 0
+        # notified whenever a piece has been downloaded, for the VODFile readers that wait for it
+        self.vod_piece_condition = Condition()
+        self.vod_pieces_finished = 0
+        # called on the reactor thread whenever a piece has been downloaded
+        self.piece_finished_callbacks = set()
 
         self.max_prebuffsize = 5 * 1024 * 1024
 
@@ -337,6 +398,9 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
     def set_vod_mode(self, enable=True):
         self._logger.debug("LibtorrentDownloadImpl: set_vod_mode for %s (enable = %s)", self.tdef.get_name(), enable)
 
+        if self.ltmgr:
+            self.ltmgr.set_progress_alerts(self, enable)
+
         if enable:
             self.vod_seekpos = 0
 
@@ -360,6 +424,39 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
             if self.get_vod_fileindex() >= 0:
                 self.set_byte_priority([(self.get_vod_fileindex(), 0, -1)], 1)
 
+    @checkHandleAndSynchronize()
+    def set_vod_readahead(self, fileindex, bytepos, readahead_piece=None):
+        """
+        Gives the pieces right after bytepos in a file increasing deadlines, so libtorrent requests them in playback
+        order and from the fastest peers.
+        :param readahead_piece: The first piece of the previous readahead window of this reader, if any.
+        :return: The first piece of the new readahead window.
+        """
+        if fileindex < 0:
+            return None
+
+        torrent_info = get_info_from_handle(self.handle)
+        last_byte = max(torrent_info.file_at(fileindex).size - 1, 0)
+        startpiece = torrent_info.map_file(fileindex, min(bytepos, last_byte), 0).piece
+        if startpiece == readahead_piece:
+            return startpiece
+
+        endpiece = torrent_info.map_file(fileindex, last_byte, 0).piece + 1
+        if readahead_piece is not None and not readahead_piece < startpiece < readahead_piece + VOD_READAHEAD_PIECES:
+            # the reader seeked, the pieces around its old position are no longer urgent
+            for piece in xrange(readahead_piece, min(endpiece, readahead_piece + VOD_READAHEAD_PIECES)):
+                if not self.handle.have_piece(piece):
+                    self.handle.reset_piece_deadline(piece)
+
+        for index, piece in enumerate(xrange(startpiece, min(endpiece, startpiece + VOD_READAHEAD_PIECES))):
+            if not self.handle.have_piece(piece):
+                self.handle.set_piece_deadline(piece, VOD_PIECE_DEADLINE * (index + 1))
+        return startpiece
+
+    @checkHandleAndSynchronize(False)
+    def has_piece(self, piece):
+        return 0 <= piece < get_info_from_handle(self.handle).num_pieces() and self.handle.have_piece(piece)
+
     def get_vod_fileindex(self):
         if self.vod_index is not None:
             return self.vod_index
@@ -458,18 +555,28 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
             pieces = list(set(pieces))
             self.set_piece_priority(pieces, priority)
 
-    @checkHandleAndSynchronize()
     def process_alert(self, alert, alert_type):
-        if alert.category() in [lt.alert.category_t.error_notification, lt.alert.category_t.performance_warning]:
-            self._logger.debug("LibtorrentDownloadImpl: alert %s with message %s", alert_type, alert)
-
-        alert_types = ('tracker_reply_alert', 'tracker_error_alert', 'tracker_warning_alert', 'metadata_received_alert',
-                       'file_renamed_alert', 'performance_alert', 'torrent_checked_alert', 'torrent_finished_alert',
-                       'save_resume_data_alert')
+        self.process_alerts([(alert, alert_type)])
 
-        if alert_type in alert_types:
-            getattr(self, 'on_' + alert_type)(alert)
-        else:
+    @checkHandleAndSynchronize()
+    def process_alerts(self, alerts):
+        """
+        Processes a batch of (alert, alert type) tuples for this download, in order. The libtorrent stats are updated
+        once for the whole batch, after the alerts that have a handler of their own have been processed.
+        """
+        update_stats = False
+        for alert, alert_type in alerts:
+            category = alert.category()
+            if category in (lt.alert.category_t.error_notification, lt.alert.category_t.performance_warning):
+                self._logger.debug("LibtorrentDownloadImpl: alert %s with message %s", alert_type, alert)
+
+            if alert_type in ALERT_HANDLERS:
+                getattr(self, 'on_' + alert_type)(alert)
+            elif not category & lt.alert.category_t.progress_notification:
+                # the block alerts that come with the piece_finished alerts do not change the stats
+                update_stats = True
+
+        if update_stats:
             self.update_lt_stats()
 
     def on_save_resume_data_alert(self, alert):
@@ -501,6 +608,15 @@ class LibtorrentDownloadImpl(DownloadConfigInterface):
         # empties the deferred list
         self.deferreds_resume = []
 
+    def on_piece_finished_alert(self, alert):
+        # wake up the VODFile readers that wait for this piece
+        with self.vod_piece_condition:
+            self.vod_pieces_finished += 1
+            self.vod_piece_condition.notify_all()
+
+        for callback in list(self.piece_finished_callbacks):
+            callback()
+
     def on_tracker_reply_alert(self, alert):
         self.tracker_status[alert.url] = [alert.num_peers, 'Working']
 
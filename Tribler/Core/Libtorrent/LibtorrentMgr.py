@@ -7,6 +7,7 @@ import threading
 import os
 import time
 from binascii import hexlify
+from collections import OrderedDict
 from copy import deepcopy
 from shutil import rmtree
 
@@ -22,13 +23,39 @@ from Tribler.Core.simpledefs import (NTFY_INSERT, NTFY_MAGNET_CLOSE, NTFY_MAGNET
                                      NTFY_REACHABLE, NTFY_TORRENTS)
 from Tribler.Core.version import version_id
 from Tribler.Core.DownloadConfig import DefaultDownloadStartupConfig
-from Tribler.dispersy.taskmanager import LoopingCall, TaskManager
+from Tribler.dispersy.taskmanager import TaskManager
 from Tribler.dispersy.util import blocking_call_on_reactor_thread, call_on_reactor_thread
 
 
 LTSTATE_FILENAME = "lt.state"
+# how long the peers, seeders and leechers of a metainfo lookup are considered up to date
 METAINFO_CACHE_PERIOD = 5 * 60
+# the number of metainfo dictionaries that are kept in memory, the least recently used one is dropped first
+METAINFO_CACHE_SIZE = 250
 DHT_CHECK_RETRIES = 1
+# libtorrent 1.1 can deliver the piece_finished alerts without the block alerts of progress_notification
+PIECE_PROGRESS_NOTIFICATION = getattr(lt.alert.category_t, 'piece_progress_notification', None)
+# how long an alert thread waits for alerts before checking whether it should stop, in ms
+ALERT_WAIT_TIMEOUT = 1000
+
+
+def get_alert_mask(progress=False):
+    """
+    Returns the alert mask of a libtorrent session. The piece_finished alerts that wake up VOD readers are always
+    included if libtorrent can deliver them on their own. Otherwise, all progress alerts are only included when
+    progress is True, as their block alerts would flood the alert queue.
+    """
+    mask = (lt.alert.category_t.stats_notification |
+            lt.alert.category_t.error_notification |
+            lt.alert.category_t.status_notification |
+            lt.alert.category_t.storage_notification |
+            lt.alert.category_t.performance_warning |
+            lt.alert.category_t.tracker_notification)
+    if PIECE_PROGRESS_NOTIFICATION is not None:
+        mask |= PIECE_PROGRESS_NOTIFICATION
+    elif progress:
+        mask |= lt.alert.category_t.progress_notification
+    return mask
 
 
 class LibtorrentMgr(TaskManager):
@@ -46,6 +73,8 @@ class LibtorrentMgr(TaskManager):
         self.set_download_rate_limit(0)
 
         self.torrents = {}
+        # the infohashes of the downloads that need progress alerts from their session, as they are in VOD mode
+        self.progress_alert_infohashes = set()
 
         self.upnp_mapping_dict = {}
 
@@ -54,7 +83,20 @@ class LibtorrentMgr(TaskManager):
         self.metadata_tmpdir = None
         self.metainfo_requests = {}
         self.metainfo_lock = threading.RLock()
-        self.metainfo_cache = {}
+        self.metainfo_cache = OrderedDict()
+        self.metainfo_cache_size = METAINFO_CACHE_SIZE
+
+        self.metainfo_cache_hits = 0
+        self.metainfo_store_hits = 0
+        self.metainfo_cache_misses = 0
+        self.metainfo_deduplicated = 0
+        self.metainfo_lookups = 0
+        self.metainfo_timeouts = 0
+        self.metainfo_lookup_time = 0.0
+        self.metainfo_max_lookup_time = 0.0
+
+        self.alert_threads = None
+        self.alerts_stopped = threading.Event()
 
     @blocking_call_on_reactor_thread
     def initialize(self):
@@ -64,18 +106,23 @@ class LibtorrentMgr(TaskManager):
         # make temporary directory for metadata collecting through DHT
         self.metadata_tmpdir = tempfile.mkdtemp(suffix=u'tribler_metainfo_tmpdir')
 
+        # wait for the alerts of every session on a thread of its own
+        self.alert_threads = {}
+        for hops, ltsession in self.ltsessions.iteritems():
+            self._start_alert_thread(hops, ltsession)
+
         # register tasks
-        self.register_task(u'process_alerts', reactor.callLater(1, self._task_process_alerts))
         self.register_task(u'check_reachability', reactor.callLater(1, self._task_check_reachability))
         self._schedule_next_check(5, DHT_CHECK_RETRIES)
 
-        self.register_task(u'task_cleanup_metacache',
-                           LoopingCall(self._task_cleanup_metainfo_cache)).start(60, now=True)
-
     @blocking_call_on_reactor_thread
     def shutdown(self):
         self.cancel_all_pending_tasks()
 
+        # the alert threads stop within ALERT_WAIT_TIMEOUT, and do not process any alerts anymore
+        self.alerts_stopped.set()
+        self.alert_threads = None
+
         # remove all upnp mapping
         for upnp_handle in self.upnp_mapping_dict.itervalues():
             self.get_session().delete_port_mapping(upnp_handle)
@@ -131,12 +178,7 @@ class LibtorrentMgr(TaskManager):
             ltsession.add_extension(lt.create_smart_ban_plugin)
 
         ltsession.set_settings(settings)
-        ltsession.set_alert_mask(lt.alert.category_t.stats_notification |
-                                 lt.alert.category_t.error_notification |
-                                 lt.alert.category_t.status_notification |
-                                 lt.alert.category_t.storage_notification |
-                                 lt.alert.category_t.performance_warning |
-                                 lt.alert.category_t.tracker_notification)
+        ltsession.set_alert_mask(get_alert_mask())
 
         # Load proxy settings
         if hops == 0:
@@ -185,6 +227,8 @@ class LibtorrentMgr(TaskManager):
     def get_session(self, hops=0):
         if hops not in self.ltsessions:
             self.ltsessions[hops] = self.create_session(hops)
+            if self.alert_threads is not None:
+                self._start_alert_thread(hops, self.ltsessions[hops])
 
         return self.ltsessions[hops]
 
@@ -284,14 +328,41 @@ class LibtorrentMgr(TaskManager):
         if handle and handle.is_valid():
             infohash = str(handle.info_hash())
             if infohash in self.torrents:
-                self.torrents[infohash][1].remove_torrent(handle, int(removecontent))
+                ltsession = self.torrents[infohash][1]
+                ltsession.remove_torrent(handle, int(removecontent))
                 del self.torrents[infohash]
+                if infohash in self.progress_alert_infohashes:
+                    self.progress_alert_infohashes.discard(infohash)
+                    self._update_alert_mask(ltsession)
                 self._logger.debug("remove torrent %s", infohash)
             else:
                 self._logger.debug("cannot remove torrent %s because it does not exists", infohash)
         else:
             self._logger.debug("cannot remove invalid torrent")
 
+    def set_progress_alerts(self, torrentdl, enable):
+        """
+        Enables or disables the progress alerts for a download that goes in or out of VOD mode. This only changes the
+        alert mask of its session if libtorrent cannot deliver the piece_finished alerts on their own.
+        """
+        handle = torrentdl.handle
+        if PIECE_PROGRESS_NOTIFICATION is not None or not handle or not handle.is_valid():
+            return
+
+        infohash = str(handle.info_hash())
+        if enable:
+            self.progress_alert_infohashes.add(infohash)
+        else:
+            self.progress_alert_infohashes.discard(infohash)
+
+        if infohash in self.torrents:
+            self._update_alert_mask(self.torrents[infohash][1])
+
+    def _update_alert_mask(self, ltsession):
+        progress = any(self.torrents[infohash][1] is ltsession
+                       for infohash in self.progress_alert_infohashes if infohash in self.torrents)
+        ltsession.set_alert_mask(get_alert_mask(progress))
+
     def add_upnp_mapping(self, port, protocol='TCP'):
         # TODO martijn: this check should be removed once we do not support libtorrent versions that do not have the
         # add_port_mapping method exposed in the Python bindings
@@ -309,26 +380,75 @@ class LibtorrentMgr(TaskManager):
             self._logger.warning("port mapping method not exposed in libtorrent")
 
     def process_alert(self, alert):
-        alert_type = str(type(alert)).split("'")[1].split(".")[-1]
-        handle = getattr(alert, 'handle', None)
-        if handle:
-            if handle.is_valid():
-                infohash = str(handle.info_hash())
-                if infohash in self.torrents:
-                    self.torrents[infohash][0].process_alert(alert, alert_type)
-                elif infohash in self.metainfo_requests:
-                    if isinstance(alert, lt.metadata_received_alert):
-                        self.got_metainfo(infohash)
-                else:
-                    self._logger.debug("LibtorrentMgr: could not find torrent %s", infohash)
-            else:
+        self.process_alerts([alert])
+
+    def process_alerts(self, alerts):
+        """
+        Routes a batch of alerts to the downloads and metainfo requests they are about. Every download gets all of
+        its alerts in the batch at once, in the order in which libtorrent posted them.
+        """
+        download_alerts = OrderedDict()
+        for alert in alerts:
+            handle = getattr(alert, 'handle', None)
+            if not handle:
+                continue
+            if not handle.is_valid():
                 self._logger.debug("Alert for invalid torrent")
+                continue
 
-    def get_metainfo(self, infohash_or_magnet, callback, timeout=30, timeout_callback=None, notify=True):
+            infohash = str(handle.info_hash())
+            if infohash in self.torrents:
+                download_alerts.setdefault(infohash, []).append((alert, type(alert).__name__))
+            elif infohash in self.metainfo_requests:
+                if isinstance(alert, lt.metadata_received_alert):
+                    self.got_metainfo(infohash)
+            else:
+                self._logger.debug("LibtorrentMgr: could not find torrent %s", infohash)
+
+        for infohash, alerts_of_download in download_alerts.iteritems():
+            # an alert of an earlier download may have removed this one
+            if infohash in self.torrents:
+                self.torrents[infohash][0].process_alerts(alerts_of_download)
+
+    def _start_alert_thread(self, hops, ltsession):
+        alert_thread = threading.Thread(target=self._wait_for_alerts, args=(ltsession,),
+                                        name="LibtorrentAlerts-%d" % hops)
+        alert_thread.setDaemon(True)
+        self.alert_threads[hops] = alert_thread
+        alert_thread.start()
+
+    def _wait_for_alerts(self, ltsession):
+        """
+        Waits for the alerts of ltsession, and lets the reactor process them as soon as they are posted. The alerts
+        are popped on the reactor thread, as libtorrent may free them on the next pop_alerts. Waiting until the
+        reactor is done with a batch keeps this thread from queueing up more work than the reactor can process.
+        """
+        while not self.alerts_stopped.is_set():
+            if ltsession.wait_for_alert(ALERT_WAIT_TIMEOUT) is None or self.alerts_stopped.is_set():
+                continue
+            try:
+                threads.blockingCallFromThread(reactor, self._process_session_alerts, ltsession)
+            except Exception:
+                self._logger.exception("failed to process libtorrent alerts")
+
+    def _process_session_alerts(self, ltsession):
+        if not self.alerts_stopped.is_set():
+            self.process_alerts(ltsession.pop_alerts())
+
+    def get_metainfo(self, infohash_or_magnet, callback, timeout=30, timeout_callback=None, notify=True,
+                     need_peers=False):
+        """
+        Looks up the metainfo of a torrent, and calls callback with it. The metainfo comes from the cache or the
+        torrent store if possible, otherwise it is downloaded from the DHT. Concurrent lookups of the same torrent
+        share a single libtorrent handle.
+        :param need_peers: Whether the peers, seeders and leechers of the metainfo should be up to date. The
+        metainfo in the torrent store does not have these.
+        """
         if not self.is_dht_ready() and timeout > 5:
             self._logger.info("DHT not ready, rescheduling get_metainfo")
             self.trsession.lm.threadpool.add_task(lambda i=infohash_or_magnet, c=callback, t=timeout - 5,
-                                                  tcb=timeout_callback, n=notify: self.get_metainfo(i, c, t, tcb, n), 5)
+                                                  tcb=timeout_callback, n=notify, p=need_peers:
+                                                  self.get_metainfo(i, c, t, tcb, n, p), 5)
             return
 
         magnet = infohash_or_magnet if infohash_or_magnet.startswith('magnet') else None
@@ -341,11 +461,13 @@ class LibtorrentMgr(TaskManager):
         with self.metainfo_lock:
             self._logger.debug('get_metainfo %s %s %s', infohash_or_magnet, callback, timeout)
 
-            cache_result = self._get_cached_metainfo(infohash)
+            cache_result = self._get_cached_metainfo(infohash, need_peers)
             if cache_result:
                 self.trsession.lm.threadpool.call_in_thread(0, callback, deepcopy(cache_result))
 
             elif infohash not in self.metainfo_requests:
+                self.metainfo_cache_misses += 1
+
                 # Flags = 4 (upload mode), should prevent libtorrent from creating files
                 atp = {'save_path': self.metadata_tmpdir,
                        'flags': (lt.add_torrent_params_flags_t.flag_duplicate_is_error |
@@ -370,16 +492,21 @@ class LibtorrentMgr(TaskManager):
                 self.metainfo_requests[infohash] = {'handle': handle,
                                                     'callbacks': [callback],
                                                     'timeout_callbacks': [timeout_callback] if timeout_callback else [],
-                                                    'notify': notify}
+                                                    'notify': notify,
+                                                    'time': time.time()}
                 self.trsession.lm.threadpool.add_task(lambda: self.got_metainfo(infohash, timeout=True), timeout)
 
             else:
+                self.metainfo_deduplicated += 1
                 self.metainfo_requests[infohash]['notify'] = self.metainfo_requests[infohash]['notify'] and notify
                 callbacks = self.metainfo_requests[infohash]['callbacks']
                 if callback not in callbacks:
                     callbacks.append(callback)
                 else:
                     self._logger.debug('get_metainfo duplicate detected, ignoring')
+                timeout_callbacks = self.metainfo_requests[infohash]['timeout_callbacks']
+                if timeout_callback and timeout_callback not in timeout_callbacks:
+                    timeout_callbacks.append(timeout_callback)
 
     def got_metainfo(self, infohash, timeout=False):
         with self.metainfo_lock:
@@ -394,6 +521,14 @@ class LibtorrentMgr(TaskManager):
 
                 self._logger.debug('got_metainfo %s %s %s', infohash, handle, timeout)
 
+                if timeout:
+                    self.metainfo_timeouts += 1
+                else:
+                    lookup_time = time.time() - request_dict['time']
+                    self.metainfo_lookups += 1
+                    self.metainfo_lookup_time += lookup_time
+                    self.metainfo_max_lookup_time = max(self.metainfo_max_lookup_time, lookup_time)
+
                 assert handle
                 if handle:
                     if callbacks and not timeout:
@@ -440,29 +575,68 @@ class LibtorrentMgr(TaskManager):
                     if notify:
                         self.notifier.notify(NTFY_TORRENTS, NTFY_MAGNET_CLOSE, infohash_bin)
 
-    def _get_cached_metainfo(self, infohash):
-        if infohash in self.metainfo_cache:
-            return self.metainfo_cache[infohash]['meta_info']
-
-    def _add_cached_metainfo(self, infohash, metainfo):
-        self.metainfo_cache[infohash] = {'time': time.time(),
+    def get_metainfo_statistics(self):
+        """
+        Returns the hits and misses of the metainfo cache, and the number and duration of the DHT lookups.
+        """
+        with self.metainfo_lock:
+            return {u"cache_size": len(self.metainfo_cache),
+                    u"cache_hits": self.metainfo_cache_hits,
+                    u"store_hits": self.metainfo_store_hits,
+                    u"misses": self.metainfo_cache_misses,
+                    u"deduplicated": self.metainfo_deduplicated,
+                    u"pending": len(self.metainfo_requests),
+                    u"lookups": self.metainfo_lookups,
+                    u"timeouts": self.metainfo_timeouts,
+                    u"average_lookup_time": self.metainfo_lookup_time / self.metainfo_lookups
+                    if self.metainfo_lookups else 0.0,
+                    u"max_lookup_time": self.metainfo_max_lookup_time}
+
+    def _get_cached_metainfo(self, infohash, need_peers=False):
+        """
+        Returns the metainfo from the cache, or from the torrent store if it is not in the cache. When need_peers is
+        set, only metainfo with recent peer information is returned.
+        """
+        cache_entry = self.metainfo_cache.pop(infohash, None)
+        if cache_entry is not None:
+            # move the entry to the most recently used end
+            self.metainfo_cache[infohash] = cache_entry
+            if not need_peers or cache_entry['time'] >= time.time() - METAINFO_CACHE_PERIOD:
+                self.metainfo_cache_hits += 1
+                return cache_entry['meta_info']
+            return None
+
+        if need_peers:
+            return None
+
+        metainfo = self._load_stored_metainfo(infohash)
+        if metainfo:
+            self.metainfo_store_hits += 1
+            self._add_cached_metainfo(infohash, metainfo, has_peers=False)
+        return metainfo
+
+    def _add_cached_metainfo(self, infohash, metainfo, has_peers=True):
+        self.metainfo_cache.pop(infohash, None)
+        self.metainfo_cache[infohash] = {'time': time.time() if has_peers else 0,
                                          'meta_info': metainfo}
 
-    def _task_cleanup_metainfo_cache(self):
-        oldest_time = time.time() - METAINFO_CACHE_PERIOD
+        while len(self.metainfo_cache) > self.metainfo_cache_size:
+            self.metainfo_cache.popitem(last=False)
 
-        for info_hash, values in self.metainfo_cache.items():
-            last_time, metainfo = values
-            if last_time < oldest_time:
-                del self.metainfo_cache[info_hash]
+    def _load_stored_metainfo(self, infohash):
+        torrent_store = self.trsession.lm.torrent_store
+        if torrent_store is None:
+            return None
 
-    def _task_process_alerts(self):
-        for ltsession in self.ltsessions.itervalues():
-            if ltsession:
-                for alert in ltsession.pop_alerts():
-                    self.process_alert(alert)
+        torrent_data = torrent_store.get(infohash)
+        metainfo = lt.bdecode(torrent_data) if torrent_data else None
+        if not isinstance(metainfo, dict) or "info" not in metainfo:
+            return None
 
-        self.register_task(u'process_alerts', reactor.callLater(1, self._task_process_alerts))
+        metainfo["initial peers"] = []
+        metainfo["leechers"] = 0
+        metainfo["seeders"] = 0
+        return metainfo
 
     def _task_check_reachability(self):
         if self.get_session() and self.get_session().status().has_incoming_connections:
@@ -1,5 +1,6 @@
 import json
 import os
+import time
 
 from twisted.web import http, resource
 from Tribler.Core.DownloadConfig import DownloadStartupConfig
@@ -8,6 +9,93 @@ from Tribler.Core.TorrentDef import TorrentDef, TorrentDefNoMetainfo
 
 from Tribler.Core.simpledefs import DOWNLOAD, UPLOAD, dlstatus_strings, NTFY_TORRENTS
 
+# The fields that are returned for every download by default
+DOWNLOAD_FIELDS = ("name", "progress", "infohash", "speed_down", "speed_up", "status", "size", "eta", "num_peers",
+                   "num_seeds", "files", "trackers", "hops", "anon_download", "safe_seeding", "max_upload_speed",
+                   "max_download_speed", "destination")
+
+# The minimum number of seconds between two updates of the download states cache
+DOWNLOAD_STATES_INTERVAL = 1.0
+
+
+class DownloadStatesCache(object):
+    """
+    Keeps the most recent state of every download, together with the revision at which it last changed.
+
+    The revision is increased every time an update contains a download that is new, that has been removed or whose
+    state differs from the previous update. This allows clients that poll the downloads to only fetch what changed
+    since the revision they received in their previous response.
+    """
+
+    def __init__(self):
+        self.revision = 0
+        self.last_update = 0
+        self._states = {}
+        self._snapshots = {}
+        self._revisions = {}
+        self._removed = {}
+
+    @staticmethod
+    def create_snapshot(download_state):
+        """
+        Returns the part of a download state that is shown by the downloads endpoint, in a comparable form.
+        """
+        download = download_state.get_download()
+        return (download.correctedinfoname, download_state.get_status(), download_state.get_progress(),
+                download_state.get_current_speed(DOWNLOAD), download_state.get_current_speed(UPLOAD),
+                download_state.get_eta(), download_state.get_num_seeds_peers(),
+                tuple(download_state.get_files_completion()), download.get_max_speed(UPLOAD),
+                download.get_max_speed(DOWNLOAD))
+
+    def update(self, dslist):
+        """
+        Stores the download states of all downloads and marks the downloads that changed.
+        """
+        self.last_update = time.time()
+        next_revision = self.revision + 1
+        infohashes = set()
+        changed = False
+
+        for download_state in dslist:
+            infohash = download_state.get_download().get_def().get_infohash()
+            infohashes.add(infohash)
+            self._states[infohash] = download_state
+
+            snapshot = self.create_snapshot(download_state)
+            if self._snapshots.get(infohash) != snapshot:
+                self._snapshots[infohash] = snapshot
+                self._revisions[infohash] = next_revision
+                self._removed.pop(infohash, None)
+                changed = True
+
+        for infohash in set(self._snapshots) - infohashes:
+            del self._states[infohash]
+            del self._snapshots[infohash]
+            del self._revisions[infohash]
+            self._removed[infohash] = next_revision
+            changed = True
+
+        if changed:
+            self.revision = next_revision
+
+    def get_state(self, infohash):
+        """
+        Returns the most recent download state of a download, or None if it has not been reported yet.
+        """
+        return self._states.get(infohash)
+
+    def has_changed(self, infohash, revision):
+        """
+        Returns whether a download changed after revision. Downloads that have not been reported yet always changed.
+        """
+        return self._revisions.get(infohash, self.revision + 1) > revision
+
+    def get_removed(self, revision):
+        """
+        Returns the infohashes of the downloads that have been removed after revision.
+        """
+        return [infohash for infohash, removed_revision in self._removed.iteritems() if removed_revision > revision]
+
 
 class DownloadBaseEndpoint(resource.Resource):
     """
@@ -33,6 +121,19 @@ class DownloadsEndpoint(DownloadBaseEndpoint):
     starting, pausing and stopping downloads.
     """
 
+    def __init__(self, session):
+        DownloadBaseEndpoint.__init__(self, session)
+        self.states_cache = DownloadStatesCache()
+
+    def update_states_cache(self, downloads):
+        """
+        Updates the states cache with the current states of all downloads, at most once every
+        DOWNLOAD_STATES_INTERVAL seconds. The states are only taken when a request needs them, so nothing is computed
+        while no client polls the downloads.
+        """
+        if time.time() - self.states_cache.last_update >= DOWNLOAD_STATES_INTERVAL:
+            self.states_cache.update([download.network_get_state(None, False) for download in downloads])
+
     def getChild(self, path, request):
         return DownloadSpecificEndpoint(self.session, path)
 
@@ -86,45 +187,123 @@ class DownloadsEndpoint(DownloadBaseEndpoint):
                     }
                 }, ...]
 
+        The response can be reduced with the following parameters:
+        - fields: a comma-separated list of the fields to return for every download. The infohash is always returned.
+          Leaving out the files and trackers fields avoids the most expensive part of building the response.
+        - offset and limit: only return limit downloads, starting at offset, ordered by infohash. The total number
+          of downloads is returned as well.
+        - since: only return the downloads whose state changed after the given revision. The response contains the
+          current revision, to pass in the next request, and the infohashes of the downloads that have been removed.
+
+            **Example request**:
+
+            .. sourcecode:: none
+
+                curl -X GET "http://localhost:8085/downloads?fields=name,progress,status&since=42"
+
+            **Example response**:
+
+            .. sourcecode:: javascript
+
+                {
+                    "downloads": [{
+                        "infohash": "4344503b7e797ebf31582327a5baae35b11bda01",
+                        "name": "Ubuntu-16.04-desktop-amd64",
+                        "progress": 0.31459265,
+                        "status": "DLSTATUS_DOWNLOADING"
+                    }],
+                    "revision": 45,
+                    "removed": ["a5f3e0fd3a9b7e3a6e6d2a0d0e2a7c9b6c1d4e5f"]
+                }
+        """
+        fields = DOWNLOAD_FIELDS
+        if 'fields' in request.args and len(request.args['fields']) > 0:
+            fields = [field for field in request.args['fields'][0].split(',') if field]
+            unknown_fields = set(fields) - set(DOWNLOAD_FIELDS)
+            if unknown_fields:
+                request.setResponseCode(http.BAD_REQUEST)
+                return json.dumps({"error": "unknown fields: %s" % ", ".join(sorted(unknown_fields))})
+
+        parameters = {}
+        for parameter in ('offset', 'limit', 'since'):
+            if parameter in request.args and len(request.args[parameter]) > 0:
+                if not request.args[parameter][0].isdigit():
+                    request.setResponseCode(http.BAD_REQUEST)
+                    return json.dumps({"error": "%s must be a non-negative integer" % parameter})
+                parameters[parameter] = int(request.args[parameter][0])
+
+        downloads = sorted(self.session.get_downloads(), key=lambda download: download.get_def().get_infohash())
+        if 'since' in parameters or 'files' in fields:
+            self.update_states_cache(downloads)
+        response = {}
+
+        if 'since' in parameters:
+            downloads = [download for download in downloads
+                         if self.states_cache.has_changed(download.get_def().get_infohash(), parameters['since'])]
+            response["revision"] = self.states_cache.revision
+            response["removed"] = [infohash.encode('hex')
+                                   for infohash in self.states_cache.get_removed(parameters['since'])]
+
+        if 'offset' in parameters or 'limit' in parameters:
+            response["total"] = len(downloads)
+            offset = parameters.get('offset', 0)
+            downloads = downloads[offset:offset + parameters['limit'] if 'limit' in parameters else None]
+
+        response["downloads"] = [self.get_download_json(download, fields) for download in downloads]
+        return json.dumps(response)
+
+    def get_download_json(self, download, fields):
         """
-        downloads_json = []
-        downloads = self.session.get_downloads()
-        for download in downloads:
+        Returns the requested fields of a download. Files and trackers are only looked up when they are requested.
+        """
+        tdef = download.get_def()
+        download_json = {"infohash": tdef.get_infohash().encode('hex')}
+
+        if "num_peers" in fields or "num_seeds" in fields:
             stats = download.network_create_statistics_reponse() or LibtorrentStatisticsResponse(0, 0, 0, 0, 0, 0, 0)
+            download_json["num_peers"] = stats.numPeers
+            download_json["num_seeds"] = stats.numSeeds
 
-            # Create files information of the download
-            files_completion = dict((name, progress) for name, progress
-                                    in download.network_get_state(None, False).get_files_completion())
+        if "files" in fields:
+            # Use the state of the last update of the states cache, rather than asking libtorrent for a new one
+            download_state = self.states_cache.get_state(tdef.get_infohash()) or download.network_get_state(None, False)
+            files_completion = dict((name, progress) for name, progress in download_state.get_files_completion())
             selected_files = download.get_selected_files()
             files_array = []
-            for file, size in download.get_def().get_files_as_unicode_with_length():
-                if download.get_def().is_multifile_torrent():
-                    file_index = download.get_def().get_index_of_file_in_files(file)
+            for file, size in tdef.get_files_as_unicode_with_length():
+                if tdef.is_multifile_torrent():
+                    file_index = tdef.get_index_of_file_in_files(file)
                 else:
                     file_index = 0
 
                 files_array.append({"index": file_index, "name": file, "size": size,
                                     "included": (file in selected_files), "progress": files_completion.get(file, 0.0)})
+            download_json["files"] = files_array
 
-            # Create tracker information of the download
+        if "trackers" in fields:
             tracker_info = []
             for url, url_info in download.network_tracker_status().iteritems():
                 tracker_info.append({"url": url, "peers": url_info[0], "status": url_info[1]})
-
-            download_json = {"name": download.correctedinfoname, "progress": download.get_progress(),
-                             "infohash": download.get_def().get_infohash().encode('hex'),
-                             "speed_down": download.get_current_speed(DOWNLOAD),
-                             "speed_up": download.get_current_speed(UPLOAD),
-                             "status": dlstatus_strings[download.get_status()],
-                             "size": download.get_def().get_length(), "eta": download.network_calc_eta(),
-                             "num_peers": stats.numPeers, "num_seeds": stats.numSeeds, "files": files_array,
-                             "trackers": tracker_info, "hops": download.get_hops(),
-                             "anon_download": download.get_anon_mode(), "safe_seeding": download.get_safe_seeding(),
-                             "max_upload_speed": download.get_max_speed(UPLOAD),
-                             "max_download_speed": download.get_max_speed(DOWNLOAD),
-                             "destination": download.get_dest_dir()}
-            downloads_json.append(download_json)
-        return json.dumps({"downloads": downloads_json})
+            download_json["trackers"] = tracker_info
+
+        field_getters = {"name": lambda: download.correctedinfoname,
+                         "progress": download.get_progress,
+                         "speed_down": lambda: download.get_current_speed(DOWNLOAD),
+                         "speed_up": lambda: download.get_current_speed(UPLOAD),
+                         "status": lambda: dlstatus_strings[download.get_status()],
+                         "size": tdef.get_length,
+                         "eta": download.network_calc_eta,
+                         "hops": download.get_hops,
+                         "anon_download": download.get_anon_mode,
+                         "safe_seeding": download.get_safe_seeding,
+                         "max_upload_speed": lambda: download.get_max_speed(UPLOAD),
+                         "max_download_speed": lambda: download.get_max_speed(DOWNLOAD),
+                         "destination": download.get_dest_dir}
+        for field in fields:
+            if field in field_getters:
+                download_json[field] = field_getters[field]()
+
+        return download_json
 
 
 class DownloadSpecificEndpoint(DownloadBaseEndpoint):
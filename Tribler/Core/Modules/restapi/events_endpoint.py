@@ -4,7 +4,7 @@ from Tribler.Core.Modules.restapi.util import convert_db_channel_to_json, conver
 from Tribler.Core.simpledefs import (NTFY_CHANNELCAST, SIGNAL_CHANNEL, SIGNAL_ON_SEARCH_RESULTS, SIGNAL_TORRENT,
                                      NTFY_UPGRADER, NTFY_STARTED, NTFY_WATCH_FOLDER_CORRUPT_TORRENT, NTFY_INSERT,
                                      NTFY_NEW_VERSION, NTFY_FINISHED, NTFY_TRIBLER, NTFY_UPGRADER_TICK, NTFY_CHANNEL,
-                                     NTFY_DISCOVERED, NTFY_TORRENT)
+                                     NTFY_DISCOVERED, NTFY_TORRENT, NTFY_CHECKPOINT_RESUME, NTFY_UPDATE)
 
 MAX_EVENTS_BUFFER_SIZE = 100
 
@@ -32,6 +32,10 @@ class EventsEndpoint(resource.Resource):
       description and dispersy community id of the discovered channel.
     - torrent_discovered: An indicator that Tribler has discovered a new torrent. The event contains the name and the
       dispersy community id of the discovered torrent.
+    - checkpoint_resume_progress: An indication that another batch of downloads in the checkpoint has been resumed.
+      The dictionary contains the number of downloads that have been resumed and the total number of downloads.
+    - checkpoint_resume_finished: An indication that all downloads in the checkpoint have been resumed. The dictionary
+      contains the total number of downloads.
     """
 
     def __init__(self, session):
@@ -55,6 +59,8 @@ class EventsEndpoint(resource.Resource):
         self.session.add_observer(self.on_tribler_started, NTFY_TRIBLER, [NTFY_STARTED])
         self.session.add_observer(self.on_channel_discovered, NTFY_CHANNEL, [NTFY_DISCOVERED])
         self.session.add_observer(self.on_torrent_discovered, NTFY_TORRENT, [NTFY_DISCOVERED])
+        self.session.add_observer(self.on_checkpoint_resume_progress, NTFY_CHECKPOINT_RESUME, [NTFY_UPDATE])
+        self.session.add_observer(self.on_checkpoint_resume_finished, NTFY_CHECKPOINT_RESUME, [NTFY_FINISHED])
 
     def write_data(self, message):
         """
@@ -121,6 +127,12 @@ class EventsEndpoint(resource.Resource):
     def on_torrent_discovered(self, subject, changetype, objectID, *args):
         self.write_data(json.dumps({"type": "torrent_discovered", "event": args[0]}))
 
+    def on_checkpoint_resume_progress(self, subject, changetype, objectID, *args):
+        self.write_data(json.dumps({"type": "checkpoint_resume_progress", "event": args[0]}))
+
+    def on_checkpoint_resume_finished(self, subject, changetype, objectID, *args):
+        self.write_data(json.dumps({"type": "checkpoint_resume_finished", "event": {"total": args[0]}}))
+
     def render_GET(self, request):
         """
         .. http:get:: /events
@@ -9,6 +9,7 @@ import urllib
 from abc import ABCMeta, abstractmethod
 from binascii import hexlify, unhexlify
 from collections import deque
+from time import time
 
 from decorator import decorator
 from twisted.internet import reactor
@@ -26,20 +27,78 @@ LOW_PRIO_COLLECTING = 0
 MAGNET_TIMEOUT = 5.0
 MAX_PRIORITY = 1
 
+# the number of requests that may run at the same time, in total and to a single candidate
+MAX_CONCURRENT_REQUESTS = 16
+MAX_REQUESTS_PER_CANDIDATE = 2
+
+# the weight of the outcome of the last request in the success rate of a requester, and the fraction of its request
+# interval that a requester waits when all of its requests succeed
+SUCCESS_RATE_WEIGHT = 0.1
+MIN_INTERVAL_FACTOR = 0.1
+
+# the period over which the number of collected torrents per second is measured
+THROUGHPUT_WINDOW = 60.0
+
 @decorator
 def pass_when_stopped(f, self, *argv, **kwargs):
     if self.running:
         return f(self, *argv, **kwargs)
 
 
+class RequestScheduler(object):
+    """
+    Keeps track of the running requests of all requesters, to limit how many run at the same time in total and to
+    a single candidate.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, max_per_candidate=MAX_REQUESTS_PER_CANDIDATE):
+        self.max_concurrent = max_concurrent
+        self.max_per_candidate = max_per_candidate
+
+        self._num_running = 0
+        self._running_per_address = {}
+
+    @property
+    def num_running(self):
+        return self._num_running
+
+    def can_start(self, candidate=None):
+        """
+        Returns whether a request to candidate may start now. Requests without a candidate, like magnet requests,
+        only count towards the total.
+        """
+        if self._num_running >= self.max_concurrent:
+            return False
+        return candidate is None or \
+            self._running_per_address.get(candidate.sock_addr, 0) < self.max_per_candidate
+
+    def start(self, candidate=None):
+        self._num_running += 1
+        if candidate is not None:
+            self._running_per_address[candidate.sock_addr] = self._running_per_address.get(candidate.sock_addr, 0) + 1
+
+    def finish(self, candidate=None):
+        self._num_running -= 1
+        if candidate is not None:
+            num_running = self._running_per_address.pop(candidate.sock_addr) - 1
+            if num_running:
+                self._running_per_address[candidate.sock_addr] = num_running
+
+
 class RemoteTorrentHandler(TaskManager):
 
-    def __init__(self, session):
+    def __init__(self, session, max_concurrent=MAX_CONCURRENT_REQUESTS, max_per_candidate=MAX_REQUESTS_PER_CANDIDATE):
         super(RemoteTorrentHandler, self).__init__()
         self._logger = logging.getLogger(self.__class__.__name__)
 
         self.running = False
 
+        if sys.platform == "darwin":
+            # Mac has just 256 fds per process, be less aggressive
+            max_concurrent = min(max_concurrent, 4)
+        self.scheduler = RequestScheduler(max_concurrent, max_per_candidate)
+        self._success_times = deque()
+
         self.torrent_callbacks = {}
         self.metadata_callbacks = {}
 
@@ -75,17 +134,49 @@ class RemoteTorrentHandler(TaskManager):
 
         self.metadata_requester = TftpRequester(u"tftp_metadata_%s" % 0, self.session, self, 0)
 
-
     def shutdown(self):
         self.running = False
-        for requester in self.torrent_requesters.itervalues():
+        for requester in self._get_requesters():
             requester.stop()
         self.cancel_all_pending_tasks()
 
+    def _get_requesters(self):
+        """
+        Returns all requesters, the ones with the highest priority first.
+        """
+        requesters = self.torrent_requesters.values() + self.magnet_requesters.values() + \
+            self.torrent_message_requesters.values()
+        if self.metadata_requester:
+            requesters.append(self.metadata_requester)
+        return sorted(requesters, key=lambda requester: requester.priority, reverse=True)
+
     @call_on_reactor_thread
     def set_max_num_torrents(self, max_num_torrents):
         self.max_num_torrents = max_num_torrents
 
+    @call_on_reactor_thread
+    def set_max_concurrent_requests(self, max_concurrent, max_per_candidate=None):
+        self.scheduler.max_concurrent = max_concurrent
+        if max_per_candidate is not None:
+            self.scheduler.max_per_candidate = max_per_candidate
+        self.start_pending_requests()
+
+    def start_pending_requests(self):
+        """
+        Lets all requesters start their pending requests, the ones with the highest priority first.
+        """
+        for requester in self._get_requesters():
+            requester.start_pending_requests()
+
+    def request_finished(self, candidate, succeeded):
+        """
+        Called by the requesters when a request has finished, which frees up its slot in the scheduler.
+        """
+        self.scheduler.finish(candidate)
+        if succeeded:
+            self._success_times.append(time())
+        self.start_pending_requests()
+
     @call_on_reactor_thread
     def __check_overflow(self):
         def clean_until_done(num_delete, deletions_per_step):
@@ -118,6 +209,15 @@ class RemoteTorrentHandler(TaskManager):
     def schedule_task(self, name, task, delay_time=0.0, *args, **kwargs):
         self.register_task(name, reactor.callLater(delay_time, task, *args, **kwargs))
 
+    def _get_torrent_requester(self, infohash):
+        """
+        Returns the TFTP or magnet requester that has a pending or running request for infohash, if any.
+        """
+        for requester in self.torrent_requesters.values() + self.magnet_requesters.values():
+            if requester.has_request(infohash):
+                return requester
+        return None
+
     @call_on_reactor_thread
     def download_torrent(self, candidate, infohash, user_callback=None, priority=1, timeout=None):
         assert isinstance(infohash, str), u"infohash has invalid type: %s" % type(infohash)
@@ -126,16 +226,43 @@ class RemoteTorrentHandler(TaskManager):
         # fix prio levels to 1 and 0
         priority = min(priority, 1)
 
-        # we use DHT if we don't have candidate
-        if candidate:
-            self.torrent_requesters[priority].add_request(infohash, candidate, timeout)
-        else:
-            self.magnet_requesters[priority].add_request(infohash)
-
         if user_callback:
             callback = lambda ih = infohash: user_callback(ih)
             self.torrent_callbacks.setdefault(infohash, set()).add(callback)
 
+        # a torrent is requested by one requester at a time. A pending request with a lower priority, or a pending
+        # magnet request when we have a candidate, is moved to the requester for this request.
+        requester = self._get_torrent_requester(infohash)
+        candidates = []
+        if requester and (requester.priority < priority or (candidate and isinstance(requester, MagnetRequester))):
+            sources = requester.cancel_pending_request(infohash)
+            if sources is not None:
+                candidates = sources
+                requester = None
+
+        if candidate and candidate not in candidates:
+            candidates.append(candidate)
+
+        if requester:
+            # the torrent is already being requested, a TFTP request can also use our candidate
+            if candidate and isinstance(requester, TftpRequester):
+                requester.add_request(infohash, candidate, timeout)
+        elif candidates:
+            for source in candidates:
+                self.torrent_requesters[priority].add_request(infohash, source, timeout)
+        else:
+            # we use DHT if we don't have candidate
+            self.magnet_requesters[priority].add_request(infohash)
+
+    def on_torrent_sources_exhausted(self, infohash, priority):
+        """
+        Called by a TftpRequester when a torrent could not be downloaded from any of its candidates.
+        """
+        if priority > LOW_PRIO_COLLECTING or infohash in self.torrent_callbacks:
+            # someone is waiting for this torrent, try the DHT instead
+            self._logger.debug(u"falling back to magnet link for %s", hexlify(infohash))
+            self.magnet_requesters[priority].add_request(infohash)
+
     @call_on_reactor_thread
     def save_torrent(self, tdef, callback=None):
         infohash = tdef.get_infohash()
@@ -272,6 +399,26 @@ class RemoteTorrentHandler(TaskManager):
             return ''
         return ", ".join([qstring for qstring in [getQueueBW("TQueue", self.torrent_requesters), getQueueBW("DQueue", self.magnet_requesters)] if qstring])
 
+    def get_torrents_per_second(self):
+        """
+        Returns the number of successful requests per second over the last THROUGHPUT_WINDOW seconds.
+        """
+        now = time()
+        while self._success_times and self._success_times[0] < now - THROUGHPUT_WINDOW:
+            self._success_times.popleft()
+        return len(self._success_times) / THROUGHPUT_WINDOW
+
+    def get_statistics(self):
+        """
+        Returns the statistics of the scheduler and of every requester.
+        """
+        return {u"running": self.scheduler.num_running,
+                u"max_concurrent": self.scheduler.max_concurrent,
+                u"max_per_candidate": self.scheduler.max_per_candidate,
+                u"torrents_per_second": self.get_torrents_per_second(),
+                u"requesters": dict((requester.name, requester.get_statistics())
+                                    for requester in self._get_requesters())}
+
 
 class Requester(object):
     __metaclass__ = ABCMeta
@@ -290,6 +437,7 @@ class Requester(object):
         self._requests_succeeded = 0
         self._requests_failed = 0
         self._total_bandwidth = 0
+        self._success_rate = 0.5
 
         self.running = True
 
@@ -297,6 +445,10 @@ class Requester(object):
         self._remote_torrent_handler.cancel_pending_task(self._name)
         self.running = False
 
+    @property
+    def name(self):
+        return self._name
+
     @property
     def priority(self):
         return self._priority
@@ -305,6 +457,10 @@ class Requester(object):
     def pending_request_queue_size(self):
         return len(self._pending_request_queue)
 
+    @property
+    def active_request_count(self):
+        return 0
+
     @property
     def requests_succeeded(self):
         return self._requests_succeeded
@@ -317,6 +473,41 @@ class Requester(object):
     def total_bandwidth(self):
         return self._total_bandwidth
 
+    @property
+    def success_rate(self):
+        return self._success_rate
+
+    @property
+    def request_interval(self):
+        """
+        The time to wait before starting pending requests. Requesters with a lower priority wait longer, and the wait
+        shrinks to MIN_INTERVAL_FACTOR of the interval as the requests of this requester succeed.
+        """
+        factor = MIN_INTERVAL_FACTOR + (1.0 - MIN_INTERVAL_FACTOR) * (1.0 - self._success_rate)
+        return self.REQUEST_INTERVAL * (MAX_PRIORITY - self._priority) * factor
+
+    def get_statistics(self):
+        return {u"priority": self._priority,
+                u"pending": self.pending_request_queue_size,
+                u"active": self.active_request_count,
+                u"succeeded": self._requests_succeeded,
+                u"failed": self._requests_failed,
+                u"bandwidth": self._total_bandwidth,
+                u"success_rate": self._success_rate,
+                u"request_interval": self.request_interval}
+
+    def _request_finished(self, candidate, succeeded):
+        """
+        Updates the statistics of this requester and lets the RemoteTorrentHandler start the next requests.
+        """
+        if succeeded:
+            self._requests_succeeded += 1
+        else:
+            self._requests_failed += 1
+        self._success_rate += SUCCESS_RATE_WEIGHT * ((1.0 if succeeded else 0.0) - self._success_rate)
+
+        self._remote_torrent_handler.request_finished(candidate, succeeded)
+
     @pass_when_stopped
     def schedule_task(self, task, delay_time=0.0, *args, **kwargs):
         """
@@ -325,15 +516,27 @@ class Requester(object):
         self._remote_torrent_handler.schedule_task(self._name, task, delay_time=delay_time, *args, **kwargs)
 
     @pass_when_stopped
-    def _start_pending_requests(self):
+    def start_pending_requests(self):
         """
-        Starts pending requests.
+        Schedules the pending requests to be started, unless that has already been done.
         """
         if self._remote_torrent_handler.is_pending_task_active(self._name):
             return
         if self._pending_request_queue:
-            self.schedule_task(self._do_request,
-                               delay_time=Requester.REQUEST_INTERVAL * (MAX_PRIORITY - self._priority))
+            self.schedule_task(self._do_request, delay_time=self.request_interval)
+
+    def has_request(self, key):
+        """
+        Returns whether there is a pending or running request for key.
+        """
+        return False
+
+    def cancel_pending_request(self, key):
+        """
+        Removes the request for key if it has not been started yet.
+        :return: The candidates that the request had not been sent to yet, or None if there is no pending request.
+        """
+        return None
 
     @abstractmethod
     def add_request(self, key, candidate, timeout=None):
@@ -353,7 +556,7 @@ class Requester(object):
 class TorrentMessageRequester(Requester):
 
     def __init__(self, session, remote_torrent_handler, priority):
-        super(TorrentMessageRequester, self).__init__(u"torrent_message_requester",
+        super(TorrentMessageRequester, self).__init__(u"torrent_message_requester_%s" % priority,
                                                       session, remote_torrent_handler, priority)
         if sys.platform == "darwin":
             # Mac has just 256 fds per process, be less aggressive
@@ -365,25 +568,19 @@ class TorrentMessageRequester(Requester):
     @pass_when_stopped
     def add_request(self, infohash, candidate, timeout=None):
         addr = candidate.sock_addr
-        queue_was_empty = len(self._pending_request_queue) == 0
-
-        if infohash in self._source_dict and candidate in self._source_dict[infohash]:
-            self._logger.debug(u"already has request %s from %s:%s, skip", hexlify(infohash), addr[0], addr[1])
 
-        if infohash not in self._pending_request_queue:
+        if infohash not in self._source_dict:
             self._pending_request_queue.append(infohash)
             self._source_dict[infohash] = []
         if candidate in self._source_dict[infohash]:
-            self._logger.warn(u"ignore duplicate torrent message request %s from %s:%s",
-                              hexlify(infohash), addr[0], addr[1])
+            self._logger.debug(u"ignore duplicate torrent message request %s from %s:%s",
+                               hexlify(infohash), addr[0], addr[1])
             return
 
         self._source_dict[infohash].append(candidate)
         self._logger.debug(u"added request %s from %s:%s", hexlify(infohash), addr[0], addr[1])
 
-        # start scheduling tasks if the queue was empty, which means there was no task running previously
-        if queue_was_empty:
-            self._start_pending_requests()
+        self.start_pending_requests()
 
     @pass_when_stopped
     def _do_request(self):
@@ -416,7 +613,8 @@ class MagnetRequester(Requester):
     TIMEOUT = 30.0
 
     def __init__(self, session, remote_torrent_handler, priority):
-        super(MagnetRequester, self).__init__(u"magnet_requester", session, remote_torrent_handler, priority)
+        super(MagnetRequester, self).__init__(u"magnet_requester_%s" % priority,
+                                              session, remote_torrent_handler, priority)
         if sys.platform == "darwin":
             # Mac has just 256 fds per process, be less aggressive
             self.REQUEST_INTERVAL = 15.0
@@ -426,26 +624,41 @@ class MagnetRequester(Requester):
 
         self._torrent_db_handler = session.open_dbhandler(NTFY_TORRENTS)
 
+        self._pending_requests = set()
         self._running_requests = []
 
+    @property
+    def active_request_count(self):
+        return len(self._running_requests)
+
+    def has_request(self, infohash):
+        return infohash in self._pending_requests or infohash in self._running_requests
+
+    def cancel_pending_request(self, infohash):
+        if infohash not in self._pending_requests:
+            return None
+        self._pending_requests.remove(infohash)
+        self._pending_request_queue.remove(infohash)
+        return []
+
     @pass_when_stopped
     def add_request(self, infohash, candidate=None, timeout=None):
-        queue_was_empty = len(self._pending_request_queue) == 0
-        if infohash not in self._pending_request_queue and infohash not in self._running_requests:
+        if not self.has_request(infohash):
             self._pending_request_queue.append(infohash)
+            self._pending_requests.add(infohash)
 
-        # start scheduling tasks if the queue was empty, which means there was no task running previously
-        if queue_was_empty:
-            self._start_pending_requests()
+        self.start_pending_requests()
 
     @pass_when_stopped
     def _do_request(self):
+        scheduler = self._remote_torrent_handler.scheduler
         while self._pending_request_queue and self.running:
-            if len(self._running_requests) >= self.MAX_CONCURRENT:
+            if len(self._running_requests) >= self.MAX_CONCURRENT or not scheduler.can_start():
                 self._logger.debug(u"max concurrency %s reached, request later", self.MAX_CONCURRENT)
                 return
 
             infohash = self._pending_request_queue.popleft()
+            self._pending_requests.remove(infohash)
             infohash_str = hexlify(infohash)
 
             # try magnet link
@@ -460,9 +673,10 @@ class MagnetRequester(Requester):
             self._logger.debug(u"requesting %s priority %s through magnet link %s",
                                infohash_str, self._priority, magnetlink)
 
+            scheduler.start()
+            self._running_requests.append(infohash)
             self._session.lm.ltmgr.get_metainfo(magnetlink, self._success_callback,
                                                 timeout=self.TIMEOUT, timeout_callback=self._failure_callback)
-            self._running_requests.append(infohash)
 
     @call_on_reactor_thread
     def _success_callback(self, meta_info):
@@ -478,10 +692,9 @@ class MagnetRequester(Requester):
         self._remote_torrent_handler.save_torrent(tdef)
         self._running_requests.remove(infohash)
 
-        self._requests_succeeded += 1
         self._total_bandwidth += tdef.get_torrent_size()
 
-        self._start_pending_requests()
+        self._request_finished(None, True)
 
     @call_on_reactor_thread
     def _failure_callback(self, infohash):
@@ -496,9 +709,7 @@ class MagnetRequester(Requester):
         self._logger.debug(u"failed to retrieve torrent %s through magnet", hexlify(infohash))
         self._running_requests.remove(infohash)
 
-        self._requests_failed += 1
-
-        self._start_pending_requests()
+        self._request_finished(None, False)
 
 
 class TftpRequester(Requester):
@@ -508,10 +719,26 @@ class TftpRequester(Requester):
 
         self.REQUEST_INTERVAL = 5.0
 
-        self._active_request_list = []
+        self._active_requests = {}
         self._untried_sources = {}
         self._tried_sources = {}
 
+    @property
+    def active_request_count(self):
+        return len(self._active_requests)
+
+    def has_request(self, infohash):
+        return hexlify(infohash) in self._untried_sources
+
+    def cancel_pending_request(self, infohash):
+        key = hexlify(infohash)
+        if key not in self._untried_sources or key in self._active_requests:
+            return None
+        self._pending_request_queue.remove(key)
+        candidates = list(self._untried_sources.pop(key))
+        del self._tried_sources[key]
+        return candidates
+
     @pass_when_stopped
     def add_request(self, key, candidate, timeout=None, is_metadata=False):
         ip, port = candidate.sock_addr
@@ -523,8 +750,8 @@ class TftpRequester(Requester):
             key = hexlify(key)
             key_str = hexlify(key)
 
-        if key in self._pending_request_queue or key in self._active_request_list:
-            # append to the active one
+        if key in self._untried_sources:
+            # append to the pending or active one
             if candidate in self._untried_sources[key] or candidate in self._tried_sources[key]:
                 self._logger.debug(u"already has request %s from %s:%s, skip", key_str, ip, port)
                 return
@@ -539,20 +766,47 @@ class TftpRequester(Requester):
             self._untried_sources[key] = deque([candidate])
             self._tried_sources[key] = deque()
 
-        # start pending tasks if there is no task running
-        if not self._active_request_list:
-            self._start_pending_requests()
+        self.start_pending_requests()
 
     @pass_when_stopped
     def _do_request(self):
-        assert not self._active_request_list, "active_request_list is not empty = %s" % repr(self._active_request_list)
+        # do not download if TFTP has been shutdown
+        if self._session.lm.tftp_handler is None:
+            return
+
+        # start as many requests as the scheduler allows. Requests whose candidates are all busy go to the back of
+        # the queue, the RemoteTorrentHandler will start them once another request has finished.
+        scheduler = self._remote_torrent_handler.scheduler
+        for _ in xrange(len(self._pending_request_queue)):
+            if not scheduler.can_start():
+                break
 
-        # starts to download a torrent
-        key = self._pending_request_queue.popleft()
+            key = self._pending_request_queue.popleft()
+            candidate = self._pop_available_source(key)
+            if candidate is None:
+                self._pending_request_queue.append(key)
+                continue
 
-        candidate = self._untried_sources[key].popleft()
-        self._tried_sources[key].append(candidate)
+            if not self._start_request(key, candidate):
+                break
 
+    def _pop_available_source(self, key):
+        """
+        Returns the first untried candidate for key that the scheduler allows a request to, or None.
+        """
+        untried_sources = self._untried_sources[key]
+        for candidate in untried_sources:
+            if self._remote_torrent_handler.scheduler.can_start(candidate):
+                untried_sources.remove(candidate)
+                self._tried_sources[key].append(candidate)
+                return candidate
+        return None
+
+    def _start_request(self, key, candidate):
+        """
+        Starts the TFTP download of key from candidate.
+        :return: False if the TFTP handler is not running, in which case the request is queued again. True otherwise.
+        """
         ip, port = candidate.sock_addr
 
         if key.startswith(METADATA_PREFIX):
@@ -568,18 +822,22 @@ class TftpRequester(Requester):
 
         self._logger.debug(u"start TFTP download for %s from %s:%s", file_name, ip, port)
 
-        # do not download if TFTP has been shutdown
-        if self._session.lm.tftp_handler is None:
-            return
-        self._session.lm.tftp_handler.download_file(file_name, ip, port, extra_info=extra_info,
-                                                    success_callback=self._on_download_successful,
-                                                    failure_callback=self._on_download_failed)
-        self._active_request_list.append(key)
+        if not self._session.lm.tftp_handler.download_file(file_name, ip, port, extra_info=extra_info,
+                                                           success_callback=self._on_download_successful,
+                                                           failure_callback=self._on_download_failed):
+            self._logger.debug(u"TFTP handler is not running, cannot download %s", file_name)
+            self._tried_sources[key].remove(candidate)
+            self._untried_sources[key].appendleft(candidate)
+            self._pending_request_queue.appendleft(key)
+            return False
+
+        self._remote_torrent_handler.scheduler.start(candidate)
+        self._active_requests[key] = candidate
+        return True
 
-    def _clear_active_request(self, key):
+    def _clear_request(self, key):
         del self._untried_sources[key]
         del self._tried_sources[key]
-        self._active_request_list.remove(key)
 
     @call_on_reactor_thread
     def _on_download_successful(self, address, file_name, file_data, extra_info):
@@ -589,10 +847,9 @@ class TftpRequester(Requester):
         info_hash = extra_info.get(u"info_hash")
         thumb_hash = extra_info.get(u"thumb_hash")
 
-        assert key in self._active_request_list, u"key = %s, active_request_list = %s" % (repr(key),
-                                                                                          self._active_request_list)
+        assert key in self._active_requests, u"key = %s, active_requests = %s" % (repr(key), self._active_requests)
+        candidate = self._active_requests.pop(key)
 
-        self._requests_succeeded += 1
         self._total_bandwidth += len(file_data)
 
         # save data
@@ -605,29 +862,28 @@ class TftpRequester(Requester):
                 # save metadata
                 self._remote_torrent_handler.save_metadata(thumb_hash, file_data)
         finally:
-            # start the next request
-            self._clear_active_request(key)
-            self._start_pending_requests()
+            # start the next requests
+            self._clear_request(key)
+            self._request_finished(candidate, True)
 
     @call_on_reactor_thread
     def _on_download_failed(self, address, file_name, error_msg, extra_info):
         self._logger.debug(u"failed to download %s from %s:%s: %s", file_name, address[0], address[1], error_msg)
 
         key = extra_info[u'key']
-        assert key in self._active_request_list, u"key = %s, active_request_list = %s" % (repr(key),
-                                                                                          self._active_request_list)
-
-        self._requests_failed += 1
+        assert key in self._active_requests, u"key = %s, active_requests = %s" % (repr(key), self._active_requests)
+        candidate = self._active_requests.pop(key)
 
         if self._untried_sources[key]:
             # try to download this data from another candidate
             self._logger.debug(u"scheduling next try for %s", repr(key))
-
             self._pending_request_queue.appendleft(key)
-            self._active_request_list.remove(key)
-            self.schedule_task(self._do_request)
 
         else:
-            # no more available candidates, download the next requested infohash
-            self._clear_active_request(key)
-            self._start_pending_requests()
+            # no more available candidates
+            self._clear_request(key)
+            info_hash = extra_info.get(u"info_hash")
+            if info_hash is not None:
+                self._remote_torrent_handler.on_torrent_sources_exhausted(info_hash, self._priority)
+
+        self._request_finished(candidate, False)
@@ -11,7 +11,8 @@ from twisted.internet import reactor
 from Tribler.dispersy.taskmanager import TaskManager, LoopingCall
 from Tribler.dispersy.candidate import Candidate
 from Tribler.dispersy.util import call_on_reactor_thread, blocking_call_on_reactor_thread, attach_runtime_statistics
-from .session import Session, DEFAULT_BLOCK_SIZE, DEFAULT_TIMEOUT
+from .session import (Session, DEFAULT_BLOCK_SIZE, DEFAULT_TIMEOUT, DEFAULT_WINDOW_SIZE, MAX_BLOCK_SIZE,
+                      MAX_WINDOW_SIZE)
 from .packet import (encode_packet, decode_packet, OPCODE_RRQ, OPCODE_WRQ, OPCODE_ACK, OPCODE_DATA, OPCODE_OACK,
                      OPCODE_ERROR, ERROR_DICT)
 from .exception import InvalidPacketException, FileNotFound
@@ -32,7 +33,7 @@ class TftpHandler(TaskManager):
     """
 
     def __init__(self, session, endpoint, prefix, block_size=DEFAULT_BLOCK_SIZE, timeout=DEFAULT_TIMEOUT,
-                 max_retries=DEFAULT_RETIES):
+                 max_retries=DEFAULT_RETIES, window_size=DEFAULT_WINDOW_SIZE):
         """ The constructor.
         :param session:     The tribler session.
         :param endpoint:    The endpoint to use.
@@ -40,6 +41,7 @@ class TftpHandler(TaskManager):
         :param block_size:  Transmission block size.
         :param timeout:     Transmission timeout.
         :param max_retries: Transmission maximum retries.
+        :param window_size: The number of blocks that are transmitted before waiting for an acknowledgement.
         """
         super(TftpHandler, self).__init__()
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -51,6 +53,7 @@ class TftpHandler(TaskManager):
 
         self._block_size = block_size
         self._timeout = timeout
+        self._window_size = window_size
         self._max_retries = max_retries
 
         self._timeout_check_interval = 0.5
@@ -94,12 +97,14 @@ class TftpHandler(TaskManager):
         :param port:      The port of the remote host.
         :param success_callback: The success callback.
         :param failure_callback: The failure callback.
+        :return: False if the download could not be started as the handler is not running, True otherwise. Only a
+        started download calls one of the callbacks.
         """
-        # generate a unique session id
-        # if the target address is higher than ours, we use even number. Otherwise, we use odd number.
         if not self._is_running:
-            return
+            return False
 
+        # generate a unique session id
+        # if the target address is higher than ours, we use even number. Otherwise, we use odd number.
         target_ip = unpack('!L', inet_aton(ip))[0]
         target_port = port
         self_ip, self_port = self.session.lm.dispersy.wan_address
@@ -126,12 +131,13 @@ class TftpHandler(TaskManager):
         self._logger.debug(u"start downloading %s from %s:%s, sid = %s", file_name, ip, port, session_id)
         session = Session(True, session_id, (ip, port), OPCODE_RRQ, file_name, '', None, None,
                           extra_info=extra_info, block_size=self._block_size, timeout=self._timeout,
-                          success_callback=success_callback, failure_callback=failure_callback)
+                          window_size=self._window_size, success_callback=success_callback, failure_callback=failure_callback)
 
         self._add_new_session(session)
         self._send_request_packet(session)
 
         self._logger.info(u"%s started", session)
+        return True
 
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
     def _task_check_timeout(self):
@@ -166,11 +172,27 @@ class TftpHandler(TaskManager):
         has_failed = False
         timeout = session.timeout * (2**session.retries)
         if session.last_contact_time + timeout < time():
-            # we do NOT resend packets that are not data-related
-            if session.retries < self._max_retries and session.last_sent_packet['opcode'] in (OPCODE_ACK, OPCODE_DATA):
+            if session.retries >= self._max_retries:
+                has_failed = True
+
+            elif session.last_sent_packet['opcode'] == OPCODE_DATA and session.last_block_number is not None:
+                # resend all DATA packets that have not been acknowledged
+                self._send_data_window(session)
+                session.retries += 1
+
+            elif session.last_sent_packet['opcode'] in (OPCODE_ACK, OPCODE_DATA):
                 self._send_packet(session, session.last_sent_packet)
                 session.retries += 1
+
+            elif session.last_sent_packet['opcode'] == OPCODE_RRQ and session.window_size > 1:
+                # older versions fail to decode a request with the windowsize option, request without it
+                self._logger.info(u"%s no response to windowed request, retrying without windowsize", session)
+                session.window_size = 1
+                self._send_request_packet(session)
+                session.retries += 1
+
             else:
+                # we do NOT resend packets that are not data-related
                 has_failed = True
         return has_failed
 
@@ -282,8 +304,10 @@ class TftpHandler(TaskManager):
             return
 
         file_name = packet['file_name'].decode('utf8')
-        block_size = packet['options']['blksize']
+        block_size = min(packet['options']['blksize'], MAX_BLOCK_SIZE)
         timeout = packet['options']['timeout']
+        # the windowsize option is only acknowledged if it was requested (RFC 7440)
+        window_size = min(packet['options'].get('windowsize', 1), self._window_size, MAX_WINDOW_SIZE)
 
         # check session_id
         if (ip, port, packet['session_id']) in self._session_dict:
@@ -315,7 +339,15 @@ class TftpHandler(TaskManager):
 
         # create a session object
         session = Session(False, packet['session_id'], (ip, port), packet['opcode'],
-                          file_name, file_data, file_size, checksum, block_size=block_size, timeout=timeout)
+                          file_name, file_data, file_size, checksum, block_size=block_size, timeout=timeout,
+                          window_size=max(window_size, 1))
+        # the last block is always smaller than the block size, it is empty if the file size is a multiple of it
+        session.last_block_number = file_size // block_size + 1
+        if session.last_block_number > MAX_INT16:
+            self._logger.warn(u"[READ %s:%s] file too large to transfer: %s bytes", ip, port, file_size)
+            self._handle_error(session, 3)
+            return
+        session.requested_options = packet['options']
 
         # insert session_id and session
         self._add_new_session(session)
@@ -350,21 +382,25 @@ class TftpHandler(TaskManager):
 
         return file_data, len(file_data)
 
-    def _get_next_data(self, session):
-        """ Gets the next block of data to be uploaded. This method is only used for data uploading.
+    def _get_block_data(self, session, block_number):
+        """ Gets a block of data to be uploaded. This method is only used for data uploading.
+        :param block_number: The number of the block, starting at 1.
         :return The data to transfer.
         """
-        start_idx = session.block_number * session.block_size
-        end_idx = start_idx + session.block_size
-        data = session.file_data[start_idx:end_idx]
-        session.block_number += 1
+        start_idx = (block_number - 1) * session.block_size
+        return session.file_data[start_idx:start_idx + session.block_size]
+
+    def _send_data_window(self, session):
+        """ Sends the window of DATA packets that follows the last acknowledged block.
+        """
+        last_block_number = min(session.block_number + session.window_size, session.last_block_number)
+        for block_number in xrange(session.block_number + 1, last_block_number + 1):
+            self._send_data_packet(session, block_number, self._get_block_data(session, block_number))
 
         # check if we are done
-        if len(data) < session.block_size:
+        if last_block_number == session.last_block_number:
             session.is_waiting_for_last_ack = True
 
-        return data
-
     def _process_packet(self, session, packet):
         """ processes an incoming packet.
         :param packet: The incoming packet dictionary.
@@ -390,8 +426,8 @@ class TftpHandler(TaskManager):
         # if this is the first packet, check OACK
         if packet['opcode'] == OPCODE_OACK:
             if session.last_received_packet is None:
-                # check options
-                if session.block_size != packet['options']['blksize']:
+                # check options, the sender may use smaller blocks than we asked for
+                if session.block_size < packet['options']['blksize']:
                     msg = "%s OACK blksize mismatch: %s != %s (expected)" %\
                           (session, session.block_size, packet['options']['blksize'])
                     self._logger.error(msg)
@@ -405,14 +441,26 @@ class TftpHandler(TaskManager):
                     self._handle_error(session, 0, error_msg=msg)  # Error: timeout mismatch
                     return
 
+                # the sender may use a smaller window than we asked for, or none at all
+                window_size = packet['options'].get('windowsize', 1)
+                if not 1 <= window_size <= session.window_size:
+                    msg = "%s OACK windowsize mismatch: %s > %s (expected)" %\
+                          (session, window_size, session.window_size)
+                    self._logger.error(msg)
+                    self._handle_error(session, 0, error_msg=msg)  # Error: windowsize mismatch
+                    return
+
+                session.block_size = packet['options']['blksize']
+                session.window_size = window_size
                 session.file_size = packet['options']['tsize']
                 session.checksum = packet['options']['checksum']
 
                 if session.request == OPCODE_RRQ:
                     # send ACK
                     self._send_ack_packet(session, session.block_number)
+                    session.last_acked_block = session.block_number
                     session.block_number += 1
-                    session.file_data = ""
+                    session.data_blocks = []
 
             else:
                 self._logger.error(u"%s Got OPCODE %s which is not expected", session, packet['opcode'])
@@ -430,24 +478,59 @@ class TftpHandler(TaskManager):
         # check block_number
         # ignore old ones, they may be retransmissions
         if packet['block_number'] < session.block_number:
-            self._logger.warn(u"%s ignore old block number DATA %s < %s",
-                              session, packet['block_number'], session.block_number)
+            self._logger.debug(u"%s ignore old block number DATA %s < %s",
+                               session, packet['block_number'], session.block_number)
+            # the sender retransmits a window when it did not get our ACK of it, so acknowledge it again
+            if packet['block_number'] == session.last_acked_block:
+                self._send_ack_packet(session, session.last_acked_block)
             return
 
-        if packet['block_number'] != session.block_number:
-            msg = "%s Got ACK with block# %s while expecting %s" %\
+        if packet['block_number'] >= session.block_number + session.window_size:
+            msg = "%s Got DATA with block# %s while expecting %s" %\
                   (session, packet['block_number'], session.block_number)
             self._logger.error(msg)
             self._handle_error(session, 0, error_msg=msg)  # Error: block_number mismatch
             return
 
-        # save data
-        session.file_data += packet['data']
-        self._send_ack_packet(session, session.block_number)
+        if packet['block_number'] > session.block_number:
+            # a block got lost or reordered, keep this one until the missing blocks have arrived
+            session.pending_blocks[packet['block_number']] = packet['data']
+            if not session.gap_acked:
+                # let the sender retransmit starting at the missing block
+                self._send_ack_packet(session, session.block_number - 1)
+                session.last_acked_block = session.block_number - 1
+                session.gap_acked = True
+            return
+
+        data = packet['data']
+        while True:
+            self._receive_block(session, data)
+            if session.is_done or session.is_failed or session.block_number not in session.pending_blocks:
+                break
+            data = session.pending_blocks.pop(session.block_number)
+
+        # acknowledge every complete window
+        if not session.is_done and not session.is_failed \
+                and session.block_number - 1 - session.last_acked_block >= session.window_size:
+            self._send_ack_packet(session, session.block_number - 1)
+            session.last_acked_block = session.block_number - 1
+
+    def _receive_block(self, session, data):
+        """ Saves the next block of data and checks whether the transfer is finished.
+        :param data: The data of the block.
+        """
+        session.data_blocks.append(data)
+        session.gap_acked = False
         session.block_number += 1
 
         # check if it is the end
-        if len(packet['data']) < session.block_size:
+        if len(data) < session.block_size:
+            self._send_ack_packet(session, session.block_number - 1)
+            session.last_acked_block = session.block_number - 1
+            session.file_data = "".join(session.data_blocks)
+            session.data_blocks = []
+            session.pending_blocks = {}
+
             self._logger.info(u"%s transfer finished. checking data integrity...", session)
             # check file size and checksum
             if session.file_size != len(session.file_data):
@@ -483,20 +566,21 @@ class TftpHandler(TaskManager):
                               session, packet['block_number'], session.block_number)
             return
 
-        if packet['block_number'] != session.block_number:
+        if packet['block_number'] > min(session.block_number + session.window_size, session.last_block_number):
             msg = "%s got ACK with block# %s while expecting %s" %\
                   (session, packet['block_number'], session.block_number)
             self._logger.error(msg)
             self._handle_error(session, 0, error_msg=msg)  # Error: block_number mismatch
             return
 
-        if session.is_waiting_for_last_ack:
+        if packet['block_number'] == session.last_block_number:
             session.is_done = True
             return
 
-        data = self._get_next_data(session)
-        # send DATA
-        self._send_data_packet(session, session.block_number, data)
+        # send the DATA following the acknowledged block. If the receiver acknowledged a block before the end of the
+        # window, a block got lost and the rest of the window is sent again.
+        session.block_number = packet['block_number']
+        self._send_data_window(session)
 
     def _handle_error(self, session, error_code, error_msg=""):
         """ Handles an error during packet processing.
@@ -528,6 +612,8 @@ class TftpHandler(TaskManager):
                   'options': {'blksize': session.block_size,
                               'timeout': session.timeout,
                               }}
+        if session.window_size > 1:
+            packet['options']['windowsize'] = session.window_size
         self._send_packet(session, packet)
 
     def _send_data_packet(self, session, block_number, data):
@@ -560,4 +646,6 @@ class TftpHandler(TaskManager):
                               'tsize': session.file_size,
                               'checksum': session.checksum,
                               }}
+        if 'windowsize' in session.requested_options:
+            packet['options']['windowsize'] = session.window_size
         self._send_packet(session, packet)
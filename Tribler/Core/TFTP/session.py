@@ -3,6 +3,12 @@ from time import time
 
 # default packet data size
 DEFAULT_BLOCK_SIZE = 512
+# the largest packet data size we send, so packets are not fragmented on common links
+MAX_BLOCK_SIZE = 1400
+
+# the number of DATA packets that are sent before waiting for an ACK (RFC 7440), and the most we accept
+DEFAULT_WINDOW_SIZE = 16
+MAX_WINDOW_SIZE = 64
 
 # default timeout and maximum retries
 DEFAULT_TIMEOUT = 2
@@ -11,7 +17,7 @@ DEFAULT_TIMEOUT = 2
 class Session(object):
 
     def __init__(self, is_client, session_id, address, request, file_name, file_data, file_size, checksum,
-                 extra_info=None, block_size=DEFAULT_BLOCK_SIZE, timeout=DEFAULT_TIMEOUT,
+                 extra_info=None, block_size=DEFAULT_BLOCK_SIZE, timeout=DEFAULT_TIMEOUT, window_size=1,
                  success_callback=None, failure_callback=None):
         self.is_client = is_client
         self.session_id = session_id
@@ -27,9 +33,20 @@ class Session(object):
         self.block_number = 0
         self.block_size = block_size
         self.timeout = timeout
+        self.window_size = window_size
         self.success_callback = success_callback
         self.failure_callback = failure_callback
 
+        # as a sender: the options of the request and the number of the last DATA block of the file
+        self.requested_options = {}
+        self.last_block_number = None
+        # as a receiver: the received data blocks, the blocks received out of order, the last acknowledged block and
+        # whether the last acknowledged block has been acknowledged again because a block is missing
+        self.data_blocks = []
+        self.pending_blocks = {}
+        self.last_acked_block = 0
+        self.gap_acked = False
+
         self.last_contact_time = time()
         self.last_received_packet = None
         self.last_sent_packet = None
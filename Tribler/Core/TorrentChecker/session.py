@@ -31,6 +31,7 @@ HTTP_TRACKER_MAX_RETRIES = 0
 
 DHT_TRACKER_RECHECK_INTERVAL = 60
 DHT_TRACKER_MAX_RETRIES = 8
+DHT_MAX_PENDING_LOOKUPS = 50  # max DHT lookups of torrent checks that are in flight at the same time
 
 MAX_TRACKER_MULTI_SCRAPE = 74
 
@@ -697,6 +698,7 @@ class FakeDHTSession(TrackerSession):
 
         self.result_deferred = None
         self._session = session
+        self._pending_lookups = set()
 
     def cleanup(self):
         """
@@ -704,16 +706,28 @@ class FakeDHTSession(TrackerSession):
         :return: A deferred that fires once the cleanup is done.
         """
         self._infohash_list = None
+        self._pending_lookups.clear()
         self._session = None
         # Return a defer that immediately calls its callback
         return defer.succeed(None)
 
     def can_add_request(self):
         """
-        Returns whether or not this session can accept additional infohashes.
+        Returns whether or not this session can accept additional infohashes, which is the case as long as fewer
+        than DHT_MAX_PENDING_LOOKUPS lookups are in flight.
         :return:
         """
-        return True
+        return len(self._pending_lookups) < DHT_MAX_PENDING_LOOKUPS
+
+    def has_request(self, infohash):
+        return infohash in self._pending_lookups
+
+    @property
+    def num_pending_lookups(self):
+        """
+        Returns the number of DHT lookups that are in flight.
+        """
+        return len(self._pending_lookups)
 
     def add_request(self, infohash):
         """
@@ -723,19 +737,22 @@ class FakeDHTSession(TrackerSession):
 
         @call_on_reactor_thread
         def on_metainfo_received(metainfo):
+            self._pending_lookups.discard(infohash)
             seed_leech_dict = {}
             seed_leech_dict[infohash] = (metainfo['seeders'], metainfo['leechers'])
             self._on_result_callback(seed_leech_dict)
 
         @call_on_reactor_thread
         def on_metainfo_timeout(result_info_hash):
+            self._pending_lookups.discard(infohash)
             seeder_leecher_dict = {}
             seeder_leecher_dict[result_info_hash] = (0, 0)
             self._on_result_callback(seeder_leecher_dict)
 
         if self._session:
+            self._pending_lookups.add(infohash)
             self._session.lm.ltmgr.get_metainfo(infohash, callback=on_metainfo_received,
-                                                timeout_callback=on_metainfo_timeout)
+                                                timeout_callback=on_metainfo_timeout, need_peers=True)
 
     def create_connection(self):
         pass
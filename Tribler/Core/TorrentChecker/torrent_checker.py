@@ -1,5 +1,6 @@
 from binascii import hexlify
 from collections import deque
+from heapq import heappush
 import logging
 import time
 from twisted.internet.error import ConnectingCancelledError
@@ -8,7 +9,7 @@ from twisted.internet.defer import Deferred, DeferredList, CancelledError
 
 from twisted.internet import reactor
 
-from Tribler.dispersy.taskmanager import TaskManager, LoopingCall
+from Tribler.dispersy.taskmanager import TaskManager
 from Tribler.dispersy.util import blocking_call_on_reactor_thread, call_on_reactor_thread
 
 from Tribler.Core.simpledefs import NTFY_TORRENTS
@@ -23,6 +24,10 @@ DEFAULT_TORRENT_CHECK_INTERVAL = 900  # base multiplier for the check delay
 DEFAULT_MAX_TORRENT_CHECK_RETRIES = 8  # max check delay increments when failed.
 DEFAULT_TORRENT_CHECK_RETRY_INTERVAL = 30  # interval when the torrent was successfully checked for the last time
 
+DEFAULT_MAX_CONCURRENT_SESSIONS = 50  # max tracker sessions that are checking torrents at the same time
+DEFAULT_MAX_QUEUED_CHECKS = 10000  # max torrent checks that are selected from the database ahead of time
+CHECK_RATE_WINDOW = 60  # the checks/second are averaged over this many seconds
+
 class TorrentChecker(TaskManager):
 
     def __init__(self, session):
@@ -34,14 +39,19 @@ class TorrentChecker(TaskManager):
 
         self._should_stop = False
 
-        self._pending_request_queue = deque()
+        # Priority queue of (next_check, torrent_id, infohash, tracker_url) tuples over all trackers
+        self._check_queue = []
+        self._queued_checks = set()
         self._pending_response_dict = {}
+        self._check_times = deque()
 
         self._torrent_check_interval = DEFAULT_TORRENT_CHECK_INTERVAL
         self._torrent_check_retry_interval = DEFAULT_TORRENT_CHECK_RETRY_INTERVAL
         self._max_torrent_check_retries = DEFAULT_MAX_TORRENT_CHECK_RETRIES
+        self._max_concurrent_sessions = DEFAULT_MAX_CONCURRENT_SESSIONS
+        self._max_queued_checks = DEFAULT_MAX_QUEUED_CHECKS
 
-        self._session_list = [FakeDHTSession(session, self._on_result_from_session), ]
+        self._session_list = [FakeDHTSession(session, self._on_dht_result), ]
         self._last_torrent_selection_time = 0
 
         # Track all session cleanups
@@ -56,10 +66,6 @@ class TorrentChecker(TaskManager):
         self._torrent_db = self._session.open_dbhandler(NTFY_TORRENTS)
         self._reschedule_torrent_select()
 
-        # Check the session every 200ms
-        self.register_task(u'task_check_torrent_sessions',
-                           LoopingCall(self.check_sessions)).start(0.2, now=True)
-
     def shutdown(self):
         """
         Shutdown the torrent health checker.
@@ -81,7 +87,8 @@ class TorrentChecker(TaskManager):
 
         self._session_list = None
 
-        self._pending_request_queue = None
+        self._check_queue = None
+        self._queued_checks = None
         self._pending_response_dict = None
 
         self._torrent_db = None
@@ -117,27 +124,61 @@ class TorrentChecker(TaskManager):
         # start selecting torrents
         current_time = int(time.time())
 
-        result = self._session.lm.tracker_manager.get_next_tracker_for_auto_check()
-        if result is None:
-            self._logger.warn(u"No tracker to select from, skip")
+        num_to_select = self._max_queued_checks - len(self._check_queue)
+        if num_to_select <= 0:
+            self._logger.debug(u"Check queue is full, skip selecting torrents")
             return
 
-        tracker_url, _ = result
-        self._logger.debug(u"Start selecting torrents on tracker %s.", tracker_url)
+        # select the torrents that are due on any tracker, the ones that are overdue the longest first
+        torrent_list = self._torrent_db.getTorrentsToCheck(current_time, current_time - self._torrent_check_interval,
+                                                           num_to_select)
 
-        all_torrent_list = self._torrent_db.getTorrentsOnTracker(tracker_url, current_time)
+        scheduled_checks = 0
+        for torrent_id, infohash, tracker_url, next_check in torrent_list:
+            if self._schedule_check(next_check, torrent_id, infohash, tracker_url):
+                scheduled_checks += 1
 
-        # get the torrents that should be checked
-        scheduled_torrents = 0
-        for torrent_id, infohash, last_check in all_torrent_list:
-            # recheck interval is: interval * 2^(retries)
-            if current_time - last_check < self._torrent_check_interval:
-                continue
+        self._logger.debug(u"Selected %d new torrent checks, %d checks queued, %.2f checks/second",
+                           scheduled_checks, len(self._check_queue), self.get_checks_per_second())
 
-            self._pending_request_queue.append((torrent_id, infohash, [tracker_url, ]))
-            scheduled_torrents += 1
+        self._schedule_check_sessions()
 
-        self._logger.debug(u"Selected %d new torrents to check on tracker: %s", scheduled_torrents, tracker_url)
+    def _schedule_check(self, next_check, torrent_id, infohash, tracker_url):
+        """
+        Queues a check of a torrent on a tracker, unless that check is already queued or in progress.
+        :return: Whether the check was queued.
+        """
+        if tracker_url == u'no-DHT' or (infohash, tracker_url) in self._queued_checks \
+                or infohash in self._pending_response_dict:
+            return False
+
+        heappush(self._check_queue, (next_check, torrent_id, infohash, tracker_url))
+        self._queued_checks.add((infohash, tracker_url))
+        return True
+
+    def get_checks_per_second(self):
+        """
+        Returns the number of torrent checks that completed per second, averaged over the last CHECK_RATE_WINDOW
+        seconds.
+        """
+        window_start = time.time() - CHECK_RATE_WINDOW
+        while self._check_times and self._check_times[0] < window_start:
+            self._check_times.popleft()
+        return len(self._check_times) / float(CHECK_RATE_WINDOW)
+
+    def get_statistics(self):
+        """
+        Returns the statistics of the torrent checker: the checks/second, the number of queued checks, the number of
+        tracker sessions that are in flight and the number of DHT lookups that are in flight.
+        """
+        return {u'checks_per_second': self.get_checks_per_second(),
+                u'queued_checks': len(self._check_queue),
+                u'active_sessions': self._get_num_active_sessions(),
+                u'pending_dht_lookups': sum(session.num_pending_lookups for session in self._session_list
+                                            if isinstance(session, FakeDHTSession))}
+
+    def _get_num_active_sessions(self):
+        return len([session for session in self._session_list if not isinstance(session, FakeDHTSession)])
 
     @call_on_reactor_thread
     def add_gui_request(self, infohash, scrape_now=False):
@@ -173,56 +214,52 @@ class TorrentChecker(TaskManager):
             # TODO: add code to handle torrents with no tracker
             return
 
-        self._pending_request_queue.append((torrent_id, infohash, tracker_set))
+        # GUI requests go before all torrents that were selected automatically
+        for tracker_url in tracker_set:
+            self._schedule_check(0, torrent_id, infohash, tracker_url)
+
+        self._schedule_check_sessions()
+
+    def _schedule_check_sessions(self):
+        """
+        Schedules a run of check_sessions, unless one is scheduled already. The events that call this may come in
+        bursts, so they share a single run.
+        """
+        if self._should_stop or self.is_pending_task_active(u'task_check_torrent_sessions'):
+            return
+
+        self.register_task(u'task_check_torrent_sessions', reactor.callLater(0, self.check_sessions))
 
     @call_on_reactor_thread
     def check_sessions(self):
         """
-        This function initiates all tracker session if they are ready,
-        checks if they have not timed out yet (udp only) and cleans them if they
-        have failed or are done.
-        :return:
+        Cleans the tracker sessions that have failed or are done, updates the torrents with the new results and adds
+        the queued checks to the sessions. Runs whenever a session completes or times out, a DHT lookup completes or
+        new checks are queued.
         """
         if self._should_stop:
             return
 
-        # >. Step 1: Perform all calls to the trackers
-        check_udp_session_list = self.check_not_initiated_sessions()
-
-        # >> Step 2: Handle timed out UDP sessions
-        self.check_timed_out_udp_session(check_udp_session_list)
-
-        # >> Step 3: Remove completed sessions and update tracker info
+        # >> Step 1: Remove completed sessions and update tracker info
         self.clean_completed_sessions()
 
-        # >> Step 4. check and update new results
+        # >> Step 2. check and update new results
         self.update_with_new_results()
 
-        self._logger.debug(u"total sessions: %d", len(self._session_list))
-        for session in self._session_list:
-            self._logger.debug(u"%s, finished: %d, failed: %d", session, session.is_finished, session.is_failed)
-
-        # process all pending request
+        # >> Step 3: process all pending requests and perform the calls to the new sessions
         self._process_pending_requests()
+        self.connect_new_sessions()
+
+        self._logger.debug(u"total sessions: %d", len(self._session_list))
 
-    def check_not_initiated_sessions(self):
+    def connect_new_sessions(self):
         """
-        Loops over all sessions and lets them connect to their tracker
-        if they haven't done so yet.
-        Returns a list of all active udp sessions as they need to be checked from
-        timeouts.
-        :return: A list of all udp sessions that are currently active
+        Lets the sessions that have not been initiated yet connect to their tracker. The DHT session is left out, as
+        it starts a lookup as soon as a check is added to it.
         """
-        check_udp_session_list = []
         for session in self._session_list:
-            if session.is_initiated:
-                if isinstance(session, UdpTrackerSession) and not session.is_finished:
-                    check_udp_session_list.append(session)
-                continue # pragma: no cover
-
-            self.session_connect_to_tracker(session)
-
-        return check_udp_session_list
+            if not session.is_initiated and not isinstance(session, FakeDHTSession):
+                self.session_connect_to_tracker(session)
 
     def session_connect_to_tracker(self, tracker_session):
         """
@@ -246,9 +283,49 @@ class TorrentChecker(TaskManager):
             if failure.check(CancelledError, ConnectingCancelledError) is None:
                 self._session.lm.tracker_manager.update_tracker_info(tracker_session.tracker_url, False)
 
+        def on_done(result):
+            self._schedule_check_sessions()
+            return result
+
         # Make the connection to the trackers and handle the response
         deferred = tracker_session.connect_to_tracker()
         deferred.addCallbacks(self._on_result_from_session, on_error)
+        deferred.addBoth(on_done)
+
+        # The session may have failed before it returned its deferred, so the deferred will never fire
+        if tracker_session.is_failed:
+            self._schedule_check_sessions()
+        elif isinstance(tracker_session, UdpTrackerSession):
+            self._schedule_session_timeout(tracker_session)
+
+    @staticmethod
+    def _get_session_timeout_task_name(tracker_session):
+        return u"torrent_checker session timeout %d" % id(tracker_session)
+
+    def _schedule_session_timeout(self, tracker_session):
+        """
+        Schedules the timeout check of a UDP session, retry_interval seconds after its last contact with the tracker.
+        """
+        task_name = self._get_session_timeout_task_name(tracker_session)
+        self.cancel_pending_task(task_name)
+
+        delay = max(tracker_session.last_contact + tracker_session.retry_interval() - time.time(), 0)
+        self.register_task(task_name, reactor.callLater(delay, self._check_session_timeout, tracker_session))
+
+    def _check_session_timeout(self, tracker_session):
+        """
+        Retries or fails a UDP session that has not heard from its tracker for retry_interval seconds.
+        """
+        if self._should_stop or tracker_session.is_finished or tracker_session.is_failed:
+            return
+
+        # the tracker responded in the meantime, wait for the next response
+        if time.time() - tracker_session.last_contact < tracker_session.retry_interval():
+            self._schedule_session_timeout(tracker_session)
+            return
+
+        self.check_timed_out_udp_session([tracker_session])
+        self._schedule_check_sessions()
 
     def check_timed_out_udp_session(self, udp_sessions):
         """
@@ -260,7 +337,7 @@ class TorrentChecker(TaskManager):
 
         for session in udp_sessions:
             diff = current_time - session.last_contact
-            if diff > session.retry_interval():
+            if diff >= session.retry_interval():
                 session._is_timed_out = True
 
                 for infohash in session.infohash_list:
@@ -289,6 +366,7 @@ class TorrentChecker(TaskManager):
 
                 if session.is_failed or session.is_finished:
                     self._logger.debug(u"%s is %s", session, u'failed' if session.is_failed else u'finished')
+                    self.cancel_pending_task(self._get_session_timeout_task_name(session))
 
                     # update tracker info
                     self._session.lm.tracker_manager.update_tracker_info(session.tracker_url, not session.is_failed)
@@ -317,17 +395,32 @@ class TorrentChecker(TaskManager):
 
     def _process_pending_requests(self):
         """
-        Processes all pending requests.
+        Processes the queued checks in order, adding them to the tracker sessions. A check that cannot be added yet,
+        as its tracker has no session that can take it and no new session can be created, stays queued without
+        holding up the checks on the other trackers.
         """
-        while len(self._pending_request_queue) > 0:
-            _, infohash, tracker_set = self._pending_request_queue.popleft()
-            for tracker_url in tracker_set:
-                self._create_session_for_request(infohash, tracker_url)
+        blocked_trackers = set()
+        remaining_checks = []
+        for check in sorted(self._check_queue):
+            _, _, infohash, tracker_url = check
+            if tracker_url in blocked_trackers or not self._create_session_for_request(infohash, tracker_url):
+                blocked_trackers.add(tracker_url)
+                remaining_checks.append(check)
+            else:
+                self._queued_checks.discard((infohash, tracker_url))
+
+        # a sorted list is a valid heap
+        self._check_queue = remaining_checks
 
     def _create_session_for_request(self, infohash, tracker_url):
+        """
+        Adds a check of a torrent to a session of the tracker, creating a new session if needed.
+        :return: False if there is no session that can take the check and no new session can be created, as too many
+        sessions are in flight. True otherwise.
+        """
         # skip no-DHT
         if tracker_url == u'no-DHT':
-            return
+            return True
 
         # >> Step 1: Try to append the request to an existing session
         # check there is any existing session that scrapes this torrent
@@ -351,7 +444,11 @@ class TorrentChecker(TaskManager):
 
         if request_handled:
             self._logger.debug(u'infohash [%s] appended', hexlify(infohash))
-            return
+            return True
+
+        # the DHT session has its own limit of lookups in flight, wait until one of them completes
+        if tracker_url == u'DHT':
+            return False
 
         # >> Step 2: No session to append to, create a new one
         # create a new session for this request
@@ -360,7 +457,10 @@ class TorrentChecker(TaskManager):
         if not self._session.lm.tracker_manager.should_check_tracker(tracker_url):
             self._logger.warn(u"skipping recently failed tracker %s by %d times", tracker_url,
                               self._session.lm.tracker_manager.get_tracker_info(tracker_url)['failures'])
-            return
+            return True
+
+        if self._get_num_active_sessions() >= self._max_concurrent_sessions:
+            return False
 
         session = create_tracker_session(tracker_url, self._on_result_from_session)
 
@@ -373,6 +473,7 @@ class TorrentChecker(TaskManager):
         self._update_pending_response(infohash)
 
         self._logger.debug(u"Session created for infohash %s", hexlify(infohash))
+        return True
 
     def _update_pending_response(self, infohash):
         if infohash in self._pending_response_dict:
@@ -385,6 +486,20 @@ class TorrentChecker(TaskManager):
                                                      u'leechers': -2,
                                                      u'updated': False}
 
+    def _on_dht_result(self, seed_leech_dict):
+        """
+        Handles the result of a DHT lookup. The DHT session never completes, so the torrent stops expecting a
+        response from it as soon as its lookup is done.
+        """
+        if self.should_stop:
+            return
+
+        self._on_result_from_session(seed_leech_dict)
+        for infohash in seed_leech_dict:
+            self._pending_response_dict[infohash][u'remaining_responses'] -= 1
+
+        self._schedule_check_sessions()
+
     def _on_result_from_session(self, seed_leech_dict):
         if self.should_stop:
             return
@@ -432,6 +547,7 @@ class TorrentChecker(TaskManager):
 
         # calculate next check time: <last-time> + <interval> * (2 ^ <retries>)
         next_check = last_check + self._torrent_check_retry_interval * (2 ** retries)
+        self._check_times.append(time.time())
 
         self._torrent_db.updateTorrentCheckResult(torrent_id,
                                                   infohash, seeders, leechers, last_check, next_check,
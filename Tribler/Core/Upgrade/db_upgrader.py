@@ -81,6 +81,10 @@ class DBUpgrader(object):
         if self.db.version == 27:
             self._upgrade_27_to_28()
 
+        # version 28 -> 29
+        if self.db.version == 28:
+            self._upgrade_28_to_29()
+
         # check if we managed to upgrade to the latest DB version.
         if self.db.version == LATEST_DB_VERSION:
             self.status_update_func(u"Database upgrade finished.")
@@ -517,6 +521,26 @@ DROP TABLE IF EXISTS MetaDataTypes;
         # update database version
         self.db.write_version(28)
 
+    def _upgrade_28_to_29(self):
+        self.status_update_func(u"Upgrading database from v%s to v%s..." % (28, 29))
+
+        # add the vocabulary of swarm name keywords
+        self.status_update_func(u"Creating SearchTerms table...")
+        self.db.execute(u"""
+CREATE TABLE IF NOT EXISTS SearchTerms (
+  term                  text            PRIMARY KEY,
+  frequency             integer         DEFAULT 0
+);
+""")
+        # the keywords of the torrents that are already in the database are added by the SuggestionIndex in the
+        # background, starting from the highest torrent id
+        populate_from = self.db.fetchone(u"SELECT max(torrent_id) FROM Torrent") or 0
+        self.db.execute(u"INSERT OR IGNORE INTO MyInfo (entry, value) VALUES ('search_terms_torrent_id', ?)",
+                        (populate_from,))
+
+        # update database version
+        self.db.write_version(29)
+
     def reimport_torrents(self):
         """Import all torrent files in the collected torrent dir, all the files already in the database will be ignored.
         """
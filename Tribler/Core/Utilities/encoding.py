@@ -1,4 +1,6 @@
 import logging
+import re
+from itertools import chain
 from json import dumps
 from urllib import unquote, urlencode
 from urlparse import urlparse, parse_qsl, ParseResult
@@ -160,11 +162,67 @@ def encode(data, version="a"):
     """
     assert isinstance(version, str)
     if version == "a":
-        return "a" + "".join(_a_encode_mapping[type(data)](data, _a_encode_mapping))
+        buf = bytearray("a")
+        _a_encode_into(buf, data)
+        return str(buf)
 
     raise ValueError("Unknown encode version")
 
 
+def _a_encode_into(buf, data):
+    """
+    Appends the version 'a' encoding of DATA to the bytearray BUF.
+
+    Produces exactly the same bytes as the _a_encode_* functions, but walks nested containers with an explicit stack
+    of iterators and writes every value straight into BUF, instead of building and joining a list of strings.
+    """
+    write = buf.extend
+    stack = [iter((data,))]
+    while stack:
+        for value in stack[-1]:
+            value_type = type(value)
+            if value_type is str:
+                write("%db" % len(value))
+                write(value)
+            elif value_type is unicode:
+                value = value.encode("UTF-8")
+                write("%ds" % len(value))
+                write(value)
+            elif value_type is int:
+                value = str(value)
+                write("%di%s" % (len(value), value))
+            elif value_type is tuple:
+                write("%dt" % len(value))
+                stack.append(iter(value))
+                break
+            elif value_type is list:
+                write("%dl" % len(value))
+                stack.append(iter(value))
+                break
+            elif value_type is dict:
+                write("%dd" % len(value))
+                stack.append(chain.from_iterable(sorted(value.items())))
+                break
+            elif value_type is bool:
+                write("0T" if value else "0F")
+            elif value is None:
+                write("0n")
+            elif value_type is long:
+                value = str(value)
+                write("%dJ%s" % (len(value), value))
+            elif value_type is float:
+                value = str(value)
+                write("%df%s" % (len(value), value))
+            elif value_type is set:
+                write("%dL" % len(value))
+                stack.append(iter(value))
+                break
+            else:
+                raise ValueError("Unable to encode value of type %s" % value_type)
+        else:
+            stack.pop()
+
+
 def _a_decode_int(stream, offset, count, _):
     """
     'a2i42',3,2 --> 5,42
@@ -318,6 +376,145 @@ _a_decode_mapping = {"i": _a_decode_int,
                      "F": _a_decode_false}
 
 
+class IncompleteStreamError(ValueError):
+    """
+    Raised when a stream ends before the value that is being decoded is complete. OFFSET is the position of the
+    first token that could not be decoded.
+    """
+
+    def __init__(self, message, offset):
+        super(IncompleteStreamError, self).__init__(message, offset)
+        self.offset = offset
+
+
+# every encoded value starts with a header: its length or number of items, followed by its type
+_a_token = re.compile(r"(\d+)([bsitldnTFJfL])").match
+_a_digits = re.compile(r"\d*").match
+# the (count, type, header length) of all headers with a count below 100, looked up by the header itself
+_a_headers = dict(("%d%s" % (count, kind), (count, kind, len(str(count)) + 1))
+                  for count in xrange(100) for kind in "bsitldnTFJfL")
+# the pending key of a dictionary while its next key has not been decoded yet
+_no_key = object()
+
+
+def _a_parse_header(stream, offset):
+    """
+    Parses a header that is not in _a_headers.
+    'a123b...',1 --> 123,'b',4
+    """
+    match = _a_token(stream, offset)
+    if match is None:
+        if _a_digits(stream, offset).end() == len(stream):
+            raise IncompleteStreamError("Stream ends in the header of a value", offset)
+        raise ValueError("Invalid header in stream", offset)
+    return int(match.group(1)), match.group(2), match.end() - offset
+
+
+def _a_decode_into(stream, offset, stack):
+    """
+    Decodes the version 'a' tokens in STREAM from OFFSET until the value that is being decoded is complete.
+
+    The decoder does not recurse and does not dispatch on the type of every value through a function call. Headers
+    are looked up in _a_headers rather than parsed digit by digit, and the container that is being filled is kept in
+    local variables, with the containers around it in STACK. A token is only consumed when it is available completely,
+    so when IncompleteStreamError is raised STACK and the offset of the exception describe where decoding can continue
+    once more data is available.
+
+    Returns the new offset and the decoded value.
+    """
+    headers = _a_headers
+    end = len(stream)
+    if stack:
+        container, append, remaining, kind, key = stack.pop()
+    else:
+        container, append, remaining, kind, key = None, None, 0, None, _no_key
+
+    try:
+        while True:
+            header = headers.get(stream[offset:offset + 2]) or headers.get(stream[offset:offset + 3]) or \
+                _a_parse_header(stream, offset)
+            count, value_kind, start = header
+            start += offset
+
+            if value_kind in "bsiJf":
+                stop = start + count
+                if stop > end:
+                    raise IncompleteStreamError("Stream ends in the payload of a value", offset)
+                value = stream[start:stop]
+                offset = stop
+                if value_kind == "s":
+                    value = value.decode("UTF-8")
+                elif value_kind == "i":
+                    value = int(value)
+                elif value_kind == "J":
+                    value = long(value)
+                elif value_kind == "f":
+                    value = float(value)
+
+            elif value_kind in "ltdL":
+                offset = start
+                if count:
+                    if kind is not None:
+                        stack.append((container, append, remaining, kind, key))
+                    if value_kind == "d":
+                        container = {}
+                        append = None
+                    elif value_kind == "L":
+                        container = set()
+                        append = None
+                    else:
+                        container = []
+                        append = container.append
+                    remaining = count
+                    kind = value_kind
+                    key = _no_key
+                    continue
+                value = () if value_kind == "t" else set() if value_kind == "L" else {} if value_kind == "d" else []
+
+            else:
+                if count:
+                    raise ValueError("Invalid length for a constant", offset)
+                offset = start
+                value = None if value_kind == "n" else value_kind == "T"
+
+            # add the value to the container, and the containers that are complete now to theirs
+            while True:
+                if append is not None:
+                    append(value)
+                elif kind == "d":
+                    if key is _no_key:
+                        key = value
+                        break
+                    try:
+                        if key in container:
+                            raise ValueError("Duplicate key in dictionary")
+                    except TypeError:
+                        raise ValueError("Unhashable key in dictionary")
+                    container[key] = value
+                    key = _no_key
+                elif kind == "L":
+                    try:
+                        container.add(value)
+                    except TypeError:
+                        raise ValueError("Unhashable item in set")
+                else:
+                    return offset, value
+
+                remaining -= 1
+                if remaining:
+                    break
+                value = tuple(container) if kind == "t" else container
+                if stack:
+                    container, append, remaining, kind, key = stack.pop()
+                else:
+                    return offset, value
+
+    except IncompleteStreamError:
+        if kind is not None:
+            stack.append((container, append, remaining, kind, key))
+        raise
+
+
 def decode(stream, offset=0):
     """
     Decode STREAM from index OFFSET and further into a python data
@@ -325,19 +522,77 @@ def decode(stream, offset=0):
 
     Returns the new OFFSET of the stream and the decoded data.
 
-    Only version 'a' decoding is supported.  This version is
-    indicated by the first byte in the binary STREAM.
+    STREAM can be a string, a buffer or a memoryview.  Only version
+    'a' decoding is supported.  This version is indicated by the
+    first byte in the binary STREAM.
     """
-    assert isinstance(stream, bytes), "STREAM has invalid type: %s" % type(stream)
+    if isinstance(stream, memoryview):
+        stream = stream.tobytes()
+    assert isinstance(stream, (bytes, buffer)), "STREAM has invalid type: %s" % type(stream)
     assert isinstance(offset, int), "OFFSET has invalid type: %s" % type(offset)
+    if offset >= len(stream):
+        raise IncompleteStreamError("Stream ends before the version", offset)
     if stream[offset] == "a":
-        index = offset + 1
-        while 48 <= ord(stream[index]) <= 57:
-            index += 1
-        return _a_decode_mapping[stream[index]](stream, index + 1, int(stream[offset + 1:index]), _a_decode_mapping)
+        return _a_decode_into(stream, offset + 1, [])
 
     raise ValueError("Unknown version found")
 
+
+class StreamDecoder(object):
+    """
+    Incrementally decodes a stream of encoded values, for instance as it is received from a socket.
+
+    Feed the data to the decoder as it arrives, every call returns the values that were completed by it. Partially
+    received values are not decoded again, decoding continues where the previous call stopped.
+    """
+
+    def __init__(self):
+        self._data = ""
+        self._offset = 0
+        self._stack = []
+        self._in_value = False
+
+    @property
+    def pending(self):
+        """
+        The number of bytes of the stream that have not been decoded yet.
+        """
+        return len(self._data) - self._offset
+
+    def feed(self, data):
+        """
+        Adds DATA to the stream and returns a list with the values that are complete now.
+
+        Raises ValueError when the stream is invalid, after which the decoder should not be used anymore.
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        elif isinstance(data, buffer):
+            data = str(data)
+        self._data = self._data[self._offset:] + data if self._offset else self._data + data
+        self._offset = 0
+
+        values = []
+        data = self._data
+        end = len(data)
+        while self._offset < end:
+            if not self._in_value:
+                if data[self._offset] != "a":
+                    raise ValueError("Unknown version found")
+                self._offset += 1
+                self._in_value = True
+
+            try:
+                self._offset, value = _a_decode_into(data, self._offset, self._stack)
+            except IncompleteStreamError as exception:
+                self._offset = exception.offset
+                break
+            values.append(value)
+            self._in_value = False
+
+        return values
+
+
 def add_url_params(url, params):
     """ Add GET params to provided URL being aware of existing.
 
@@ -52,13 +52,13 @@ class VideoPlayer(object):
         self.player_in = None
 
     def shutdown(self):
-        if self.videoserver:
-            self.videoserver.shutdown()
-            self.videoserver.server_close()
         if self.vlcwrap:
             self.vlcwrap.shutdown()
             self.vlcwrap = None
+        # the streams are stopped first, so the download is no longer streaming when it is set back to normal mode
+        deferred = self.videoserver.shutdown() if self.videoserver else None
         self.set_vod_download(None)
+        return deferred
 
     def get_vlcwrap(self):
         return self.vlcwrap
@@ -129,7 +129,7 @@ class VideoPlayer(object):
         return self.vod_download
 
     def set_vod_download(self, download):
-        if self.vod_download:
+        if self.vod_download and not self.videoserver.is_streaming(self.vod_download):
             self.vod_download.set_mode(DLMODE_NORMAL)
             vi_dict = self.vod_info.pop(self.vod_download.get_def().get_infohash(), None)
             if vi_dict and 'stream' in vi_dict:
@@ -2,21 +2,34 @@
 # Based on SimpleServer written by Jan David Mol, Arno Bakker
 # see LICENSE.txt for license information
 #
-import socket
 import logging
 import mimetypes
-
-from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-from SocketServer import ThreadingMixIn
-from threading import Event, Thread
-from traceback import print_exc
+import os
 from binascii import unhexlify
+
 from cherrypy.lib.httputil import get_ranges
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.interfaces import IPushProducer
+from twisted.web import server, resource
+from zope.interface import implementer
 
+from Tribler.Core.Libtorrent.LibtorrentDownloadImpl import VODFile
 from Tribler.Core.simpledefs import DLMODE_VOD
+from Tribler.dispersy.util import blocking_call_on_reactor_thread
+
+
+# the largest number of bytes that is written to a client at once
+STREAM_BLOCK_SIZE = 64 * 1024
+# how long to wait before checking again for a file or a piece, in case we missed the notification
+STREAM_RETRY_INTERVAL = 1.0
 
 
-class VideoServer(ThreadingMixIn, HTTPServer):
+class VideoServer(object):
+    """
+    HTTP server that streams the files of downloads to video players. Every request gets its own stream, so several
+    clients can play several downloads and files at the same time.
+    """
 
     def __init__(self, port, session, video_player):
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -26,145 +39,211 @@ class VideoServer(ThreadingMixIn, HTTPServer):
 
         self.videoplayer = video_player
 
-        HTTPServer.__init__(self, ("127.0.0.1", self.port), VideoRequestHandler)
-
-        self.server_thread = None
-
-        self.daemon_threads = True
-        self.allow_reuse_address = True
+        self.listening_port = None
+        self.producers = set()
 
+    @blocking_call_on_reactor_thread
     def start(self):
-        self.server_thread = Thread(target=self.serve_forever, name="VideoHTTPServerThread-1")
-        self.server_thread.setDaemon(True)
-        self.server_thread.start()
+        site = server.Site(VideoRequestResource(self))
+        self.listening_port = reactor.listenTCP(self.port, site, interface="127.0.0.1")
 
-    def process_request_thread(self, request, client_address):
-        try:
-            self.finish_request(request, client_address)
-            self.close_request(request)
-        except socket.error:
-            pass
-        except Exception:
-            print_exc()
+    def shutdown(self):
+        """
+        Stops all streams and the server, and returns a deferred that fires when the server has shut down.
+        """
+        for producer in list(self.producers):
+            producer.stopProducing()
+        return maybeDeferred(self.listening_port.stopListening)
+
+    def is_streaming(self, download):
+        return any(producer.download == download for producer in self.producers)
 
 
-class VideoRequestHandler(BaseHTTPRequestHandler):
+class VideoRequestResource(resource.Resource):
+    """
+    Serves requests for /<infohash>/<fileindex>, optionally for a single byte range.
+    """
 
-    def __init__(self, request, client_address, server):
-        self._logger = server._logger
-        self.videoplayer = server.videoplayer
-        self.event = None
-        BaseHTTPRequestHandler.__init__(self, request, client_address, server)
+    isLeaf = True
 
-    def log_message(self, f, *args):
-        pass
+    def __init__(self, video_server):
+        resource.Resource.__init__(self)
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.video_server = video_server
+        self.session = video_server.session
+        self.videoplayer = video_server.videoplayer
 
-    def do_GET(self):
-        if self.request_version == 'HTTP/1.1':
-            self.protocol_version = 'HTTP/1.1'
+    def render_GET(self, request):
+        self._logger.debug("VOD request %s %s", request.getClientIP(), request.path)
 
-        self._logger.debug("VOD request %s %s", self.client_address, self.path)
-        downloadhash, fileindex = self.path.strip('/').split('/')
-        downloadhash = unhexlify(downloadhash)
-        download = self.server.session.get_download(downloadhash)
+        parts = request.path.strip('/').split('/')
+        try:
+            downloadhash, fileindex = unhexlify(parts[0]), parts[1]
+        except (TypeError, IndexError):
+            return self.render_error(request, 404, "Not Found")
+        download = self.session.get_download(downloadhash) if len(parts) == 2 else None
 
         if not download or not fileindex.isdigit() or int(fileindex) > len(download.get_def().get_files()):
-            self.send_error(404, "Not Found")
-            return
+            return self.render_error(request, 404, "Not Found")
 
         fileindex = int(fileindex)
         filename, length = download.get_def().get_files_as_unicode_with_length()[fileindex]
 
-        requested_range = get_ranges(self.headers.getheader('range'), length)
+        requested_range = get_ranges(request.getHeader('range'), length)
         if requested_range is not None and len(requested_range) != 1:
-            self.send_error(416, "Requested Range Not Satisfiable")
-            return
+            return self.render_error(request, 416, "Requested Range Not Satisfiable")
 
-        has_changed = self.videoplayer.get_vod_fileindex() != fileindex or\
-            self.videoplayer.get_vod_download() != download
-        if has_changed:
-            # Notify the videoplayer (which will put the old VOD download back in normal mode).
-            self.videoplayer.set_vod_fileindex(fileindex)
-            self.videoplayer.set_vod_download(download)
-
-            # Put download in sequential mode + trigger initial buffering.
+        if (download.get_mode() != DLMODE_VOD or download.get_vod_fileindex() != fileindex) and \
+                not self.video_server.is_streaming(download):
+            # Put download in sequential mode + trigger initial buffering. While another file of the download is being
+            # streamed we leave the file selection alone, the readahead deadlines of the stream still fetch its pieces.
             if download.get_def().is_multifile_torrent():
                 download.set_selected_files([filename])
             download.set_mode(DLMODE_VOD)
             download.restart()
 
-        piecelen = download.get_def().get_piece_length()
-        blocksize = piecelen
+        if self.videoplayer.get_vod_fileindex() != fileindex or self.videoplayer.get_vod_download() != download:
+            # Notify the videoplayer, which puts the old VOD download back in normal mode unless it is still streamed.
+            self.videoplayer.set_vod_fileindex(fileindex)
+            self.videoplayer.set_vod_download(download)
 
         if requested_range is not None:
             firstbyte, lastbyte = requested_range[0]
             nbytes2send = lastbyte - firstbyte
-            self.send_response(206)
-            self.send_header('Content-Range', 'bytes %d-%d/%d' % (firstbyte, lastbyte - 1, length))
+            request.setResponseCode(206)
+            request.setHeader('Content-Range', 'bytes %d-%d/%d' % (firstbyte, lastbyte - 1, length))
         else:
             firstbyte = 0
             nbytes2send = length
-            self.send_response(200)
 
         self._logger.debug("requested range %d - %d", firstbyte, firstbyte + nbytes2send)
 
         mimetype = mimetypes.guess_type(filename)[0]
         if mimetype:
-            self.send_header('Content-Type', mimetype)
-        self.send_header('Accept-Ranges', 'bytes')
+            request.setHeader('Content-Type', mimetype)
+        request.setHeader('Accept-Ranges', 'bytes')
+        request.setHeader('Content-Length', str(nbytes2send))
+
+        if request.method == 'HEAD':
+            return ''
 
-        if length is not None:
-            self.send_header('Content-Length', nbytes2send)
+        if download.get_def().is_multifile_torrent():
+            path = os.path.join(download.get_content_dest(), filename)
         else:
-            self.send_header('Transfer-Encoding', 'chunked')
+            path = download.get_content_dest()
+
+        producer = VODStreamProducer(self.video_server, request, download, fileindex, path, firstbyte, nbytes2send)
+        producer.start()
+        return server.NOT_DONE_YET
+
+    def render_error(self, request, code, message):
+        request.setResponseCode(code)
+        request.setHeader('Content-Type', 'text/plain')
+        return message
+
+
+@implementer(IPushProducer)
+class VODStreamProducer(object):
+    """
+    Streams a byte range of a file in a download to a single client. Data is written as soon as the pieces it is in
+    have been downloaded, and the transport of the client pauses the producer when its buffers are full.
+    """
+
+    def __init__(self, video_server, request, download, fileindex, path, firstbyte, length):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.video_server = video_server
+        self.request = request
+        self.download = download
+        self.fileindex = fileindex
+        self.path = path
 
-        if self.request_version == 'HTTP/1.1' and self.headers.get('Connection', '').lower() != 'close':
-            self.send_header('Connection', 'Keep-Alive')
-            self.send_header('Keep-Alive', 'timeout=300, max=1')
+        self.position = firstbyte
+        self.remaining = length
 
-        self.end_headers()
+        self.stream = None
+        self.paused = False
+        self.stopped = False
+        self.retry_call = None
 
-        if has_changed:
-            self.wait_for_buffer(download)
+    def start(self):
+        self.video_server.producers.add(self)
+        self.request.notifyFinish().addErrback(lambda _: self.stopProducing())
+        self.request.registerProducer(self, True)
+        self.open_stream()
+
+    def open_stream(self):
+        self.retry_call = None
+        if self.stopped:
+            return
 
-        stream, lock = self.videoplayer.get_vod_stream(downloadhash, wait=True)
+        # the file is created by libtorrent after the download has (re)started
+        if not self.download.handle or not os.path.exists(self.path):
+            self.retry_call = reactor.callLater(STREAM_RETRY_INTERVAL, self.open_stream)
+            return
 
-        with lock:
-            if stream.closed:
+        self.stream = VODFile(open(self.path, 'rb'), self.download, fileindex=self.fileindex, shared=True)
+        self.stream.seek(self.position)
+        self.write_available()
+
+    def write_available(self):
+        """
+        Writes the data that is available at the current position, until the client pauses us or we run into a piece
+        that has not been downloaded yet.
+        """
+        self.cancel_wait()
+
+        while self.remaining > 0 and not self.paused and not self.stopped:
+            readable = self.stream.get_readable_bytes(self.position, min(self.remaining, STREAM_BLOCK_SIZE))
+            if not readable:
+                self.download.piece_finished_callbacks.add(self.on_piece_finished)
+                self.retry_call = reactor.callLater(STREAM_RETRY_INTERVAL, self.write_available)
                 return
 
-            stream.seek(firstbyte)
-            nbyteswritten = 0
-            while True:
-                data = stream.read(blocksize)
-
-                if len(data) == 0:
-                    break
-                elif length is not None and nbyteswritten + len(data) > nbytes2send:
-                    endlen = nbytes2send - nbyteswritten
-                    if endlen != 0:
-                        self.wfile.write(data[:endlen])
-                        nbyteswritten += endlen
-                    break
-                else:
-                    self.wfile.write(data)
-                    nbyteswritten += len(data)
-
-            if nbyteswritten != nbytes2send:
-                self._logger.error("sent wrong amount, wanted %s got %s", nbytes2send, nbyteswritten)
-
-            if not requested_range:
-                stream.close()
-
-    def wait_for_buffer(self, download):
-        self.event = Event()
-
-        def wait_for_buffer(ds):
-            if download.vod_seekpos is None or download != self.videoplayer.get_vod_download()\
-                    or ds.get_vod_prebuffering_progress() == 1.0:
-                self.event.set()
-                return 0, False
-            return 1.0, False
-        download.set_state_callback(wait_for_buffer)
-        self.event.wait()
-        self.event.clear()
+            data = self.stream.read(readable)
+            if not data:
+                self._logger.error("file %s ended at %s, %s bytes short", self.path, self.position, self.remaining)
+                break
+
+            self.position += len(data)
+            self.remaining -= len(data)
+            self.request.write(data)
+
+        if not self.paused and not self.stopped:
+            self.request.unregisterProducer()
+            self.request.finish()
+            self.close()
+
+    def on_piece_finished(self):
+        # the alerts are processed while holding the lock of the download, write after they have been processed
+        self.download.piece_finished_callbacks.discard(self.on_piece_finished)
+        if not self.retry_call or not self.retry_call.active():
+            return
+        self.retry_call.reset(0)
+
+    def cancel_wait(self):
+        self.download.piece_finished_callbacks.discard(self.on_piece_finished)
+        if self.retry_call and self.retry_call.active():
+            self.retry_call.cancel()
+        self.retry_call = None
+
+    def close(self):
+        self.stopped = True
+        self.cancel_wait()
+        if self.stream:
+            self.stream.close()
+        self.video_server.producers.discard(self)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        if not self.paused or self.stopped:
+            return
+        self.paused = False
+        if self.stream and not self.retry_call:
+            self.write_available()
+
+    def stopProducing(self):
+        if not self.stopped:
+            self._logger.debug("client stopped streaming %s at %s", self.path, self.position)
+            self.close()
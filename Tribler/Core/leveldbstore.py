@@ -33,8 +33,9 @@
 #
 
 # Code:
-from collections import MutableMapping
+from collections import MutableMapping, OrderedDict
 from itertools import chain
+import logging
 import os
 
 
@@ -64,9 +65,16 @@ from Tribler.dispersy.taskmanager import TaskManager
 
 
 WRITEBACK_PERIOD = 120
+# The pending writes are also flushed as soon as there are this many of them, or they take this many bytes
+WRITEBACK_MAX_ITEMS = 100
+WRITEBACK_MAX_BYTES = 4 * 1024 * 1024
 
-# TODO(emilon): Make sure the caching makes an actual difference in IO and kill
-# it if it doesn't as it complicates the code.
+# The maximum size of the values in the read cache
+READ_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# The number of keys is kept in this file while the store is closed. It is removed when the store is opened, so that
+# the keys are counted again if Tribler does not shut down cleanly.
+KEY_COUNT_FILENAME = u"KEYCOUNT"
 
 
 class LevelDbStore(MutableMapping, TaskManager):
@@ -76,9 +84,17 @@ class LevelDbStore(MutableMapping, TaskManager):
 
     def __init__(self, store_dir):
         super(LevelDbStore, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
 
         self._store_dir = store_dir
         self._pending_torrents = {}
+        self._pending_bytes = 0
+        self._read_cache = OrderedDict()
+        self._read_cache_bytes = 0
+        self._key_count = self._read_key_count()
+        self._statistics = {u'hits': 0, u'misses': 0, u'flushes': 0, u'flushed_items': 0, u'flushed_bytes': 0,
+                            u'last_flush_items': 0, u'last_flush_bytes': 0}
+
         # This is done to work around LevelDB's inability to deal with non-ascii
         # paths on windows.
         self._db = self._leveldb(os.path.relpath(store_dir, os.getcwdu()))
@@ -91,39 +107,107 @@ class LevelDbStore(MutableMapping, TaskManager):
         try:
             return self._pending_torrents[key]
         except KeyError:
-            return self._db.Get(key)
+            pass
+
+        try:
+            value = self._read_cache.pop(key)
+            self._statistics[u'hits'] += 1
+        except KeyError:
+            value = self._db.Get(key)
+            self._statistics[u'misses'] += 1
+            self._read_cache_bytes += len(value)
+            self._evict_read_cache()
+
+        # (Re)insert the value as the most recently used one
+        self._read_cache[key] = value
+        return value
 
     def __setitem__(self, key, value):
+        if self._key_count is not None and not self._has_key(key):
+            self._key_count += 1
+
+        self._pending_bytes += len(value) - len(self._pending_torrents.get(key, ""))
         self._pending_torrents[key] = value
-        # self._db.Put(key, value)
+        self._discard_from_read_cache(key)
+
+        if len(self._pending_torrents) >= WRITEBACK_MAX_ITEMS or self._pending_bytes >= WRITEBACK_MAX_BYTES:
+            self.flush()
 
     def __delitem__(self, key):
+        if self._key_count is not None and self._has_key(key):
+            self._key_count -= 1
+
         if key in self._pending_torrents:
-            self._pending_torrents.pop(key)
+            self._pending_bytes -= len(self._pending_torrents.pop(key))
+        self._discard_from_read_cache(key)
         self._db.Delete(key)
 
     def __iter__(self):
         for k in self._pending_torrents.iterkeys():
             yield k
-        for k, _ in self._db.RangeIter():
-            yield k
+        for k in self._db.RangeIter(include_value=False):
+            if k not in self._pending_torrents:
+                yield k
 
     def __contains__(self, key):
-        if key in self._pending_torrents:
-            return True
-        try:
-            self.__getitem__(key)
+        return self._has_key(key)
+
+    def __len__(self):
+        if self._key_count is None:
+            self._logger.info(u"Counting the keys in %s", self._store_dir)
+            self._key_count = len(self._pending_torrents) + \
+                sum(1 for k in self._db.RangeIter(include_value=False) if k not in self._pending_torrents)
+        return self._key_count
+
+    def _has_key(self, key):
+        """
+        Checks whether key is in the store, without reading its value from the database.
+        """
+        if key in self._pending_torrents or key in self._read_cache:
             return True
-        except KeyError:
-            pass
 
+        for k in self._db.RangeIter(key_from=key, include_value=False):
+            return k == key
         return False
 
-    def __len__(self):
-        return len(self._pending_torrents) + len(list(self.keys()))
+    def _discard_from_read_cache(self, key):
+        if key in self._read_cache:
+            self._read_cache_bytes -= len(self._read_cache.pop(key))
+
+    def _evict_read_cache(self):
+        while self._read_cache_bytes > READ_CACHE_MAX_BYTES and self._read_cache:
+            _, value = self._read_cache.popitem(last=False)
+            self._read_cache_bytes -= len(value)
+
+    def _get_key_count_path(self):
+        return os.path.join(self._store_dir, KEY_COUNT_FILENAME)
+
+    def _read_key_count(self):
+        key_count_path = self._get_key_count_path()
+        if not os.path.exists(key_count_path):
+            return None
+
+        try:
+            with open(key_count_path, 'r') as key_count_file:
+                return int(key_count_file.read())
+        except (IOError, ValueError) as e:
+            self._logger.warning(u"Could not read the key count of %s: %s", self._store_dir, e)
+            return None
+        finally:
+            os.remove(key_count_path)
+
+    def _write_key_count(self):
+        if self._key_count is None:
+            return
+
+        try:
+            with open(self._get_key_count_path(), 'w') as key_count_file:
+                key_count_file.write(str(self._key_count))
+        except IOError as e:
+            self._logger.warning(u"Could not write the key count of %s: %s", self._store_dir, e)
 
     def keys(self):
-        return [k for k, _ in self._db.RangeIter()]
+        return list(self)
 
     def iteritems(self):
         return chain(self._pending_torrents, self._db.RangeIter())
@@ -144,12 +228,36 @@ class LevelDbStore(MutableMapping, TaskManager):
             write_batch = self._writebatch(self._db)
             for k, v in self._pending_torrents.iteritems():
                 write_batch.Put(k, v)
+
+            self._statistics[u'flushes'] += 1
+            self._statistics[u'flushed_items'] += len(self._pending_torrents)
+            self._statistics[u'flushed_bytes'] += self._pending_bytes
+            self._statistics[u'last_flush_items'] = len(self._pending_torrents)
+            self._statistics[u'last_flush_bytes'] = self._pending_bytes
+
             self._pending_torrents.clear()
+            self._pending_bytes = 0
             return self._db.Write(write_batch)
 
+    def get_statistics(self):
+        """
+        Returns the statistics of the read cache and the flushes of pending writes.
+        """
+        statistics = dict(self._statistics)
+        lookups = statistics[u'hits'] + statistics[u'misses']
+        statistics[u'hit_rate'] = statistics[u'hits'] / float(lookups) if lookups else 0.0
+        statistics[u'read_cache_items'] = len(self._read_cache)
+        statistics[u'read_cache_bytes'] = self._read_cache_bytes
+        statistics[u'pending_items'] = len(self._pending_torrents)
+        statistics[u'pending_bytes'] = self._pending_bytes
+        return statistics
+
     def close(self):
         self.cancel_all_pending_tasks()
         self.flush()
+        self._write_key_count()
+        self._read_cache.clear()
+        self._read_cache_bytes = 0
         self._db = None
 
 
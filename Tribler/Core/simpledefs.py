@@ -94,6 +94,7 @@ NTFY_TRIBLER = 'tribler'  # notifications regarding Tribler in general
 NTFY_DISPERSY = 'dispersy'  # an notification regarding dispersy
 NTFY_WATCH_FOLDER_CORRUPT_TORRENT = 'corrupt_torrent'  # a corrupt torrent has been found in the watch folder
 NTFY_NEW_VERSION = 'newversion' # a new version of Tribler is available
+NTFY_CHECKPOINT_RESUME = 'checkpointresume'  # progress of resuming the downloads in the checkpoint
 
 # changeTypes
 NTFY_UPDATE = 'update'  # data is updated
@@ -44,6 +44,25 @@ class TriblerCategoryTest(AbstractServer):
                         "announce-list": ["http://tracker.org"], "comment": "lorem ipsum"}
         self.assertEquals(cat.calculateCategory(torrent_info, "my torrent"), 'xxx')
 
+    def test_calculate_category_keywords(self):
+        cat = Category.getInstance(install_dir=self.CATEGORY_TEST_DATA_DIR)
+        self.assertEquals(cat.calculateCategoryNonDict([("file.dat", 100)], "My DivX Movie", "", None), 'Video')
+        self.assertEquals(cat.calculateCategoryNonDict([("My.XviD.Movie.dat", 100)], "my movie", "", None), 'Video')
+        self.assertEquals(cat.calculateCategoryNonDict([("movie.AVI", 100)], "my movie", "", None), 'Video')
+        self.assertEquals(cat.calculateCategoryNonDict([("file.dat", 100)], "my divxmovie", "", None), 'other')
+
+    def test_judge(self):
+        cat = Category.getInstance(install_dir=self.CATEGORY_TEST_DATA_DIR)
+        video = next(category for category in cat.category_info if category['name'] == 'Video')
+        self.assertEquals(cat.judge(video, [("movie.avi", 100), ("readme.txt", 100)]), (True, 0.5))
+        self.assertEquals(cat.judge(video, [("movie.avi", 1), ("readme.txt", 100)]), (False, 0))
+
+    def test_calculate_categories(self):
+        cat = Category.getInstance(install_dir=self.CATEGORY_TEST_DATA_DIR)
+        torrents = [({"info": {"name": "term1", "length": 1234}}, "my torrent"),
+                    ({"info": {"name": "my_torrent", "length": 1234}}, "my torrent")]
+        self.assertEquals(cat.calculate_categories(torrents), ['xxx', 'other'])
+
     def test_get_family_filter_sql(self):
         cat = Category.getInstance(install_dir=self.CATEGORY_TEST_DATA_DIR)
         self.assertFalse(cat.get_family_filter_sql())
@@ -28,6 +28,27 @@ class TriblerCategoryTestFamilyFilter(AbstractServer):
         self.assertTrue(family_filter.isXXXTerm("term1s"))
         self.assertFalse(family_filter.isXXXTerm("term0n"))
 
+    def test_xxx_term_forms(self):
+        family_filter = XXXFilter(self.CATEGORY_TEST_DATA_DIR)
+        for term in ["term1", "term1es", "term1s", "term1n", "term2es"]:
+            self.assertIn(term, family_filter.xxx_term_forms)
+        self.assertNotIn("term0s", family_filter.xxx_term_forms)
+        self.assertNotIn("term3", family_filter.xxx_term_forms)
+
+    def test_is_xxx_tokens(self):
+        family_filter = XXXFilter(self.CATEGORY_TEST_DATA_DIR)
+        for s in ["Term1", "my term2s.avi", "mytorrent", "a term3 b", "term0es"]:
+            self.assertEqual(family_filter.is_xxx_tokens(*family_filter.tokenize(s)), family_filter.isXXX(s))
+        self.assertEqual(family_filter.tokenize("My Term1.avi"), ("my term1.avi", ["my", "term1", "avi"]))
+
+    def test_filter_torrent_tokenized(self):
+        family_filter = XXXFilter(self.CATEGORY_TEST_DATA_DIR)
+        files_list = [("file1.txt", 1), ("term1.txt", 1)]
+        tokenized_files = [family_filter.tokenize(name) for name, _ in files_list]
+        self.assertTrue(family_filter.isXXXTorrent(files_list, "mytorrent", "", tokenized_files=tokenized_files))
+        self.assertFalse(family_filter.isXXXTorrent(files_list[:1], "mytorrent", "",
+                                                    tokenized_files=tokenized_files[:1]))
+
     def test_invalid_filename_exception(self):
         family_filter = XXXFilter(self.CATEGORY_TEST_DATA_DIR)
         terms, searchterms = family_filter.initTerms("thisfiledoesnotexist.txt")
@@ -32,6 +32,20 @@ class TestBarterStatistics(AbstractServer):
         assert len(self.stats.bartercast[BartercastStatisticTypes.TUNNELS_EXIT_BYTES_SENT]) == 1
         assert self.stats.bartercast[BartercastStatisticTypes.TUNNELS_EXIT_BYTES_SENT][self._peer1] == 1
 
+    def test_inc_bartercast_address(self):
+        self.stats.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_BYTES_SENT, ("1.2.3.4", 5), 5)
+        self.stats.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_BYTES_SENT, ("1.2.3.4", 5), 5)
+        assert len(self.stats.bartercast[BartercastStatisticTypes.TUNNELS_BYTES_SENT]) == 0
+        self.stats.flush_pending()
+        assert self.stats.bartercast[BartercastStatisticTypes.TUNNELS_BYTES_SENT]["1.2.3.4:5"] == 10
+        self.stats.flush_pending()
+        assert self.stats.bartercast[BartercastStatisticTypes.TUNNELS_BYTES_SENT]["1.2.3.4:5"] == 10
+
+    def test_get_top_n_bartercast_statistics_pending(self):
+        self.stats.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_BYTES_SENT, ("1.2.3.4", 5), 5)
+        top1 = self.stats.get_top_n_bartercast_statistics(BartercastStatisticTypes.TUNNELS_BYTES_SENT, 1)
+        assert top1 == [("1.2.3.4:5", 5)]
+
     def test_get_top_n_bartercast_statistics(self):
         self.stats.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED, self._peer1, 5)
         self.stats.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED, self._peer2, 5)
@@ -74,6 +88,16 @@ class TestBarterStatistics(AbstractServer):
         self.stats.load_statistics(self.dispersy)
         assert len(self.stats.bartercast[BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED]) == 5
 
+    @blocking_call_on_reactor_thread
+    def test_persist_changed(self):
+        self.stats.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED, self._peer1, 5)
+        self.stats.persist(self.dispersy, 1)
+        self.stats.db.execute(u"DELETE FROM statistic")
+        self.stats.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED, self._peer2, 5)
+        self.stats.persist(self.dispersy, 1)
+        records = self.stats.db.execute(u"SELECT peer FROM statistic").fetchall()
+        assert records == [(self._peer2,)]
+
     @blocking_call_on_reactor_thread
     def test_log_interaction(self):
         self.stats.log_interaction(self.dispersy, BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED,
@@ -1,16 +1,19 @@
 """
 This file contains the tests for the community.py for MultiChain community.
 """
+import time
 from unittest.case import skip
 
 from nose.tools import raises
 
 from Tribler.Core.Session import Session
 from Tribler.community.multichain.community import (MultiChainCommunity, MultiChainCommunityCrawler, CRAWL_REQUEST,
-                                                    CRAWL_RESPONSE, CRAWL_RESUME)
+                                                    CRAWL_RESPONSE, CRAWL_RESUME, CRAWL_FRONTIER_TIMEOUT)
 from Tribler.community.multichain.conversion import EMPTY_HASH
 from Tribler.community.tunnel.routing import Circuit, RelayRoute
 from Tribler.community.tunnel.tunnel_community import TunnelExitSocket
+from Tribler.Test.Community.Multichain.test_multichain_utilities import TestBlock
+from Tribler.Test.Core.base_test import MockObject
 from Tribler.Test.test_as_server import AbstractServer
 from Tribler.dispersy.tests.dispersytestclass import DispersyTestFunc
 from Tribler.dispersy.util import blocking_call_on_reactor_thread
@@ -498,6 +501,43 @@ class TestMultiChainCommunity(AbstractServer, DispersyTestFunc):
         self.assertBlocksInDatabase(crawler, 2)
         self.assertBlocksAreEqual(node, crawler)
 
+    def test_check_chain_links(self):
+        """
+        Test that crawled blocks that do not link up with the block before them in the chain are dropped.
+        """
+        # Arrange
+        node, = self.create_nodes(1)
+        blocks = [TestBlock(), TestBlock(), TestBlock()]
+        public_key = blocks[0].public_key_requester
+        for sequence_number, block in enumerate(blocks, 10):
+            block.public_key_requester = public_key
+            block.sequence_number_requester = sequence_number
+        blocks[1].previous_hash_requester = blocks[0].hash_requester
+        message = MockObject()
+        message.authentication = MockObject()
+        message.authentication.member = MockObject()
+        message.authentication.member.public_key = public_key
+        message.authentication.member.mid = "mid"
+        # Act
+        result = node.call(node.community._check_chain_links, [(block, message) for block in blocks])
+        # Assert
+        # The block before the first block is unknown, the third block does not link up with the second block
+        self.assertEqual(blocks[:2], [block for block, _ in result])
+
+    def test_prune_crawl_frontier(self):
+        """
+        Test that the crawls of nodes from which no blocks were requested for a while are forgotten.
+        """
+        # Arrange
+        node, = self.create_nodes(1)
+        node.community._crawl_frontier["done"] = (500, time.time() - CRAWL_FRONTIER_TIMEOUT - 1)
+        node.community._crawl_frontier["active"] = (300, time.time())
+        # Act & Assert
+        self.assertEqual(-1, node.community._get_crawl_frontier("done"))
+        self.assertEqual(300, node.community._get_crawl_frontier("active"))
+        node.community._prune_crawl_frontier()
+        self.assertEqual(["active"], node.community._crawl_frontier.keys())
+
     def test_crawler_on_introduction_received(self):
         """
         Test the crawler takes a step when an introduction is made by the walker
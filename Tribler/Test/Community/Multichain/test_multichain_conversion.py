@@ -177,6 +177,43 @@ class TestConversion(MultiChainTestCase):
             # Remove a bit of message.
             self.converter._decode_crawl_response(TestPlaceholder(meta), 0, encoded_message[:-10])[1]
 
+    def test_encoding_decoding_crawl_resume(self):
+        """
+        Test if a responder can send a crawl resume message with the sequence number to continue at.
+        """
+        # Arrange
+        meta = self.community.get_meta_message(CRAWL_RESUME)
+        requested_sequence_number = 500
+        message = meta.impl(distribution=(self.community.claim_global_time(),),
+                            payload=(requested_sequence_number,))
+        # Act
+        encoded_message = self.converter._encode_crawl_resume(message)[0]
+        result = self.converter._decode_crawl_resume(TestPlaceholder(meta), 0, encoded_message)[1]
+        # Assert
+        self.assertEqual(requested_sequence_number, result.requested_sequence_number)
+
+    def test_decoding_crawl_resume_without_sequence_number(self):
+        """
+        Test if a crawl resume message of an older version, without a sequence number, can be decoded.
+        """
+        # Arrange
+        meta = self.community.get_meta_message(CRAWL_RESUME)
+        # Act
+        result = self.converter._decode_crawl_resume(TestPlaceholder(meta), 0, '')[1]
+        # Assert
+        self.assertEqual(-1, result.requested_sequence_number)
+        self.assertEqual("\x01", self.converter.community_version)
+
+    def test_decoding_crawl_resume_too_short(self):
+        """
+        Test if a crawl resume message with a truncated sequence number is dropped.
+        """
+        # Arrange
+        meta = self.community.get_meta_message(CRAWL_RESUME)
+        # Act & Assert
+        with self.assertRaises(DropPacket):
+            self.converter._decode_crawl_resume(TestPlaceholder(meta), 0, '\x00\x01')
+
     def test_split_function(self):
         """
         Test the MultiChain split function.
@@ -53,6 +53,21 @@ class TestDatabase(MultiChainTestCase):
         result = self.db.get_by_hash_requester(self.block2.hash_requester)
         self.assertEqual_block(self.block2, result)
 
+    def test_add_blocks(self):
+        # Act
+        self.db.add_blocks([self.block1, self.block2])
+        # Assert
+        self.assertEqual_block(self.block1, self.db.get_by_hash_requester(self.block1.hash_requester))
+        self.assertEqual_block(self.block2, self.db.get_by_hash_requester(self.block2.hash_requester))
+
+    def test_get_known_hash_requesters(self):
+        # Arrange
+        self.db.add_block(self.block1)
+        # Act
+        result = self.db.get_known_hash_requesters([self.block1.hash_requester, self.block2.hash_requester])
+        # Assert
+        self.assertEqual({self.block1.hash_requester}, result)
+
     def test_get_block_non_existing(self):
         # Act
         result = self.db.get_by_hash_requester(self.block1.hash_requester)
@@ -204,3 +219,55 @@ class TestDatabase(MultiChainTestCase):
         self.assertEquals(time_difference.days, 0)
         self.assertLess(time_difference.seconds, 10,
                         "Difference in stored and retrieved time is too large.")
+
+    def test_update_block_with_responder(self):
+        # Arrange
+        # A block of which only the requester half is signed is not part of the chain of the responder yet.
+        self.block1.sequence_number_responder = -1
+        self.db.add_block(self.block1)
+        self.assertEquals(self.db.get_latest_sequence_number(self.block1.public_key_responder), -1)
+        self.block1.sequence_number_responder = 10
+        # Act
+        self.db.update_block_with_responder(self.block1)
+        # Assert
+        self.assertEquals(self.db.get_latest_sequence_number(self.block1.public_key_responder), 10)
+        self.assertEquals(self.db.get_latest_hash(self.block1.public_key_responder), self.block1.hash_responder)
+
+    def test_get_blocks_since(self):
+        # Arrange
+        self.block2.public_key_requester = self.block1.public_key_responder
+        self.block2.sequence_number_requester = self.block1.sequence_number_responder + 1
+        self.db.add_block(self.block1)
+        self.db.add_block(self.block2)
+        # Act
+        result = self.db.get_blocks_since(self.block1.public_key_responder, self.block1.sequence_number_responder)
+        # Assert
+        self.assertEquals(len(result), 2)
+        self.assertEqual_block(self.block1, result[0])
+        self.assertEqual_block(self.block2, result[1])
+
+    def test_get_hashes_between(self):
+        # Arrange
+        self.block2.public_key_requester = self.block1.public_key_responder
+        self.block2.sequence_number_requester = self.block1.sequence_number_responder + 1
+        self.db.add_block(self.block1)
+        self.db.add_block(self.block2)
+        # Act
+        result = self.db.get_hashes_between(self.block1.public_key_responder, self.block1.sequence_number_responder,
+                                            self.block1.sequence_number_responder + 5)
+        # Assert
+        self.assertEqual({self.block1.sequence_number_responder: self.block1.hash_responder,
+                          self.block2.sequence_number_requester: self.block2.hash_requester}, result)
+
+    def test_upgrade_from_version_1(self):
+        # Arrange
+        # Version 1 of the database only had the multi_chain table.
+        self.db.add_block(self.block1)
+        self.db.execute(u"DROP TABLE multi_chain_half")
+        # Act
+        self.db.check_database(u"1")
+        # Assert
+        self.assertEquals(self.db.get_latest_sequence_number(self.block1.public_key_requester),
+                          self.block1.sequence_number_requester)
+        self.assertEqual_block(self.block1, self.db.get_by_public_key_and_sequence_number(
+            self.block1.public_key_responder, self.block1.sequence_number_responder))
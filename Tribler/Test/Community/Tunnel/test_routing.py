@@ -0,0 +1,51 @@
+from Tribler.Test.Core.base_test import TriblerCoreTest
+from Tribler.community.tunnel.routing import TimerWheel
+
+
+class TestTimerWheel(TriblerCoreTest):
+
+    def setUp(self, annotate=True):
+        super(TestTimerWheel, self).setUp(annotate=annotate)
+        self.wheel = TimerWheel(tick_length=1.0, num_slots=16)
+        self.now = self.wheel.tick * 1.0
+
+    def test_advance(self):
+        """
+        Testing whether entries are returned once their deadline has passed, and not before
+        """
+        self.wheel.schedule("a", self.now + 2.5)
+        self.wheel.schedule("b", self.now + 5)
+        self.assertEqual(len(self.wheel), 2)
+
+        self.assertEqual(self.wheel.advance(self.now + 2.9), [])
+        self.assertEqual(self.wheel.advance(self.now + 3), ["a"])
+        self.assertEqual(self.wheel.advance(self.now + 3), [])
+        self.assertEqual(self.wheel.advance(self.now + 10), ["b"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_schedule_past_deadline(self):
+        """
+        Testing whether entries with a deadline in the past are returned by the next advance
+        """
+        self.wheel.advance(self.now + 4)
+        self.wheel.schedule("a", 0)
+        self.assertEqual(self.wheel.advance(self.now + 4), [])
+        self.assertEqual(self.wheel.advance(self.now + 5), ["a"])
+
+    def test_schedule_beyond_horizon(self):
+        """
+        Testing whether entries beyond the horizon of the wheel are returned at the end of the horizon
+        """
+        self.wheel.schedule("a", self.now + 100)
+        self.assertEqual(self.wheel.advance(self.now + 14), [])
+        self.assertEqual(self.wheel.advance(self.now + 15), ["a"])
+
+    def test_advance_full_turn(self):
+        """
+        Testing whether advancing more than a full turn returns every entry exactly once
+        """
+        for i in xrange(16):
+            self.wheel.schedule(i, self.now + i)
+        self.assertEqual(sorted(self.wheel.advance(self.now + 1000)), range(16))
+        self.wheel.schedule("a", self.now + 1001)
+        self.assertEqual(self.wheel.advance(self.now + 1001), ["a"])
@@ -0,0 +1,102 @@
+import struct
+
+from Tribler.Test.Core.base_test import TriblerCoreTest, MockObject
+from Tribler.community.tunnel import CIRCUIT_STATE_EXTENDING, CIRCUIT_STATE_READY
+from Tribler.community.tunnel.Socks5 import conversion
+from Tribler.community.tunnel.Socks5.server import SocksUDPConnection
+from Tribler.dispersy.util import blocking_call_on_reactor_thread
+
+
+class TestSocks5Conversion(TriblerCoreTest):
+
+    def test_decode_udp_header_ipv4(self):
+        packet = conversion.encode_udp_packet(0, 0, conversion.ADDRESS_TYPE_IPV4, "1.2.3.4", 5, "data")
+        frag, address_type, destination, offset = conversion.decode_udp_header(packet)
+        self.assertEqual((frag, address_type, destination), (0, conversion.ADDRESS_TYPE_IPV4, ("1.2.3.4", 5)))
+        self.assertEqual(packet[offset:], "data")
+
+    def test_decode_udp_header_domain_name(self):
+        packet = conversion.encode_udp_packet(0, 1, conversion.ADDRESS_TYPE_DOMAIN_NAME, "tribler.org", 5, "data")
+        frag, address_type, destination, offset = conversion.decode_udp_header(packet)
+        self.assertEqual((frag, address_type, destination),
+                         (1, conversion.ADDRESS_TYPE_DOMAIN_NAME, ("tribler.org", 5)))
+        self.assertEqual(packet[offset:], "data")
+
+    def test_decode_udp_header_ipv6(self):
+        packet = struct.pack("!HBB8HH", 0, 0, conversion.ADDRESS_TYPE_IPV6, 0x2001, 0xdb8, 0, 0, 0, 0, 0, 1, 5) + "data"
+        frag, address_type, destination, offset = conversion.decode_udp_header(packet)
+        self.assertEqual(destination, ("2001:db8:0:0:0:0:0:1", 5))
+        self.assertEqual(packet[offset:], "data")
+        self.assertEqual(conversion.decode_udp_packet(packet).destination, destination)
+
+    def test_decode_udp_header_invalid(self):
+        self.assertRaises(ValueError, conversion.decode_udp_header, struct.pack("!HBB", 0, 0, 42) + "data")
+        self.assertRaises(struct.error, conversion.decode_udp_header, struct.pack("!HBB", 0, 0, 1) + "\x01")
+
+
+class TestSocksUDPConnection(TriblerCoreTest):
+
+    @blocking_call_on_reactor_thread
+    def setUp(self, annotate=True):
+        super(TestSocksUDPConnection, self).setUp(annotate=annotate)
+        self.tunneled = []
+        self.circuit = MockObject()
+        self.circuit.circuit_id = 42
+        self.circuit.state = CIRCUIT_STATE_READY
+        self.circuit.tunnel_data_batch = self.tunneled.append
+
+        self.socksconnection = MockObject()
+        self.socksconnection.destinations = {}
+        self.socksconnection.select = lambda destination: \
+            self.socksconnection.destinations.setdefault(destination, self.circuit)
+        self.connection = SocksUDPConnection(self.socksconnection, ("127.0.0.1", 1234))
+
+    def tearDown(self, annotate=True):
+        self.close_connection()
+        super(TestSocksUDPConnection, self).tearDown(annotate=annotate)
+
+    @blocking_call_on_reactor_thread
+    def close_connection(self):
+        stopped = self.connection.listen_port.stopListening()
+        self.connection.listen_port = None
+        self.connection.close()
+        return stopped
+
+    @blocking_call_on_reactor_thread
+    def test_batch(self):
+        """
+        Testing whether udp datagrams are tunneled in a single batch per circuit
+        """
+        for i in xrange(3):
+            packet = conversion.encode_udp_packet(0, 0, conversion.ADDRESS_TYPE_IPV4, "1.2.3.4", 5, "data%d" % i)
+            self.connection.datagramReceived(packet, ("127.0.0.1", 1234))
+        self.assertEqual(self.tunneled, [])
+        self.assertEqual(self.socksconnection.destinations, {("1.2.3.4", 5): self.circuit})
+
+        self.connection.flush()
+        self.assertEqual(self.tunneled, [[(("1.2.3.4", 5), "data%d" % i) for i in xrange(3)]])
+        self.assertEqual(self.connection.stats['packets_up'], 3)
+        self.assertEqual(self.connection.stats['bytes_up'], 15)
+        self.assertIsNone(self.connection.flush_call)
+
+    @blocking_call_on_reactor_thread
+    def test_drop(self):
+        """
+        Testing whether udp datagrams that cannot be tunneled are dropped
+        """
+        packets = [(conversion.encode_udp_packet(0, 0, conversion.ADDRESS_TYPE_IPV4, "1.2.3.4", 5, "data"),
+                    ("127.0.0.1", 4321)),
+                   (conversion.encode_udp_packet(0, 1, conversion.ADDRESS_TYPE_IPV4, "1.2.3.4", 5, "data"),
+                    ("127.0.0.1", 1234)),
+                   (struct.pack("!HBB8HH", 0, 0, conversion.ADDRESS_TYPE_IPV6, 0, 0, 0, 0, 0, 0, 0, 1, 5) + "data",
+                    ("127.0.0.1", 1234)),
+                   ("\x00", ("127.0.0.1", 1234))]
+        for packet, source in packets:
+            self.connection.datagramReceived(packet, source)
+        self.assertEqual(self.connection.stats['packets_dropped'], 3)
+
+        self.circuit.state = CIRCUIT_STATE_EXTENDING
+        self.connection.datagramReceived(packets[0][0], ("127.0.0.1", 1234))
+        self.connection.flush()
+        self.assertEqual(self.tunneled, [])
+        self.assertEqual(self.connection.stats['packets_dropped'], 4)
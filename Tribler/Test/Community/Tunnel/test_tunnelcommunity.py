@@ -1,9 +1,12 @@
 import time
+from struct import pack
 
 from Tribler.Core.Utilities.twisted_thread import deferred
 from Tribler.Test.Community.Tunnel.test_tunnel_base import AbstractTestTunnelCommunity
-from Tribler.community.tunnel.routing import Circuit, RelayRoute
-from Tribler.community.tunnel.tunnel_community import TunnelExitSocket, CircuitRequestCache, PingRequestCache
+from Tribler.community.tunnel.conversion import TunnelConversion
+from Tribler.community.tunnel.routing import Circuit, Hop, RelayRoute
+from Tribler.community.tunnel.tunnel_community import (TunnelExitSocket, CircuitRequestCache, PingRequestCache,
+                                                       RoundRobin, LeastLoaded, LowestRTT, TunnelSettings)
 from Tribler.dispersy.candidate import Candidate
 from Tribler.dispersy.message import DropMessage
 from Tribler.dispersy.util import blocking_call_on_reactor_thread
@@ -58,6 +61,185 @@ class TestTunnelCommunity(AbstractTestTunnelCommunity):
 
         self.tunnel_community.request_cache.pop(u"ping", ping_num)
 
+    def create_ready_circuits(self, hops, *circuit_ids):
+        circuits = []
+        for circuit_id in circuit_ids:
+            circuit = Circuit(circuit_id, goal_hops=hops)
+            for _ in xrange(hops):
+                circuit.add_hop(Hop())
+            self.tunnel_community.circuits[circuit_id] = circuit
+            self.tunnel_community.ready_circuits.add(circuit)
+            circuits.append(circuit)
+        return circuits
+
+    @blocking_call_on_reactor_thread
+    def test_ready_circuits(self):
+        """
+        Testing whether the ready circuits are indexed by their number of hops
+        """
+        circuit1, circuit2 = self.create_ready_circuits(1, 42L, 43L)
+        circuit3, = self.create_ready_circuits(2, 44L)
+        self.tunnel_community.ready_circuits.add(circuit1)
+
+        self.assertEqual(self.tunnel_community.ready_circuits.get(1), [circuit1, circuit2])
+        self.assertEqual(self.tunnel_community.ready_circuits.get(2), [circuit3])
+        self.assertEqual(self.tunnel_community.ready_circuits.get(3), [])
+        self.assertEqual(len(self.tunnel_community.ready_circuits), 3)
+
+        self.tunnel_community.ready_circuits.remove(circuit1)
+        self.tunnel_community.ready_circuits.remove(circuit1)
+        self.assertEqual(self.tunnel_community.ready_circuits.get(1), [circuit2])
+
+    @blocking_call_on_reactor_thread
+    def test_round_robin(self):
+        """
+        Testing whether the round robin strategy cycles through the ready circuits with the requested number of hops
+        """
+        strategy = RoundRobin(self.tunnel_community)
+        self.assertFalse(strategy.has_options(1))
+        self.assertIsNone(strategy.select(None, 1))
+
+        circuit1, circuit2 = self.create_ready_circuits(1, 42L, 43L)
+        circuit3, = self.create_ready_circuits(2, 44L)
+        self.assertTrue(strategy.has_options(1))
+        self.assertEqual([strategy.select(None, 1) for _ in xrange(3)], [circuit1, circuit2, circuit1])
+        self.assertEqual(strategy.select(None, 2), circuit3)
+
+    @blocking_call_on_reactor_thread
+    def test_least_loaded(self):
+        """
+        Testing whether the least loaded strategy selects the circuit with the least bytes sent
+        """
+        strategy = LeastLoaded(self.tunnel_community)
+        circuit1, circuit2 = self.create_ready_circuits(1, 42L, 43L)
+        circuit1.bytes_up = 1000
+        self.assertEqual(strategy.select(None, 1), circuit2)
+        circuit2.bytes_up = 2000
+        self.assertEqual(strategy.select(None, 1), circuit1)
+
+    @blocking_call_on_reactor_thread
+    def test_lowest_rtt(self):
+        """
+        Testing whether the lowest RTT strategy prefers circuits with a low measured ping RTT
+        """
+        strategy = LowestRTT(self.tunnel_community)
+        circuit1, circuit2, circuit3 = self.create_ready_circuits(1, 42L, 43L, 44L)
+        circuit2.rtt = 0.5
+        self.assertEqual(strategy.select(None, 1), circuit2)
+        circuit3.rtt = 0.1
+        self.assertEqual(strategy.select(None, 1), circuit3)
+
+    @blocking_call_on_reactor_thread
+    def test_on_pong_rtt(self):
+        """
+        Testing whether a pong sets the RTT of the pinged circuit
+        """
+        circuit = Circuit(42L)
+        ping_request_cache = PingRequestCache(self.tunnel_community, circuit)
+        ping_num = self.tunnel_community.request_cache.add(ping_request_cache).number
+        meta = self.tunnel_community.get_meta_message(u"pong")
+        msg = meta.impl(distribution=(self.tunnel_community.global_time,),
+                        candidate=Candidate(("127.0.0.1", 1234), False), payload=(42, ping_num))
+
+        self.tunnel_community.on_pong([msg])
+        self.assertGreaterEqual(circuit.rtt, 0)
+
+    @blocking_call_on_reactor_thread
+    def test_get_diffie_secret(self):
+        """
+        Testing whether Diffie-Hellman key pairs are taken from the pool before they are generated on the spot
+        """
+        self.tunnel_community.settings = TunnelSettings()
+        self.tunnel_community.settings.dh_secret_pool_size = 0
+        self.tunnel_community.dh_secrets.extend([("secret1", "first_part1"), ("secret2", "first_part2")])
+
+        self.assertEqual(self.tunnel_community.get_diffie_secret(), ("secret1", "first_part1"))
+        self.assertEqual(self.tunnel_community.get_diffie_secret(), ("secret2", "first_part2"))
+        dh_secret, dh_first_part = self.tunnel_community.get_diffie_secret()
+        self.assertEqual(len(dh_first_part), 32)
+        self.assertFalse(self.tunnel_community.dh_secrets_refilling)
+
+    @blocking_call_on_reactor_thread
+    def test_do_circuits_spare(self):
+        """
+        Testing whether spare circuits are built on top of the circuits that are needed, for the hop counts that
+        tunnels were requested for
+        """
+        created = []
+        self.tunnel_community.settings = TunnelSettings()
+        self.tunnel_community.settings.spare_circuits = {1: 2}
+        self.tunnel_community.create_circuit = lambda hops: created.append(hops) or True
+        self.create_ready_circuits(1, 42L)
+
+        self.tunnel_community.do_circuits()
+        self.assertEqual(created, [])
+
+        self.tunnel_community.circuits_needed[1] = 1
+        self.tunnel_community.do_circuits()
+        self.assertEqual(created, [1, 1])
+
+        del created[:]
+        self.tunnel_community.circuits_needed[3] = 4
+        self.tunnel_community.do_circuits()
+        self.assertEqual(sorted(created), [1, 1] + [3] * 4)
+
+    def advance_removal_wheel(self, seconds):
+        now = time.time() + seconds
+        for kind, key, obj in self.tunnel_community.removal_wheel.advance(now):
+            self.tunnel_community.check_removal(kind, key, obj, now)
+
+    @blocking_call_on_reactor_thread
+    def test_do_remove(self):
+        """
+        Testing whether circuits, relays and exit sockets are removed once they are inactive or too old
+        """
+        removed = []
+        self.tunnel_community.settings = TunnelSettings()
+        self.tunnel_community.remove_circuit = lambda circuit_id, reason: removed.append((circuit_id, reason))
+        self.tunnel_community.remove_relay = lambda circuit_id, reason, both_sides: \
+            removed.append((circuit_id, reason))
+        self.tunnel_community.remove_exit_socket = lambda circuit_id, reason: removed.append((circuit_id, reason))
+
+        circuit = self.tunnel_community.circuits[42] = Circuit(42L)
+        relay = self.tunnel_community.relay_from_to[43] = RelayRoute(44, ("127.0.0.1", 1234))
+        exit_socket = self.tunnel_community.exit_sockets[45] = TunnelExitSocket(45, self.tunnel_community,
+                                                                                ("127.0.0.1", 1234))
+        active_circuit = self.tunnel_community.circuits[46] = Circuit(46L)
+        circuit.last_incoming -= 1000
+        relay.creation_time -= 1000
+        exit_socket.creation_time -= 1000
+
+        self.tunnel_community.schedule_removal_check(u"circuit", 42, circuit)
+        self.tunnel_community.schedule_removal_check(u"relay", 43, relay)
+        self.tunnel_community.schedule_removal_check(u"exit-socket", 45, exit_socket)
+        self.tunnel_community.schedule_removal_check(u"circuit", 46, active_circuit)
+
+        self.advance_removal_wheel(1)
+        self.assertEqual(sorted(removed), [(42, 'no activity'), (43, 'too old'), (45, 'too old')])
+        self.assertEqual(len(self.tunnel_community.removal_wheel), 1)
+
+    @blocking_call_on_reactor_thread
+    def test_traffic_limit(self):
+        """
+        Testing whether a circuit is checked for removal as soon as it crosses the traffic limit
+        """
+        removed = []
+        self.tunnel_community.settings = TunnelSettings()
+        self.tunnel_community.settings.max_traffic = 100
+        self.tunnel_community.remove_circuit = lambda circuit_id, reason: removed.append((circuit_id, reason))
+        circuit = self.tunnel_community.circuits[42] = Circuit(42L, first_hop=("127.0.0.1", 1234))
+        self.tunnel_community.schedule_removal_check(u"circuit", 42, circuit)
+
+        self.tunnel_community.increase_bytes_sent(circuit, 100)
+        self.tunnel_community.do_remove()
+        self.assertEqual(removed, [])
+
+        self.tunnel_community.increase_bytes_received(circuit, 1)
+        self.tunnel_community.increase_bytes_received(circuit, 1)
+        self.assertEqual(len(self.tunnel_community.removal_wheel), 2)
+        self.advance_removal_wheel(1)
+        self.assertEqual(removed, [(42, 'traffic limit exceeded')])
+
     def test_check_destroy(self):
         # Only the first and last node in the circuit may check a destroy message
         with self.assertRaises(StopIteration):
@@ -126,3 +308,20 @@ class TestTunnelCommunity(AbstractTestTunnelCommunity):
 
     def test_increase_bytes_received_error_branch(self):
         self.assertRaises(TypeError, self.tunnel_community.increase_bytes_received, 1, 1)
+
+    @blocking_call_on_reactor_thread
+    def test_on_data_batch(self):
+        relayed = []
+        self.tunnel_community.relay_packets = lambda circuit_id, message_type, packets: \
+            relayed.append((circuit_id, packets))
+        self.tunnel_community.relay_from_to[42] = RelayRoute(43, ("127.0.0.1", 1234))
+
+        sock_addr = ("127.0.0.1", 1235)
+        packets = [pack('!I', 42) + "first", pack('!I', 44) + "unknown", pack('!I', 42) + "second", "abc"]
+        self.tunnel_community.on_data_batch([(sock_addr, packet) for packet in packets])
+        self.assertEqual(relayed, [(42, [packets[0], packets[2]])])
+
+    def test_decode_data_cell(self):
+        packet = TunnelConversion.encode_data(42, ("1.2.3.4", 5), ("0.0.0.0", 0), "data")
+        self.assertEqual(TunnelConversion.decode_data(packet), (42, ("1.2.3.4", 5), ("0.0.0.0", 0), "data"))
+        self.assertEqual(TunnelConversion.decode_data_cell(packet[4:]), (("1.2.3.4", 5), ("0.0.0.0", 0), "data"))
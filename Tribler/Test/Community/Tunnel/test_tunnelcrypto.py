@@ -0,0 +1,32 @@
+from Tribler.Test.Core.base_test import TriblerCoreTest
+from Tribler.community.tunnel import EXIT_NODE, EXIT_NODE_SALT_EXPLICIT, ORIGINATOR
+from Tribler.community.tunnel.crypto.tunnelcrypto import TunnelCrypto
+
+
+class TestTunnelCrypto(TriblerCoreTest):
+
+    def setUp(self, annotate=True):
+        super(TestTunnelCrypto, self).setUp(annotate=annotate)
+        self.crypto = TunnelCrypto()
+        self.session_keys = self.crypto.generate_session_keys("a" * 64)
+
+    def test_encrypt_decrypt_cells(self):
+        cells = ["cell %d" % i for i in xrange(10)]
+        encrypted = self.crypto.encrypt_cells(cells, self.session_keys, EXIT_NODE)
+        self.assertEqual(self.session_keys[EXIT_NODE_SALT_EXPLICIT], 11)
+        self.assertNotIn(cells[0], encrypted)
+        self.assertEqual(self.crypto.decrypt_cells(encrypted, self.session_keys, EXIT_NODE), cells)
+
+    def test_cells_compatible_with_str(self):
+        encrypted = self.crypto.encrypt_str("cell", self.session_keys[EXIT_NODE], self.session_keys[EXIT_NODE + 2], 5)
+        self.assertEqual(self.crypto.decrypt_cells([encrypted], self.session_keys, EXIT_NODE), ["cell"])
+
+        encrypted = self.crypto.encrypt_cells(["cell"], self.session_keys, ORIGINATOR)[0]
+        self.assertEqual(self.crypto.decrypt_str(encrypted, self.session_keys[ORIGINATOR],
+                                                 self.session_keys[ORIGINATOR + 2]), "cell")
+
+    def test_decrypt_invalid_cell(self):
+        encrypted = self.crypto.encrypt_cells(["cell 1", "cell 2"], self.session_keys, ORIGINATOR)
+        encrypted[0] = encrypted[0][:-1] + chr(ord(encrypted[0][-1]) ^ 1)
+        self.assertEqual(self.crypto.decrypt_cells(encrypted + ["short"], self.session_keys, ORIGINATOR),
+                         [None, "cell 2", None])
@@ -1,9 +1,12 @@
 import binascii
 import os
+from StringIO import StringIO
+from threading import Thread
+
 import libtorrent as lt
 
 from Tribler.Core.DownloadConfig import DownloadStartupConfig
-from Tribler.Core.Libtorrent.LibtorrentDownloadImpl import LibtorrentDownloadImpl
+from Tribler.Core.Libtorrent.LibtorrentDownloadImpl import LibtorrentDownloadImpl, VODFile
 from Tribler.Core.SessionConfig import SessionStartupConfig
 from Tribler.Core.TorrentDef import TorrentDef
 from Tribler.Core.Utilities.configparser import CallbackConfigParser
@@ -403,3 +406,97 @@ class TestLibtorrentDownloadImplNoSession(TriblerCoreTest):
         self.libtorrent_download_impl.stop_remove = mocked_stop_remove
         self.libtorrent_download_impl.stop()
         self.assertTrue(mocked_stop_remove.called)
+
+    def test_piece_finished_alert(self):
+        """
+        Testing whether a piece_finished alert wakes up the VOD readers and does not update the stats
+        """
+        mock_alert = MockObject()
+        mock_alert.category = lambda: lt.alert.category_t.progress_notification
+        self.libtorrent_download_impl.process_alert(mock_alert, 'piece_finished_alert')
+        self.assertEqual(self.libtorrent_download_impl.vod_pieces_finished, 1)
+
+        self.libtorrent_download_impl.update_lt_stats = lambda: self.fail("update_lt_stats may not be called")
+        self.libtorrent_download_impl.process_alert(mock_alert, 'block_finished_alert')
+
+    def test_process_alerts_batch(self):
+        """
+        Testing whether the stats are updated once for a batch of alerts
+        """
+        def mocked_update_lt_stats():
+            mocked_update_lt_stats.called += 1
+
+        mocked_update_lt_stats.called = 0
+        self.libtorrent_download_impl.update_lt_stats = mocked_update_lt_stats
+
+        mock_alert = MockObject()
+        mock_alert.category = lambda: lt.alert.category_t.status_notification
+        self.libtorrent_download_impl.process_alerts([(mock_alert, 'state_changed_alert'),
+                                                      (mock_alert, 'stats_alert')])
+        self.assertEqual(mocked_update_lt_stats.called, 1)
+
+    def test_process_alerts_invalid_handle(self):
+        """
+        Testing whether a batch of alerts is not processed when the handle of the download is no longer valid
+        """
+        def mocked_update_lt_stats():
+            mocked_update_lt_stats.called += 1
+
+        mocked_update_lt_stats.called = 0
+        self.libtorrent_download_impl.update_lt_stats = mocked_update_lt_stats
+        self.libtorrent_download_impl.handle.is_valid = lambda: False
+
+        mock_alert = MockObject()
+        mock_alert.category = lambda: lt.alert.category_t.status_notification
+        self.libtorrent_download_impl.process_alerts([(mock_alert, 'stats_alert')])
+        self.assertEqual(mocked_update_lt_stats.called, 0)
+
+    def create_vod_file(self, data, piece_size, have_pieces):
+        """
+        Creates a VODFile for a single-file torrent with the given data, of which we have the pieces in have_pieces.
+        """
+        mock_peer_request = MockObject()
+        mock_peer_request.piece = 0
+        mock_peer_request.start = 0
+        mock_file_entry = MockObject()
+        mock_file_entry.size = len(data)
+        mock_torrent_info = MockObject()
+        mock_torrent_info.map_file = lambda *_: mock_peer_request
+        mock_torrent_info.file_at = lambda _: mock_file_entry
+        mock_torrent_info.num_pieces = lambda: (len(data) + piece_size - 1) // piece_size
+        self.libtorrent_download_impl.handle.get_torrent_info = lambda: mock_torrent_info
+        self.libtorrent_download_impl.handle.have_piece = lambda piece: piece in have_pieces
+
+        self.libtorrent_download_impl.tdef = MockObject()
+        self.libtorrent_download_impl.tdef.get_pieces = lambda: ""
+        self.libtorrent_download_impl.tdef.get_piece_length = lambda: piece_size
+        self.libtorrent_download_impl.vod_index = 0
+        self.libtorrent_download_impl.set_vod_readahead = lambda *_: None
+        return VODFile(StringIO(data), self.libtorrent_download_impl)
+
+    def test_vod_file_read_finished_pieces(self):
+        """
+        Testing whether a VODFile read returns the bytes of the pieces we have, without waiting for the rest
+        """
+        stream = self.create_vod_file("abcdefghij", 4, {0, 1})
+        self.assertEqual(stream.read(3), "abc")
+        self.assertEqual(stream.read(10), "defgh")
+
+    def test_vod_file_read_wait_for_piece(self):
+        """
+        Testing whether a VODFile read waits for the piece it needs, until it has been downloaded
+        """
+        have_pieces = {0}
+        stream = self.create_vod_file("abcdefghij", 4, have_pieces)
+        self.assertEqual(stream.read(4), "abcd")
+
+        result = []
+        reader = Thread(target=lambda: result.append(stream.read(4)))
+        reader.start()
+        reader.join(0.1)
+        self.assertTrue(reader.is_alive())
+
+        have_pieces.add(1)
+        self.libtorrent_download_impl.on_piece_finished_alert(None)
+        reader.join(1)
+        self.assertEqual(result, ["efgh"])
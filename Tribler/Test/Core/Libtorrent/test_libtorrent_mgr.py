@@ -1,9 +1,14 @@
 import os
+from binascii import hexlify
 
 import shutil
 
+import libtorrent as lt
+
 from Tribler.Core.CacheDB.Notifier import Notifier
-from Tribler.Core.Libtorrent.LibtorrentMgr import LibtorrentMgr
+from Tribler.Core.Libtorrent import LibtorrentMgr as libtorrent_mgr_module
+from Tribler.Core.Libtorrent.LibtorrentMgr import LibtorrentMgr, get_alert_mask
+from Tribler.Test.Core.base_test import MockObject
 from Tribler.Test.test_as_server import AbstractServer
 
 
@@ -40,6 +45,10 @@ class TestLibtorrentMgr(AbstractServer):
     def setUp(self, annotate=True):
         super(TestLibtorrentMgr, self).setUp(annotate)
         self.tribler_session = FakeTriblerSession(self.session_base_dir)
+        self.tribler_session.lm = MockObject()
+        self.tribler_session.lm.torrent_store = None
+        self.tribler_session.lm.threadpool = MockObject()
+        self.tribler_session.lm.threadpool.add_task = lambda *_: None
         self.ltmgr = LibtorrentMgr(self.tribler_session)
 
     def tearDown(self, annotate=True):
@@ -72,3 +81,138 @@ class TestLibtorrentMgr(AbstractServer):
         self.ltmgr.initialize()
         ltsession = self.ltmgr.get_session(0)
         self.assertTrue(ltsession)
+
+    def test_metainfo_cache_lru(self):
+        """
+        Testing whether the least recently used metainfo is dropped from a full cache
+        """
+        self.ltmgr.metainfo_cache_size = 2
+        self.ltmgr._add_cached_metainfo("a" * 40, {"info": "a"})
+        self.ltmgr._add_cached_metainfo("b" * 40, {"info": "b"})
+        self.assertEqual(self.ltmgr._get_cached_metainfo("a" * 40), {"info": "a"})
+        self.ltmgr._add_cached_metainfo("c" * 40, {"info": "c"})
+
+        self.assertIsNone(self.ltmgr._get_cached_metainfo("b" * 40))
+        self.assertEqual(self.ltmgr.metainfo_cache.keys(), ["a" * 40, "c" * 40])
+        self.assertEqual(self.ltmgr.get_metainfo_statistics()[u"cache_hits"], 1)
+
+    def test_get_metainfo_from_store(self):
+        """
+        Testing whether metainfo that is not in the cache is loaded from the torrent store
+        """
+        infohash = "\x01" * 20
+        self.tribler_session.lm.torrent_store = {hexlify(infohash): lt.bencode({"info": {"name": "test"}})}
+        results = []
+        self.tribler_session.lm.threadpool.call_in_thread = lambda _, callback, metainfo: callback(metainfo)
+        self.ltmgr.dht_ready = True
+
+        self.ltmgr.get_metainfo(infohash, results.append)
+        self.ltmgr.get_metainfo(infohash, results.append)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["info"], {"name": "test"})
+        self.assertEqual(results[0]["seeders"], 0)
+        statistics = self.ltmgr.get_metainfo_statistics()
+        self.assertEqual((statistics[u"store_hits"], statistics[u"cache_hits"], statistics[u"misses"]), (1, 1, 0))
+
+    def test_got_metainfo_not_stored(self):
+        """
+        Testing whether the metainfo of a lookup is cached, but not saved to the torrent store
+        """
+        infohash = "\x03" * 20
+        self.tribler_session.lm.torrent_store = {}
+        self.tribler_session.lm.threadpool.call_in_thread = lambda *_: None
+        ltsession = MockObject()
+        ltsession.remove_torrent = lambda *_: None
+        self.ltmgr.get_session = lambda: ltsession
+
+        handle = MockObject()
+        handle.torrent_file = lambda: handle
+        handle.metadata = lambda: lt.bencode({"name": "test", "piece length": 16384, "pieces": ""})
+        handle.trackers = lambda: []
+        handle.get_peer_info = lambda: []
+        self.ltmgr.metainfo_requests[hexlify(infohash)] = {'handle': handle,
+                                                           'callbacks': [lambda _: None],
+                                                           'timeout_callbacks': [],
+                                                           'notify': False,
+                                                           'time': 0}
+        self.ltmgr.got_metainfo(hexlify(infohash))
+        del self.ltmgr.get_session
+
+        self.assertIn(hexlify(infohash), self.ltmgr.metainfo_cache)
+        self.assertEqual(self.tribler_session.lm.torrent_store, {})
+
+    def test_get_metainfo_deduplicate(self):
+        """
+        Testing whether concurrent lookups of the same torrent share a single request
+        """
+        self.ltmgr.initialize()
+        self.ltmgr.dht_ready = True
+        infohash = "\x02" * 20
+        self.tribler_session.lm.torrent_store = {hexlify(infohash): lt.bencode({"info": {"name": "test"}})}
+        callbacks = [lambda _: None for _ in xrange(4)]
+
+        # the stored metainfo does not have peers
+        self.ltmgr.get_metainfo(infohash, callbacks[0], timeout_callback=callbacks[1], need_peers=True)
+        self.ltmgr.get_metainfo("magnet:?xt=urn:btih:" + hexlify(infohash), callbacks[2],
+                                timeout_callback=callbacks[3], need_peers=True)
+
+        request = self.ltmgr.metainfo_requests[hexlify(infohash)]
+        self.assertEqual(request['callbacks'], [callbacks[0], callbacks[2]])
+        self.assertEqual(request['timeout_callbacks'], [callbacks[1], callbacks[3]])
+        statistics = self.ltmgr.get_metainfo_statistics()
+        self.assertEqual((statistics[u"misses"], statistics[u"deduplicated"], statistics[u"pending"]), (1, 1, 1))
+
+    def test_process_alerts_batch(self):
+        """
+        Testing whether a batch of alerts is routed to the downloads it is about, one call per download
+        """
+        def create_alert(infohash):
+            alert = MockObject()
+            alert.handle = MockObject()
+            alert.handle.is_valid = lambda: True
+            alert.handle.info_hash = lambda: infohash
+            return alert
+
+        received = {}
+        for infohash in ("a" * 40, "b" * 40):
+            download = MockObject()
+            download.process_alerts = lambda alerts, infohash=infohash: received.setdefault(infohash, []).append(alerts)
+            self.ltmgr.torrents[infohash] = (download, None)
+
+        alerts = [create_alert("a" * 40), create_alert("b" * 40), create_alert("a" * 40), create_alert("c" * 40)]
+        self.ltmgr.process_alerts(alerts)
+
+        self.assertEqual(received["a" * 40], [[(alerts[0], 'MockObject'), (alerts[2], 'MockObject')]])
+        self.assertEqual(received["b" * 40], [[(alerts[1], 'MockObject')]])
+
+    def test_set_progress_alerts(self):
+        """
+        Testing whether a session only delivers progress alerts while one of its downloads is in VOD mode
+        """
+        def create_download(infohash):
+            download = MockObject()
+            download.handle = MockObject()
+            download.handle.is_valid = lambda: True
+            download.handle.info_hash = lambda: infohash
+            return download
+
+        ltsession = MockObject()
+        ltsession.set_alert_mask = lambda mask: setattr(ltsession, 'mask', mask)
+        downloads = [create_download("a" * 40), create_download("b" * 40)]
+        for download in downloads:
+            self.ltmgr.torrents[download.handle.info_hash()] = (download, ltsession)
+
+        piece_progress_notification = libtorrent_mgr_module.PIECE_PROGRESS_NOTIFICATION
+        libtorrent_mgr_module.PIECE_PROGRESS_NOTIFICATION = None
+        try:
+            self.ltmgr.set_progress_alerts(downloads[0], True)
+            self.ltmgr.set_progress_alerts(downloads[1], True)
+            self.assertEqual(ltsession.mask, get_alert_mask(True))
+            self.ltmgr.set_progress_alerts(downloads[0], False)
+            self.assertEqual(ltsession.mask, get_alert_mask(True))
+            self.ltmgr.set_progress_alerts(downloads[1], False)
+            self.assertEqual(ltsession.mask, get_alert_mask(False))
+            self.assertFalse(get_alert_mask(False) & lt.alert.category_t.progress_notification)
+        finally:
+            libtorrent_mgr_module.PIECE_PROGRESS_NOTIFICATION = piece_progress_notification
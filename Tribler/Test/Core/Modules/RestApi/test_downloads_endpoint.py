@@ -3,9 +3,11 @@ import os
 from urllib import pathname2url
 
 from Tribler.Core.DownloadConfig import DownloadStartupConfig
+from Tribler.Core.Modules.restapi.downloads_endpoint import DownloadStatesCache, DownloadsEndpoint
 from Tribler.Core.Utilities.twisted_thread import deferred
 from Tribler.Core.simpledefs import NTFY_TORRENTS
 from Tribler.Test.Core.Modules.RestApi.base_api_test import AbstractApiTest
+from Tribler.Test.Core.base_test import TriblerCoreTest, MockObject
 from Tribler.Test.test_as_server import TESTS_DATA_DIR
 
 
@@ -40,6 +42,72 @@ class TestDownloadsEndpoint(AbstractApiTest):
         self.should_check_equality = False
         return self.do_request('downloads', expected_code=200).addCallback(verify_download)
 
+    def start_downloads(self):
+        video_tdef, _ = self.create_local_torrent(os.path.join(TESTS_DATA_DIR, 'video.avi'))
+        self.session.start_download_from_tdef(video_tdef, DownloadStartupConfig())
+        self.session.start_download_from_uri("file:" + pathname2url(
+            os.path.join(TESTS_DATA_DIR, "bak_single.torrent")))
+
+    @deferred(timeout=20)
+    def test_get_downloads_fields(self):
+        """
+        Testing whether the API only returns the requested fields of the downloads
+        """
+        def verify_download(downloads):
+            downloads_json = json.loads(downloads)
+            self.assertEqual(len(downloads_json['downloads']), 2)
+            for download_json in downloads_json['downloads']:
+                self.assertEqual(set(download_json.keys()), {"infohash", "name", "progress"})
+
+        self.start_downloads()
+        self.should_check_equality = False
+        return self.do_request('downloads?fields=name,progress', expected_code=200).addCallback(verify_download)
+
+    @deferred(timeout=10)
+    def test_get_downloads_unknown_field(self):
+        """
+        Testing whether the API returns error 400 if an unknown field is requested
+        """
+        self.should_check_equality = False
+        return self.do_request('downloads?fields=name,unknown', expected_code=400)
+
+    @deferred(timeout=10)
+    def test_get_downloads_invalid_limit(self):
+        """
+        Testing whether the API returns error 400 if the limit is not a number
+        """
+        self.should_check_equality = False
+        return self.do_request('downloads?limit=abc', expected_code=400)
+
+    @deferred(timeout=20)
+    def test_get_downloads_paginated(self):
+        """
+        Testing whether the API returns a single page of downloads together with the total number of downloads
+        """
+        def verify_download(downloads):
+            downloads_json = json.loads(downloads)
+            self.assertEqual(len(downloads_json['downloads']), 1)
+            self.assertEqual(downloads_json['total'], 2)
+
+        self.start_downloads()
+        self.should_check_equality = False
+        return self.do_request('downloads?offset=1&limit=1', expected_code=200).addCallback(verify_download)
+
+    @deferred(timeout=20)
+    def test_get_downloads_since(self):
+        """
+        Testing whether the API returns the current revision and the removed downloads when downloads are polled
+        """
+        def verify_download(downloads):
+            downloads_json = json.loads(downloads)
+            self.assertEqual(len(downloads_json['downloads']), 2)
+            self.assertIn('revision', downloads_json)
+            self.assertEqual(downloads_json['removed'], [])
+
+        self.start_downloads()
+        self.should_check_equality = False
+        return self.do_request('downloads?since=0', expected_code=200).addCallback(verify_download)
+
     @deferred(timeout=10)
     def test_remove_download_no_remove_data_param(self):
         """
@@ -283,3 +351,85 @@ class TestDownloadsEndpoint(AbstractApiTest):
 
         return self.do_request('downloads/%s' % video_tdef.get_infohash().encode('hex'), expected_code=409,
                                request_type='PUT')
+
+
+class TestDownloadStatesCache(TriblerCoreTest):
+
+    def setUp(self, annotate=True):
+        super(TestDownloadStatesCache, self).setUp(annotate=annotate)
+        self.states_cache = DownloadStatesCache()
+
+    @staticmethod
+    def create_download_state(infohash, progress):
+        download_state = MockObject()
+        download_state.download = MockObject()
+        download_state.download.correctedinfoname = u"test"
+        download_state.download.get_max_speed = lambda _: 0
+        download_state.download.get_def = lambda: download_state.download
+        download_state.download.get_infohash = lambda: infohash
+        download_state.get_download = lambda: download_state.download
+        download_state.get_status = lambda: 3
+        download_state.get_progress = lambda: progress
+        download_state.get_current_speed = lambda _: 0
+        download_state.get_eta = lambda: 0
+        download_state.get_num_seeds_peers = lambda: (0, 0)
+        download_state.get_files_completion = lambda: []
+        return download_state
+
+    def test_update_changed(self):
+        """
+        Testing whether only downloads with a different state are marked as changed
+        """
+        self.states_cache.update([self.create_download_state('a' * 20, 0.0), self.create_download_state('b' * 20, 0.0)])
+        revision = self.states_cache.revision
+        self.assertTrue(self.states_cache.has_changed('a' * 20, 0))
+        self.assertFalse(self.states_cache.has_changed('a' * 20, revision))
+
+        self.states_cache.update([self.create_download_state('a' * 20, 0.5), self.create_download_state('b' * 20, 0.0)])
+        self.assertEqual(self.states_cache.revision, revision + 1)
+        self.assertTrue(self.states_cache.has_changed('a' * 20, revision))
+        self.assertFalse(self.states_cache.has_changed('b' * 20, revision))
+
+    def test_update_unchanged(self):
+        """
+        Testing whether the revision stays the same when no download changed
+        """
+        self.states_cache.update([self.create_download_state('a' * 20, 0.0)])
+        revision = self.states_cache.revision
+        self.states_cache.update([self.create_download_state('a' * 20, 0.0)])
+        self.assertEqual(self.states_cache.revision, revision)
+
+    def test_update_removed(self):
+        """
+        Testing whether downloads that are no longer reported are returned as removed
+        """
+        self.states_cache.update([self.create_download_state('a' * 20, 0.0)])
+        revision = self.states_cache.revision
+        self.states_cache.update([])
+        self.assertEqual(self.states_cache.get_removed(revision), ['a' * 20])
+        self.assertEqual(self.states_cache.get_removed(self.states_cache.revision), [])
+        self.assertIsNone(self.states_cache.get_state('a' * 20))
+
+    def test_unknown_download_changed(self):
+        """
+        Testing whether downloads that have not been reported yet are always considered changed
+        """
+        self.assertTrue(self.states_cache.has_changed('a' * 20, self.states_cache.revision))
+
+    def test_update_states_cache_interval(self):
+        """
+        Testing whether the downloads endpoint takes the states of the downloads at most once per interval
+        """
+        download_state = self.create_download_state('a' * 20, 0.0)
+        states_taken = []
+
+        def network_get_state(*_):
+            states_taken.append(download_state)
+            return download_state
+        download_state.download.network_get_state = network_get_state
+
+        endpoint = DownloadsEndpoint(MockObject())
+        endpoint.update_states_cache([download_state.download])
+        endpoint.update_states_cache([download_state.download])
+        self.assertEqual(len(states_taken), 1)
+        self.assertIs(endpoint.states_cache.get_state('a' * 20), download_state)
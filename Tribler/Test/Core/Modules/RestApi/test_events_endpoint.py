@@ -8,7 +8,7 @@ from Tribler.Core.Modules.restapi import events_endpoint as events_endpoint_file
 from Tribler.Core.Utilities.twisted_thread import deferred
 from Tribler.Core.simpledefs import SIGNAL_CHANNEL, SIGNAL_ON_SEARCH_RESULTS, SIGNAL_TORRENT, NTFY_UPGRADER, \
     NTFY_STARTED, NTFY_FINISHED, NTFY_UPGRADER_TICK, NTFY_WATCH_FOLDER_CORRUPT_TORRENT, NTFY_INSERT, NTFY_NEW_VERSION, \
-    NTFY_CHANNEL, NTFY_DISCOVERED, NTFY_TORRENT
+    NTFY_CHANNEL, NTFY_DISCOVERED, NTFY_TORRENT, NTFY_CHECKPOINT_RESUME, NTFY_UPDATE
 from Tribler.Core.version import version_id
 from Tribler.Test.Core.Modules.RestApi.base_api_test import AbstractApiTest
 
@@ -92,7 +92,7 @@ class TestEventsEndpoint(AbstractApiTest):
         """
         Testing whether various events are coming through the events endpoints
         """
-        self.messages_to_wait_for = 10
+        self.messages_to_wait_for = 12
 
         def send_notifications(_):
             self.session.lm.api_manager.root_endpoint.events_endpoint.start_new_query()
@@ -106,6 +106,8 @@ class TestEventsEndpoint(AbstractApiTest):
             self.session.notifier.notify(NTFY_NEW_VERSION, NTFY_INSERT, None, None)
             self.session.notifier.notify(NTFY_CHANNEL, NTFY_DISCOVERED, None, None)
             self.session.notifier.notify(NTFY_TORRENT, NTFY_DISCOVERED, None, None)
+            self.session.notifier.notify(NTFY_CHECKPOINT_RESUME, NTFY_UPDATE, None, {u'resumed': 1, u'total': 2})
+            self.session.notifier.notify(NTFY_CHECKPOINT_RESUME, NTFY_FINISHED, None, 2)
 
         self.socket_open_deferred.addCallback(send_notifications)
 
@@ -1,7 +1,8 @@
 from nose.tools import raises
 from Tribler.Core.TFTP.exception import FileNotFound
 from Tribler.Core.TFTP.handler import TftpHandler
-from Tribler.Core.TFTP.packet import OPCODE_OACK, OPCODE_ERROR
+from Tribler.Core.TFTP.packet import OPCODE_OACK, OPCODE_ERROR, OPCODE_ACK, OPCODE_DATA, OPCODE_RRQ
+from Tribler.Core.TFTP.session import Session
 from Tribler.Test.Core.base_test import TriblerCoreTest, MockObject
 from Tribler.dispersy.util import blocking_call_on_reactor_thread
 
@@ -28,7 +29,7 @@ class TestTFTPHandler(TriblerCoreTest):
             raise RuntimeError("_add_new_session not be called")
 
         self.handler._add_new_session = mocked_add_new_session
-        self.handler.download_file("test", "127.0.0.1", 1234)
+        self.assertFalse(self.handler.download_file("test", "127.0.0.1", 1234))
 
     def test_check_session_timeout(self):
         """
@@ -142,6 +143,73 @@ class TestTFTPHandler(TriblerCoreTest):
         self.handler._handle_packet_as_sender(None, packet)
         self.assertTrue(mocked_handle_error.called)
 
+    def test_handle_packet_as_sender_window(self):
+        """
+        Testing whether a sender sends a window of DATA packets after every ACK
+        """
+        sent_blocks = []
+        self.handler._send_data_packet = lambda _, block_number, data: sent_blocks.append((block_number, data))
+
+        session = Session(False, 1, ("127.0.0.1", 1234), OPCODE_RRQ, u"test", "abcdefghij", 10, None,
+                          block_size=2, window_size=4)
+        session.last_block_number = 6
+
+        self.handler._handle_packet_as_sender(session, {'opcode': OPCODE_ACK, 'block_number': 0})
+        self.assertEqual(sent_blocks, [(1, "ab"), (2, "cd"), (3, "ef"), (4, "gh")])
+        self.assertFalse(session.is_waiting_for_last_ack)
+
+        # block 3 got lost, the window is sent again from there
+        sent_blocks[:] = []
+        self.handler._handle_packet_as_sender(session, {'opcode': OPCODE_ACK, 'block_number': 2})
+        self.assertEqual(sent_blocks, [(3, "ef"), (4, "gh"), (5, "ij"), (6, "")])
+        self.assertTrue(session.is_waiting_for_last_ack)
+
+        self.handler._handle_packet_as_sender(session, {'opcode': OPCODE_ACK, 'block_number': 6})
+        self.assertTrue(session.is_done)
+
+    def test_handle_packet_as_receiver_window(self):
+        """
+        Testing whether a receiver buffers DATA packets that arrive out of order and acknowledges every window
+        """
+        sent_acks = []
+        self.handler._send_ack_packet = lambda _, block_number: sent_acks.append(block_number)
+
+        session = Session(True, 1, ("127.0.0.1", 1234), OPCODE_RRQ, u"test", None, None, None,
+                          block_size=2, timeout=2, window_size=4)
+        oack = {'opcode': OPCODE_OACK, 'options': {'blksize': 2, 'timeout': 2, 'windowsize': 2, 'tsize': 5,
+                                                   'checksum': "A95sVwv+JL/DKMzXyka3bq2vQzQ="}}
+        self.handler._handle_packet_as_receiver(session, oack)
+        self.assertEqual(session.window_size, 2)
+        self.assertEqual(sent_acks, [0])
+
+        session.last_received_packet = oack
+        self.handler._handle_packet_as_receiver(session, {'opcode': OPCODE_DATA, 'block_number': 2, 'data': "cd"})
+        self.assertEqual(sent_acks, [0, 0])
+        self.handler._handle_packet_as_receiver(session, {'opcode': OPCODE_DATA, 'block_number': 1, 'data': "ab"})
+        self.assertEqual(sent_acks, [0, 0, 2])
+        self.handler._handle_packet_as_receiver(session, {'opcode': OPCODE_DATA, 'block_number': 3, 'data': "e"})
+        self.assertEqual(sent_acks, [0, 0, 2, 3])
+
+        self.assertEqual(session.file_data, "abcde")
+        self.assertTrue(session.is_done)
+
+    def test_check_session_timeout_windowsize_fallback(self):
+        """
+        Testing whether a request is sent again without the windowsize option if it is not answered
+        """
+        sent_packets = []
+        self.handler._send_packet = lambda _, packet: sent_packets.append(packet)
+
+        session = Session(True, 1, ("127.0.0.1", 1234), OPCODE_RRQ, u"test", None, None, None, window_size=4)
+        self.handler._send_request_packet(session)
+        self.assertEqual(sent_packets[-1]['options']['windowsize'], 4)
+
+        session.last_sent_packet = sent_packets[-1]
+        session.last_contact_time = 0
+        self.assertFalse(self.handler._check_session_timeout(session))
+        self.assertEqual(session.window_size, 1)
+        self.assertNotIn('windowsize', sent_packets[-1]['options'])
+
     def test_handle_error(self):
         """
         Testing the error handling of a tftp handler
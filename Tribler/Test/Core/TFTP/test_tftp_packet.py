@@ -45,6 +45,14 @@ class TestTFTPPacket(TriblerCoreTest):
         """
         _decode_options({}, "blksize\0a\0", 0)
 
+    def test_decode_options_windowsize(self):
+        """
+        Testing whether the windowsize option is decoded as an integer
+        """
+        packet = {}
+        _decode_options(packet, "windowsize\x0016\0", 0)
+        self.assertEqual(packet['options']['windowsize'], 16)
+
     @raises(InvalidPacketException)
     def test_decode_data(self):
         """
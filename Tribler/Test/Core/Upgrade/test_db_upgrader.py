@@ -34,6 +34,18 @@ class TestDBUpgrader(AbstractUpgrader):
         db_migrator.start_migrate()
         self.assertEqual(self.sqlitedb.version, LATEST_DB_VERSION)
 
+    def test_upgrade_17_to_latest_search_terms(self):
+        """
+        Testing whether the SearchTerms table is created and queued to be filled from the existing torrents after an upgrade
+        """
+        self.copy_and_initialize_upgrade_database('tribler_v17.sdb')
+        db_migrator = DBUpgrader(self.session, self.sqlitedb, torrent_store=MockTorrentStore())
+        db_migrator.start_migrate()
+        self.assertEqual(self.sqlitedb.fetchone(u"SELECT COUNT(*) FROM SearchTerms"), 0)
+
+        populate_from = self.sqlitedb.fetchone(u"SELECT value FROM MyInfo WHERE entry == 'search_terms_torrent_id'")
+        self.assertEqual(int(populate_from), self.sqlitedb.fetchone(u"SELECT max(torrent_id) FROM Torrent") or 0)
+
     def test_upgrade_wrong_version(self):
         self.copy_and_initialize_upgrade_database('tribler_v17.sdb')
         db_migrator = DBUpgrader(self.session, self.sqlitedb, torrent_store=MockTorrentStore())
@@ -0,0 +1,3 @@
+"""
+This package contains tests for the video streaming of Tribler.
+"""
@@ -0,0 +1,44 @@
+from twisted.internet.defer import succeed
+
+from Tribler.Core.Video.VideoPlayer import VideoPlayer
+from Tribler.Core.simpledefs import DLMODE_NORMAL, DLMODE_VOD
+from Tribler.Test.Core.base_test import TriblerCoreTest, MockObject
+
+
+class TestVideoPlayer(TriblerCoreTest):
+    """
+    This class contains tests for the video player.
+    """
+
+    def test_shutdown(self):
+        """
+        Testing whether shutting down stops the streams, resets the VOD download and returns the deferred of the server
+        """
+        streaming = set()
+        download = MockObject()
+        download.mode = DLMODE_VOD
+
+        def set_mode(mode):
+            download.mode = mode
+        download.set_mode = set_mode
+        download.get_def = lambda: download
+        download.get_infohash = lambda: "a" * 20
+        streaming.add(download)
+
+        deferred = succeed(None)
+
+        def shutdown():
+            streaming.clear()
+            return deferred
+
+        video_player = VideoPlayer.__new__(VideoPlayer)
+        video_player.vlcwrap = None
+        video_player.vod_download = download
+        video_player.vod_info = {}
+        video_player.videoserver = MockObject()
+        video_player.videoserver.is_streaming = lambda d: d in streaming
+        video_player.videoserver.shutdown = shutdown
+
+        self.assertIs(video_player.shutdown(), deferred)
+        self.assertIsNone(video_player.vod_download)
+        self.assertEqual(download.mode, DLMODE_NORMAL)
@@ -0,0 +1,111 @@
+from twisted.internet.defer import Deferred
+
+from Tribler.Core.Video.VideoServer import VODStreamProducer
+from Tribler.Test.Core.base_test import TriblerCoreTest, MockObject
+from Tribler.dispersy.util import blocking_call_on_reactor_thread
+
+
+class MockStream(object):
+    """
+    A VODFile of which only the first available bytes have been downloaded.
+    """
+
+    def __init__(self, data, available):
+        self.data = data
+        self.available = available
+        self.position = 0
+        self.closed = False
+
+    def get_readable_bytes(self, pos, size):
+        return max(0, min(size, self.available - pos))
+
+    def read(self, size):
+        result = self.data[self.position:self.position + size]
+        self.position += len(result)
+        return result
+
+    def close(self):
+        self.closed = True
+
+
+class TestVODStreamProducer(TriblerCoreTest):
+    """
+    This class contains tests for the producer that streams a file to a single client.
+    """
+
+    def setUp(self, annotate=True):
+        super(TestVODStreamProducer, self).setUp(annotate=annotate)
+        self.written = []
+
+        self.request = MockObject()
+        self.request.finished = False
+        self.request.write = self.written.append
+        self.request.notifyFinish = Deferred
+        self.request.registerProducer = lambda *_: None
+        self.request.unregisterProducer = lambda: None
+
+        def finish():
+            self.request.finished = True
+        self.request.finish = finish
+
+        self.video_server = MockObject()
+        self.video_server.producers = set()
+        self.download = MockObject()
+        self.download.piece_finished_callbacks = set()
+
+        self.producer = VODStreamProducer(self.video_server, self.request, self.download, 0, None, 2, 6)
+        self.producer.stream = MockStream("abcdefghij", 5)
+        self.producer.stream.position = 2
+        self.video_server.producers.add(self.producer)
+
+    def tearDown(self, annotate=True):
+        self.producer.stopProducing()
+        super(TestVODStreamProducer, self).tearDown(annotate=annotate)
+
+    @blocking_call_on_reactor_thread
+    def test_write_finished_pieces(self):
+        """
+        Testing whether the producer writes the downloaded data and waits for the rest
+        """
+        self.producer.write_available()
+        self.assertEqual(self.written, ["cde"])
+        self.assertFalse(self.request.finished)
+        self.assertIn(self.producer.on_piece_finished, self.download.piece_finished_callbacks)
+
+        self.producer.stream.available = 10
+        self.producer.write_available()
+        self.assertEqual(self.written, ["cde", "fgh"])
+        self.assertTrue(self.request.finished)
+        self.assertFalse(self.download.piece_finished_callbacks)
+        self.assertFalse(self.video_server.producers)
+        self.assertTrue(self.producer.stream.closed)
+
+    @blocking_call_on_reactor_thread
+    def test_pause_resume(self):
+        """
+        Testing whether the producer stops writing when the client is paused, and continues once it is resumed
+        """
+        self.producer.stream.available = 10
+
+        def write(data):
+            self.written.append(data)
+            self.producer.pauseProducing()
+        self.request.write = write
+
+        self.producer.write_available()
+        self.assertEqual(self.written, ["cdefgh"])
+        self.assertFalse(self.request.finished)
+
+        self.producer.resumeProducing()
+        self.assertTrue(self.request.finished)
+
+    @blocking_call_on_reactor_thread
+    def test_stop_producing(self):
+        """
+        Testing whether the producer stops when the client goes away
+        """
+        self.producer.write_available()
+        self.producer.stopProducing()
+        self.assertFalse(self.download.piece_finished_callbacks)
+        self.assertIsNone(self.producer.retry_call)
+        self.assertFalse(self.video_server.producers)
@@ -0,0 +1,76 @@
+"""
+Micro-benchmarks of the version 'a' encoding, comparing encode/decode with the original implementation that dispatches
+every value through the _a_encode_mapping and _a_decode_mapping dictionaries.
+
+Run with: python -m Tribler.Test.Core.benchmark_encoding [repeat]
+"""
+import sys
+from hashlib import sha1
+from timeit import repeat
+
+from Tribler.Core.Utilities.encoding import (_a_decode_mapping, _a_encode_mapping, decode, encode, StreamDecoder)
+
+
+def mapping_encode(data):
+    return "a" + "".join(_a_encode_mapping[type(data)](data, _a_encode_mapping))
+
+
+def mapping_decode(stream, offset=0):
+    index = offset + 1
+    while 48 <= ord(stream[index]) <= 57:
+        index += 1
+    return _a_decode_mapping[stream[index]](stream, index + 1, int(stream[offset + 1:index]), _a_decode_mapping)
+
+
+def stream_decode(stream, chunk_size=1400):
+    decoder = StreamDecoder()
+    for offset in xrange(0, len(stream), chunk_size):
+        decoder.feed(stream[offset:offset + chunk_size])
+
+
+def make_torrent(i):
+    infohash = sha1(str(i)).digest()
+    files = tuple((u"Episode %d/file %d.mkv" % (i, j), 123456789L * j) for j in xrange(5))
+    trackers = (u"udp://tracker.example.org:80", u"http://tracker.example.org/announce")
+    return (infohash + "\x00" * 8, u"Some swarm name %d" % i, files, trackers)
+
+
+PAYLOADS = [
+    (u"int", 42),
+    (u"comment", {u"text": u"a comment" * 10, u"timestamp": 1460000000, u"reply-to-mid": "\x01" * 20,
+                  u"infohash": "\x02" * 20}),
+    (u"torrent", make_torrent(0)),
+    (u"channel (500 torrents)", [make_torrent(i) for i in xrange(500)]),
+]
+
+
+def benchmark(number_of_repeats=5):
+    results = []
+    for name, data in PAYLOADS:
+        stream = encode(data)
+        assert mapping_encode(data) == stream
+        assert mapping_decode(stream) == decode(stream)
+        number = max(1, 20000 / len(stream))
+
+        timings = [(u"encode", lambda: mapping_encode(data), lambda: encode(data)),
+                   (u"decode", lambda: mapping_decode(stream), lambda: decode(stream)),
+                   (u"decode buffer", lambda: mapping_decode(stream), lambda: decode(buffer(stream))),
+                   (u"decode stream", lambda: mapping_decode(stream), lambda: stream_decode(stream))]
+        for operation, old, new in timings:
+            old_time = min(repeat(old, number=number, repeat=number_of_repeats)) / number
+            new_time = min(repeat(new, number=number, repeat=number_of_repeats)) / number
+            results.append((name, operation, len(stream), old_time, new_time))
+    return results
+
+
+def main(argv):
+    results = benchmark(int(argv[1]) if len(argv) > 1 else 5)
+
+    print "%-24s %-14s %8s %12s %12s %8s" % ("payload", "operation", "bytes", "mapping (us)", "new (us)", "speedup")
+    for name, operation, size, old_time, new_time in results:
+        print "%-24s %-14s %8d %12.1f %12.1f %7.2fx" % (name, operation, size, old_time * 1e6, new_time * 1e6,
+                                                         old_time / new_time)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -6,7 +6,8 @@ from Tribler.Core.Utilities.encoding import (_a_encode_int, _a_encode_long, _a_e
                                              _a_decode_int, _a_decode_long, _a_decode_float,
                                              _a_decode_unicode, encode, _a_decode_bytes, _a_decode_list,
                                              _a_decode_mapping, _a_decode_set, _a_decode_tuple,
-                                             _a_decode_dictionary, decode)
+                                             _a_decode_dictionary, decode, _a_encode_mapping,
+                                             IncompleteStreamError, StreamDecoder)
 from Tribler.Test.Core.base_test import TriblerCoreTest
 
 
@@ -193,3 +194,65 @@ class TriblerCoreTestUnicode(TriblerCoreTest):
 
     def test_decode(self):
         self.assertEqual(decode("a2d3sfoo3sbar3smoo4smilk", 0), (24, {'foo': 'bar', 'moo': 'milk'}))
+
+    def test_encode_nested(self):
+        data = {u'torrents': [("\x00" * 20, u'name \u00e9', (1, 2L, 3.5)), set([None])],
+                'flags': (True, False), 'empty': ((), [], {}, set())}
+        self.assertEqual(encode(data), "a" + "".join(_a_encode_mapping[dict](data, _a_encode_mapping)))
+
+    @raises(ValueError)
+    def test_encode_unknown_type(self):
+        encode(object())
+
+    def test_decode_nested(self):
+        data = {u'torrents': [("\x00" * 20, u'name \u00e9', (1, 2L, 3.5)), set([None])],
+                'flags': (True, False), 'empty': ((), [], {}, set())}
+        stream = encode(data)
+        self.assertEqual(decode(stream), (len(stream), data))
+
+    def test_decode_buffer(self):
+        self.assertEqual(decode(buffer("xxa2d3sfoo3sbar3smoo4smilk"), 2), (26, {'foo': 'bar', 'moo': 'milk'}))
+        self.assertEqual(decode(memoryview("a2l1i42b42")), (10, [4, '42']))
+
+    @raises(IncompleteStreamError)
+    def test_decode_incomplete_payload(self):
+        decode("a2l1i43sba")
+
+    @raises(IncompleteStreamError)
+    def test_decode_incomplete_header(self):
+        decode("a2l1i412")
+
+    @raises(ValueError)
+    def test_decode_invalid_header(self):
+        decode("a2l1i4x")
+
+    @raises(ValueError)
+    def test_decode_dupkey(self):
+        decode("a2d3sfoo3sbar3sfoo4smilk")
+
+    @raises(ValueError)
+    def test_decode_constant_length(self):
+        decode("a1nx")
+
+    def test_stream_decoder(self):
+        values = [42, {u'foo': [u'bar', "\x01" * 20]}, (1, (2, (3,)))]
+        stream = "".join(encode(value) for value in values)
+
+        decoder = StreamDecoder()
+        decoded = []
+        for offset in xrange(0, len(stream), 3):
+            decoded.extend(decoder.feed(stream[offset:offset + 3]))
+        self.assertEqual(decoded, values)
+        self.assertEqual(decoder.pending, 0)
+
+    def test_stream_decoder_partial(self):
+        decoder = StreamDecoder()
+        self.assertEqual(decoder.feed("a2l1i42b42"), [[4, '42']])
+        self.assertEqual(decoder.feed("a2t2"), [])
+        self.assertEqual(decoder.pending, 1)
+        self.assertEqual(decoder.feed(buffer("s\xc3")), [])
+        self.assertEqual(decoder.feed("\xa90n"), [(u'\xe9', None)])
+
+    @raises(ValueError)
+    def test_stream_decoder_wrong_version(self):
+        StreamDecoder().feed("b2i42")
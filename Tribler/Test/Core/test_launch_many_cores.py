@@ -1,4 +1,5 @@
 import os
+import time
 
 from nose.tools import raises
 
@@ -55,6 +56,27 @@ class TestLaunchManyCore(TriblerCoreTest):
         self.assertIsInstance(config, CallbackConfigParser)
         self.assertEqual(config.get('general', 'version'), 11)
 
+    def test_load_download_pstate_from_file_noexc(self):
+        """
+        Testing whether None is returned when a pstate cannot be loaded
+        """
+        self.assertIsNone(self.lm.load_download_pstate_from_file_noexc(os.path.join(self.DATA_DIR, u"missing.state")))
+
+    def test_wait_for_resumed_downloads(self):
+        """
+        Testing whether the next batch of downloads is resumed once most downloads have been added to libtorrent
+        """
+        waiting_download, added_download = MockObject(), MockObject()
+        waiting_download.handle = None
+        added_download.handle = MockObject()
+
+        callbacks = []
+        self.lm._wait_for_resumed_downloads([waiting_download, added_download], time.time() + 10,
+                                            lambda: callbacks.append(u"added"))
+        self.lm._wait_for_resumed_downloads([waiting_download, waiting_download, added_download], 0,
+                                            lambda: callbacks.append(u"deadline"))
+        self.assertEqual(callbacks, [u"added", u"deadline"])
+
     def test_sessconfig_changed_cb(self):
         """
         Testing whether the callback works correctly when changing session config parameters
@@ -40,7 +40,8 @@ from tempfile import mkdtemp
 
 from twisted.internet.task import Clock
 
-from Tribler.Core.leveldbstore import LevelDbStore, WRITEBACK_PERIOD, get_write_batch_plyvel, get_write_batch_leveldb
+from Tribler.Core.leveldbstore import (LevelDbStore, WRITEBACK_PERIOD, WRITEBACK_MAX_ITEMS, get_write_batch_plyvel,
+                                       get_write_batch_leveldb)
 from Tribler.Test.test_as_server import BaseTestCase
 
 
@@ -138,6 +139,55 @@ class AbstractTestLevelDBStore(BaseTestCase):
         for key in iter(self.store):
             self.assertTrue(key)
 
+    def test_contains_flushed(self):
+        self.store[K] = V
+        self.store.flush()
+        self.assertTrue(K in self.store)
+        self.assertFalse(K + "2" in self.store)
+        self.assertFalse("f" in self.store)
+
+    def test_flush_max_items(self):
+        for i in xrange(WRITEBACK_MAX_ITEMS):
+            self.store[K + str(i)] = V
+        self.assertEqual(0, len(self.store._pending_torrents))
+        self.assertEqual(1, self.store.get_statistics()[u'flushes'])
+        self.assertEqual(WRITEBACK_MAX_ITEMS, self.store.get_statistics()[u'last_flush_items'])
+
+    def test_read_cache(self):
+        self.store[K] = V
+        self.store.flush()
+        self.assertEqual(self.store[K], V)
+        self.assertEqual(self.store[K], V)
+        statistics = self.store.get_statistics()
+        self.assertEqual(1, statistics[u'hits'])
+        self.assertEqual(1, statistics[u'misses'])
+        self.assertEqual(len(V), statistics[u'read_cache_bytes'])
+
+        self.store[K] = V + V
+        self.assertEqual(0, self.store.get_statistics()[u'read_cache_bytes'])
+        self.assertEqual(self.store[K], V + V)
+
+    def test_len_maintained(self):
+        self.store[K] = V
+        self.assertEqual(1, len(self.store))
+        self.store[K] = V
+        self.store[K + "2"] = V
+        self.store.flush()
+        self.store[K] = V
+        self.assertEqual(2, len(self.store))
+        del self.store[K]
+        del self.store[K]
+        self.assertEqual(1, len(self.store))
+
+    def test_len_persistent(self):
+        self.store[K] = V
+        self.assertEqual(1, len(self.store))
+        store_dir = self.store._store_dir
+        self.store.close()
+        self.openStore(store_dir)
+        self.assertEqual(1, self.store._key_count)
+        self.assertEqual(1, len(self.store))
+
 
 class TestLevelDBStore(AbstractTestLevelDBStore):
     __test__ = True
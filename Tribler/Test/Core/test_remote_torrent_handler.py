@@ -0,0 +1,146 @@
+from Tribler.Core.RemoteTorrentHandler import RemoteTorrentHandler, RequestScheduler, TftpRequester, MagnetRequester
+from Tribler.Test.Core.base_test import TriblerCoreTest, MockObject
+from Tribler.dispersy.candidate import Candidate
+from Tribler.dispersy.util import blocking_call_on_reactor_thread
+
+
+class TestRequestScheduler(TriblerCoreTest):
+    """
+    This class contains tests for the scheduler that limits the number of concurrent requests.
+    """
+
+    def test_limits(self):
+        """
+        Testing whether the scheduler limits the requests in total and per candidate
+        """
+        scheduler = RequestScheduler(max_concurrent=3, max_per_candidate=2)
+        candidate1 = Candidate(("1.2.3.4", 1234), False)
+        candidate2 = Candidate(("1.2.3.5", 1234), False)
+
+        scheduler.start(candidate1)
+        scheduler.start(candidate1)
+        self.assertFalse(scheduler.can_start(candidate1))
+        self.assertTrue(scheduler.can_start(candidate2))
+
+        scheduler.start(candidate2)
+        self.assertFalse(scheduler.can_start(candidate2))
+        self.assertFalse(scheduler.can_start())
+
+        scheduler.finish(candidate1)
+        self.assertEqual(scheduler.num_running, 2)
+        self.assertTrue(scheduler.can_start(candidate1))
+
+
+class TestRemoteTorrentHandler(TriblerCoreTest):
+    """
+    This class contains tests for the scheduling of requests by the RemoteTorrentHandler.
+    """
+
+    def setUp(self, annotate=True):
+        super(TestRemoteTorrentHandler, self).setUp(annotate=annotate)
+        self.downloads = []
+
+        session = MockObject()
+        session.open_dbhandler = lambda _: None
+        session.lm = MockObject()
+        session.lm.tftp_handler = MockObject()
+
+        def mocked_download_file(file_name, ip, port, **_):
+            self.downloads.append((file_name, ip))
+            return True
+        session.lm.tftp_handler.download_file = mocked_download_file
+
+        self.handler = RemoteTorrentHandler(session, max_concurrent=3, max_per_candidate=1)
+        self.handler.running = True
+        for priority in (0, 1):
+            self.handler.torrent_requesters[priority] = TftpRequester(u"tftp_torrent_%s" % priority,
+                                                                      session, self.handler, priority)
+            self.handler.magnet_requesters[priority] = MagnetRequester(session, self.handler, priority)
+        for requester in self.handler._get_requesters():
+            requester.start_pending_requests = lambda: None
+
+        self.candidates = [Candidate(("1.2.3.%d" % i, 1234), False) for i in xrange(4)]
+
+    def tearDown(self, annotate=True):
+        self.handler.shutdown()
+        super(TestRemoteTorrentHandler, self).tearDown(annotate=annotate)
+
+    @blocking_call_on_reactor_thread
+    def test_concurrent_tftp_requests(self):
+        """
+        Testing whether TFTP requests run concurrently, within the limits of the scheduler
+        """
+        requester = self.handler.torrent_requesters[1]
+        for i in xrange(3):
+            self.handler.download_torrent(self.candidates[0], chr(i) * 20)
+        self.handler.download_torrent(self.candidates[1], chr(3) * 20)
+        self.handler.download_torrent(self.candidates[2], chr(4) * 20)
+        self.handler.download_torrent(self.candidates[3], chr(5) * 20)
+
+        requester._do_request()
+        # one request per candidate, three in total
+        self.assertEqual([ip for _, ip in self.downloads], ["1.2.3.0", "1.2.3.1", "1.2.3.2"])
+        self.assertEqual(requester.active_request_count, 3)
+        self.assertEqual(requester.pending_request_queue_size, 3)
+
+        requester._on_download_failed(("1.2.3.0", 1234), None, "", {u'key': (chr(0) * 20).encode('hex'),
+                                                                    u'info_hash': chr(0) * 20})
+        self.assertEqual(requester.requests_failed, 1)
+        self.assertLess(requester.success_rate, 0.5)
+        self.assertEqual(self.handler.scheduler.num_running, 2)
+
+        requester._do_request()
+        self.assertEqual([ip for _, ip in self.downloads[3:]], ["1.2.3.3"])
+
+    @blocking_call_on_reactor_thread
+    def test_deduplicate_requests(self):
+        """
+        Testing whether a torrent is requested by a single requester, at the highest requested priority
+        """
+        infohash = "a" * 20
+        self.handler.download_torrent(None, infohash, priority=0)
+        self.assertTrue(self.handler.magnet_requesters[0].has_request(infohash))
+
+        self.handler.download_torrent(self.candidates[0], infohash, priority=0)
+        self.assertFalse(self.handler.magnet_requesters[0].has_request(infohash))
+        self.assertTrue(self.handler.torrent_requesters[0].has_request(infohash))
+
+        self.handler.download_torrent(self.candidates[1], infohash, priority=1)
+        self.assertFalse(self.handler.torrent_requesters[0].has_request(infohash))
+        self.assertTrue(self.handler.torrent_requesters[1].has_request(infohash))
+        self.assertEqual(self.handler.torrent_requesters[1].pending_request_queue_size, 1)
+
+        self.handler.download_torrent(None, infohash, priority=1)
+        self.assertFalse(self.handler.magnet_requesters[1].has_request(infohash))
+
+    @blocking_call_on_reactor_thread
+    def test_fallback_to_magnet(self):
+        """
+        Testing whether a torrent is requested through a magnet link when no candidate could provide it
+        """
+        infohash = "a" * 20
+        requester = self.handler.torrent_requesters[1]
+        self.handler.download_torrent(self.candidates[0], infohash)
+        requester._do_request()
+        requester._on_download_failed(("1.2.3.0", 1234), None, "", {u'key': infohash.encode('hex'),
+                                                                    u'info_hash': infohash})
+
+        self.assertFalse(requester.has_request(infohash))
+        self.assertTrue(self.handler.magnet_requesters[1].has_request(infohash))
+        self.assertEqual(self.handler.get_statistics()[u"requesters"][u"tftp_torrent_1"][u"failed"], 1)
+
+    @blocking_call_on_reactor_thread
+    def test_tftp_handler_not_running(self):
+        """
+        Testing whether a request is queued again, without taking a slot, when the TFTP handler is not running
+        """
+        infohash = "a" * 20
+        requester = self.handler.torrent_requesters[1]
+        requester._session.lm.tftp_handler.download_file = lambda file_name, ip, port, **_: False
+        self.handler.download_torrent(self.candidates[0], infohash)
+        requester._do_request()
+
+        self.assertEqual(requester.active_request_count, 0)
+        self.assertEqual(requester.pending_request_queue_size, 1)
+        self.assertEqual(self.handler.scheduler.num_running, 0)
+        self.assertTrue(self.handler.scheduler.can_start(self.candidates[0]))
@@ -0,0 +1,35 @@
+from struct import pack
+
+from Tribler.Core.CacheDB.search_engine import search_rank, unpack_matchinfo
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+def create_matchinfo(phrases):
+    """
+    Creates a matchinfo blob from a list of phrases, each a list of (hits, total hits, documents with hits) per column.
+    """
+    values = [value for columns in phrases for column in columns for value in column]
+    return pack('II' + 'I' * len(values), len(phrases), len(phrases[0]), *values)
+
+
+class TestSearchEngine(TriblerCoreTest):
+
+    def test_unpack_matchinfo(self):
+        matchinfo = create_matchinfo([[(1, 2, 3), (4, 5, 6), (0, 0, 0)]])
+        self.assertEqual(unpack_matchinfo(matchinfo), (1, 3, (1, 2, 3, 4, 5, 6, 0, 0, 0)))
+
+    def test_rank_swarmname_over_filenames(self):
+        swarmname = create_matchinfo([[(1, 10, 10), (0, 10, 10), (0, 0, 0)]])
+        filenames = create_matchinfo([[(0, 10, 10), (1, 10, 10), (0, 0, 0)]])
+        self.assertGreater(search_rank(swarmname, 1000, 0, 0), search_rank(filenames, 1000, 0, 0))
+
+    def test_rank_rare_terms(self):
+        rare = create_matchinfo([[(1, 10, 10), (0, 0, 0), (0, 0, 0)]])
+        common = create_matchinfo([[(1, 900, 900), (0, 0, 0), (0, 0, 0)]])
+        self.assertGreater(search_rank(rare, 1000, 0, 0), search_rank(common, 1000, 0, 0))
+
+    def test_rank_seeders_and_votes(self):
+        matchinfo = create_matchinfo([[(1, 10, 10), (0, 0, 0), (0, 0, 0)]])
+        self.assertGreater(search_rank(matchinfo, 1000, 100, 0), search_rank(matchinfo, 1000, 0, 0))
+        self.assertGreater(search_rank(matchinfo, 1000, 0, 10), search_rank(matchinfo, 1000, 0, 0))
+        self.assertEqual(search_rank(matchinfo, 1000, None, -10), search_rank(matchinfo, 1000, 0, 0))
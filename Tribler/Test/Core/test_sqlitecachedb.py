@@ -6,9 +6,11 @@ import shutil
 from unittest import skipIf
 from nose.tools import raises
 import sys
+import time
 
 from Tribler.Test.Core.base_test import TriblerCoreTest
 from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, DB_SCRIPT_NAME, CorruptedDatabaseError
+from Tribler.Core.Utilities.twisted_thread import deferred
 from Tribler.dispersy.util import blocking_call_on_reactor_thread
 
 
@@ -220,3 +222,113 @@ class TestSqliteCacheDB(TriblerCoreTest):
         self.sqlite_test.delete("person", lastname=("LIKE", "a"))
         one = self.sqlite_test.fetchone(u"SELECT * FROM person")
         self.assertEqual(one, ('x', 'z'))
+
+    @deferred(timeout=10)
+    def test_async_fetchall_in_memory(self):
+        """
+        This test tests whether asynchronous reads on an in-memory database fall back to the write connection.
+        """
+        self.test_insertmany()
+        return self.sqlite_test.async_fetchall(u"SELECT * FROM person")\
+            .addCallback(lambda rows: self.assertEqual(len(rows), 100))
+
+    @deferred(timeout=10)
+    def test_async_fetchone_read_pool(self):
+        """
+        This test tests whether asynchronous reads are served by the read-only connections of the reader threads.
+        """
+        sqlite_test_2 = SQLiteCacheDB(os.path.join(self.session_base_dir, "test_db.db"))
+        sqlite_test_2.initialize()
+        sqlite_test_2.execute(u"CREATE TABLE person(lastname, firstname);")
+        sqlite_test_2.insert('person', lastname='a', firstname='b')
+
+        def verify(one):
+            self.assertEqual(one, ('a', 'b'))
+            self.assertIsNotNone(sqlite_test_2._read_pool)
+            sqlite_test_2.close()
+
+        return sqlite_test_2.async_fetchone(u"SELECT * FROM person").addCallback(verify)
+
+    @deferred(timeout=10)
+    def test_async_execute_write(self):
+        self.test_create_db()
+
+        def verify(_):
+            self.assertEqual(self.sqlite_test.size('person'), 1)
+
+        return self.sqlite_test.async_execute_write(u"INSERT INTO person VALUES (?, ?)", ('a', 'b'))\
+            .addCallback(verify)
+
+    @deferred(timeout=10)
+    def test_async_execute_write_waits_for_connection(self):
+        """
+        This test tests whether the writer thread waits for the statements of the reactor on the shared connection.
+        """
+        self.test_create_db()
+
+        def verify(_):
+            self.assertEqual(self.sqlite_test.size('person'), 1)
+
+        with self.sqlite_test._connection_lock:
+            deferred_write = self.sqlite_test.async_execute_write(u"INSERT INTO person VALUES (?, ?)", ('a', 'b'))
+            time.sleep(0.1)
+            self.assertEqual(self.sqlite_test.size('person'), 0)
+        return deferred_write.addCallback(verify)
+
+    @blocking_call_on_reactor_thread
+    def test_queue_write_flush_on_read(self):
+        """
+        This test tests whether queued writes are coalesced and flushed before reading from the same table.
+        """
+        self.test_create_db()
+        for i in range(10):
+            self.sqlite_test.queue_write(u"person", u"INSERT INTO person VALUES (?, ?)", (str(i), str(i)))
+        self.assertEqual(self.sqlite_test.get_write_queue_statistics()[u"queue_depth"], 10)
+
+        self.assertEqual(self.sqlite_test.size('person'), 10)
+        statistics = self.sqlite_test.get_write_queue_statistics()
+        self.assertEqual(statistics[u"queue_depth"], 0)
+        self.assertEqual(statistics[u"flushed_rows"], 10)
+        self.assertEqual(statistics[u"flushed_batches"], 1)
+
+    @blocking_call_on_reactor_thread
+    def test_touches_write_queue(self):
+        """
+        This test tests whether only statements on a table with queued writes, or on one of its views, flush the queue.
+        """
+        self.sqlite_test._write_queue_table_index = {u"Torrent": 0, u"_ChannelTorrents": 1}
+        self.assertTrue(self.sqlite_test._touches_write_queue(u"SELECT name FROM Torrent WHERE torrent_id = ?"))
+        self.assertTrue(self.sqlite_test._touches_write_queue(u"SELECT COUNT(*) FROM CollectedTorrent"))
+        self.assertTrue(self.sqlite_test._touches_write_queue(u"SELECT * FROM Channels JOIN ChannelTorrents ON"
+                                                              u" Channels.id = ChannelTorrents.channel_id"))
+        self.assertFalse(self.sqlite_test._touches_write_queue(u"SELECT * FROM TorrentFiles WHERE torrent_id = ?"))
+        self.assertFalse(self.sqlite_test._touches_write_queue(u"SELECT * FROM TorrentMarkings"))
+        self.sqlite_test._write_queue_table_index = {}
+
+    @blocking_call_on_reactor_thread
+    def test_queue_write_keeps_table_order(self):
+        """
+        This test tests whether statements on the same table are not reordered by the write-behind queue.
+        """
+        self.test_create_db()
+        self.sqlite_test.queue_write(u"person", u"INSERT INTO person VALUES (?, ?)", ('a', 'b'))
+        self.sqlite_test.queue_write(u"person", u"DELETE FROM person WHERE lastname = ?", ('a',))
+        self.sqlite_test.queue_write(u"person", u"INSERT INTO person VALUES (?, ?)", ('x', 'z'))
+        self.sqlite_test.flush_write_queue()
+
+        self.assertEqual(self.sqlite_test.get_write_queue_statistics()[u"flushed_batches"], 3)
+        self.assertEqual(self.sqlite_test.fetchall(u"SELECT * FROM person"), [('x', 'z')])
+
+    @blocking_call_on_reactor_thread
+    def test_commit_now_flushes_write_queue(self):
+        sqlite_test_2 = SQLiteCacheDB(os.path.join(self.session_base_dir, "test_db.db"), self.tribler_db_script)
+        sqlite_test_2.initialize()
+        sqlite_test_2.initial_begin()
+        sqlite_test_2.queue_write(u"MyInfo", u"INSERT INTO MyInfo (entry, value) VALUES (?, ?)", ('foo', 'bar'))
+        sqlite_test_2.commit_now()
+
+        statistics = sqlite_test_2.get_write_queue_statistics()
+        self.assertEqual(statistics[u"queue_depth"], 0)
+        self.assertEqual(statistics[u"uncommitted_rows"], 0)
+        self.assertEqual(statistics[u"commits"], 1)
+        sqlite_test_2.close()
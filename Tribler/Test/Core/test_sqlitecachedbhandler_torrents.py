@@ -1,7 +1,9 @@
 from binascii import unhexlify
 import os
+import time
 from shutil import copy as copyfile
 from Tribler.Category.Category import Category
+from Tribler.Core.CacheDB import suggestion_index
 from Tribler.Core.CacheDB.SqliteCacheDBHandler import TorrentDBHandler, MyPreferenceDBHandler, ChannelCastDBHandler
 from Tribler.Core.CacheDB.sqlitecachedb import str2bin
 from Tribler.Core.TorrentDef import TorrentDef
@@ -222,6 +224,28 @@ class TestTorrentDBHandler(AbstractDB):
     def test_index_torrent_existing(self):
         self.tdb._indexTorrent(1, "test", [])
 
+    @blocking_call_on_reactor_thread
+    def test_index_torrent_renamed(self):
+        tids, _ = self.tdb.addOrGetTorrentIDSReturn([unhexlify('50865489ac16e2f34ea0cd3043cfd970cc24ec09')])
+        self.tdb._indexTorrent(tids[0], u"zebra", [])
+        self.tdb._indexTorrent(tids[0], u"zebra zebras", [], u"zebra")
+        self.assertEqual(self.tdb._db.fetchall(u"SELECT term, frequency FROM SearchTerms WHERE term LIKE 'zebra%'"
+                                               u" ORDER BY term"), [(u"zebra", 1), (u"zebras", 1)])
+
+    @blocking_call_on_reactor_thread
+    def test_get_torrents_to_check(self):
+        self.addTorrent()
+        m_infohash = unhexlify('ed81da94d21ad1b305133f2726cdaec5a57fed98')
+        current_time = int(time.time())
+
+        torrents = self.tdb.getTorrentsToCheck(current_time, current_time, 1000)
+        self.assertEqual(torrents, sorted(torrents, key=lambda torrent: torrent[3]))
+        m_trackers = [tracker for _, infohash, tracker, _ in torrents if infohash == m_infohash]
+        self.assertEqual(sorted(m_trackers), sorted(tracker for tracker in self.tdb.getTrackerListByInfohash(m_infohash)
+                                                    if tracker != u'no-DHT'))
+        self.assertEqual(len(self.tdb.getTorrentsToCheck(current_time, current_time, 1)), 1)
+        self.assertFalse(self.tdb.getTorrentsToCheck(current_time, 0, 1000))
+
     @blocking_call_on_reactor_thread
     def test_getCollectedTorrentHashes(self):
         res = self.tdb.getNumberCollectedTorrents()
@@ -245,6 +269,35 @@ class TestTorrentDBHandler(AbstractDB):
     def test_get_autocomplete_terms(self):
         self.assertEqual(len(self.tdb.getAutoCompleteTerms("content", 100)), 0)
 
+    @blocking_call_on_reactor_thread
+    def test_get_search_suggestions_misspelled(self):
+        self.tdb.suggestion_index.add_keywords([u"content"])
+        self.assertEqual(self.tdb.getSearchSuggestion(["contnet"]), ["Content 1"])
+
+    @blocking_call_on_reactor_thread
+    def test_get_autocomplete_terms_vocabulary(self):
+        self.tdb.suggestion_index.add_keywords([u"contents", u"contention", u"content"])
+        self.tdb.suggestion_index.add_keywords([u"contents"])
+        self.assertEqual(self.tdb.getAutoCompleteTerms(u"content", 100), [u"contents", u"contention"])
+
+    @blocking_call_on_reactor_thread
+    def test_add_keywords_counted_once(self):
+        self.tdb.suggestion_index.add_keywords([u"contents", u"contents", u"contention"])
+        self.tdb.suggestion_index.add_keywords([u"contention", u"contents"], [u"contents"])
+        self.assertEqual(self.tdb.getAutoCompleteTerms(u"content", 100), [u"contention", u"contents"])
+
+    @blocking_call_on_reactor_thread
+    def test_bk_tree_max_terms(self):
+        self.tdb.suggestion_index.add_keywords([u"contents", u"contention"])
+        self.tdb.suggestion_index.add_keywords([u"contents"])
+        bk_tree_max_terms = suggestion_index.BK_TREE_MAX_TERMS
+        suggestion_index.BK_TREE_MAX_TERMS = 1
+        try:
+            bk_tree = self.tdb.suggestion_index._get_bk_tree()
+        finally:
+            suggestion_index.BK_TREE_MAX_TERMS = bk_tree_max_terms
+        self.assertEqual(bk_tree.search(u"content", 2), [(1, u"contents")])
+
     @blocking_call_on_reactor_thread
     def test_get_recently_randomly_collected_torrents(self):
         self.assertEqual(len(self.tdb.getRecentlyCollectedTorrents(limit=10)), 10)
@@ -283,3 +336,24 @@ class TestTorrentDBHandler(AbstractDB):
         results = self.tdb.searchNames(['content'], keys=columns)
         self.assertEqual(len(results), 4848)
         self.assertEqual(results[0][3], 493785)
+
+    @blocking_call_on_reactor_thread
+    def test_search_names_paging(self):
+        """
+        Test whether searching for torrents in db returns the requested page of results
+        """
+        columns = ['T.torrent_id', 'infohash', 'status', 'num_seeders']
+        self.tdb.channelcast_db = ChannelCastDBHandler(self.session)
+        results = self.tdb.searchNames(['content'], keys=columns)
+        page = self.tdb.searchNames(['content'], keys=columns, limit=10, offset=5)
+        self.assertEqual(len(page), 10)
+        self.assertEqual([result[0] for result in page], [result[0] for result in results[5:15]])
+
+    @blocking_call_on_reactor_thread
+    def test_search_names_remote(self):
+        """
+        Test whether a remote search returns at most 25 results
+        """
+        columns = ['T.torrent_id', 'infohash', 'status', 'num_seeders']
+        self.tdb.channelcast_db = ChannelCastDBHandler(self.session)
+        self.assertLessEqual(len(self.tdb.searchNames(['content'], local=False, keys=columns)), 25)
@@ -0,0 +1,34 @@
+from Tribler.Core.CacheDB.suggestion_index import BKTree, levenshtein, max_suggestion_distance
+from Tribler.Test.Core.base_test import TriblerCoreTest
+
+
+class TestSuggestionIndex(TriblerCoreTest):
+
+    def test_levenshtein(self):
+        self.assertEqual(levenshtein("kitten", "sitting"), 3)
+        self.assertEqual(levenshtein("", "abc"), 3)
+        self.assertEqual(levenshtein("ubuntu", "ubuntu"), 0)
+
+    def test_max_suggestion_distance(self):
+        self.assertEqual(max_suggestion_distance("cont"), 1)
+        self.assertEqual(max_suggestion_distance("content"), 2)
+
+    def test_bk_tree_add(self):
+        bk_tree = BKTree()
+        self.assertTrue(bk_tree.add("ubuntu"))
+        self.assertTrue(bk_tree.add("debian"))
+        self.assertFalse(bk_tree.add("ubuntu"))
+        self.assertEqual(len(bk_tree), 2)
+
+    def test_bk_tree_search(self):
+        bk_tree = BKTree()
+        for term in ["ubuntu", "kubuntu", "xubuntu", "debian", "fedora", "ubunto"]:
+            bk_tree.add(term)
+
+        self.assertEqual(sorted(bk_tree.search("ubuntu", 0)), [(0, "ubuntu")])
+        self.assertEqual(sorted(bk_tree.search("ubuntu", 1)), [(0, "ubuntu"), (1, "kubuntu"), (1, "ubunto"),
+                                                                (1, "xubuntu")])
+        self.assertEqual(bk_tree.search("gentoo", 1), [])
+
+    def test_bk_tree_search_empty(self):
+        self.assertEqual(BKTree().search("ubuntu", 2), [])
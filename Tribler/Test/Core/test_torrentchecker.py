@@ -1,7 +1,7 @@
 import time
 
 from Tribler.Core.Modules.tracker_manager import TrackerManager
-from Tribler.Core.TorrentChecker.session import UdpTrackerSession, HttpTrackerSession
+from Tribler.Core.TorrentChecker.session import UdpTrackerSession, DHT_MAX_PENDING_LOOKUPS
 from Tribler.Core.TorrentChecker.torrent_checker import TorrentChecker
 from Tribler.Core.Utilities.twisted_thread import deferred
 from Tribler.Test.test_as_server import TestAsServer
@@ -15,8 +15,9 @@ class TestTorrentChecker(TestAsServer):
     @deferred(timeout=20)
     def test_torrent_checker_session_timout_retry(self):
         session = UdpTrackerSession("http://localhost/test", ("localhost", 4782), "/test", None)
-        session2 = HttpTrackerSession("http://localhost/test", ("localhost", 8475), "/test", None)
+        session2 = UdpTrackerSession("http://localhost/test", ("localhost", 4783), "/test", None)
         session._last_contact = int(time.time()) - (session.retry_interval() + 1)
+        session2._last_contact = int(time.time())
         session.create_connection()
         session2.create_connection()
         session._is_initiated = True
@@ -27,7 +28,8 @@ class TestTorrentChecker(TestAsServer):
         torrent_checker = TorrentChecker(self.session)
         torrent_checker._session_list.append(session)
         torrent_checker._session_list.append(session2)
-        torrent_checker.check_sessions()
+        torrent_checker._check_session_timeout(session)
+        torrent_checker._check_session_timeout(session2)
         self.assertEqual(session._retries, 1, "Retries was %s while it should've been 1" % session._retries)
         self.assertEqual(session2._retries, 0, "Retries was not 0")
         return torrent_checker.shutdown()
@@ -47,3 +49,38 @@ class TestTorrentChecker(TestAsServer):
         torrent_checker.check_timed_out_udp_session([session])
         self.assertEqual(session._retries, 1, "Retries was %s while it should've been 1" % session._retries)
         return torrent_checker.shutdown()
+
+    @deferred(timeout=20)
+    def test_torrent_checker_max_concurrent_sessions(self):
+        self.session.lm.tracker_manager = TrackerManager(self.session)
+        self.session.lm.tracker_manager.initialize()
+        torrent_checker = TorrentChecker(self.session)
+        torrent_checker._max_concurrent_sessions = 2
+
+        for i in xrange(3):
+            self.assertTrue(torrent_checker._schedule_check(i, i, "%020d" % i, u"udp://localhost:%d" % (4782 + i)))
+        self.assertFalse(torrent_checker._schedule_check(0, 0, "%020d" % 0, u"udp://localhost:4782"))
+        self.assertTrue(torrent_checker._schedule_check(0, 3, "%020d" % 3, u"udp://localhost:4782"))
+
+        torrent_checker._process_pending_requests()
+        self.assertEqual(torrent_checker.get_statistics()[u'active_sessions'], 2)
+        self.assertEqual(torrent_checker.get_statistics()[u'queued_checks'], 1)
+        self.assertEqual(len(torrent_checker._session_list[1].infohash_list), 2)
+        return torrent_checker.shutdown()
+
+    @deferred(timeout=20)
+    def test_torrent_checker_full_dht_session(self):
+        self.session.lm.tracker_manager = TrackerManager(self.session)
+        self.session.lm.tracker_manager.initialize()
+        torrent_checker = TorrentChecker(self.session)
+        dht_session = torrent_checker._session_list[0]
+        dht_session._pending_lookups.update("%020d" % i for i in xrange(DHT_MAX_PENDING_LOOKUPS))
+
+        self.assertTrue(torrent_checker._schedule_check(0, 0, "a" * 20, u"DHT"))
+        self.assertTrue(torrent_checker._schedule_check(1, 1, "b" * 20, u"udp://localhost:4782"))
+
+        torrent_checker._process_pending_requests()
+        self.assertEqual(torrent_checker.get_statistics()[u'active_sessions'], 1)
+        self.assertEqual(torrent_checker.get_statistics()[u'queued_checks'], 1)
+        self.assertEqual(torrent_checker._check_queue[0][3], u"DHT")
+        return torrent_checker.shutdown()
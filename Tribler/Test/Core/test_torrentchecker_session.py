@@ -6,9 +6,11 @@ from twisted.internet.task import Clock
 from twisted.internet.defer import Deferred, DeferredList
 
 
-from Tribler.Core.TorrentChecker.session import HttpTrackerSession, UDPScraper, UdpTrackerSession
+from Tribler.Core.TorrentChecker.session import (HttpTrackerSession, UDPScraper, UdpTrackerSession, FakeDHTSession,
+                                                 DHT_MAX_PENDING_LOOKUPS)
 from Tribler.Core.Utilities.twisted_thread import deferred, reactor
-from Tribler.Test.Core.base_test import TriblerCoreTest
+from Tribler.Test.Core.base_test import TriblerCoreTest, MockObject
+from Tribler.dispersy.util import blocking_call_on_reactor_thread
 
 
 class ClockedUDPCrawler(UDPScraper):
@@ -257,3 +259,24 @@ class TestTorrentCheckerSession(TriblerCoreTest):
         session.on_ip_address_resolved("127.0.0.1")
         self.assertNotEquals(session.scraper, scraper, "Scrapers are identical while they should not be")
         return session.cleanup()
+
+    @blocking_call_on_reactor_thread
+    def test_dhtsession_max_pending_lookups(self):
+        timeout_callbacks = []
+        tribler_session = MockObject()
+        tribler_session.lm = MockObject()
+        tribler_session.lm.ltmgr = MockObject()
+        tribler_session.lm.ltmgr.get_metainfo = lambda infohash, callback, timeout_callback, need_peers: \
+            timeout_callbacks.append(timeout_callback)
+        session = FakeDHTSession(tribler_session, lambda _: None)
+
+        for i in xrange(DHT_MAX_PENDING_LOOKUPS):
+            self.assertTrue(session.can_add_request())
+            session.add_request("%020d" % i)
+        self.assertFalse(session.can_add_request())
+        self.assertTrue(session.has_request("%020d" % 0))
+
+        timeout_callbacks[0]("%020d" % 0)
+        self.assertFalse(session.has_request("%020d" % 0))
+        self.assertTrue(session.can_add_request())
+        self.assertEqual(session.num_pending_lookups, DHT_MAX_PENDING_LOOKUPS - 1)
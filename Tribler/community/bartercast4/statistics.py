@@ -1,4 +1,5 @@
 from Tribler.dispersy.database import Database
+import heapq
 import random
 from operator import itemgetter
 from collections import defaultdict
@@ -6,12 +7,19 @@ from os import path
 from threading import RLock
 import logging
 
+# Seconds between two flushes of the counters that are kept per address into the bartercast statistics
+BARTERCAST_FLUSH_INTERVAL = 5.0
+
 
 class BarterStatistics(object):
     def __init__(self):
         self.db = None
         self._db_counter = dict()
         self._lock = RLock()
+        # (stats_type, address) -> value, increased on the packet path and periodically flushed into bartercast
+        self._pending = {}
+        # (stats_type, peer) pairs that changed since they were last persisted
+        self._dirty = set()
         self.bartercast = defaultdict()
         self.db_closed = True
         for t in BartercastStatisticTypes.reverse_mapping:
@@ -26,6 +34,25 @@ class BarterStatistics(object):
                 self.bartercast[stats_type][peer] = value
             else:
                 self.bartercast[stats_type][peer] += value
+            self._dirty.add((stats_type, peer))
+
+    def inc_bartercast_address(self, stats_type, address, value=1):
+        """
+        Increases the statistic of the peer at address (an (ip, port) tuple). Only a counter per address is kept, so
+        it is cheap enough to call for every packet. The value is added to the bartercast statistics by flush_pending.
+        """
+        key = (stats_type, address)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + value
+
+    def flush_pending(self):
+        """
+        Adds the values collected by inc_bartercast_address to the bartercast statistics.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for (stats_type, address), value in pending.iteritems():
+            self.dict_inc_bartercast(stats_type, "%s:%s" % address, value)
 
     def get_top_n_bartercast_statistics(self, key, n):
         """
@@ -34,6 +61,7 @@ class BarterStatistics(object):
         as well.
         @TODO check if random portion should be larger or smaller
         """
+        self.flush_pending()
         with self._lock:
             # shouldn't happen but dont crash the program when bartercast statistics are not available
             if not hasattr(self, "bartercast"):
@@ -46,13 +74,15 @@ class BarterStatistics(object):
             if d is not None:
                 random_n = n / 2
                 fixed_n = n - random_n
-                sorted_list = sorted(d.items(), key=itemgetter(1), reverse=True)
-                top_stats = sorted_list[0:fixed_n]
+                # Only the top fixed_n statistics have to be ordered, so use a heap rather than sorting all of them
+                top_stats = heapq.nlargest(fixed_n, d.iteritems(), key=itemgetter(1))
                 self._logger.debug("len d: %d, fixed_n: %d" % (len(d), fixed_n))
                 if len(d) <= fixed_n:
                     random_stats = []
                 else:
-                    random_stats = random.sample(sorted_list[fixed_n:len(d)], min(random_n, len(d) - fixed_n))
+                    top_peers = set(peer for peer, _ in top_stats)
+                    other_stats = [item for item in d.iteritems() if item[0] not in top_peers]
+                    random_stats = random.sample(other_stats, min(random_n, len(other_stats)))
                 return top_stats + random_stats
             return None
 
@@ -77,11 +107,14 @@ class BarterStatistics(object):
         if not self.should_persist(key, n):
             return
 
+        self.flush_pending()
         self._init_database(dispersy)
         self._logger.debug("persisting bc data")
-        for t in self.bartercast:
-            for peer in self.bartercast[t]:
-                self.db.execute(u"INSERT OR REPLACE INTO statistic (type, peer, value) values (?, ?, ?)", (t, unicode(peer), self.bartercast[t][peer]))
+        # Only the statistics that changed since the last time they were persisted are written
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [(t, unicode(peer), self.bartercast[t][peer]) for t, peer in dirty if peer in self.bartercast[t]]
+        self.db.executemany(u"INSERT OR REPLACE INTO statistic (type, peer, value) values (?, ?, ?)", rows)
         self._logger.debug("data persisted")
 
     def load_statistics(self, dispersy):
@@ -100,7 +133,9 @@ class BarterStatistics(object):
             if not t in statistics:
                 statistics[t] = defaultdict()
             statistics[t][peer] = value
-        self.bartercast = statistics
+        with self._lock:
+            self.bartercast = statistics
+            self._dirty = set()
         return statistics
 
     def _init_database(self, dispersy):
@@ -8,6 +8,7 @@ Full documentation will be available at http://repository.tudelft.nl/.
 
 import logging
 import base64
+import time
 from twisted.internet.task import LoopingCall
 from Tribler.Core.Session import Session
 from Tribler.Core.CacheDB.sqlitecachedb import forceDBThread
@@ -33,6 +34,13 @@ CRAWL_RESUME = u"crawl_resume"
 # Divide by this to convert from bytes to MegaBytes.
 MEGA_DIVIDER = 1024 * 1024
 
+# The maximum number of blocks sent in response to a single crawl request.
+CRAWL_BATCH_SIZE = 100
+# The number of ranges of blocks that the crawler requests from a node at once.
+CRAWL_PIPELINE_DEPTH = 4
+# The crawl of a node is considered done when no range of blocks was requested from it for this many seconds.
+CRAWL_FRONTIER_TIMEOUT = 60
+
 
 class MultiChainCommunity(Community):
     """
@@ -52,6 +60,9 @@ class MultiChainCommunity(Community):
 
         # No response is expected yet.
         self.expected_response = None
+        # The highest sequence number that has been requested from a public key in the current crawl, and the time of
+        # the last request.
+        self._crawl_frontier = {}
 
     @classmethod
     def get_master_members(cls, dispersy):
@@ -270,8 +281,12 @@ class MultiChainCommunity(Community):
         self.persistence.add_block(block)
 
     def send_crawl_request(self, candidate, sequence_number=None):
+        public_key = candidate.get_member().public_key
         if sequence_number is None:
-            sequence_number = self.persistence.get_latest_sequence_number(candidate.get_member().public_key)
+            # A new crawl starts, forget the crawls that are done
+            self._prune_crawl_frontier()
+            sequence_number = self.persistence.get_latest_sequence_number(public_key)
+        self._crawl_frontier[public_key] = (sequence_number, time.time())
         self.logger.info("Crawler: Requesting crawl from node %s, from sequence number %d",
                          base64.encodestring(candidate.get_member().mid).strip(), sequence_number)
         meta = self.get_meta_message(CRAWL_REQUEST)
@@ -289,7 +304,7 @@ class MultiChainCommunity(Community):
             self.crawl_requested(message.candidate, message.payload.requested_sequence_number)
 
     def crawl_requested(self, candidate, sequence_number):
-        blocks = self.persistence.get_blocks_since(self._public_key, sequence_number)
+        blocks = self.persistence.get_blocks_since(self._public_key, sequence_number, CRAWL_BATCH_SIZE)
         if len(blocks) > 0:
             self.logger.debug("Crawler: Sending %d blocks", len(blocks))
             messages = [self.get_meta_message(CRAWL_RESPONSE)
@@ -299,15 +314,15 @@ class MultiChainCommunity(Community):
                                   payload=block.to_payload()) for block in blocks]
             self.dispersy.store_update_forward(messages, False, False, True)
             if len(blocks) > 1:
-                # we sent more than 1 block. Send a resumption token so the other side knows it should continue crawling
-                # last_block = blocks[-1]
-                # resumption_number = last_block.sequence_number_requster if
-                # last_block.mid_requester == self._mid else last_block.sequence_number_responder
+                # we sent more than 1 block. Send a resumption token so the other side knows where to continue.
+                # It continues at the last block we sent, so it can check that the ranges of blocks link up.
+                last_block = blocks[-1]
+                resumption_number = last_block.sequence_number_requester \
+                    if last_block.public_key_requester == self._public_key else last_block.sequence_number_responder
                 message = self.get_meta_message(CRAWL_RESUME).impl(authentication=(self.my_member,),
                                                                    distribution=(self.claim_global_time(),),
                                                                    destination=(candidate,),
-                                                                   # payload=(resumption_number))
-                                                                   payload=())
+                                                                   payload=(resumption_number,))
                 self.dispersy.store_update_forward([message], False, False, True)
         else:
             # This is slightly worrying since the last block should always be returned.
@@ -316,24 +331,117 @@ class MultiChainCommunity(Community):
 
     def received_crawl_response(self, messages):
         self.logger.debug("Crawler: Valid %d block response(s) received.", len(messages))
+        blocks = []
         for message in messages:
             requester = self.dispersy.get_member(public_key=message.payload.public_key_requester)
             responder = self.dispersy.get_member(public_key=message.payload.public_key_responder)
-            block = DatabaseBlock.from_block_response_message(message, requester, responder)
-            # Create the hash of the message
-            if not self.persistence.contains(block.hash_requester):
+            blocks.append((DatabaseBlock.from_block_response_message(message, requester, responder), message))
+        blocks = self._check_chain_links(blocks)
+
+        # Check which blocks are known with a single query, and persist the new blocks in a single transaction
+        known = self.persistence.get_known_hash_requesters(block.hash_requester for block, _ in blocks)
+        new_blocks = []
+        for block, message in blocks:
+            if block.hash_requester not in known:
+                known.add(block.hash_requester)
                 self.logger.info("Crawler: Persisting sr: %s from ip (%s:%d)",
                                  base64.encodestring(block.hash_requester).strip(),
                                  message.candidate.sock_addr[0],
                                  message.candidate.sock_addr[1])
-                self.persistence.add_block(block)
+                new_blocks.append(block)
             else:
                 self.logger.debug("Crawler: Received already known block")
 
+        if new_blocks:
+            self.persistence.add_blocks(new_blocks)
+
+    @staticmethod
+    def _get_chain_half(block, public_key):
+        """
+        Returns the (sequence number, previous hash, hash) of the half of a block in the chain of public_key, or None
+        if the block does not have a signed half in that chain.
+        """
+        if block.public_key_requester == public_key:
+            return block.sequence_number_requester, block.previous_hash_requester, block.hash_requester
+        if block.public_key_responder == public_key and block.sequence_number_responder != -1:
+            return block.sequence_number_responder, block.previous_hash_responder, block.hash_responder
+        return None
+
+    def _check_chain_links(self, blocks):
+        """
+        Drop the crawled blocks that do not link up with the block before them in the chain of the node that sent them.
+        The hash of that block is looked up in the database and in the crawled blocks, so the first block of a range
+        is checked against the last block of the range before it. Blocks of which the block before them is unknown
+        cannot be checked and are kept.
+        :param blocks: A list of (block, message) tuples.
+        :return: The list of (block, message) tuples that link up.
+        """
+        halves = []
+        hashes = {}
+        for block, message in blocks:
+            public_key = message.authentication.member.public_key
+            half = self._get_chain_half(block, public_key)
+            halves.append((public_key, half))
+            if half:
+                hashes.setdefault(public_key, {}).setdefault(half[0], half[2])
+
+        for public_key, chain_hashes in hashes.iteritems():
+            # The blocks that are already known take precedence over the crawled ones
+            chain_hashes.update(self.persistence.get_hashes_between(public_key, min(chain_hashes) - 1,
+                                                                    max(chain_hashes)))
+
+        linked_blocks = []
+        for (block, message), (public_key, half) in zip(blocks, halves):
+            if half:
+                sequence_number, previous_hash, _ = half
+                expected_hash = GENESIS_ID if sequence_number == 0 else \
+                    hashes[public_key].get(sequence_number - 1)
+                if expected_hash is not None and previous_hash != expected_hash:
+                    self.logger.warning("Crawler: Dropping block %d of %s, it does not link up with the previous block",
+                                        sequence_number, base64.encodestring(message.authentication.member.mid).strip())
+                    continue
+            linked_blocks.append((block, message))
+        return linked_blocks
+
     def received_crawl_resumption(self, messages):
         self.logger.info("Crawler: Valid %s crawl resumptions received.", len(messages))
         for message in messages:
-            self.send_crawl_request(message.candidate)
+            if message.payload.requested_sequence_number < 0:
+                # Older nodes do not tell where to continue, so continue at the latest block we know of
+                self.send_crawl_request(message.candidate)
+            else:
+                self.pipeline_crawl_requests(message.candidate, message.payload.requested_sequence_number)
+
+    def pipeline_crawl_requests(self, candidate, sequence_number):
+        """
+        Request the next CRAWL_PIPELINE_DEPTH ranges of blocks from a candidate, starting at sequence_number.
+        Ranges that have already been requested in the current crawl are skipped.
+        :param candidate: The candidate that is crawled.
+        :param sequence_number: The sequence number of the first block of the first range.
+        """
+        frontier = self._get_crawl_frontier(candidate.get_member().public_key)
+        for start in xrange(sequence_number, sequence_number + CRAWL_PIPELINE_DEPTH * CRAWL_BATCH_SIZE,
+                            CRAWL_BATCH_SIZE):
+            if start > frontier:
+                self.send_crawl_request(candidate, start)
+
+    def _get_crawl_frontier(self, public_key):
+        """
+        Returns the highest sequence number that has been requested from a public key in the current crawl, or -1 if
+        the public key is not being crawled.
+        """
+        sequence_number, request_time = self._crawl_frontier.get(public_key, (-1, 0))
+        return sequence_number if request_time >= time.time() - CRAWL_FRONTIER_TIMEOUT else -1
+
+    def _prune_crawl_frontier(self):
+        """
+        Removes the public keys from which no range of blocks was requested for CRAWL_FRONTIER_TIMEOUT seconds. Their
+        crawls are done, or the nodes have gone away.
+        """
+        deadline = time.time() - CRAWL_FRONTIER_TIMEOUT
+        for public_key, (_, request_time) in self._crawl_frontier.items():
+            if request_time < deadline:
+                del self._crawl_frontier[public_key]
 
     @blocking_call_on_reactor_thread
     def get_statistics(self):
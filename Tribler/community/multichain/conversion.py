@@ -32,6 +32,9 @@ append_size = calcsize(append_format)
 crawl_request_format = 'i'
 crawl_request_size = calcsize(crawl_request_format)
 
+crawl_resume_format = 'i'
+crawl_resume_size = calcsize(crawl_resume_format)
+
 # [signature, pk]
 authentication_format = str(PK_LENGTH) + 's ' + str(SIG_LENGTH) + 's '
 # [Up, Down, TotalUpRequester, TotalDownRequester, sequence_number_requester, previous_hash_requester,
@@ -151,7 +154,7 @@ class MultiChainConversion(BinaryConversion):
         :param message: Message.impl of CrawlResumePayload.impl
         return encoding of the message ready to be sent over the network
         """
-        return '',
+        return pack(crawl_resume_format, message.payload.requested_sequence_number),
 
     @staticmethod
     def _decode_crawl_resume(placeholder, offset, data):
@@ -162,7 +165,17 @@ class MultiChainConversion(BinaryConversion):
         :param data: ByteStream containing the message.
         :return: (offset, CrawlResume.impl)
         """
-        return offset, placeholder.meta.payload.implement()
+        if len(data) == offset:
+            # The sequence number to continue at is optional, older versions do not include it
+            return offset, placeholder.meta.payload.implement()
+
+        if len(data) < offset + crawl_resume_size:
+            raise DropPacket("Unable to decode the payload")
+
+        values = unpack_from(crawl_resume_format, data, offset)
+        offset += crawl_resume_size
+
+        return offset, placeholder.meta.payload.implement(*values)
 
 
 def split_function(payload):
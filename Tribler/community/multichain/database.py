@@ -10,7 +10,26 @@ DATABASE_DIRECTORY = path.join(u"sqlite")
 # Path to the database location + dispersy._workingdirectory
 DATABASE_PATH = path.join(DATABASE_DIRECTORY, u"multichain.db")
 # Version to keep track if the db schema needs to be updated.
-LATEST_DB_VERSION = 1
+LATEST_DB_VERSION = 2
+# Every block consists of a requester half and a responder half, each belonging to the chain of one public key.
+# The multi_chain_half table indexes the halves by (public_key, sequence_number), so looking up the latest half or the
+# halves since a sequence number of a single chain does not have to scan all blocks.
+half_block_schema = u"""
+CREATE TABLE IF NOT EXISTS multi_chain_half(
+ public_key                 TEXT NOT NULL,
+ sequence_number            INTEGER NOT NULL,
+ block_hash                 TEXT NOT NULL,
+ total_up                   UNSIGNED BIG INT NOT NULL,
+ total_down                 UNSIGNED BIG INT NOT NULL,
+ hash_requester             TEXT NOT NULL,
+
+ PRIMARY KEY (public_key, sequence_number)
+ );
+
+CREATE INDEX IF NOT EXISTS multi_chain_half_latest
+ ON multi_chain_half(public_key, sequence_number, block_hash, total_up, total_down);
+CREATE INDEX IF NOT EXISTS multi_chain_hash_responder ON multi_chain(hash_responder);
+"""
 # Schema for the MultiChain DB.
 schema = u"""
 CREATE TABLE IF NOT EXISTS multi_chain(
@@ -38,7 +57,23 @@ CREATE TABLE IF NOT EXISTS multi_chain(
 
 CREATE TABLE option(key TEXT PRIMARY KEY, value BLOB);
 INSERT INTO option(key, value) VALUES('database_version', '""" + str(LATEST_DB_VERSION) + u"""');
+""" + half_block_schema
+# Upgrade from version 1, which only had the multi_chain table.
+upgrade_to_version_2 = half_block_schema + u"""
+INSERT OR IGNORE INTO multi_chain_half
+ SELECT public_key_requester, sequence_number_requester, hash_requester, total_up_requester, total_down_requester,
+ hash_requester FROM multi_chain;
+INSERT OR IGNORE INTO multi_chain_half
+ SELECT public_key_responder, sequence_number_responder, hash_responder, total_up_responder, total_down_responder,
+ hash_requester FROM multi_chain WHERE sequence_number_responder != -1;
+UPDATE option SET value = '2' WHERE key = 'database_version';
 """
+# The columns of a block, in the order expected by DatabaseBlock.
+BLOCK_COLUMNS = (u"public_key_requester", u"public_key_responder", u"up", u"down",
+                 u"total_up_requester", u"total_down_requester", u"sequence_number_requester",
+                 u"previous_hash_requester", u"signature_requester", u"hash_requester",
+                 u"total_up_responder", u"total_down_responder", u"sequence_number_responder",
+                 u"previous_hash_responder", u"signature_responder", u"hash_responder", u"insert_time")
 
 
 class MultiChainDB(Database):
@@ -65,6 +100,22 @@ class MultiChainDB(Database):
         Persist a block
         :param block: The data that will be saved.
         """
+        self.add_blocks([block])
+
+    def add_blocks(self, blocks):
+        """
+        Persist several blocks in a single transaction
+        :param blocks: The blocks that will be saved.
+        """
+        for block in blocks:
+            self._insert_block(block)
+        self.commit()
+
+    def _insert_block(self, block):
+        """
+        Insert a block without committing.
+        :param block: The data that will be saved.
+        """
         data = (buffer(block.public_key_requester), buffer(block.public_key_responder), block.up, block.down,
                 block.total_up_requester, block.total_down_requester,
                 block.sequence_number_requester, buffer(block.previous_hash_requester),
@@ -81,7 +132,28 @@ class MultiChainDB(Database):
             u"signature_responder, hash_responder) "
             u"VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
             data)
-        self.commit()
+        self._add_half_block(block.public_key_requester, block.sequence_number_requester, block.hash_requester,
+                             block.total_up_requester, block.total_down_requester, block.hash_requester)
+        self._add_responder_half_block(block)
+
+    def _add_responder_half_block(self, block):
+        """
+        Index the responder half of a block, if the responder has signed it.
+        :param block: The block of which the responder half is indexed.
+        """
+        if block.sequence_number_responder != -1:
+            self._add_half_block(block.public_key_responder, block.sequence_number_responder, block.hash_responder,
+                                 block.total_up_responder, block.total_down_responder, block.hash_requester)
+
+    def _add_half_block(self, public_key, sequence_number, block_hash, total_up, total_down, hash_requester):
+        """
+        Index a half of a block in the chain of public_key. If the chain already has a half with the same sequence
+        number, that half is kept.
+        """
+        self.execute(
+            u"INSERT OR IGNORE INTO multi_chain_half (public_key, sequence_number, block_hash, total_up, total_down, "
+            u"hash_requester) VALUES(?,?,?,?,?,?)",
+            (buffer(public_key), sequence_number, buffer(block_hash), total_up, total_down, buffer(hash_requester)))
 
     def update_block_with_responder(self, block):
         """
@@ -100,6 +172,7 @@ class MultiChainDB(Database):
             u"signature_responder = ?, hash_responder = ? "
             u"WHERE hash_requester = ?",
             data)
+        self._add_responder_half_block(block)
         self.commit()
 
     def get_latest_hash(self, public_key):
@@ -110,16 +183,24 @@ class MultiChainDB(Database):
         :param public_key: The public_key for which the latest hash has to be found.
         :return: the relevant hash
         """
-        public_key = buffer(public_key)
-        db_query = u"SELECT block_hash FROM (" \
-                   u"SELECT hash_requester AS block_hash, sequence_number_requester AS sequence_number " \
-                   u"FROM multi_chain WHERE public_key_requester = ? " \
-                   u"UNION " \
-                   u"SELECT hash_responder AS block_hash, sequence_number_responder AS sequence_number " \
-                   u"FROM multi_chain WHERE public_key_responder = ?) ORDER BY sequence_number DESC LIMIT 1"
-        db_result = self.execute(db_query, (public_key, public_key)).fetchone()
+        db_query = u"SELECT block_hash FROM multi_chain_half WHERE public_key = ? " \
+                   u"ORDER BY sequence_number DESC LIMIT 1"
+        db_result = self.execute(db_query, (buffer(public_key),)).fetchone()
         return str(db_result[0]) if db_result else None
 
+    def get_hashes_between(self, public_key, first_sequence_number, last_sequence_number):
+        """
+        Get the relevant hashes of the blocks in the chain of a public key, between two sequence numbers.
+        :param public_key: The public_key of the chain.
+        :param first_sequence_number: The lowest sequence number, inclusive.
+        :param last_sequence_number: The highest sequence number, inclusive.
+        :return: A dictionary of the relevant hashes by sequence number, of the blocks that are known.
+        """
+        db_query = u"SELECT sequence_number, block_hash FROM multi_chain_half WHERE public_key = ? " \
+                   u"AND sequence_number BETWEEN ? AND ?"
+        db_result = self.execute(db_query, (buffer(public_key), first_sequence_number, last_sequence_number))
+        return dict((sequence_number, str(block_hash)) for sequence_number, block_hash in db_result.fetchall())
+
     def get_latest_block(self, public_key):
         return self.get_by_hash(self.get_latest_hash(public_key))
 
@@ -164,46 +245,36 @@ class MultiChainDB(Database):
         :param public_key: The public key corresponding to the block
         :param sequence_number: The sequence number corresponding to the block.
         :return: The block that was requested or None"""
-        db_query = u"SELECT public_key_requester, public_key_responder, up, down, " \
-                   u"total_up_requester, total_down_requester, sequence_number_requester, previous_hash_requester, " \
-                   u"signature_requester, hash_requester, " \
-                   u"total_up_responder, total_down_responder, sequence_number_responder, previous_hash_responder, " \
-                   u"signature_responder, hash_responder, insert_time " \
-                   u"FROM (" \
-                   u"SELECT *, sequence_number_requester AS sequence_number, " \
-                   u"public_key_requester AS pk FROM `multi_chain` " \
-                   u"UNION " \
-                   u"SELECT *, sequence_number_responder AS sequence_number," \
-                   u"public_key_responder AS pk FROM `multi_chain`) " \
-                   u"WHERE sequence_number = ? AND pk = ? LIMIT 1"
-        db_result = self.execute(db_query, (sequence_number, buffer(public_key))).fetchone()
+        db_query = u"SELECT " + self._get_block_columns(u"M") + u" FROM multi_chain_half H " \
+                   u"JOIN multi_chain M ON M.hash_requester = H.hash_requester " \
+                   u"WHERE H.public_key = ? AND H.sequence_number = ? LIMIT 1"
+        db_result = self.execute(db_query, (buffer(public_key), sequence_number)).fetchone()
         # Create a DB Block or return None
         return self._create_database_block(db_result)
 
-    def get_blocks_since(self, public_key, sequence_number):
+    def get_blocks_since(self, public_key, sequence_number, limit=100):
         """
-        Returns database blocks with sequence number higher than or equal to sequence_number, at most 100 results
+        Returns database blocks with sequence number higher than or equal to sequence_number, at most limit results
         :param public_key: The public key corresponding to the member id
         :param sequence_number: The linear block number
+        :param limit: The maximum number of blocks to return
         :return A list of DB Blocks that match the criteria
         """
-        db_query = u"SELECT public_key_requester, public_key_responder, up, down, " \
-                   u"total_up_requester, total_down_requester, sequence_number_requester, previous_hash_requester, " \
-                   u"signature_requester, hash_requester, " \
-                   u"total_up_responder, total_down_responder, sequence_number_responder, previous_hash_responder, " \
-                   u"signature_responder, hash_responder, insert_time " \
-                   u"FROM (" \
-                   u"SELECT *, sequence_number_requester AS sequence_number," \
-                   u" public_key_requester AS public_key FROM `multi_chain` " \
-                   u"UNION " \
-                   u"SELECT *, sequence_number_responder AS sequence_number," \
-                   u" public_key_responder AS public_key FROM `multi_chain`) " \
-                   u"WHERE sequence_number >= ? AND public_key = ? " \
-                   u"ORDER BY sequence_number ASC " \
-                   u"LIMIT 100"
-        db_result = self.execute(db_query, (sequence_number, buffer(public_key))).fetchall()
+        db_query = u"SELECT " + self._get_block_columns(u"M") + u" FROM multi_chain_half H " \
+                   u"JOIN multi_chain M ON M.hash_requester = H.hash_requester " \
+                   u"WHERE H.public_key = ? AND H.sequence_number >= ? " \
+                   u"ORDER BY H.sequence_number ASC " \
+                   u"LIMIT ?"
+        db_result = self.execute(db_query, (buffer(public_key), sequence_number, limit)).fetchall()
         return [self._create_database_block(db_item) for db_item in db_result]
 
+    @staticmethod
+    def _get_block_columns(table_alias):
+        """
+        Returns the columns of a block, prefixed with the alias of the multi_chain table in a query.
+        """
+        return u", ".join(u"%s.%s" % (table_alias, column) for column in BLOCK_COLUMNS)
+
     def _create_database_block(self, db_result):
         """
         Create a Database block or return None.
@@ -234,6 +305,22 @@ class MultiChainDB(Database):
         db_result = self.execute(db_query, (buffer(hash_requester),)).fetchone()
         return db_result is not None
 
+    def get_known_hash_requesters(self, hash_requesters):
+        """
+        Check which of several blocks are existent in the persistence layer.
+        :param hash_requesters: The hash_requesters that are queried
+        :return: The set of hash_requesters of the blocks that exist.
+        """
+        known = set()
+        hash_requesters = list(hash_requesters)
+        # Stay well below the maximum number of parameters of a SQLite query
+        for index in xrange(0, len(hash_requesters), 500):
+            chunk = hash_requesters[index:index + 500]
+            db_query = u"SELECT hash_requester FROM multi_chain WHERE hash_requester IN (%s)" \
+                       % u",".join(u"?" * len(chunk))
+            known.update(str(x[0]) for x in self.execute(db_query, [buffer(h) for h in chunk]).fetchall())
+        return known
+
     def get_latest_sequence_number(self, public_key):
         """
         Return the latest sequence number known for this public_key.
@@ -241,13 +328,8 @@ class MultiChainDB(Database):
         :param public_key: Corresponding public key
         :return: sequence number (integer) or -1 if no block is known
         """
-        public_key = buffer(public_key)
-        db_query = u"SELECT MAX(sequence_number) FROM (" \
-                   u"SELECT sequence_number_requester AS sequence_number " \
-                   u"FROM multi_chain WHERE public_key_requester = ? UNION " \
-                   u"SELECT sequence_number_responder AS sequence_number " \
-                   u"FROM multi_chain WHERE public_key_responder = ? )"
-        db_result = self.execute(db_query, (public_key, public_key)).fetchone()[0]
+        db_query = u"SELECT MAX(sequence_number) FROM multi_chain_half WHERE public_key = ?"
+        db_result = self.execute(db_query, (buffer(public_key),)).fetchone()[0]
         return db_result if db_result is not None else -1
 
     def get_total(self, public_key):
@@ -257,15 +339,9 @@ class MultiChainDB(Database):
         :param public_key: public_key of the node
         :return: (total_up (int), total_down (int)) or (-1, -1) if no block is known.
         """
-        public_key = buffer(public_key)
-        db_query = u"SELECT total_up, total_down FROM (" \
-                   u"SELECT total_up_requester AS total_up, total_down_requester AS total_down, " \
-                   u"sequence_number_requester AS sequence_number FROM multi_chain " \
-                   u"WHERE public_key_requester = ? UNION " \
-                   u"SELECT total_up_responder AS total_up, total_down_responder AS total_down, " \
-                   u"sequence_number_responder AS sequence_number FROM multi_chain WHERE public_key_responder = ? ) " \
+        db_query = u"SELECT total_up, total_down FROM multi_chain_half WHERE public_key = ? " \
                    u"ORDER BY sequence_number DESC LIMIT 1"
-        db_result = self.execute(db_query, (public_key, public_key)).fetchone()
+        db_result = self.execute(db_query, (buffer(public_key),)).fetchone()
         return (db_result[0], db_result[1]) if db_result is not None and db_result[0] is not None \
                                                and db_result[1] is not None else (-1, -1)
 
@@ -290,6 +366,12 @@ class MultiChainDB(Database):
             self.executescript(schema)
             self.commit()
 
+        else:
+            # upgrade to version 2
+            if database_version < 2:
+                self.executescript(upgrade_to_version_2)
+                self.commit()
+
         return LATEST_DB_VERSION
 
 
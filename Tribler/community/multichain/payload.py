@@ -177,6 +177,15 @@ class CrawlResponsePayload(Payload):
 
 
 class CrawlResumePayload(Payload):
+    """
+    Tell the crawler to continue crawling at a specific sequence number, or at the latest block it knows if -1.
+    """
+
     class Implementation(Payload.Implementation):
-        def __init__(self, meta):
+        def __init__(self, meta, requested_sequence_number=-1):
             super(CrawlResumePayload.Implementation, self).__init__(meta)
+            self._requested_sequence_number = requested_sequence_number
+
+        @property
+        def requested_sequence_number(self):
+            return self._requested_sequence_number
@@ -22,6 +22,11 @@ REP_TTL_EXPIRED = 0x06
 REP_COMMAND_NOT_SUPPORTED = 0x07
 REP_ADDRESS_TYPE_NOT_SUPPORTED = 0x08
 
+UDP_HEADER = struct.Struct("!HBB")
+IPV4_ADDRESS = struct.Struct("!4sH")
+IPV6_ADDRESS = struct.Struct("!8HH")
+PORT = struct.Struct("!H")
+
 
 class MethodRequest(object):
 
@@ -134,6 +139,11 @@ def __encode_address(address_type, address):
     return data
 
 
+def __format_ipv6(groups):
+    # socket.inet_ntop is not available on Windows
+    return ":".join("%x" % group for group in groups[:8])
+
+
 def __decode_address(address_type, offset, data):
     if address_type == ADDRESS_TYPE_IPV4:
         destination_address = socket.inet_ntoa(data[offset:offset + 4])
@@ -144,7 +154,8 @@ def __decode_address(address_type, offset, data):
         destination_address = data[offset:offset + domain_length]
         offset += domain_length
     elif address_type == ADDRESS_TYPE_IPV6:
-        raise IPV6AddrError()
+        destination_address = __format_ipv6(IPV6_ADDRESS.unpack_from(data, offset))
+        offset += 16
     else:
         raise ValueError("Unsupported address type %r" % address_type )
 
@@ -229,6 +240,31 @@ def decode_udp_packet(data):
                       destination_port, payload)
 
 
+def decode_udp_header(data):
+    """
+    Decodes the header of a SOCKS5 UDP packet, without creating an UdpRequest
+    @param str data: the raw packet data
+    @return: tuple (frag, address_type, destination, payload_offset)
+    @rtype: (int, int, (str, int), int)
+    """
+    _, frag, address_type = UDP_HEADER.unpack_from(data)
+
+    if address_type == ADDRESS_TYPE_IPV4:
+        host, port = IPV4_ADDRESS.unpack_from(data, 4)
+        return frag, address_type, (socket.inet_ntoa(host), port), 10
+
+    elif address_type == ADDRESS_TYPE_DOMAIN_NAME:
+        end = 5 + ord(data[4])
+        port, = PORT.unpack_from(data, end)
+        return frag, address_type, (data[5:end], port), end + 2
+
+    elif address_type == ADDRESS_TYPE_IPV6:
+        address = IPV6_ADDRESS.unpack_from(data, 4)
+        return frag, address_type, (__format_ipv6(address), address[8]), 22
+
+    raise ValueError("Unsupported address type %r" % address_type)
+
+
 def encode_udp_packet(rsv, frag, address_type, address, port, payload):
     """
     Encodes a SOCKS5 UDP packet
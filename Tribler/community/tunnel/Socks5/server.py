@@ -1,4 +1,6 @@
 import logging
+import struct
+from collections import OrderedDict, defaultdict
 
 from twisted.internet import reactor
 from twisted.internet.protocol import Protocol, DatagramProtocol, connectionDone, Factory
@@ -32,6 +34,10 @@ class SocksUDPConnection(DatagramProtocol):
         else:
             self.remote_udp_address = None
 
+        self.pending = OrderedDict()
+        self.flush_call = None
+        self.stats = defaultdict(int)
+
         self.listen_port = reactor.listenUDP(0, self)
 
     def get_listen_port(self):
@@ -40,6 +46,8 @@ class SocksUDPConnection(DatagramProtocol):
     def sendDatagram(self, data):
         if self.remote_udp_address:
             self.transport.write(data, self.remote_udp_address)
+            self.stats['packets_down'] += 1
+            self.stats['bytes_down'] += len(data)
         else:
             self._logger.error("cannot send data, no clue where to send it to")
 
@@ -48,32 +56,66 @@ class SocksUDPConnection(DatagramProtocol):
         if self.remote_udp_address is None:
             self.remote_udp_address = source
 
-        if self.remote_udp_address == source:
-            try:
-                request = conversion.decode_udp_packet(data)
-            except conversion.IPV6AddrError:
-                self._logger.warning("Received an IPV6 udp datagram, dropping it (Not implemented yet)")
-                return
-
-            if request.frag == 0:
-                circuit = self.socksconnection.select(request.destination)
-
-                if not circuit:
-                    self._logger.debug(
-                        "No circuits available, dropping %d bytes to %s", len(request.payload), request.destination)
-                elif circuit.state != CIRCUIT_STATE_READY:
-                    self._logger.debug(
-                        "Circuit is not ready, dropping %d bytes to %s", len(request.payload), request.destination)
-                else:
-                    self._logger.debug("Sending data over circuit destined for %r:%r", *request.destination)
-                    circuit.tunnel_data(request.destination, request.payload)
-            else:
-                self._logger.debug("No support for fragmented data, dropping")
-        else:
+        if self.remote_udp_address != source:
             self._logger.debug("Ignoring data from %s:%d, is not %s:%d",
                                source[0], source[1], self.remote_udp_address[0], self.remote_udp_address[1])
+            return
+
+        try:
+            frag, address_type, destination, offset = conversion.decode_udp_header(data)
+        except (ValueError, struct.error):
+            self.stats['packets_dropped'] += 1
+            self._logger.debug("Dropping malformed udp datagram of %d bytes", len(data))
+            return
+
+        if frag != 0:
+            self.stats['packets_dropped'] += 1
+            self._logger.debug("No support for fragmented data, dropping")
+            return
+
+        if address_type == conversion.ADDRESS_TYPE_IPV6:
+            # Exit nodes only have IPv4 sockets, the tunnel cannot deliver this datagram
+            self.stats['packets_dropped'] += 1
+            self._logger.debug("Dropping udp datagram to IPv6 destination %s", destination[0])
+            return
+
+        circuit = self.socksconnection.destinations.get(destination) or self.socksconnection.select(destination)
+        if not circuit:
+            self.stats['packets_dropped'] += 1
+            self._logger.debug("No circuits available, dropping %d bytes to %s", len(data) - offset, destination)
+            return
+
+        # Datagrams are handed to the tunnel once the reactor is done reading, one batch per circuit
+        packets = self.pending.get(circuit)
+        if packets is None:
+            packets = self.pending[circuit] = []
+            if not self.flush_call:
+                self.flush_call = reactor.callLater(0, self.flush)
+        packets.append((destination, data[offset:]))
+
+    def flush(self):
+        if self.flush_call and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        pending, self.pending = self.pending, OrderedDict()
+
+        for circuit, packets in pending.iteritems():
+            if circuit.state != CIRCUIT_STATE_READY:
+                self.stats['packets_dropped'] += len(packets)
+                self._logger.debug("Circuit is not ready, dropping %d packets", len(packets))
+                continue
+
+            self._logger.debug("Sending %d packets over circuit %d", len(packets), circuit.circuit_id)
+            circuit.tunnel_data_batch(packets)
+            self.stats['packets_up'] += len(packets)
+            self.stats['bytes_up'] += sum(len(payload) for _, payload in packets)
 
     def close(self):
+        if self.flush_call:
+            self.flush_call.cancel()
+            self.flush_call = None
+        self.pending.clear()
+
         if self.listen_port:
             self.listen_port.stopListening()
             self.listen_port = None
@@ -475,8 +475,14 @@ class TunnelConversion(BinaryConversion):
     @staticmethod
     def decode_data(packet):
         circuit_id, = unpack_from("!I", packet)
-        offset = 4
+        return (circuit_id,) + TunnelConversion.decode_data_cell(packet, 4)
 
+    @staticmethod
+    def decode_data_cell(packet, offset=0):
+        """
+        Decodes the destination, origin and data of a decrypted data cell, starting at offset, so that the cell does
+        not have to be joined with its circuit id first.
+        """
         def decode_address(packet, offset):
             addr_type, = unpack_from("!B", packet, offset)
             offset += 1
@@ -502,7 +508,7 @@ class TunnelConversion(BinaryConversion):
 
         data = packet[offset:]
 
-        return circuit_id, dest_address, org_address, data
+        return dest_address, org_address, data
 
     @staticmethod
     def convert_from_cell(packet):
@@ -1,5 +1,7 @@
 import struct
 
+from cryptography.exceptions import InvalidTag
+
 from cryptowrapper import crypto_box_beforenm, crypto_auth, crypto_auth_verify, Cipher, algorithms, modes, HKDFExpand, hashes, default_backend
 from Tribler.dispersy.crypto import ECCrypto, LibNaCLPK
 
@@ -62,23 +64,62 @@ class TunnelCrypto(ECCrypto):
         return salt + str(salt_explicit)
 
     def encrypt_str(self, content, key, salt, salt_explicit):
-        # return the encrypted content prepended with the
-        # gcm tag and salt_explicit
-        cipher = Cipher(algorithms.AES(key),
-                        modes.GCM(initialization_vector=self._bulid_iv(salt, salt_explicit)),
-                        backend=default_backend()
-                        ).encryptor()
-        ciphertext = cipher.update(content) + cipher.finalize()
-        return struct.pack('!q16s', salt_explicit, cipher.tag) + ciphertext
+        return self._encrypt(content, algorithms.AES(key), salt, salt_explicit, default_backend())
 
     def decrypt_str(self, content, key, salt):
+        return self._decrypt(content, algorithms.AES(key), salt, default_backend())
+
+    def encrypt_cells(self, contents, session_keys, direction):
+        """
+        Encrypts a list of cells with one direction of session_keys, using the next salt_explicit for every cell.
+        The AES key is set up once for the whole list, every cell still needs its own GCM context as its IV differs.
+        :return: The list of encrypted cells.
+        """
+        cipher = algorithms.AES(session_keys[direction])
+        salt = session_keys[direction + 2]
+        backend = default_backend()
+
+        encrypted = []
+        for content in contents:
+            session_keys[direction + 4] += 1
+            encrypted.append(self._encrypt(content, cipher, salt, session_keys[direction + 4], backend))
+        return encrypted
+
+    def decrypt_cells(self, contents, session_keys, direction):
+        """
+        Decrypts a list of cells with one direction of session_keys.
+        :return: The list of decrypted cells, with None for every cell that could not be decrypted.
+        """
+        cipher = algorithms.AES(session_keys[direction])
+        salt = session_keys[direction + 2]
+        backend = default_backend()
+
+        decrypted = []
+        for content in contents:
+            try:
+                decrypted.append(self._decrypt(content, cipher, salt, backend))
+            except (InvalidTag, struct.error, CryptoException):
+                decrypted.append(None)
+        return decrypted
+
+    def _encrypt(self, content, cipher, salt, salt_explicit, backend):
+        # return the encrypted content prepended with the
+        # gcm tag and salt_explicit
+        encryptor = Cipher(cipher,
+                           modes.GCM(initialization_vector=self._bulid_iv(salt, salt_explicit)),
+                           backend=backend
+                           ).encryptor()
+        ciphertext = encryptor.update(content) + encryptor.finalize()
+        return struct.pack('!q16s', salt_explicit, encryptor.tag) + ciphertext
+
+    def _decrypt(self, content, cipher, salt, backend):
         # content contains the gcm tag and salt_explicit in plaintext
         salt_explicit, gcm_tag = struct.unpack_from('!q16s', content)
-        cipher = Cipher(algorithms.AES(key),
-                        modes.GCM(initialization_vector=self._bulid_iv(salt, salt_explicit), tag=gcm_tag),
-                        backend=default_backend()
-                        ).decryptor()
-        return cipher.update(content[24:]) + cipher.finalize()
+        decryptor = Cipher(cipher,
+                           modes.GCM(initialization_vector=self._bulid_iv(salt, salt_explicit), tag=gcm_tag),
+                           backend=backend
+                           ).decryptor()
+        return decryptor.update(content[24:]) + decryptor.finalize()
 
 class NoTunnelCrypto(TunnelCrypto):
 
@@ -99,7 +140,7 @@ class NoTunnelCrypto(TunnelCrypto):
         return ''
 
     def generate_session_keys(self, shared_secret):
-        return '\0' * 16, '\0' * 16, '\0' * 4, '\0' * 4, 1, 1
+        return ['\0' * 16, '\0' * 16, '\0' * 4, '\0' * 4, 1, 1]
 
     def encrypt_str(self, content, key, salt, salt_explicit):
         return content
@@ -107,5 +148,11 @@ class NoTunnelCrypto(TunnelCrypto):
     def decrypt_str(self, content, key, salt):
         return content
 
+    def encrypt_cells(self, contents, session_keys, direction):
+        return list(contents)
+
+    def decrypt_cells(self, contents, session_keys, direction):
+        return list(contents)
+
 if __name__ == "__main__":
     tc = TunnelCrypto()
@@ -462,7 +462,7 @@ class HiddenTunnelCommunity(TunnelCommunity):
 
     def create_e2e(self, circuit, sock_addr, info_hash, public_key):
         hop = Hop(self.crypto.key_from_public_bin(public_key))
-        hop.dh_secret, hop.dh_first_part = self.crypto.generate_diffie_secret()
+        hop.dh_secret, hop.dh_first_part = self.get_diffie_secret()
         if self.notifier:
             self.notifier.notify(NTFY_TUNNEL, NTFY_CREATE_E2E, info_hash.encode('hex')[:6])
         self.tunnel_logger.info("Create end to end initiated here")
@@ -585,6 +585,9 @@ class HiddenTunnelCommunity(TunnelCommunity):
 
             self.relay_from_to[circuit.circuit_id] = RelayRoute(relay_circuit.circuit_id, relay_circuit.sock_addr, True)
             self.relay_from_to[relay_circuit.circuit_id] = RelayRoute(circuit.circuit_id, circuit.sock_addr, True)
+            self.schedule_removal_check(u"relay", circuit.circuit_id, self.relay_from_to[circuit.circuit_id])
+            self.schedule_removal_check(u"relay", relay_circuit.circuit_id,
+                                        self.relay_from_to[relay_circuit.circuit_id])
 
     def check_linked_e2e(self, messages):
         for message in messages:
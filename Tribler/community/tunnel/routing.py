@@ -1,4 +1,5 @@
 import time
+from math import ceil
 
 from Tribler.community.tunnel import CIRCUIT_STATE_READY, CIRCUIT_STATE_BROKEN, CIRCUIT_STATE_EXTENDING, \
     CIRCUIT_TYPE_DATA
@@ -41,6 +42,7 @@ class Circuit(object):
         self.last_incoming = time.time()
         self.unverified_hop = None
         self.bytes_up = self.bytes_down = 0
+        self.rtt = None
 
         self.proxy = proxy
         self.ctype = ctype
@@ -96,11 +98,19 @@ class Circuit(object):
         @return bool: whether the tunnel request has succeeded, this is in no
          way an acknowledgement of delivery!
         """
+        return self.tunnel_data_batch([(destination, payload)])
 
-        self._logger.info("Tunnel data (len %d) to end for circuit %s with ultimate destination %s", len(payload),
-                           self.circuit_id, destination)
+    def tunnel_data_batch(self, packets):
+        """
+        Tunnel a list of packets over this circuit at once
+        @param [((str, int), str)] packets: the destination and payload of every packet
+        @return bool: whether the tunnel request has succeeded, this is in no
+         way an acknowledgement of delivery!
+        """
+        self._logger.debug("Tunnel %d packets to end for circuit %s", len(packets), self.circuit_id)
 
-        num_bytes = self.proxy.send_data([Candidate(self.first_hop, False)], self.circuit_id, destination, ('0.0.0.0', 0), payload)
+        num_bytes = self.proxy.send_data_batch([Candidate(self.first_hop, False)], self.circuit_id, ('0.0.0.0', 0),
+                                               packets)
         self.proxy.increase_bytes_sent(self, num_bytes)
 
         return num_bytes > 0
@@ -203,3 +213,47 @@ class RendezvousPoint(object):
         self.cookie = cookie
         self.finished_callback = finished_callback
         self.rp_info = None
+
+
+class TimerWheel(object):
+
+    """
+    Coarse timer wheel holding entries that have to be looked at again once their deadline has passed. Deadlines
+    beyond the horizon of the wheel are put in its last slot, so an entry may come out before its deadline: whoever
+    advances the wheel checks every entry it gets back and schedules it again if needed.
+    """
+
+    def __init__(self, tick_length=1.0, num_slots=1024):
+        """
+        @param float tick_length: the number of seconds covered by a single slot
+        @param int num_slots: the number of slots, the horizon of the wheel is tick_length * num_slots seconds
+        """
+        self.tick_length = tick_length
+        self.slots = [[] for _ in xrange(num_slots)]
+        self.tick = int(time.time() / tick_length)
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def schedule(self, entry, deadline):
+        """
+        Add an entry that will be returned by the first call to advance at or after its deadline
+        @param float deadline: the deadline as a time.time() timestamp
+        """
+        tick = min(max(int(ceil(deadline / self.tick_length)), self.tick), self.tick + len(self.slots) - 1)
+        self.slots[tick % len(self.slots)].append(entry)
+
+    def advance(self, now):
+        """
+        Move the wheel forward to now
+        @param float now: the current time as a time.time() timestamp
+        @return list: the entries of all slots that have passed
+        """
+        now_tick = int(now / self.tick_length)
+        expired = []
+        for tick in xrange(self.tick, min(now_tick + 1, self.tick + len(self.slots))):
+            slot = self.slots[tick % len(self.slots)]
+            expired.extend(slot)
+            del slot[:]
+        self.tick = max(self.tick, now_tick + 1)
+        return expired
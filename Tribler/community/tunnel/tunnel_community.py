@@ -2,21 +2,23 @@
 
 import random
 import time
-from collections import defaultdict
-from cryptography.exceptions import InvalidTag
+from abc import ABCMeta, abstractmethod
+from collections import defaultdict, deque
+from threading import Lock
 from twisted.internet.error import MessageLengthError
 
 from twisted.internet.defer import maybeDeferred, succeed
 
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 from twisted.internet.protocol import DatagramProtocol
 from twisted.internet.task import LoopingCall
 
 from Tribler.Core.Utilities.encoding import decode, encode
-from Tribler.community.bartercast4.statistics import BartercastStatisticTypes, _barter_statistics
+from Tribler.community.bartercast4.statistics import (BartercastStatisticTypes, _barter_statistics,
+                                                      BARTERCAST_FLUSH_INTERVAL)
 from Tribler.community.tunnel import (CIRCUIT_ID_PORT, CIRCUIT_STATE_EXTENDING, CIRCUIT_STATE_READY, CIRCUIT_TYPE_DATA,
                                       CIRCUIT_TYPE_RENDEZVOUS, CIRCUIT_TYPE_RP, EXIT_NODE, EXIT_NODE_SALT, ORIGINATOR,
-                                      ORIGINATOR_SALT, PING_INTERVAL)
+                                      PING_INTERVAL)
 from Tribler.community.tunnel.Socks5.server import Socks5Server
 from Tribler.community.tunnel.conversion import TunnelConversion
 from Tribler.community.tunnel.crypto.tunnelcrypto import CryptoException, TunnelCrypto
@@ -24,7 +26,7 @@ from Tribler.community.tunnel.payload import (CellPayload, CreatePayload, Create
                                               ExtendedPayload, PingPayload, PongPayload, StatsRequestPayload,
                                               StatsResponsePayload, TunnelIntroductionRequestPayload,
                                               TunnelIntroductionResponsePayload)
-from Tribler.community.tunnel.routing import Circuit, Hop, RelayRoute
+from Tribler.community.tunnel.routing import Circuit, Hop, RelayRoute, TimerWheel
 from Tribler.dispersy.authentication import MemberAuthentication, NoAuthentication
 from Tribler.dispersy.candidate import Candidate
 from Tribler.dispersy.community import Community
@@ -88,6 +90,7 @@ class PingRequestCache(RandomNumberCache):
         self.tunnel_logger = logging.getLogger('TunnelLogger')
         self.circuit = circuit
         self.community = community
+        self.send_time = time.time()
 
     @property
     def timeout_delay(self):
@@ -223,6 +226,12 @@ class TunnelSettings(object):
         self.max_packets_without_reply = 50
         self.dht_lookup_interval = 30
 
+        # Number of data circuits per hop count that are kept built on top of the circuits that are needed, once
+        # tunnels with that hop count have been requested
+        self.spare_circuits = {1: 2}
+        # Number of Diffie-Hellman key pairs that are generated in advance, outside of the reactor thread
+        self.dh_secret_pool_size = 32
+
         if tribler_session:
             self.become_exitnode = tribler_session.get_tunnel_community_exitnode_enabled()
             self.enable_multichain = tribler_session.get_enable_multichain()
@@ -238,14 +247,43 @@ class ExitCandidate(object):
         self.creation_time = time.time()
 
 
-class RoundRobin(object):
+class ReadyCircuits(object):
+    """
+    Index of the ready data circuits, grouped by their number of hops. The TunnelCommunity updates it whenever a data
+    circuit becomes ready or is removed, so the selection strategies below never have to scan all circuits.
+    """
+
+    def __init__(self):
+        self.rings = defaultdict(list)
+
+    def add(self, circuit):
+        ring = self.rings[len(circuit.hops)]
+        if circuit not in ring:
+            ring.append(circuit)
+
+    def remove(self, circuit):
+        ring = self.rings.get(len(circuit.hops))
+        if ring and circuit in ring:
+            ring.remove(circuit)
+
+    def get(self, hops):
+        """
+        Return the ready data circuits with the given number of hops, in the order in which they became ready.
+        """
+        return self.rings.get(hops, [])
+
+    def __len__(self):
+        return sum(len(ring) for ring in self.rings.itervalues())
+
+
+class CircuitSelectionStrategy(object):
+    __metaclass__ = ABCMeta
 
     def __init__(self, community):
         self.community = community
-        self.index = -1
 
     def has_options(self, hops):
-        return len(self.community.active_data_circuits(hops)) > 0
+        return len(self.community.ready_circuits.get(hops)) > 0
 
     def select(self, destination, hops):
         if destination and destination[1] == CIRCUIT_ID_PORT:
@@ -256,14 +294,41 @@ class RoundRobin(object):
                circuit.ctype == CIRCUIT_TYPE_RENDEZVOUS:
                 return circuit
 
-        circuit_ids = sorted(self.community.active_data_circuits(hops).keys())
-
-        if not circuit_ids:
+        circuits = self.community.ready_circuits.get(hops)
+        if not circuits:
             return None
+        return self.select_from(circuits, hops)
+
+    @abstractmethod
+    def select_from(self, circuits, hops):
+        """
+        Pick one of the (non-empty list of) ready data circuits with the given number of hops.
+        """
+        pass
+
+
+class RoundRobin(CircuitSelectionStrategy):
+
+    def __init__(self, community):
+        super(RoundRobin, self).__init__(community)
+        self.index = defaultdict(lambda: -1)
+
+    def select_from(self, circuits, hops):
+        self.index[hops] = (self.index[hops] + 1) % len(circuits)
+        return circuits[self.index[hops]]
 
-        self.index = (self.index + 1) % len(circuit_ids)
-        circuit_id = circuit_ids[self.index]
-        return self.community.active_data_circuits()[circuit_id]
+
+class LeastLoaded(CircuitSelectionStrategy):
+
+    def select_from(self, circuits, hops):
+        return min(circuits, key=lambda circuit: circuit.bytes_up)
+
+
+class LowestRTT(CircuitSelectionStrategy):
+
+    def select_from(self, circuits, hops):
+        # Circuits that have not answered a ping yet come last
+        return min(circuits, key=lambda circuit: (circuit.rtt is None, circuit.rtt))
 
 
 class TunnelCommunity(Community):
@@ -278,9 +343,15 @@ class TunnelCommunity(Community):
         self.relay_from_to = {}
         self.relay_session_keys = {}
         self.exit_sockets = {}
+        self.data_queue = []
+        self.data_queue_lock = Lock()
         self.circuits_needed = defaultdict(int)
         self.exit_candidates = {}
         self.notifier = None
+        self.ready_circuits = ReadyCircuits()
+        self.dh_secrets = deque()
+        self.removal_wheel = TimerWheel()
+        self.dh_secrets_refilling = False
         self.selection_strategy = RoundRobin(self)
         self.stats = defaultdict(int)
         self.creation_time = time.time()
@@ -302,11 +373,14 @@ class TunnelCommunity(Community):
         assert isinstance(self.settings.crypto, TunnelCrypto), self.settings.crypto
 
         self.crypto.initialize(self)
+        self.refill_diffie_secrets()
 
         self.dispersy.endpoint.listen_to(self.data_prefix, self.on_data)
 
         self.register_task("do_circuits", LoopingCall(self.do_circuits)).start(5, now=True)
         self.register_task("do_ping", LoopingCall(self.do_ping)).start(PING_INTERVAL)
+        self.register_task("flush_bartercast",
+                           LoopingCall(_barter_statistics.flush_pending)).start(BARTERCAST_FLUSH_INTERVAL, now=False)
 
         self.socks_server = Socks5Server(self, tribler_session.get_tunnel_community_socks5_listen_ports()
                                          if tribler_session else self.settings.socks_listen_ports)
@@ -397,6 +471,8 @@ class TunnelCommunity(Community):
         for circuit_id in self.exit_sockets.keys():
             self.remove_exit_socket(circuit_id, 'unload', destroy=True)
 
+        _barter_statistics.flush_pending()
+
         super(TunnelCommunity, self).unload_community()
 
     @property
@@ -425,9 +501,36 @@ class TunnelCommunity(Community):
 
         return circuit_id
 
+    def get_diffie_secret(self):
+        """
+        Return a Diffie-Hellman key pair, taken from the pool of pregenerated pairs when possible.
+        """
+        dh_secret = self.dh_secrets.popleft() if self.dh_secrets else self.crypto.generate_diffie_secret()
+        self.refill_diffie_secrets()
+        return dh_secret
+
+    def refill_diffie_secrets(self):
+        num_to_generate = self.settings.dh_secret_pool_size - len(self.dh_secrets)
+        if self.dh_secrets_refilling or num_to_generate <= 0:
+            return
+
+        def on_generated(dh_secrets):
+            self.dh_secrets_refilling = False
+            self.dh_secrets.extend(dh_secrets)
+
+        def on_failure(failure):
+            self.dh_secrets_refilling = False
+            self.tunnel_logger.error("failed to generate Diffie-Hellman key pairs: %s", failure.getErrorMessage())
+
+        self.dh_secrets_refilling = True
+        threads.deferToThread(lambda: [self.crypto.generate_diffie_secret() for _ in xrange(num_to_generate)]) \
+            .addCallbacks(on_generated, on_failure)
+
     @call_on_reactor_thread
     def do_circuits(self):
-        for circuit_length, num_circuits in self.circuits_needed.items():
+        # spare circuits are only kept for the hop counts that tunnels were requested for
+        for circuit_length, num_needed in self.circuits_needed.items():
+            num_circuits = num_needed + self.settings.spare_circuits.get(circuit_length, 0)
             num_to_build = num_circuits - len(self.data_circuits(circuit_length))
             self.tunnel_logger.info("want %d data circuits of length %d", num_to_build, circuit_length)
             for _ in range(num_to_build):
@@ -451,30 +554,11 @@ class TunnelCommunity(Community):
             self.do_circuits()
 
     def do_remove(self):
-        # Remove circuits that are inactive / are too old / have transferred too many bytes.
-        for key, circuit in self.circuits.items():
-            if circuit.last_incoming < time.time() - self.settings.max_time_inactive:
-                self.remove_circuit(key, 'no activity')
-            elif circuit.creation_time < time.time() - self.settings.max_time:
-                self.remove_circuit(key, 'too old')
-            elif circuit.bytes_up + circuit.bytes_down > self.settings.max_traffic:
-                self.remove_circuit(key, 'traffic limit exceeded')
-
-        # Remove relays that are inactive / are too old / have transferred too many bytes.
-        for key, relay in self.relay_from_to.items():
-            if relay.last_incoming < time.time() - self.settings.max_time_inactive:
-                self.remove_relay(key, 'no activity', both_sides=False)
-            elif relay.creation_time < time.time() - self.settings.max_time:
-                self.remove_relay(key, 'too old', both_sides=False)
-            elif relay.bytes_up + relay.bytes_down > self.settings.max_traffic:
-                self.remove_relay(key, 'traffic limit exceeded', both_sides=False)
-
-        # Remove exit sockets that are too old / have transferred too many bytes.
-        for circuit_id, exit_socket in self.exit_sockets.items():
-            if exit_socket.creation_time < time.time() - self.settings.max_time:
-                self.remove_exit_socket(circuit_id, 'too old')
-            elif exit_socket.bytes_up + exit_socket.bytes_down > self.settings.max_traffic:
-                self.remove_exit_socket(circuit_id, 'traffic limit exceeded')
+        # Remove circuits/relays that are inactive, and circuits/relays/exit sockets that are too old or have
+        # transferred too many bytes. Only the ones whose deadline has passed are looked at.
+        now = time.time()
+        for kind, key, obj in self.removal_wheel.advance(now):
+            self.check_removal(kind, key, obj, now)
 
         # Remove exit_candidates that are not returned as dispersy verified candidates
         current_candidates = set(c.get_member().public_key for c in self.dispersy_yield_verified_candidates())
@@ -484,6 +568,45 @@ class TunnelCommunity(Community):
                 self.exit_candidates.pop(pubkey)
                 self.tunnel_logger.info("Removed candidate from exit_candidates dictionary")
 
+    def schedule_removal_check(self, kind, key, obj, deadline=None):
+        """
+        Check the circuit, relay or exit socket obj, stored under key, for removal at its next deadline.
+        @param unicode kind: either u"circuit", u"relay" or u"exit-socket"
+        """
+        if deadline is None:
+            deadline = obj.creation_time + self.settings.max_time
+            if kind != u"exit-socket":
+                deadline = min(deadline, obj.last_incoming + self.settings.max_time_inactive)
+        self.removal_wheel.schedule((kind, key, obj), deadline)
+
+    def check_removal(self, kind, key, obj, now):
+        objects = {u"circuit": self.circuits, u"relay": self.relay_from_to, u"exit-socket": self.exit_sockets}[kind]
+        if objects.get(key) is not obj:
+            return
+
+        if kind != u"exit-socket" and obj.last_incoming < now - self.settings.max_time_inactive:
+            reason = 'no activity'
+        elif obj.creation_time < now - self.settings.max_time:
+            reason = 'too old'
+        elif obj.bytes_up + obj.bytes_down > self.settings.max_traffic:
+            reason = 'traffic limit exceeded'
+        else:
+            self.schedule_removal_check(kind, key, obj)
+            return
+
+        if kind == u"circuit":
+            self.remove_circuit(key, reason)
+        elif kind == u"relay":
+            self.remove_relay(key, reason, both_sides=False)
+        else:
+            self.remove_exit_socket(key, reason)
+
+    def check_traffic_limit(self, kind, key, obj, num_bytes):
+        # Schedule an immediate removal check when the byte counters have just crossed the traffic limit
+        num_bytes_total = obj.bytes_up + obj.bytes_down
+        if num_bytes_total - num_bytes <= self.settings.max_traffic < num_bytes_total:
+            self.schedule_removal_check(kind, key, obj, 0)
+
     def create_circuit(self, goal_hops, ctype=CIRCUIT_TYPE_DATA, callback=None, required_endpoint=None, info_hash=None):
         assert required_endpoint is None or isinstance(required_endpoint, tuple), type(required_endpoint)
         assert required_endpoint is None or len(required_endpoint) == 3, required_endpoint
@@ -540,12 +663,13 @@ class TunnelCommunity(Community):
 
         circuit.unverified_hop = Hop(first_hop.get_member()._ec)
         circuit.unverified_hop.address = first_hop.sock_addr
-        circuit.unverified_hop.dh_secret, circuit.unverified_hop.dh_first_part = self.crypto.generate_diffie_secret()
+        circuit.unverified_hop.dh_secret, circuit.unverified_hop.dh_first_part = self.get_diffie_secret()
 
         self.tunnel_logger.info("creating circuit %d of %d hops. First hop: %s:%d", circuit_id, circuit.goal_hops,
                            first_hop.sock_addr[0], first_hop.sock_addr[1])
 
         self.circuits[circuit_id] = circuit
+        self.schedule_removal_check(u"circuit", circuit_id, circuit)
 
         self.increase_bytes_sent(circuit, self.send_cell([first_hop],
                                                          u"create", (circuit_id,
@@ -553,8 +677,7 @@ class TunnelCommunity(Community):
                                                                      circuit.unverified_hop.node_public_key,
                                                                      circuit.unverified_hop.dh_first_part)))
 
-        _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_CREATED, "%s:%s" %
-                                               (first_hop.sock_addr[0], first_hop.sock_addr[1]))
+        _barter_statistics.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_CREATED, first_hop.sock_addr)
         return circuit_id
 
     def readd_bittorrent_peers(self):
@@ -577,6 +700,7 @@ class TunnelCommunity(Community):
                 self.destroy_circuit(circuit_id)
 
             circuit = self.circuits.pop(circuit_id)
+            self.ready_circuits.remove(circuit)
             if self.notifier:
                 peer = (circuit.first_hop[0], circuit.first_hop[1])
                 candidate = self.get_candidate(peer)
@@ -733,6 +857,22 @@ class TunnelCommunity(Community):
         packet = TunnelConversion.encode_data(circuit_id, dest_address, source_address, data)
         return self.send_message(candidates, u"data", packet, circuit_id)
 
+    def send_data_batch(self, candidates, circuit_id, source_address, packets):
+        """
+        Encrypts and sends a list of (destination, data) tuples over the same circuit.
+        :return: The number of bytes sent.
+        """
+        plaintexts, cells = zip(*[TunnelConversion.split_encrypted_packet(
+            TunnelConversion.encode_data(circuit_id, dest_address, source_address, data), u"data")
+            for dest_address, data in packets])
+        try:
+            cells = self.crypto_out_batch(circuit_id, list(cells), is_data=True)
+        except CryptoException, e:
+            self.tunnel_logger.error(str(e))
+            return 0
+
+        return self.send_packets(candidates, u"data", [plaintext + cell for plaintext, cell in zip(plaintexts, cells)])
+
     def send_message(self, candidates, message_type, packet, circuit_id):
         is_data = message_type == u"data"
 
@@ -749,10 +889,14 @@ class TunnelCommunity(Community):
         return self.send_packet(candidates, message_type, packet)
 
     def send_packet(self, candidates, message_type, packet):
-        if self.dispersy.endpoint.send(candidates, [packet], prefix=self.data_prefix if message_type == u"data" else None):
-            self.statistics.increase_msg_count(u"outgoing", message_type, len(candidates))
-            self.tunnel_logger.debug("send %s to %s candidates: %s", message_type, len(candidates), map(str, candidates))
-            return len(packet)
+        return self.send_packets(candidates, message_type, [packet])
+
+    def send_packets(self, candidates, message_type, packets):
+        if self.dispersy.endpoint.send(candidates, packets, prefix=self.data_prefix if message_type == u"data" else None):
+            self.statistics.increase_msg_count(u"outgoing", message_type, len(candidates) * len(packets))
+            self.tunnel_logger.debug("send %d %s to %s candidates: %s", len(packets), message_type, len(candidates),
+                                     map(str, candidates))
+            return sum(len(packet) for packet in packets)
         return 0
 
     def send_destroy(self, candidate, circuit_id, reason):
@@ -765,32 +909,59 @@ class TunnelCommunity(Community):
         return self.relay_packet(circuit_id, message_type, message.packet)
 
     def relay_packet(self, circuit_id, message_type, packet):
+        return self.relay_packets(circuit_id, message_type, [packet])
+
+    def relay_packets(self, circuit_id, message_type, packets):
+        """
+        Relays a list of packets of the same message type that arrived over the same circuit.
+        :return: Whether any of the packets was relayed.
+        """
         next_relay = self.relay_from_to[circuit_id]
         this_relay = self.relay_from_to.get(next_relay.circuit_id, None)
 
-        self.tunnel_logger.debug("Relay %s from %d to %d", message_type, circuit_id, next_relay.circuit_id)
+        self.tunnel_logger.debug("Relay %d %s from %d to %d", len(packets), message_type, circuit_id,
+                                 next_relay.circuit_id)
 
         if this_relay:
             this_relay.last_incoming = time.time()
-            self.increase_bytes_received(this_relay, len(packet))
+            num_bytes = sum(len(packet) for packet in packets)
+            self.increase_bytes_received(this_relay, num_bytes)
+            self.check_traffic_limit(u"relay", next_relay.circuit_id, this_relay, num_bytes)
 
-        plaintext, encrypted = TunnelConversion.split_encrypted_packet(packet, message_type)
+        plaintexts, cells = zip(*[TunnelConversion.split_encrypted_packet(packet, message_type)
+                                  for packet in packets])
         try:
             if next_relay.rendezvous_relay:
-                decrypted = self.crypto_in(circuit_id, encrypted)
-                encrypted = self.crypto_out(next_relay.circuit_id, decrypted)
+                plaintexts, cells = self._drop_undecrypted(plaintexts, self.crypto_in_batch(circuit_id, cells))
+                cells = self.crypto_out_batch(next_relay.circuit_id, cells)
             else:
-                encrypted = self.crypto_relay(circuit_id, encrypted)
-            packet = plaintext + encrypted
+                plaintexts, cells = self._drop_undecrypted(plaintexts, self.crypto_relay_batch(circuit_id, cells))
 
         except CryptoException, e:
             self.tunnel_logger.error(str(e))
             return False
 
-        packet = TunnelConversion.swap_circuit_id(packet, message_type, circuit_id, next_relay.circuit_id)
-        self.increase_bytes_sent(next_relay, self.send_packet([Candidate(next_relay.sock_addr, False)], message_type, packet))
+        if not cells:
+            self.tunnel_logger.error("Could not decrypt any of the %d %s packets to relay for circuit %d",
+                                     len(packets), message_type, circuit_id)
+            return False
+
+        # The circuit id is always in the plaintext part, so every packet is put together in a single concatenation
+        packets = [TunnelConversion.swap_circuit_id(plaintext, message_type, circuit_id, next_relay.circuit_id) + cell
+                   for plaintext, cell in zip(plaintexts, cells)]
+        num_bytes = self.send_packets([Candidate(next_relay.sock_addr, False)], message_type, packets)
+        self.increase_bytes_sent(next_relay, num_bytes)
+        self.check_traffic_limit(u"relay", circuit_id, next_relay, num_bytes)
         return True
 
+    def _drop_undecrypted(self, plaintexts, cells):
+        if None not in cells:
+            return plaintexts, cells
+
+        decrypted = [(plaintext, cell) for plaintext, cell in zip(plaintexts, cells) if cell is not None]
+        self.tunnel_logger.warning("Dropping %d packets that could not be decrypted", len(cells) - len(decrypted))
+        return [plaintext for plaintext, _ in decrypted], [cell for _, cell in decrypted]
+
     def check_create(self, messages):
         for message in messages:
             if self.crypto.key and self.crypto.key.key_to_hash() != message.payload.node_id:
@@ -929,8 +1100,7 @@ class TunnelCommunity(Community):
             if extend_hop_public_bin:
                 extend_hop_public_key = self.dispersy.crypto.key_from_public_bin(extend_hop_public_bin)
                 circuit.unverified_hop = Hop(extend_hop_public_key)
-                circuit.unverified_hop.dh_secret, circuit.unverified_hop.dh_first_part = \
-                    self.crypto.generate_diffie_secret()
+                circuit.unverified_hop.dh_secret, circuit.unverified_hop.dh_first_part = self.get_diffie_secret()
 
                 self.tunnel_logger.info("extending circuit %d with %s", circuit.circuit_id,
                                         extend_hop_public_bin.encode('hex'))
@@ -948,6 +1118,8 @@ class TunnelCommunity(Community):
 
         elif circuit.state == CIRCUIT_STATE_READY:
             self.request_cache.pop(u"anon-circuit", circuit.circuit_id)
+            if circuit.ctype == CIRCUIT_TYPE_DATA:
+                self.ready_circuits.add(circuit)
             # Re-add BitTorrent peers, if needed.
             self.readd_bittorrent_peers()
 
@@ -1046,6 +1218,7 @@ class TunnelCommunity(Community):
             if candidate.get_member() is not None:
                 candidate_mid = candidate.get_member().mid.encode('hex')
             self.exit_sockets[circuit_id] = TunnelExitSocket(circuit_id, self, candidate.sock_addr, candidate_mid)
+            self.schedule_removal_check(u"exit-socket", circuit_id, self.exit_sockets[circuit_id])
 
             if self.notifier:
                 from Tribler.Core.simpledefs import NTFY_TUNNEL, NTFY_JOINED
@@ -1074,6 +1247,10 @@ class TunnelCommunity(Community):
                                                                          request.to_candidate_sock_addr,
                                                                          mid=request.to_candidate_mid)
 
+                self.schedule_removal_check(u"relay", request.to_circuit_id, forwarding_relay)
+                self.schedule_removal_check(u"relay", request.from_circuit_id,
+                                            self.relay_from_to[request.from_circuit_id])
+
                 self.relay_session_keys[request.to_circuit_id] = self.relay_session_keys[request.from_circuit_id]
 
                 self.directions[request.from_circuit_id] = EXIT_NODE
@@ -1133,42 +1310,79 @@ class TunnelCommunity(Community):
             circuit = self.circuits[circuit_id]
             self._ours_on_created_extended(circuit, message)
 
-    @call_on_reactor_thread
     def on_data(self, sock_addr, packet):
-        # If its our circuit, the messenger is the candidate assigned to that circuit and the DATA's destination
-        # is set to the zero-address then the packet is from the outside world and addressed to us from.
+        """
+        Queues an incoming data packet. The endpoint calls this for every packet it reads, possibly from its own
+        thread, while the queued packets are processed together on the reactor thread.
+        """
+        with self.data_queue_lock:
+            self.data_queue.append((sock_addr, packet))
+            if len(self.data_queue) > 1:
+                # The queue is already scheduled to be processed
+                return
+        reactor.callFromThread(self.process_data_queue)
+
+    def process_data_queue(self):
+        with self.data_queue_lock:
+            packets, self.data_queue = self.data_queue, []
+        self.on_data_batch(packets)
 
+    def on_data_batch(self, packets):
+        """
+        Processes a burst of incoming data packets. The packets are grouped by circuit, so that every circuit is
+        relayed, decrypted and delivered once per burst, while the order of the packets within a circuit is kept.
+        :param packets: A list of (sock_addr, packet) tuples.
+        """
         message_type = u'data'
-        circuit_id = TunnelConversion.get_circuit_id(packet, message_type)
 
-        self.tunnel_logger.debug("Got data (%d) from %s", circuit_id, sock_addr)
+        circuit_ids = []
+        circuit_packets = {}
+        for sock_addr, packet in packets:
+            if len(packet) < 4:
+                self.tunnel_logger.warning("Dropping data packet of %d bytes from %s", len(packet), sock_addr)
+                continue
 
-        if self.is_relay(circuit_id):
-            self.relay_packet(circuit_id, message_type, packet)
+            circuit_id = TunnelConversion.get_circuit_id(packet, message_type)
+            if circuit_id not in circuit_packets:
+                circuit_ids.append(circuit_id)
+                circuit_packets[circuit_id] = []
+            circuit_packets[circuit_id].append((sock_addr, packet))
 
-        else:
-            plaintext, encrypted = TunnelConversion.split_encrypted_packet(packet, message_type)
+        for circuit_id in circuit_ids:
+            packets = circuit_packets[circuit_id]
+            self.tunnel_logger.debug("Got %d data packets (%d) from %s", len(packets), circuit_id, packets[0][0])
 
-            try:
-                encrypted = self.crypto_in(circuit_id, encrypted, is_data=True)
+            if self.is_relay(circuit_id):
+                self.relay_packets(circuit_id, message_type, [packet for _, packet in packets])
+            else:
+                self._on_data_for_circuit(circuit_id, packets)
 
-            except CryptoException, e:
-                self.tunnel_logger.warning(str(e))
-                return
+    def _on_data_for_circuit(self, circuit_id, packets):
+        # If its our circuit, the messenger is the candidate assigned to that circuit and the DATA's destination
+        # is set to the zero-address then the packet is from the outside world and addressed to us from.
+        try:
+            cells = self.crypto_in_batch(circuit_id, [TunnelConversion.split_encrypted_packet(packet, u'data')[1]
+                                                      for _, packet in packets], is_data=True)
 
-            packet = plaintext + encrypted
-            circuit_id, destination, origin, data = TunnelConversion.decode_data(packet)
+        except CryptoException, e:
+            self.tunnel_logger.warning(str(e))
+            return
+
+        circuit = self.circuits.get(circuit_id, None)
+        num_bytes = 0
+        dispersy_packets = []
+        for (sock_addr, _), cell in zip(packets, cells):
+            if cell is None:
+                self.tunnel_logger.warning("Could not decrypt data packet for circuit %d from %s", circuit_id, sock_addr)
+                continue
+
+            destination, origin, data = TunnelConversion.decode_data_cell(cell)
 
-            circuit = self.circuits.get(circuit_id, None)
             if circuit and origin and sock_addr == circuit.first_hop:
-                circuit.beat_heart()
-                self.increase_bytes_received(circuit, len(packet))
+                num_bytes += 4 + len(cell)
 
                 if TunnelConversion.could_be_dispersy(data):
-                    self.tunnel_logger.debug("Giving incoming data packet to dispersy")
-                    self.dispersy.on_incoming_packets([(Candidate(origin, False),
-                                                        data[TUNNEL_PREFIX_LENGHT:])],
-                                                      False, source=u"circuit_%d" % circuit_id)
+                    dispersy_packets.append((Candidate(origin, False), data[TUNNEL_PREFIX_LENGHT:]))
                 else:
                     anon_seed = circuit.ctype == CIRCUIT_TYPE_RP
                     self.socks_server.on_incoming_from_tunnel(self, circuit, origin, data, anon_seed)
@@ -1181,6 +1395,14 @@ class TunnelCommunity(Community):
                 else:
                     self.tunnel_logger.warning("cannot exit data, destination is 0.0.0.0:0")
 
+        if num_bytes:
+            circuit.beat_heart()
+            self.increase_bytes_received(circuit, num_bytes)
+
+        if dispersy_packets:
+            self.tunnel_logger.debug("Giving %d incoming data packets to dispersy", len(dispersy_packets))
+            self.dispersy.on_incoming_packets(dispersy_packets, False, source=u"circuit_%d" % circuit_id)
+
     def on_ping(self, messages):
         for message in messages:
             self.send_cell([message.candidate], u"pong", (message.payload.circuit_id, message.payload.identifier))
@@ -1188,7 +1410,9 @@ class TunnelCommunity(Community):
 
     def on_pong(self, messages):
         for message in messages:
-            self.request_cache.pop(u"ping", message.payload.identifier)
+            cache = self.request_cache.pop(u"ping", message.payload.identifier)
+            if cache:
+                cache.circuit.rtt = time.time() - cache.send_time
             self.tunnel_logger.info("Got pong from %s", message.candidate)
 
     def do_ping(self):
@@ -1264,75 +1488,88 @@ class TunnelCommunity(Community):
             self.tunnel_logger.error("Dropping data packets with unknown circuit_id")
 
     def crypto_out(self, circuit_id, content, is_data=False):
+        return self.crypto_out_batch(circuit_id, [content], is_data=is_data)[0]
+
+    def crypto_out_batch(self, circuit_id, contents, is_data=False):
+        """
+        Adds all encryption layers to a list of outgoing cells for the same circuit.
+        :return: The list of encrypted cells.
+        """
         circuit = self.circuits.get(circuit_id, None)
         if circuit:
-            if circuit and is_data and circuit.ctype in [CIRCUIT_TYPE_RENDEZVOUS, CIRCUIT_TYPE_RP]:
+            if is_data and circuit.ctype in [CIRCUIT_TYPE_RENDEZVOUS, CIRCUIT_TYPE_RP]:
                 direction = int(circuit.ctype == CIRCUIT_TYPE_RP)
-                content = self.crypto.encrypt_str(content, *self.get_session_keys(circuit.hs_session_keys, direction))
+                contents = self.crypto.encrypt_cells(contents, circuit.hs_session_keys, direction)
 
             for hop in reversed(circuit.hops):
-                content = self.crypto.encrypt_str(content, *self.get_session_keys(hop.session_keys, EXIT_NODE))
-            return content
+                contents = self.crypto.encrypt_cells(contents, hop.session_keys, EXIT_NODE)
+            return contents
 
         elif circuit_id in self.relay_session_keys:
-            return self.crypto.encrypt_str(content,
-                                           *self.get_session_keys(self.relay_session_keys[circuit_id], ORIGINATOR))
+            return self.crypto.encrypt_cells(contents, self.relay_session_keys[circuit_id], ORIGINATOR)
 
         raise CryptoException("Don't know how to encrypt outgoing message for circuit_id %d" % circuit_id)
 
     def crypto_in(self, circuit_id, content, is_data=False):
+        decrypted = self.crypto_in_batch(circuit_id, [content], is_data=is_data)[0]
+        if decrypted is None:
+            raise CryptoException("Could not remove the encryption layers of message: %r received for circuit_id: %s, "
+                                  "is_data: %i" % (content, circuit_id, is_data))
+        return decrypted
+
+    def crypto_in_batch(self, circuit_id, contents, is_data=False):
+        """
+        Removes all encryption layers from a list of incoming cells for the same circuit.
+        :return: The list of decrypted cells, with None for every cell that could not be decrypted.
+        """
         circuit = self.circuits.get(circuit_id, None)
         if circuit:
             if len(circuit.hops) > 0:
-                # Remove all the encryption layers
-                layer = 0
-                for hop in self.circuits[circuit_id].hops:
-                    layer += 1
-                    try:
-                        content = self.crypto.decrypt_str(content,
-                                                          hop.session_keys[ORIGINATOR],
-                                                          hop.session_keys[ORIGINATOR_SALT])
-                    except InvalidTag as e:
-                        raise CryptoException("Got exception %r when trying to remove encryption layer %s "
-                                              "for message: %r received for circuit_id: %s, is_data: %i, "
-                                              "circuit_hops: %r" % (e, layer, content, circuit_id, is_data, circuit.hops
-                                                                    ))
+                # Remove all the encryption layers, cells that fail to decrypt are skipped in the following layers
+                for hop in circuit.hops:
+                    contents = self._decrypt_cells(contents, hop.session_keys, ORIGINATOR)
 
                 if is_data and circuit.ctype in [CIRCUIT_TYPE_RENDEZVOUS, CIRCUIT_TYPE_RP]:
                     direction = int(circuit.ctype != CIRCUIT_TYPE_RP)
-                    direction_salt = direction + 2
-                    content = self.crypto.decrypt_str(content,
-                                                      circuit.hs_session_keys[direction],
-                                                      circuit.hs_session_keys[direction_salt])
-                return content
+                    contents = self._decrypt_cells(contents, circuit.hs_session_keys, direction)
+                return contents
 
             else:
-                raise CryptoException("Error decrypting message for circuit %d, circuit is set to 0 hops.")
+                raise CryptoException("Error decrypting message for circuit %d, circuit is set to 0 hops." % circuit_id)
 
         elif circuit_id in self.relay_session_keys:
-            try:
-                return self.crypto.decrypt_str(content,
-                                               self.relay_session_keys[circuit_id][EXIT_NODE],
-                                               self.relay_session_keys[circuit_id][EXIT_NODE_SALT])
-            except InvalidTag as e:
-                raise CryptoException("Got exception %r when trying to decrypt relay message: "
-                                      "%r received for circuit_id: %s, is_data: %i, "
-                                      "circuit_hops: %r" % (e, content, circuit_id, is_data, circuit.hops
-                                      ))
+            return self.crypto.decrypt_cells(contents, self.relay_session_keys[circuit_id], EXIT_NODE)
 
         raise CryptoException("Received message for unknown circuit ID: %d" % circuit_id)
 
+    def _decrypt_cells(self, contents, session_keys, direction):
+        indices = [index for index, content in enumerate(contents) if content is not None]
+        if len(indices) == len(contents):
+            return self.crypto.decrypt_cells(contents, session_keys, direction)
+
+        decrypted = [None] * len(contents)
+        for index, content in zip(indices, self.crypto.decrypt_cells([contents[index] for index in indices],
+                                                                     session_keys, direction)):
+            decrypted[index] = content
+        return decrypted
+
     def crypto_relay(self, circuit_id, content):
+        relayed = self.crypto_relay_batch(circuit_id, [content])[0]
+        if relayed is None:
+            raise CryptoException("Could not decrypt relayed message for circuit %d" % circuit_id)
+        return relayed
+
+    def crypto_relay_batch(self, circuit_id, contents):
+        """
+        Adds or removes our encryption layer of a list of cells we relay for the same circuit.
+        :return: The list of cells, with None for every cell that could not be decrypted.
+        """
         direction = self.directions[circuit_id]
         if direction == ORIGINATOR:
-            return self.crypto.encrypt_str(content,
-                                           *self.get_session_keys(self.relay_session_keys[circuit_id], ORIGINATOR))
+            return self.crypto.encrypt_cells(contents, self.relay_session_keys[circuit_id], ORIGINATOR)
         elif direction == EXIT_NODE:
-            try:
-                return self.crypto.decrypt_str(content,
-                                               self.relay_session_keys[circuit_id][EXIT_NODE],
-                                               self.relay_session_keys[circuit_id][EXIT_NODE_SALT])
-            except InvalidTag:
+            relayed = self.crypto.decrypt_cells(contents, self.relay_session_keys[circuit_id], EXIT_NODE)
+            if None in relayed:
                 # Reasons that can cause this:
                 # - The introductionpoint circuit is extended with a candidate
                 # that is already part of the circuit, causing a crypto error.
@@ -1348,12 +1585,12 @@ class TunnelCommunity(Community):
                 # possible. :)
                 # (from https://github.com/Tribler/tribler/issues/1932#issuecomment-182035383)
 
-                self._logger.warning("Could not decrypt message:\n"
+                self._logger.warning("Could not decrypt %d of %d messages:\n"
                                      "  direction %s\n"
                                      "  circuit_id: %r\n"
-                                     "  content: : %r\n"
                                      "  Possibly corrupt data?",
-                                     direction, circuit_id, content)
+                                     relayed.count(None), len(relayed), direction, circuit_id)
+            return relayed
 
         raise CryptoException("Direction must be either ORIGINATOR or EXIT_NODE")
 
@@ -1361,18 +1598,20 @@ class TunnelCommunity(Community):
         if isinstance(obj, Circuit):
             obj.bytes_up += num_bytes
             self.stats['bytes_up'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_BYTES_SENT, "%s:%s" %
-                                                   (obj.first_hop[0], obj.first_hop[1]), num_bytes)
+            self.check_traffic_limit(u"circuit", obj.circuit_id, obj, num_bytes)
+            _barter_statistics.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_BYTES_SENT,
+                                                      obj.first_hop, num_bytes)
         elif isinstance(obj, RelayRoute):
             obj.bytes_up += num_bytes
             self.stats['bytes_relay_up'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_RELAY_BYTES_SENT, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            _barter_statistics.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_RELAY_BYTES_SENT,
+                                                      obj.sock_addr, num_bytes)
         elif isinstance(obj, TunnelExitSocket):
             obj.bytes_up += num_bytes
             self.stats['bytes_exit'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_SENT, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            self.check_traffic_limit(u"exit-socket", obj.circuit_id, obj, num_bytes)
+            _barter_statistics.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_SENT,
+                                                      obj.sock_addr, num_bytes)
         else:
             raise TypeError("Increase_bytes_sent() was called with an object that is not a Circuit, " +
                             "RelayRoute or TunnelExitSocket")
@@ -1381,18 +1620,20 @@ class TunnelCommunity(Community):
         if isinstance(obj, Circuit):
             obj.bytes_down += num_bytes
             self.stats['bytes_down'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_BYTES_RECEIVED, "%s:%s" %
-                                                   (obj.first_hop[0], obj.first_hop[1]), num_bytes)
+            self.check_traffic_limit(u"circuit", obj.circuit_id, obj, num_bytes)
+            _barter_statistics.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_BYTES_RECEIVED,
+                                                      obj.first_hop, num_bytes)
         elif isinstance(obj, RelayRoute):
             obj.bytes_down += num_bytes
             self.stats['bytes_relay_down'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_RELAY_BYTES_RECEIVED, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            _barter_statistics.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_RELAY_BYTES_RECEIVED,
+                                                      obj.sock_addr, num_bytes)
         elif isinstance(obj, TunnelExitSocket):
             obj.bytes_down += num_bytes
             self.stats['bytes_enter'] += num_bytes
-            _barter_statistics.dict_inc_bartercast(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED, "%s:%s" %
-                                                   (obj.sock_addr[0], obj.sock_addr[1]), num_bytes)
+            self.check_traffic_limit(u"exit-socket", obj.circuit_id, obj, num_bytes)
+            _barter_statistics.inc_bartercast_address(BartercastStatisticTypes.TUNNELS_EXIT_BYTES_RECEIVED,
+                                                      obj.sock_addr, num_bytes)
         else:
             raise TypeError("Increase_bytes_received() was called with an object that is not a Circuit, " +
                             "RelayRoute or TunnelExitSocket")
@@ -269,6 +269,11 @@ CREATE INDEX IF NOT EXISTS TorMarkIndex ON _TorrentMarkings(channeltorrent_id);
 
 CREATE VIRTUAL TABLE FullTextIndex USING fts3(swarmname, filenames, fileextensions);
 
+CREATE TABLE SearchTerms (
+  term                  text            PRIMARY KEY,
+  frequency             integer         DEFAULT 0
+);
+
 -------------------------------------
 
 COMMIT TRANSACTION create_table;
@@ -277,7 +282,7 @@ COMMIT TRANSACTION create_table;
 
 BEGIN TRANSACTION init_values;
 
-INSERT INTO MyInfo VALUES ('version', 28);
+INSERT INTO MyInfo VALUES ('version', 29);
 
 INSERT INTO TrackerInfo (tracker) VALUES ('no-DHT');
 INSERT INTO TrackerInfo (tracker) VALUES ('DHT');